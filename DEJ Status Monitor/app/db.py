@@ -1,10 +1,12 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
 
 # SQLite database file path
 DB_PATH = os.getenv("DB_PATH", "status_monitor.db")
+READ_DB_CACHE_MB = int(os.getenv("READ_DB_CACHE_MB", "64"))  # Page cache per read connection
+READ_DB_MMAP_MB = int(os.getenv("READ_DB_MMAP_MB", "256"))
 
 SQLALCHEMY_DATABASE_URL = f"sqlite:///./{DB_PATH}"
 
@@ -14,7 +16,36 @@ engine = create_engine(
     echo=False
 )
 
+# Separate engine for GET routes: dashboards read the last committed state
+# without holding locks the check run's writes wait on (and vice versa)
+read_engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    echo=False
+)
+
+
+@event.listens_for(engine, "connect")
+def _set_primary_pragmas(dbapi_connection, connection_record):
+    # WAL: readers see the last commit while a run writes; the mode persists in the file
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
+@event.listens_for(read_engine, "connect")
+def _set_read_pragmas(dbapi_connection, connection_record):
+    # Shared cache is left off: its table locks would make readers wait on the writer again
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.execute(f"PRAGMA cache_size=-{READ_DB_CACHE_MB * 1024}")
+    cursor.execute(f"PRAGMA mmap_size={READ_DB_MMAP_MB * 1024 * 1024}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 
 Base = declarative_base()
 
@@ -28,6 +59,15 @@ def get_db():
         db.close()
 
 
+def get_read_db():
+    """Dependency for read-only (GET) routes: session on the query_only engine"""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
 def init_db():
     """Initialize database tables"""
     Base.metadata.create_all(bind=engine)
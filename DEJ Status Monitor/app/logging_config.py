@@ -0,0 +1,162 @@
+"""
+Non-blocking logging setup
+Log calls only enqueue records; a QueueListener thread does the formatting
+and file/console I/O, so logging never blocks the event loop.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+from datetime import datetime
+from typing import Dict, Optional
+
+import pytz
+
+# Loggers that get the queue handler directly (in addition to root)
+MANAGED_LOGGERS = ["uvicorn", "uvicorn.error", "uvicorn.access", "apscheduler"]
+
+# Chatty per-item loggers and the fraction of their INFO/DEBUG records to keep.
+# Override with LOG_SAMPLE_RATES="logger.name=0.5,other.logger=0.01".
+DEFAULT_SAMPLE_RATES = {
+    "app.services.checker.retries": 0.1,
+    "app.services.steam_soap.bodies": 0.1,
+}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class LocalTimeFormatter(logging.Formatter):
+    """Formatter that converts UTC time to local timezone (cached per second)"""
+
+    def __init__(self, fmt=None, datefmt=None, timezone=pytz.UTC):
+        super().__init__(fmt, datefmt)
+        self.timezone = timezone
+        self._cached_second = None
+        self._cached_local = None
+
+    def formatTime(self, record, datefmt=None):
+        # record.created is a timestamp (seconds since epoch); convert once per second
+        second = int(record.created)
+        if second != self._cached_second:
+            utc_dt = datetime.fromtimestamp(second, tz=pytz.UTC)
+            self._cached_local = utc_dt.astimezone(self.timezone)
+            self._cached_second = second
+        if datefmt:
+            return self._cached_local.strftime(datefmt)
+        return self._cached_local.strftime('%Y-%m-%d %H:%M:%S')
+
+
+class JsonFormatter(LocalTimeFormatter):
+    """One JSON object per line: time, level, logger, message (+ exception)"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep roughly `rate` of INFO/DEBUG records per configured logger (and its children).
+    Warnings and errors always pass. Uses a counter, so sampling is deterministic.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._counters: Dict[str, int] = {}
+
+    def _rate_for(self, name: str) -> Optional[float]:
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return None
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate_for(record.name)
+        if rate is None or rate >= 1:
+            return True
+        if rate <= 0:
+            return False
+        every = max(1, round(1 / rate))
+        count = self._counters.get(record.name, 0)
+        self._counters[record.name] = count + 1
+        return count % every == 0
+
+
+def parse_sample_rates(value: Optional[str]) -> Dict[str, float]:
+    """Parse LOG_SAMPLE_RATES ("name=rate,name=rate") on top of the defaults"""
+    rates = dict(DEFAULT_SAMPLE_RATES)
+    if not value:
+        return rates
+    for item in value.split(","):
+        name, _, rate = item.partition("=")
+        try:
+            rates[name.strip()] = float(rate)
+        except ValueError:
+            continue
+    return rates
+
+
+def setup_logging(log_file: str, log_level: str = "INFO", timezone=pytz.UTC) -> logging.handlers.QueueListener:
+    """
+    Route root, uvicorn and apscheduler logging through a queue.
+    The listener thread writes to a size-rotated file and the console.
+    Env: LOG_FORMAT (text/json), LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_SAMPLE_RATES.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    if os.getenv("LOG_FORMAT", "text").lower() == "json":
+        formatter = JsonFormatter(timezone=timezone)
+    else:
+        formatter = LocalTimeFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s', timezone=timezone)
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file,
+        maxBytes=int(os.getenv("LOG_MAX_BYTES", str(20 * 1024 * 1024))),
+        backupCount=int(os.getenv("LOG_BACKUP_COUNT", "5")),
+        encoding="utf-8"
+    )
+    file_handler.setFormatter(formatter)
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(parse_sample_rates(os.getenv("LOG_SAMPLE_RATES"))))
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(getattr(logging, log_level.upper()))
+    root_logger.handlers = [queue_handler]
+
+    for name in MANAGED_LOGGERS:
+        logging.getLogger(name).handlers = [queue_handler]
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
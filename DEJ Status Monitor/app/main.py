@@ -2,8 +2,10 @@
 Main FastAPI application for Terminal Status Monitor
 """
 import asyncio
+import json
 import logging
 import os
+import time
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import List, Optional
@@ -17,12 +19,15 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, and_, or_
+from sqlalchemy import func, desc, and_, or_, case
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-from app.db import get_db, init_db
-from app.models import Terminal, StatusCheck, User, UserMerchant, UserRole, PasswordResetToken
+from app.db import get_db, get_read_db, init_db
+from app.models import Terminal, StatusCheck, User, UserMerchant, UserRole, PasswordResetToken, TerminalState, TerminalAvailability
 from app.services.checker import run_check_all_terminals
+from app.services.cpu_pool import dumps_json, run_in_thread, shutdown_pools
+from app.services.sql_profiler import profile_queries, log_if_slow
+from app.services.transitions import record_transitions
 from app.services.tpn_loader import load_tpns_from_file
 from app.services.config_loader import load_config
 from app.auth import (
@@ -62,56 +67,9 @@ from app.services.config_loader import load_config
 CONFIG = load_config()
 TIMEZONE = pytz.timezone(CONFIG["timezone"])
 
-# Create custom formatter with local timezone
-class LocalTimeFormatter(logging.Formatter):
-    """Formatter that converts UTC time to local timezone"""
-    def formatTime(self, record, datefmt=None):
-        # record.created is a timestamp (seconds since epoch)
-        # Convert to UTC datetime first, then to local timezone
-        # Use fromtimestamp with UTC to ensure we're working with UTC
-        utc_dt = datetime.fromtimestamp(record.created, tz=pytz.UTC)
-        local_dt = utc_dt.astimezone(TIMEZONE)
-        if datefmt:
-            return local_dt.strftime(datefmt)
-        return local_dt.strftime('%Y-%m-%d %H:%M:%S')
-
-# Configure logging to both file and console with local timezone
-formatter = LocalTimeFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
-file_handler = logging.FileHandler(log_file)
-file_handler.setFormatter(formatter)
-
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
-
-# Configure root logger
-root_logger = logging.getLogger()
-root_logger.setLevel(getattr(logging, log_level.upper()))
-root_logger.handlers = []  # Clear existing handlers
-root_logger.addHandler(file_handler)
-root_logger.addHandler(console_handler)
-
-# Apply formatter to uvicorn loggers
-uvicorn_logger = logging.getLogger("uvicorn")
-uvicorn_logger.handlers = []
-uvicorn_logger.addHandler(file_handler)
-uvicorn_logger.addHandler(console_handler)
-
-uvicorn_error = logging.getLogger("uvicorn.error")
-uvicorn_error.handlers = []
-uvicorn_error.addHandler(file_handler)
-uvicorn_error.addHandler(console_handler)
-
-uvicorn_access = logging.getLogger("uvicorn.access")
-uvicorn_access.handlers = []
-uvicorn_access.addHandler(file_handler)
-uvicorn_access.addHandler(console_handler)
-
-# Apply formatter to apscheduler logger
-apscheduler_logger = logging.getLogger("apscheduler")
-apscheduler_logger.handlers = []
-apscheduler_logger.addHandler(file_handler)
-apscheduler_logger.addHandler(console_handler)
+# Configure non-blocking logging (queue + background writer) with local timezone
+from app.logging_config import setup_logging
+setup_logging(log_file, log_level, TIMEZONE)
 
 logger = logging.getLogger(__name__)
 
@@ -124,6 +82,50 @@ logger.info("=" * 80)
 
 app = FastAPI(title="Terminal Status Monitor")
 
+_route_paths = {}
+
+
+def get_route_path(scope) -> str:
+    """Route template (e.g. /terminal/{tpn}) for a handled request, to keep metric labels bounded"""
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    if endpoint not in _route_paths:
+        _route_paths[endpoint] = next(
+            (r.path for r in app.routes if getattr(r, "endpoint", None) is endpoint or getattr(r, "app", None) is endpoint),
+            "unmatched"
+        )
+    return _route_paths[endpoint]
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Record request latency per route template for /metrics"""
+    from app.services import metrics
+    start_time = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route_path = get_route_path(request.scope)
+        metrics.HTTP_LATENCY.observe(
+            time.perf_counter() - start_time,
+            method=request.method, route=route_path, status=str(status_code)
+        )
+
+@app.middleware("http")
+async def profile_request_sql(request: Request, call_next):
+    """Count queries and DB time per request; report via Server-Timing and the slow-request log"""
+    start_time = time.perf_counter()
+    with profile_queries() as profile:
+        response = await call_next(request)
+    total_ms = (time.perf_counter() - start_time) * 1000
+    response.headers["Server-Timing"] = profile.server_timing(total_ms)
+    log_if_slow(request.method, request.url.path, profile, total_ms)
+    return response
+
 # Add session middleware for authentication
 SECRET_KEY = os.getenv("SECRET_KEY", "change-this-secret-key-in-production-use-random-string")
 app.add_middleware(SessionMiddleware, secret_key=SECRET_KEY)
@@ -190,6 +192,8 @@ templates.env.filters["to_eastern"] = to_eastern_time
 # Scheduler
 scheduler = AsyncIOScheduler()
 check_in_progress = False
+outbox_worker: Optional[asyncio.Task] = None
+webhook_worker: Optional[asyncio.Task] = None
 
 # Configuration
 TPN_FILE_PATH = os.getenv("TPN_FILE_PATH", "./tpns.txt")
@@ -197,6 +201,94 @@ TPN_FILE_PATH = os.getenv("TPN_FILE_PATH", "./tpns.txt")
 CHECK_TIMES = CONFIG["check_times"]
 
 
+async def after_check_run(run_id: str):
+    """
+    Post-run hooks: run summary, availability, merchant snapshots, outage
+    incidents, latency sketches, alert digests and webhook events (never
+    fail the run). The stages take seconds on large fleets, so they run on
+    a worker thread with their own session instead of holding the event loop.
+    """
+    from app.services.tpn_loader import read_tpns_from_file
+    active_tpns = set(read_tpns_from_file(TPN_FILE_PATH)) if os.path.exists(TPN_FILE_PATH) else None
+    await asyncio.to_thread(_run_post_run_stages, run_id, active_tpns)
+
+
+def _run_post_run_stages(run_id: str, active_tpns: Optional[set]):
+    from app.db import SessionLocal
+    db = SessionLocal()
+    try:
+        # Paused terminals (check policies) keep their last status but raise no incidents or alerts
+        try:
+            from app.services.check_policies import paused_tpns
+            if active_tpns is not None:
+                active_tpns -= paused_tpns(db)
+        except Exception as e:
+            logger.error(f"Error loading paused terminals for run {run_id}: {e}", exc_info=True)
+            db.rollback()
+        
+        try:
+            from app.services.trends import record_run_summary
+            record_run_summary(db, run_id, active_tpns)
+        except Exception as e:
+            logger.error(f"Error recording run summary for run {run_id}: {e}", exc_info=True)
+            db.rollback()
+        
+        try:
+            from app.services.availability import update_availability
+            update_availability(db, TIMEZONE)
+        except Exception as e:
+            logger.error(f"Error updating availability for run {run_id}: {e}", exc_info=True)
+            db.rollback()
+        
+        try:
+            from app.services.merchant_snapshots import refresh_merchant_snapshots
+            refresh_merchant_snapshots(db, TIMEZONE)
+        except Exception as e:
+            logger.error(f"Error refreshing merchant snapshots for run {run_id}: {e}", exc_info=True)
+            db.rollback()
+        
+        try:
+            from app.services.search_index import sync_merchant_names
+            sync_merchant_names(db)
+        except Exception as e:
+            logger.error(f"Error re-indexing merchant names for run {run_id}: {e}", exc_info=True)
+            db.rollback()
+        
+        try:
+            from app.services.incidents import process_incidents
+            process_incidents(db, run_id, active_tpns, TIMEZONE)
+        except Exception as e:
+            logger.error(f"Error detecting outage incidents for run {run_id}: {e}", exc_info=True)
+            db.rollback()
+        
+        try:
+            from app.services.latency_sketch import record_run_latency
+            record_run_latency(db, run_id, TIMEZONE)
+        except Exception as e:
+            logger.error(f"Error recording latency sketches for run {run_id}: {e}", exc_info=True)
+            db.rollback()
+        
+        try:
+            from app.services.alert_engine import process_alerts
+            digests = process_alerts(db, run_id, active_tpns, TIMEZONE)
+            if digests:
+                logger.info(f"Queued {digests} alert digest(s) for run {run_id}")
+        except Exception as e:
+            logger.error(f"Error evaluating alerts for run {run_id}: {e}", exc_info=True)
+            db.rollback()
+        
+        try:
+            from app.services.webhooks import queue_run_webhooks
+            queued = queue_run_webhooks(db, run_id)
+            if queued:
+                logger.info(f"Queued {queued} webhook event(s) for run {run_id}")
+        except Exception as e:
+            logger.error(f"Error queueing webhooks for run {run_id}: {e}", exc_info=True)
+            db.rollback()
+    finally:
+        db.close()
+
+
 async def scheduled_check():
     """Scheduled task to run terminal checks"""
     global check_in_progress
@@ -209,10 +301,17 @@ async def scheduled_check():
     try:
         # Create a new DB session for the scheduled task
         from app.db import SessionLocal
+        from app.services.check_policies import plan_run
         db = SessionLocal()
         logger.info("Starting scheduled check...")
-        run_id = await run_check_all_terminals(db)
+        # Per-merchant/terminal check policies decide which terminals this slot checks
+        terminals, _ = plan_run(db, timezone=TIMEZONE)
+        if not terminals:
+            logger.info("No terminals due under the current check policies, skipping scheduled run")
+            return
+        run_id = await run_check_all_terminals(db, terminals)
         logger.info(f"Scheduled check completed successfully with run_id: {run_id}")
+        await after_check_run(run_id)
     except asyncio.CancelledError:
         logger.warning("Scheduled check was cancelled (likely due to server reload). Check may be incomplete.")
         if db:
@@ -238,15 +337,63 @@ async def scheduled_check():
         logger.info("Scheduled check finished, check_in_progress set to False")
 
 
+async def scheduled_terminal_info_enrichment():
+    """Scheduled task to refresh stale STEAM TerminalInfo cache entries"""
+    steam_config = CONFIG.get("steam_api", {})
+    username = steam_config.get("username")
+    password = steam_config.get("password")
+    soap_url = steam_config.get("soap_url", "https://dvmms.com/steam/api/ws/VDirectAccess.asmx")
+    if not (username and password):
+        logger.info("STEAM API not configured, skipping TerminalInfo enrichment")
+        return
+    
+    db = None
+    try:
+        from app.db import SessionLocal
+        from app.services.tpn_loader import read_tpns_from_file
+        from app.services.terminal_info_cache import enrich_stale_terminal_info
+        db = SessionLocal()
+        await enrich_stale_terminal_info(
+            db, soap_url, username, password, read_tpns_from_file(TPN_FILE_PATH)
+        )
+    except Exception as e:
+        logger.error(f"Error in TerminalInfo enrichment: {e}", exc_info=True)
+        if db:
+            db.rollback()
+    finally:
+        if db:
+            db.close()
+
+
 async def scheduled_backup():
     """Scheduled task to run daily database backup"""
     try:
         import os
+        from app.db import SessionLocal
         from app.services.backup_service import daily_backup_task
+        from app.services import history
+        
+        # Move closed months to their partition files first, so the backup
+        # copies only the hot database plus newly frozen months
+        if check_in_progress:
+            logger.info("Check run in progress, history archiving deferred to the next night")
+        else:
+            def archive():
+                db = SessionLocal()
+                try:
+                    return history.archive_closed_months(db)
+                finally:
+                    db.close()
+            try:
+                archived = await asyncio.to_thread(archive)
+                if archived:
+                    logger.info(f"Archived history months: {', '.join(archived)}")
+            except Exception as e:
+                logger.error(f"Error archiving history: {e}", exc_info=True)
         
         db_path = os.getenv("DB_PATH", "status_monitor.db")
         logger.info("Starting scheduled backup...")
-        success = await daily_backup_task(db_path)
+        success = await daily_backup_task(db_path, history.HISTORY_DIR)
         if success:
             logger.info("Scheduled backup completed successfully")
         else:
@@ -305,6 +452,18 @@ def setup_scheduler():
     
     logger.info(f"Scheduled daily backup at 02:00 {TIMEZONE} - Next run: {next_backup.strftime('%Y-%m-%d %H:%M:%S %Z')}")
     
+    # Refresh stale STEAM TerminalInfo hourly so detail pages render from local data
+    scheduler.add_job(
+        scheduled_terminal_info_enrichment,
+        trigger=CronTrigger(minute=45, timezone=TIMEZONE),
+        id="terminal_info_enrichment",
+        replace_existing=True,
+        misfire_grace_time=600,
+        coalesce=True,
+        max_instances=1
+    )
+    logger.info(f"Scheduled hourly TerminalInfo enrichment at :45 {TIMEZONE}")
+    
     scheduler.start()
     logger.info(f"Scheduler started. Current Eastern time: {now_eastern.strftime('%Y-%m-%d %H:%M:%S %Z')}")
 
@@ -339,22 +498,117 @@ def get_next_check_time():
 async def startup_event():
     """Initialize database and load TPNs on startup"""
     logger.info("Application startup event triggered")
+    startup_start = time.perf_counter()
     init_db()
-    logger.info("Database initialized")
+    logger.info(f"Database initialized in {int((time.perf_counter() - startup_start) * 1000)}ms")
     
     # Load TPNs from file
     try:
         from app.db import SessionLocal
         db = SessionLocal()
         try:
+            load_start = time.perf_counter()
             load_tpns_from_file(db, TPN_FILE_PATH)
             db.commit()
-            logger.info(f"Loaded TPNs from {TPN_FILE_PATH}")
+            logger.info(f"Loaded TPNs from {TPN_FILE_PATH} in {int((time.perf_counter() - load_start) * 1000)}ms")
         finally:
             db.close()
     except Exception as e:
         logger.error(f"Error loading TPNs: {e}", exc_info=True)
     
+    # Sync the typeahead search index with the active TPNs
+    try:
+        from app.db import SessionLocal
+        from app.services.search_index import rebuild_search_index
+        from app.services.tpn_loader import read_tpns_from_file
+        db = SessionLocal()
+        try:
+            index_start = time.perf_counter()
+            rebuild_search_index(db, read_tpns_from_file(TPN_FILE_PATH) if os.path.exists(TPN_FILE_PATH) else [])
+            logger.info(f"Search index synced in {int((time.perf_counter() - index_start) * 1000)}ms")
+        finally:
+            db.close()
+    except Exception as e:
+        logger.error(f"Error syncing search index: {e}", exc_info=True)
+    
+    # Build terminal state/transition log for terminals checked before it existed
+    try:
+        from app.db import SessionLocal
+        from app.services.transitions import backfill_terminal_states
+        db = SessionLocal()
+        try:
+            backfill_start = time.perf_counter()
+            if backfill_terminal_states(db):
+                logger.info(f"Terminal state backfill took {int((time.perf_counter() - backfill_start) * 1000)}ms")
+        finally:
+            db.close()
+    except Exception as e:
+        logger.error(f"Error backfilling terminal state: {e}", exc_info=True)
+    
+    # Summarize runs stored before run summaries existed (trend charts)
+    try:
+        from app.db import SessionLocal
+        from app.services.trends import backfill_run_summaries
+        db = SessionLocal()
+        try:
+            backfill_start = time.perf_counter()
+            if backfill_run_summaries(db):
+                logger.info(f"Run summary backfill took {int((time.perf_counter() - backfill_start) * 1000)}ms")
+        finally:
+            db.close()
+    except Exception as e:
+        logger.error(f"Error backfilling run summaries: {e}", exc_info=True)
+    
+    # Apply checks not yet counted in availability (all history on first start)
+    try:
+        from app.db import SessionLocal
+        from app.services.availability import update_availability
+        db = SessionLocal()
+        try:
+            availability_start = time.perf_counter()
+            if update_availability(db, TIMEZONE):
+                logger.info(f"Availability catch-up took {int((time.perf_counter() - availability_start) * 1000)}ms")
+        finally:
+            db.close()
+    except Exception as e:
+        logger.error(f"Error updating availability: {e}", exc_info=True)
+    
+    # Fold checks stored since the last refresh into merchant snapshots (all history on first start)
+    try:
+        from app.db import SessionLocal
+        from app.services.merchant_snapshots import refresh_merchant_snapshots
+        db = SessionLocal()
+        try:
+            snapshot_start = time.perf_counter()
+            if refresh_merchant_snapshots(db, TIMEZONE):
+                logger.info(f"Merchant snapshot catch-up took {int((time.perf_counter() - snapshot_start) * 1000)}ms")
+        finally:
+            db.close()
+    except Exception as e:
+        logger.error(f"Error refreshing merchant snapshots: {e}", exc_info=True)
+    
+    # Sketch latency of runs stored before latency sketches existed
+    try:
+        from app.db import SessionLocal
+        from app.services.latency_sketch import backfill_latency_sketches
+        db = SessionLocal()
+        try:
+            backfill_start = time.perf_counter()
+            if backfill_latency_sketches(db, TIMEZONE):
+                logger.info(f"Latency sketch backfill took {int((time.perf_counter() - backfill_start) * 1000)}ms")
+        finally:
+            db.close()
+    except Exception as e:
+        logger.error(f"Error backfilling latency sketches: {e}", exc_info=True)
+    
+    # Deliver queued email and webhooks in the background so handlers and runs never wait on receivers
+    global outbox_worker, webhook_worker
+    from app.db import SessionLocal
+    from app.services.email_outbox import run_outbox_worker
+    from app.services.webhooks import run_webhook_worker
+    outbox_worker = asyncio.create_task(run_outbox_worker(SessionLocal))
+    webhook_worker = asyncio.create_task(run_webhook_worker(SessionLocal))
+    
     # Setup scheduler
     setup_scheduler()
     
@@ -369,12 +623,22 @@ async def startup_event():
         if now_eastern < first_scheduled_time:
             logger.info(f"Running initial check (before first scheduled time {first_check_time})")
             asyncio.create_task(scheduled_check())
+    
+    logger.info(f"Startup completed in {int((time.perf_counter() - startup_start) * 1000)}ms")
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    """Shutdown scheduler"""
+    """Shutdown scheduler, the background delivery workers and the CPU pools"""
     scheduler.shutdown()
+    for worker in (outbox_worker, webhook_worker):
+        if worker:
+            worker.cancel()
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+    shutdown_pools()
 
 
 # Helper function to get current user from session
@@ -411,13 +675,28 @@ async def require_admin_session(request: Request, db: Session = Depends(get_db))
 # API Endpoints
 
 @app.get("/api/terminals")
-async def get_terminals(
+async def api_terminals(
     status: Optional[str] = None,
     last_online_before: Optional[str] = None,
     search: Optional[str] = None,
     merchant: Optional[str] = None,
     min_uptime: Optional[float] = Query(None, description="Minimum uptime percentage"),
     max_uptime: Optional[float] = Query(None, description="Maximum uptime percentage"),
+    db: Session = Depends(get_read_db)
+):
+    """/api/terminals: get_terminals, serialized off the event loop (the list can be fleet-sized)"""
+    from fastapi.responses import Response
+    data = await get_terminals(status, last_online_before, search, merchant, min_uptime, max_uptime, db=db)
+    return Response(content=await dumps_json(data), media_type="application/json")
+
+
+async def get_terminals(
+    status: Optional[str] = None,
+    last_online_before: Optional[str] = None,
+    search: Optional[str] = None,
+    merchant: Optional[str] = None,
+    min_uptime: Optional[float] = None,
+    max_uptime: Optional[float] = None,
     db: Session = Depends(get_db)
 ):
     """
@@ -425,23 +704,11 @@ async def get_terminals(
     Query params:
     - status: filter by status (ONLINE/OFFLINE/DISCONNECT/ERROR/UNKNOWN)
     - last_online_before: ISO datetime string
-    - search: search in TPN
+    - search: search in TPN (substring)
     - merchant: filter by merchant number (first 4 chars of TPN)
     - min_uptime: minimum uptime percentage (0-100)
     - max_uptime: maximum uptime percentage (0-100)
     """
-    # Subquery for latest status per terminal
-    latest_check_subq = db.query(
-        StatusCheck.terminal_id,
-        func.max(StatusCheck.checked_at).label('latest_checked_at')
-    ).group_by(StatusCheck.terminal_id).subquery()
-    
-    # Subquery for last online time per terminal
-    last_online_subq = db.query(
-        StatusCheck.terminal_id,
-        func.max(StatusCheck.checked_at).label('last_online_at')
-    ).filter(StatusCheck.status == 'ONLINE').group_by(StatusCheck.terminal_id).subquery()
-    
     # Get terminals that are in the file (exclude deleted ones)
     file_tpns = set()
     if os.path.exists(TPN_FILE_PATH):
@@ -451,24 +718,21 @@ async def get_terminals(
                 if line and not line.startswith('#'):
                     file_tpns.add(line)
     
-    # Main query - only include terminals in the file
+    # Main query - only include terminals in the file; latest status and last
+    # online time come from terminal_states (maintained at ingest), uptime
+    # from terminal_availability (maintained after each run)
     query = db.query(
         Terminal,
-        StatusCheck.status.label('latest_status'),
-        StatusCheck.checked_at.label('latest_checked_at'),
-        last_online_subq.c.last_online_at.label('last_online_at')
-    ).join(
-        latest_check_subq,
-        Terminal.id == latest_check_subq.c.terminal_id
+        TerminalState.status.label('latest_status'),
+        TerminalState.checked_at.label('latest_checked_at'),
+        TerminalState.last_online_at.label('last_online_at'),
+        TerminalAvailability
     ).join(
-        StatusCheck,
-        and_(
-            StatusCheck.terminal_id == Terminal.id,
-            StatusCheck.checked_at == latest_check_subq.c.latest_checked_at
-        )
+        TerminalState,
+        Terminal.id == TerminalState.terminal_id
     ).outerjoin(
-        last_online_subq,
-        Terminal.id == last_online_subq.c.terminal_id
+        TerminalAvailability,
+        Terminal.id == TerminalAvailability.terminal_id
     )
     
     # Filter to only terminals in the file
@@ -480,10 +744,16 @@ async def get_terminals(
     
     # Apply filters
     if status:
-        query = query.filter(StatusCheck.status == status.upper())
+        query = query.filter(TerminalState.status == status.upper())
     
     if search:
-        query = query.filter(Terminal.tpn.contains(search))
+        # Trigram index lookup; 1-2 character searches fall back to a LIKE scan
+        from app.services.search_index import matching_tpns_query
+        search_tpns = matching_tpns_query(db, search)
+        if search_tpns is None:
+            query = query.filter(Terminal.tpn.contains(search))
+        else:
+            query = query.filter(Terminal.tpn.in_(search_tpns))
     
     if merchant:
         # Merchant can be either a code (4 digits) or a company name
@@ -510,8 +780,8 @@ async def get_terminals(
             before_dt = datetime.fromisoformat(last_online_before.replace('Z', '+00:00'))
             query = query.filter(
                 or_(
-                    last_online_subq.c.last_online_at < before_dt,
-                    last_online_subq.c.last_online_at.is_(None)
+                    TerminalState.last_online_at < before_dt,
+                    TerminalState.last_online_at.is_(None)
                 )
             )
         except ValueError:
@@ -532,17 +802,18 @@ async def get_terminals(
             return eastern_dt.isoformat()
         return None
     
-    for terminal, latest_status, latest_checked_at, last_online_at in results:
+    from app.services.availability import uptime_percentage as lifetime_uptime
+    
+    for terminal, latest_status, latest_checked_at, last_online_at, availability in results:
         time_since_last_online = None
         if last_online_at:
             delta = now - last_online_at
             time_since_last_online = int(delta.total_seconds())
         
-        # Calculate uptime percentage (all time)
-        all_checks = db.query(StatusCheck).filter(StatusCheck.terminal_id == terminal.id).all()
-        total_checks = len(all_checks)
-        online_checks = sum(1 for c in all_checks if c.status == 'ONLINE')
-        uptime_percentage = (online_checks / total_checks * 100) if total_checks > 0 else 0
+        # Time-weighted uptime percentage (all time)
+        total_checks = availability.checks if availability else 0
+        online_checks = availability.online_checks if availability else 0
+        uptime_percentage = lifetime_uptime(availability)
         
         # Apply uptime filters
         if min_uptime is not None and uptime_percentage < min_uptime:
@@ -565,24 +836,13 @@ async def get_terminals(
 
 
 @app.get("/api/terminals/{tpn}")
-async def get_terminal(tpn: str, db: Session = Depends(get_db)):
+async def get_terminal(tpn: str, db: Session = Depends(get_read_db)):
     """Get terminal info with latest status and last online time"""
     terminal = db.query(Terminal).filter(Terminal.tpn == tpn).first()
     if not terminal:
         raise HTTPException(status_code=404, detail="Terminal not found")
     
-    # Get latest check
-    latest_check = db.query(StatusCheck).filter(
-        StatusCheck.terminal_id == terminal.id
-    ).order_by(desc(StatusCheck.checked_at)).first()
-    
-    # Get last online
-    last_online_check = db.query(StatusCheck).filter(
-        and_(
-            StatusCheck.terminal_id == terminal.id,
-            StatusCheck.status == 'ONLINE'
-        )
-    ).order_by(desc(StatusCheck.checked_at)).first()
+    state = db.query(TerminalState).filter(TerminalState.terminal_id == terminal.id).first()
     
     # Convert to Eastern time for display
     def to_eastern_iso(dt):
@@ -595,9 +855,10 @@ async def get_terminal(tpn: str, db: Session = Depends(get_db)):
         "tpn": terminal.tpn,
         "profile_id": terminal.profile_id,
         "created_at": to_eastern_iso(terminal.created_at) if terminal.created_at else None,
-        "latest_status": latest_check.status if latest_check else None,
-        "latest_checked_at": to_eastern_iso(latest_check.checked_at) if latest_check else None,
-        "last_online_at": to_eastern_iso(last_online_check.checked_at) if last_online_check else None
+        "latest_status": state.status if state else None,
+        "latest_checked_at": to_eastern_iso(state.checked_at) if state else None,
+        "last_online_at": to_eastern_iso(state.last_online_at) if state and state.last_online_at else None,
+        "status_since": to_eastern_iso(state.status_since) if state else None
     }
 
 
@@ -607,30 +868,29 @@ async def get_terminal_history(
     start: Optional[str] = None,
     end: Optional[str] = None,
     limit: Optional[int] = 100,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get status check history for a terminal"""
     terminal = db.query(Terminal).filter(Terminal.tpn == tpn).first()
     if not terminal:
         raise HTTPException(status_code=404, detail="Terminal not found")
     
-    query = db.query(StatusCheck).filter(StatusCheck.terminal_id == terminal.id)
-    
+    start_dt = end_dt = None
     if start:
         try:
             start_dt = datetime.fromisoformat(start.replace('Z', '+00:00'))
-            query = query.filter(StatusCheck.checked_at >= start_dt)
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid start datetime format")
     
     if end:
         try:
             end_dt = datetime.fromisoformat(end.replace('Z', '+00:00'))
-            query = query.filter(StatusCheck.checked_at <= end_dt)
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid end datetime format")
     
-    checks = query.order_by(desc(StatusCheck.checked_at)).limit(limit).all()
+    # Hot checks, then only the archived months the range overlaps
+    from app.services.history import terminal_checks
+    checks = terminal_checks(db, terminal.id, start_dt, end_dt, limit)
     
     # Convert to Eastern time for display
     def to_eastern_iso(dt):
@@ -672,6 +932,7 @@ async def trigger_check(
     check_in_progress = True
     try:
         run_id = await run_check_all_terminals(db)
+        await after_check_run(run_id)
         return {"message": "Check run started", "run_id": run_id}
     except Exception as e:
         logger.error(f"Error in manual check: {e}", exc_info=True)
@@ -681,10 +942,17 @@ async def trigger_check(
 
 
 @app.post("/api/check-tpn/{tpn}")
-async def check_single_tpn(tpn: str, db: Session = Depends(get_db)):
-    """Check a single TPN manually"""
-    from app.services.checker import check_single_terminal
-    import httpx
+async def check_single_tpn(
+    tpn: str,
+    max_age_seconds: Optional[int] = Query(None, description="Return a result from the last N seconds instead of re-checking"),
+    db: Session = Depends(get_db)
+):
+    """
+    Check a single TPN manually.
+    Concurrent callers (and a scheduled run checking the same TPN) share one
+    upstream request. Pass max_age_seconds to accept a recent result.
+    """
+    from app.services.checker import check_terminal_singleflight
     import asyncio
     
     # Check if terminal exists, if not create it
@@ -695,25 +963,30 @@ async def check_single_tpn(tpn: str, db: Session = Depends(get_db)):
         db.commit()
         db.refresh(terminal)
     
-    # Run the check
+    # Run the check (or join an in-flight one / reuse a fresh result). No client of
+    # our own: a scheduled run may join the check and outlive this request.
     semaphore = asyncio.Semaphore(1)
-    async with httpx.AsyncClient(timeout=30) as client:
-        result = await check_single_terminal(client, tpn, semaphore)
-    
-    # Store result
-    from datetime import datetime
-    status_check = StatusCheck(
-        terminal_id=terminal.id,
-        checked_at=datetime.utcnow(),
-        status=result["status"].value,
-        raw_response=result["raw_response"],
-        error=result["error"],
-        http_status=result["http_status"],
-        latency_ms=result["latency_ms"],
-        run_id=f"manual-{datetime.utcnow().isoformat()}"
+    result, checked_at, performed = await check_terminal_singleflight(
+        None, tpn, semaphore, max_age_seconds=max_age_seconds
     )
-    db.add(status_check)
-    db.commit()
+    
+    # Store result only if this request actually hit SpinPOS; shared results
+    # are stored by whichever caller performed the check (a run that joins
+    # this check skips it).
+    if performed:
+        status_check = StatusCheck(
+            terminal_id=terminal.id,
+            checked_at=checked_at,
+            status=result["status"].value,
+            raw_response=result["raw_response"],
+            error=result["error"],
+            http_status=result["http_status"],
+            latency_ms=result["latency_ms"],
+            run_id=f"manual-{checked_at.isoformat()}"
+        )
+        db.add(status_check)
+        record_transitions(db, [(terminal.id, status_check.status, checked_at, status_check.run_id)])
+        db.commit()
     
     # Convert to Eastern time
     def to_eastern_iso(dt):
@@ -727,11 +1000,12 @@ async def check_single_tpn(tpn: str, db: Session = Depends(get_db)):
     return {
         "tpn": tpn,
         "status": result["status"].value,
-        "checked_at": to_eastern_iso(status_check.checked_at),
+        "checked_at": to_eastern_iso(checked_at),
         "raw_response": result["raw_response"],
         "error": result["error"],
         "http_status": result["http_status"],
-        "latency_ms": result["latency_ms"]
+        "latency_ms": result["latency_ms"],
+        "shared": not performed
     }
 
 
@@ -783,6 +1057,23 @@ async def reload_tpns(
         # Get count after reload
         tpns_after = count_tpns_in_file(TPN_FILE_PATH)
         
+        # Keep typeahead search in step with the new active set (non-fatal)
+        try:
+            from app.services.search_index import rebuild_search_index
+            from app.services.tpn_loader import read_tpns_from_file
+            rebuild_search_index(db, read_tpns_from_file(TPN_FILE_PATH))
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to sync search index after reload: {e}", exc_info=True)
+        
+        # New terminals get their merchant page rows now rather than after the next run
+        try:
+            from app.services.merchant_snapshots import refresh_merchant_snapshots
+            refresh_merchant_snapshots(db, TIMEZONE)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to refresh merchant snapshots after reload: {e}", exc_info=True)
+        
         # Build detailed message
         account_info = "main account"
         if ur_account:
@@ -822,7 +1113,7 @@ async def get_analytics(
     start_date: Optional[str] = Query(None, description="Start date for custom range (YYYY-MM-DD)"),
     end_date: Optional[str] = Query(None, description="End date for custom range (YYYY-MM-DD)"),
     user_merchant_codes: Optional[List[str]] = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Analytics endpoint:
@@ -871,12 +1162,9 @@ async def get_analytics(
         range_start_utc = range_start.astimezone(pytz.UTC).replace(tzinfo=None)
         range_end_utc = now_utc
     
-    # Get all checks in date range
-    query = db.query(StatusCheck).filter(
-        StatusCheck.checked_at >= range_start_utc,
-        StatusCheck.checked_at <= range_end_utc
-    )
-    range_checks = query.all()
+    # Get all checks in date range (hot table plus any archived months it spans)
+    from app.services.history import checks_in_range
+    range_checks = checks_in_range(db, range_start_utc, range_end_utc)
     
     # Get total terminals for percentage calculation (only terminals in the file)
     from app.services.tpn_loader import count_tpns_in_file
@@ -943,25 +1231,28 @@ async def get_analytics(
     # Find terminals that were online at least once today
     online_at_least_once = set()
     
+    # One query for every terminal's TPN instead of one per checked terminal
+    tpn_by_id = dict(db.query(Terminal.id, Terminal.tpn)) if terminal_checks else {}
+    
     for terminal_id, checks in terminal_checks.items():
         if len(checks) > 0:  # At least one check in range
-            terminal = db.query(Terminal).filter(Terminal.id == terminal_id).first()
-            if not terminal:
+            tpn = tpn_by_id.get(terminal_id)
+            if not tpn:
                 continue
             
             # Only include terminals that are in the file
-            if terminal.tpn not in file_tpns:
+            if tpn not in file_tpns:
                 continue
             
             # Apply merchant filter
             if merchant_code:
-                tpn_merchant_code = terminal.tpn[:4] if len(terminal.tpn) >= 4 else None
+                tpn_merchant_code = tpn[:4] if len(tpn) >= 4 else None
                 if tpn_merchant_code != merchant_code:
                     continue
             
             # Apply user merchant access filter (if not admin)
             if user_merchant_codes is not None:
-                tpn_merchant_code = terminal.tpn[:4] if len(terminal.tpn) >= 4 else None
+                tpn_merchant_code = tpn[:4] if len(tpn) >= 4 else None
                 if tpn_merchant_code not in user_merchant_codes:
                     continue
                 
@@ -971,7 +1262,7 @@ async def get_analytics(
                 for check in checks
             )
             if all_offline:
-                always_offline.append(terminal.tpn)
+                always_offline.append(tpn)
             
             # Check if all checks are online
             all_online = all(
@@ -979,11 +1270,11 @@ async def get_analytics(
                 for check in checks
             )
             if all_online:
-                always_online.append(terminal.tpn)
+                always_online.append(tpn)
             
             # Check if online at least once
             if any(check.status == 'ONLINE' for check in checks):
-                online_at_least_once.add(terminal.tpn)
+                online_at_least_once.add(tpn)
     
     # Calculate percentages
     always_offline_pct = (len(always_offline) / total_terminals * 100) if total_terminals > 0 else 0
@@ -1004,6 +1295,14 @@ async def get_analytics(
     }
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text-format metrics for checks, STEAM calls and HTTP routes"""
+    from fastapi.responses import Response
+    from app.services import metrics
+    return Response(content=metrics.render_metrics(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/api/next-check")
 async def get_next_check():
     """Get the next scheduled check time"""
@@ -1048,8 +1347,228 @@ async def get_scheduler_status():
     }
 
 
+@app.get("/api/search")
+async def search_terminals_and_merchants(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=50),
+    db: Session = Depends(get_read_db)
+):
+    """Typeahead search over TPNs, merchant codes/names and STEAM description/hardware (ranked)"""
+    from app.services.search_index import search
+    
+    current_user = await get_current_user_from_session(request, db)
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    start = time.perf_counter()
+    results = search(db, q, limit, get_user_merchant_codes(current_user, db))
+    return {
+        "query": q,
+        "results": results,
+        "took_ms": round((time.perf_counter() - start) * 1000, 2)
+    }
+
+
+def _local_date_range(start_date: Optional[str], end_date: Optional[str], days: int):
+    """[start, end) as naive UTC from local YYYY-MM-DD dates (end inclusive), else the last `days` days"""
+    from app.services.latency_sketch import day_range
+    
+    if not start_date and not end_date:
+        return day_range(days, TIMEZONE)
+    try:
+        start_local = datetime.strptime(start_date, "%Y-%m-%d") if start_date else None
+        end_local = datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1) if end_date else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+    to_utc = lambda value: TIMEZONE.localize(value).astimezone(pytz.UTC).replace(tzinfo=None)
+    end = to_utc(end_local) if end_local else datetime.utcnow() + timedelta(seconds=1)
+    start = to_utc(start_local) if start_local else end - timedelta(days=days)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+    return start, end
+
+
+@app.get("/api/latency")
+async def get_latency_percentiles(
+    request: Request,
+    scope: str = Query("all", pattern="^(all|merchant|terminal)$"),
+    key: Optional[str] = Query(None, description="Merchant code or TPN for merchant/terminal scope"),
+    start_date: Optional[str] = Query(None, description="YYYY-MM-DD (local)"),
+    end_date: Optional[str] = Query(None, description="YYYY-MM-DD (local, inclusive)"),
+    days: int = Query(7, ge=1, le=366),
+    db: Session = Depends(get_read_db)
+):
+    """p50/p95/p99 SpinPOS latency for a date range, merged from stored sketches"""
+    from app.services.latency_sketch import latency_summary, merchant_latency
+    
+    current_user = await get_current_user_from_session(request, db)
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    merchant_codes = get_user_merchant_codes(current_user, db)
+    if scope != "all" and not key:
+        raise HTTPException(status_code=400, detail=f"key is required for {scope} scope")
+    if scope == "all" and merchant_codes is not None:
+        raise HTTPException(status_code=403, detail="Overall latency is only available to admins")
+    if key and merchant_codes is not None and key[:4] not in merchant_codes:
+        raise HTTPException(status_code=403, detail="Access denied to this merchant")
+    
+    start, end = _local_date_range(start_date, end_date, days)
+    result = {
+        "scope": scope,
+        "key": key,
+        "start": start.isoformat() + "Z",
+        "end": end.isoformat() + "Z",
+        **latency_summary(db, start, end, scope, key),
+    }
+    if scope == "all":
+        result["merchants"] = merchant_latency(db, start, end)
+    return result
+
+
+@app.get("/api/latency/slowest")
+async def get_slowest_terminals(
+    request: Request,
+    start_date: Optional[str] = Query(None, description="YYYY-MM-DD (local)"),
+    end_date: Optional[str] = Query(None, description="YYYY-MM-DD (local, inclusive)"),
+    days: int = Query(7, ge=1, le=366),
+    merchant: Optional[str] = Query(None, description="Limit to one merchant code"),
+    limit: int = Query(10, ge=1, le=100),
+    min_count: int = Query(2, ge=1),
+    db: Session = Depends(get_read_db)
+):
+    """Active terminals with the highest p95 SpinPOS latency over a date range"""
+    from app.services.latency_sketch import slowest_terminals
+    from app.services.tpn_loader import read_tpns_from_file
+    
+    current_user = await get_current_user_from_session(request, db)
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    merchant_codes = get_user_merchant_codes(current_user, db)
+    if merchant:
+        if merchant_codes is not None and merchant not in merchant_codes:
+            raise HTTPException(status_code=403, detail="Access denied to this merchant")
+        merchant_codes = [merchant]
+    
+    start, end = _local_date_range(start_date, end_date, days)
+    active_tpns = set(read_tpns_from_file(TPN_FILE_PATH)) if os.path.exists(TPN_FILE_PATH) else None
+    return {
+        "start": start.isoformat() + "Z",
+        "end": end.isoformat() + "Z",
+        "terminals": slowest_terminals(
+            db, start, end, limit, min_count, merchant_codes, active_tpns
+        ),
+    }
+
+
+@app.get("/api/availability")
+async def get_availability(
+    request: Request,
+    scope: str = Query("all", pattern="^(all|merchant|terminal)$"),
+    key: Optional[str] = Query(None, description="Merchant code or TPN for merchant/terminal scope"),
+    start_date: Optional[str] = Query(None, description="YYYY-MM-DD (local)"),
+    end_date: Optional[str] = Query(None, description="YYYY-MM-DD (local, inclusive)"),
+    days: int = Query(30, ge=1, le=366),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Time-weighted availability, outage count, MTTR and MTBF for a date range.
+    Merchant scope includes each terminal; all scope includes each merchant.
+    """
+    from app.services.availability import availability_by_key, availability_summary
+    
+    current_user = await get_current_user_from_session(request, db)
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    merchant_codes = get_user_merchant_codes(current_user, db)
+    if scope != "all" and not key:
+        raise HTTPException(status_code=400, detail=f"key is required for {scope} scope")
+    if key and merchant_codes is not None and key[:4] not in merchant_codes:
+        raise HTTPException(status_code=403, detail="Access denied to this merchant")
+    
+    start, end = _local_date_range(start_date, end_date, days)
+    result = {
+        "scope": scope,
+        "key": key,
+        "start": start.isoformat() + "Z",
+        "end": end.isoformat() + "Z",
+    }
+    if scope == "all":
+        # Restricted users get totals over their own merchants
+        result.update(availability_summary(db, start, end, "all", keys=merchant_codes))
+        result["merchants"] = availability_by_key(db, start, end, "merchant", keys=merchant_codes)
+    else:
+        result.update(availability_summary(db, start, end, scope, key))
+        if scope == "merchant":
+            result["terminals"] = availability_by_key(db, start, end, "terminal", prefix=key)
+    return result
+
+
+@app.get("/api/trends")
+async def get_trends(
+    request: Request,
+    scope: str = Query("all", pattern="^(all|merchant)$"),
+    key: Optional[str] = Query(None, description="Merchant code for merchant scope"),
+    metric: str = Query("online_percentage", pattern="^(online_percentage|online|offline|disconnect|error|unknown|total)$"),
+    start_date: Optional[str] = Query(None, description="YYYY-MM-DD (local)"),
+    end_date: Optional[str] = Query(None, description="YYYY-MM-DD (local, inclusive)"),
+    days: int = Query(90, ge=1, le=3660),
+    points: int = Query(500, ge=10, le=5000, description="Maximum points returned"),
+    method: str = Query("lttb", pattern="^(lttb|minmax)$"),
+    db: Session = Depends(get_read_db)
+):
+    """Per-run trend series (fleet or merchant) from run summaries, downsampled server-side"""
+    from app.services.trends import trend_series
+    
+    current_user = await get_current_user_from_session(request, db)
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    merchant_codes = get_user_merchant_codes(current_user, db)
+    if scope == "merchant":
+        if not key:
+            raise HTTPException(status_code=400, detail="key is required for merchant scope")
+        if merchant_codes is not None and key not in merchant_codes:
+            raise HTTPException(status_code=403, detail="Access denied to this merchant")
+    
+    start, end = _local_date_range(start_date, end_date, days)
+    return {
+        "scope": scope,
+        "key": key,
+        "start": start.isoformat() + "Z",
+        "end": end.isoformat() + "Z",
+        **trend_series(db, start, end, scope, key, merchant_codes, metric, points, method),
+    }
+
+
+@app.get("/api/incidents")
+async def get_incidents(
+    request: Request,
+    days: int = Query(7, ge=1, le=366),
+    merchant: Optional[str] = Query(None, description="Limit to one merchant code"),
+    open_only: bool = Query(False),
+    db: Session = Depends(get_read_db)
+):
+    """Merchant-wide outage incidents: open ones plus those started in the last `days` days"""
+    from app.services.incidents import incident_dict, list_incidents
+    from app.services.merchant_loader import load_merchant_mapping
+    
+    current_user = await get_current_user_from_session(request, db)
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    merchant_codes = get_user_merchant_codes(current_user, db)
+    if merchant:
+        if merchant_codes is not None and merchant not in merchant_codes:
+            raise HTTPException(status_code=403, detail="Access denied to this merchant")
+        merchant_codes = [merchant]
+    
+    mapping = load_merchant_mapping()
+    incidents = list_incidents(db, datetime.utcnow() - timedelta(days=days), merchant_codes, open_only)
+    return {"incidents": [incident_dict(incident, mapping) for incident in incidents]}
+
+
 @app.get("/api/merchants")
-async def get_merchants(db: Session = Depends(get_db)):
+async def get_merchants(db: Session = Depends(get_read_db)):
     """Get list of all merchants with company names - only merchants with active terminals in tpns.txt"""
     from app.services.merchant_loader import load_merchant_mapping
     
@@ -1092,22 +1611,13 @@ async def get_merchant_stats(
     merchant: str,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Get statistics for a specific merchant (first 4 chars of TPN).
-    Returns percentage online for today (default) or date range.
+    Returns percentage online for today (default) or date range, and
+    all-time counts per terminal.
     """
-    # Get all terminals for this merchant
-    merchant_terminals = db.query(Terminal).filter(
-        Terminal.tpn.like(f"{merchant}%")
-    ).all()
-    
-    if not merchant_terminals:
-        raise HTTPException(status_code=404, detail="Merchant not found")
-    
-    terminal_ids = [t.id for t in merchant_terminals]
-    
     # Default to today if no date range provided
     if not start_date:
         # Get today in Eastern time, then convert to UTC
@@ -1146,67 +1656,12 @@ async def get_merchant_stats(
         except (ValueError, IndexError) as e:
             raise HTTPException(status_code=400, detail=f"Invalid date format: {str(e)}")
     
-    # Get checks for date range
-    range_checks = db.query(StatusCheck).filter(
-        and_(
-            StatusCheck.checked_at >= start_date_dt,
-            StatusCheck.checked_at <= end_date_dt,
-            StatusCheck.terminal_id.in_(terminal_ids)
-        )
-    ).all()
-    
-    # Calculate statistics for date range
-    total_checks = len(range_checks)
-    online_count = sum(1 for c in range_checks if c.status == 'ONLINE')
-    offline_count = sum(1 for c in range_checks if c.status == 'OFFLINE')
-    disconnect_count = sum(1 for c in range_checks if c.status == 'DISCONNECT')
-    error_count = sum(1 for c in range_checks if c.status == 'ERROR')
-    unknown_count = sum(1 for c in range_checks if c.status == 'UNKNOWN')
-    
-    online_percentage = (online_count / total_checks * 100) if total_checks > 0 else 0
-    
-    # Get terminal statistics (all history)
-    terminal_stats = []
-    for terminal in merchant_terminals:
-        all_checks = db.query(StatusCheck).filter(
-            StatusCheck.terminal_id == terminal.id
-        ).all()
-        
-        total_all = len(all_checks)
-        online_all = sum(1 for c in all_checks if c.status == 'ONLINE')
-        offline_all = sum(1 for c in all_checks if c.status == 'OFFLINE')
-        online_pct_all = (online_all / total_all * 100) if total_all > 0 else 0
-        
-        # Get latest status
-        latest_check = db.query(StatusCheck).filter(
-            StatusCheck.terminal_id == terminal.id
-        ).order_by(desc(StatusCheck.checked_at)).first()
-        
-        terminal_stats.append({
-            "tpn": terminal.tpn,
-            "latest_status": latest_check.status if latest_check else None,
-            "total_checks": total_all,
-            "online_count": online_all,
-            "offline_count": offline_all,
-            "online_percentage": round(online_pct_all, 2)
-        })
-    
-    return {
-        "merchant": merchant,
-        "total_terminals": len(merchant_terminals),
-        "range_stats": {
-            "total_checks": total_checks,
-            "online": online_count,
-            "offline": offline_count,
-            "disconnect": disconnect_count,
-            "error": error_count,
-            "unknown": unknown_count,
-            "online_percentage": round(online_percentage, 2),
-            "start_date": start_date_dt.isoformat() if start_date_dt else None,
-            "end_date": end_date_dt.isoformat() if end_date_dt else None
-        },
-        "terminal_stats": terminal_stats
-    }
+    # Served from the snapshots refreshed after each run (whole local days)
+    from app.services.merchant_snapshots import merchant_stats
+    stats = merchant_stats(db, merchant, start_date_dt, end_date_dt, TIMEZONE)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Merchant not found")
+    return stats
 
 
 # Authentication Routes
@@ -1228,7 +1683,7 @@ async def register(
     # Create new user (inactive until approved)
     user = User(
         email=email,
-        hashed_password=get_password_hash(password),
+        hashed_password=await run_in_thread(get_password_hash, password),
         is_active=False,  # Requires admin approval
         role=UserRole.USER
     )
@@ -1236,9 +1691,8 @@ async def register(
     db.commit()
     db.refresh(user)
     
-    # Send email notifications
-    from app.services.email_service import EmailService
-    email_service = EmailService()
+    # Queue email notifications (delivered by the outbox worker)
+    from app.services.email_outbox import enqueue_email
     
     # Notify admin
     admin_users = db.query(User).filter(User.is_admin == True, User.is_active == True).all()
@@ -1258,7 +1712,7 @@ async def register(
         </body>
         </html>
         """
-        await email_service.send_notification(admin_emails, admin_subject, admin_body)
+        enqueue_email(db, admin_emails, admin_subject, admin_body, commit=False)
     
     # Notify new user
     user_subject = "Registration Received - Awaiting Approval"
@@ -1272,7 +1726,7 @@ async def register(
     </body>
     </html>
     """
-    await email_service.send_notification([email], user_subject, user_body)
+    enqueue_email(db, [email], user_subject, user_body)
     
     return {"message": "Registration successful. Awaiting admin approval."}
 
@@ -1287,7 +1741,7 @@ async def login(
     # Ensure password is properly decoded (FastAPI should handle this, but be safe)
     password = safe_decode_password(password)
     user = db.query(User).filter(User.email == username).first()
-    if not user or not verify_password(password, user.hashed_password):
+    if not user or not await run_in_thread(verify_password, password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     if not user.is_active:
@@ -1320,7 +1774,7 @@ async def login_page_post(
     # Ensure password is properly decoded (FastAPI should handle this, but be safe)
     password = safe_decode_password(password)
     user = db.query(User).filter(User.email == email).first()
-    if not user or not verify_password(password, user.hashed_password):
+    if not user or not await run_in_thread(verify_password, password, user.hashed_password):
         return templates.TemplateResponse("login.html", {
             "request": request,
             "error": "Invalid credentials"
@@ -1387,16 +1841,15 @@ async def register_page_post(
     # Create new user (inactive until approved)
     user = User(
         email=email,
-        hashed_password=get_password_hash(password),
+        hashed_password=await run_in_thread(get_password_hash, password),
         is_active=False,
         role=UserRole.USER
     )
     db.add(user)
     db.commit()
     
-    # Send email notifications
-    from app.services.email_service import EmailService
-    email_service = EmailService()
+    # Queue email notifications (delivered by the outbox worker)
+    from app.services.email_outbox import enqueue_email
     
     # Notify admin
     admin_users = db.query(User).filter(User.is_admin == True, User.is_active == True).all()
@@ -1416,7 +1869,7 @@ async def register_page_post(
         </body>
         </html>
         """
-        await email_service.send_notification(admin_emails, admin_subject, admin_body)
+        enqueue_email(db, admin_emails, admin_subject, admin_body, commit=False)
     
     # Notify new user
     user_subject = "Registration Received - Awaiting Approval"
@@ -1430,7 +1883,7 @@ async def register_page_post(
     </body>
     </html>
     """
-    await email_service.send_notification([email], user_subject, user_body)
+    enqueue_email(db, [email], user_subject, user_body)
     
     return templates.TemplateResponse("register.html", {
         "request": request,
@@ -1461,7 +1914,7 @@ async def forgot_password_post(
 ):
     """Send password reset link if user exists. Always show same message (no email enumeration)."""
     from app.services.password_reset import create_reset_token
-    from app.services.email_service import EmailService
+    from app.services.email_outbox import enqueue_email
 
     user = db.query(User).filter(User.email == email.strip()).first()
     if user and user.is_active:
@@ -1469,7 +1922,6 @@ async def forgot_password_post(
             raw_token = create_reset_token(db, user)
             base_url = os.getenv("BASE_URL", "http://10.200.0.235:8091")
             reset_url = f"{base_url}/reset-password?token={raw_token}"
-            email_service = EmailService()
             subject = "Reset your password - Terminal Status Monitor"
             body = f"""
             <html>
@@ -1481,9 +1933,9 @@ async def forgot_password_post(
             </body>
             </html>
             """
-            await email_service.send_notification([user.email], subject, body)
+            enqueue_email(db, [user.email], subject, body)
         except Exception as e:
-            logger.warning(f"Failed to send password reset email: {e}", exc_info=True)
+            logger.warning(f"Failed to queue password reset email: {e}", exc_info=True)
 
     return templates.TemplateResponse("forgot_password.html", {
         "request": request,
@@ -1495,7 +1947,7 @@ async def forgot_password_post(
 async def reset_password_page(
     request: Request,
     token: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Show form to set new password; token required and must be valid."""
     from app.services.password_reset import verify_reset_token
@@ -1539,7 +1991,7 @@ async def reset_password_post(
     if not user:
         return RedirectResponse(url="/login?error=invalid_or_expired", status_code=303)
 
-    user.hashed_password = get_password_hash(new_password)
+    user.hashed_password = await run_in_thread(get_password_hash, new_password)
     db.commit()
     invalidate_reset_token(db, token)
     return RedirectResponse(url="/login?reset=success", status_code=303)
@@ -1550,7 +2002,7 @@ async def reset_password_post(
 @app.get("/change-password", response_class=HTMLResponse)
 async def change_password_page(
     request: Request,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Show change-password form (requires login)."""
     current_user = await get_current_user_from_session(request, db)
@@ -1591,14 +2043,14 @@ async def change_password_post(
             "current_user": current_user,
             "error": "New password must be at least 8 characters."
         })
-    if not verify_password(current_password, current_user.hashed_password):
+    if not await run_in_thread(verify_password, current_password, current_user.hashed_password):
         return templates.TemplateResponse("change_password.html", {
             "request": request,
             "current_user": current_user,
             "error": "Current password is incorrect."
         })
 
-    current_user.hashed_password = get_password_hash(new_password)
+    current_user.hashed_password = await run_in_thread(get_password_hash, new_password)
     db.commit()
     return RedirectResponse(url="/?password_changed=1", status_code=303)
 
@@ -1620,7 +2072,7 @@ async def get_current_user_info(
 async def get_pending_users(
     request: Request,
     current_user: User = Depends(require_admin_session),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get list of users pending approval"""
     pending = db.query(User).filter(User.is_active == False).all()
@@ -1644,9 +2096,8 @@ async def approve_user(
     user.approved_by = current_user.id
     db.commit()
     
-    # Send approval email to user
-    from app.services.email_service import EmailService
-    email_service = EmailService()
+    # Queue approval email to user
+    from app.services.email_outbox import enqueue_email
     subject = "Account Approved - Terminal Status Monitor"
     base_url = os.getenv("BASE_URL", "http://10.200.0.235:8091")
     body = f"""
@@ -1660,7 +2111,7 @@ async def approve_user(
     </body>
     </html>
     """
-    await email_service.send_notification([user.email], subject, body)
+    enqueue_email(db, [user.email], subject, body)
     
     return {"message": f"User {user.email} approved"}
 
@@ -1718,7 +2169,7 @@ async def toggle_steam_access(
 @app.get("/admin/users", response_class=HTMLResponse)
 async def admin_users_page(
     request: Request,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Admin user management page"""
     # Check authentication using session
@@ -1739,11 +2190,15 @@ async def admin_users_page(
     merchants_response = await get_merchants(db=db)
     merchants = merchants_response["merchants"]
     
+    # Merchant access for every user in one query
+    merchant_codes_by_user = {}
+    for user_id, merchant_code in db.query(UserMerchant.user_id, UserMerchant.merchant_code):
+        merchant_codes_by_user.setdefault(user_id, []).append(merchant_code)
+    
     # Format user data for template
     all_users = []
     for user in all_users_db:
-        merchant_access = db.query(UserMerchant).filter(UserMerchant.user_id == user.id).all()
-        merchant_codes = [ma.merchant_code for ma in merchant_access]
+        merchant_codes = merchant_codes_by_user.get(user.id, [])
         
         all_users.append({
             "id": user.id,
@@ -1774,7 +2229,7 @@ async def admin_users_page(
 async def get_all_users(
     request: Request,
     current_user: User = Depends(require_admin_session),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get all users (admin only)"""
     users = db.query(User).all()
@@ -1798,7 +2253,7 @@ async def get_user_details(
     user_id: int,
     request: Request,
     current_user: User = Depends(require_admin_session),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get user details (admin only)"""
     user = db.query(User).filter(User.id == user_id).first()
@@ -1863,6 +2318,10 @@ async def delete_user(
     # Delete merchant assignments
     db.query(UserMerchant).filter(UserMerchant.user_id == user_id).delete()
     
+    # Delete alert events and states (subscriptions go with the user)
+    from app.services.alert_engine import delete_user_alerts
+    delete_user_alerts(db, user_id)
+    
     # Delete user
     db.delete(user)
     db.commit()
@@ -1870,6 +2329,358 @@ async def delete_user(
     return {"message": f"User {user.email} deleted"}
 
 
+@app.get("/api/admin/runs")
+async def get_run_traces(
+    limit: int = Query(30, le=200),
+    current_user: User = Depends(require_admin_session),
+    db: Session = Depends(get_read_db)
+):
+    """Recent traced check runs (admin only)"""
+    from app.models import CheckRunTrace
+    
+    def to_eastern_iso(dt):
+        if dt.tzinfo is None:
+            dt = pytz.UTC.localize(dt)
+        return dt.astimezone(TIMEZONE).isoformat()
+    
+    rows = (
+        db.query(CheckRunTrace.run_id, CheckRunTrace.started_at, CheckRunTrace.duration_ms,
+                 CheckRunTrace.terminal_count, CheckRunTrace.concurrency)
+        .order_by(CheckRunTrace.started_at.desc())
+        .limit(limit)
+        .all()
+    )
+    return {
+        "runs": [
+            {
+                "run_id": row.run_id,
+                "started_at": to_eastern_iso(row.started_at),
+                "duration_ms": row.duration_ms,
+                "terminal_count": row.terminal_count,
+                "concurrency": row.concurrency
+            }
+            for row in rows
+        ]
+    }
+
+
+@app.get("/api/admin/runs/{run_id}/trace")
+async def get_run_trace(
+    run_id: str,
+    current_user: User = Depends(require_admin_session),
+    db: Session = Depends(get_read_db)
+):
+    """Span timeline, phase/time breakdown and queue-depth curve for one run (admin only)"""
+    from app.services.run_trace import load_trace, summarize_trace, queue_depth_series
+    trace = load_trace(db, run_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="No trace recorded for this run")
+    return {
+        **trace,
+        "summary": summarize_trace(trace),
+        "queue_depth": queue_depth_series(trace)
+    }
+
+
+@app.get("/admin/runs", response_class=HTMLResponse)
+async def admin_runs_page(
+    request: Request,
+    run_id: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """Admin check-run timeline page"""
+    current_user = await get_current_user_from_session(request, db)
+    if not current_user:
+        return RedirectResponse(url="/login", status_code=303)
+    
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    runs = (await get_run_traces(limit=30, current_user=current_user, db=db))["runs"]
+    return templates.TemplateResponse("admin_runs.html", {
+        "request": request,
+        "current_user": current_user,
+        "runs": runs,
+        "selected_run_id": run_id or (runs[0]["run_id"] if runs else None)
+    })
+
+
+def _webhook_subscription_dict(subscription) -> dict:
+    return {
+        "id": subscription.id,
+        "name": subscription.name,
+        "url": subscription.url,
+        "event_types": json.loads(subscription.event_types),
+        "merchant_codes": json.loads(subscription.merchant_codes) if subscription.merchant_codes else None,
+        "is_enabled": subscription.is_enabled,
+        "created_at": subscription.created_at.isoformat()
+    }
+
+
+def _apply_webhook_subscription(subscription, data: dict):
+    """Validate and copy admin-supplied fields onto a subscription"""
+    from app.services.webhooks import EVENT_TYPES
+    
+    if "name" in data:
+        subscription.name = str(data["name"]).strip()
+    if "url" in data:
+        url = str(data["url"]).strip()
+        if not url.startswith(("http://", "https://")):
+            raise HTTPException(status_code=400, detail="url must be an http(s) URL")
+        subscription.url = url
+    if "event_types" in data:
+        event_types = data["event_types"]
+        if not isinstance(event_types, list) or not event_types or any(e not in EVENT_TYPES for e in event_types):
+            raise HTTPException(status_code=400, detail=f"event_types must be a non-empty list of {sorted(EVENT_TYPES)}")
+        subscription.event_types = json.dumps(event_types)
+    if "merchant_codes" in data:
+        codes = data["merchant_codes"]
+        if codes is not None and not isinstance(codes, list):
+            raise HTTPException(status_code=400, detail="merchant_codes must be a list or null")
+        subscription.merchant_codes = json.dumps([str(c) for c in codes]) if codes else None
+    if "is_enabled" in data:
+        subscription.is_enabled = bool(data["is_enabled"])
+    if "secret" in data and data["secret"]:
+        subscription.secret = str(data["secret"])
+
+
+@app.get("/api/admin/webhooks")
+async def get_webhook_subscriptions(
+    current_user: User = Depends(require_admin_session),
+    db: Session = Depends(get_read_db)
+):
+    """Webhook subscriptions with queued and dead-lettered event counts (admin only)"""
+    from app.models import WebhookSubscription, WebhookDelivery, WebhookDeadLetter
+    from app.services.webhooks import EVENT_TYPES
+    
+    queued = dict(db.query(WebhookDelivery.subscription_id, func.count(WebhookDelivery.id)).group_by(WebhookDelivery.subscription_id).all())
+    dead = dict(db.query(WebhookDeadLetter.subscription_id, func.count(WebhookDeadLetter.id)).group_by(WebhookDeadLetter.subscription_id).all())
+    return {
+        "event_types": EVENT_TYPES,
+        "subscriptions": [
+            {**_webhook_subscription_dict(s), "queued": queued.get(s.id, 0), "dead_letters": dead.get(s.id, 0)}
+            for s in db.query(WebhookSubscription).order_by(WebhookSubscription.id)
+        ]
+    }
+
+
+@app.post("/api/admin/webhooks")
+async def create_webhook_subscription(
+    request: Request,
+    current_user: User = Depends(require_admin_session),
+    db: Session = Depends(get_db)
+):
+    """Create a webhook subscription (admin only). The signing secret is returned once."""
+    import secrets
+    from app.models import WebhookSubscription
+    
+    data = await request.json()
+    for field in ("name", "url", "event_types"):
+        if not data.get(field):
+            raise HTTPException(status_code=400, detail=f"{field} is required")
+    subscription = WebhookSubscription(secret=secrets.token_hex(32), created_by=current_user.id)
+    _apply_webhook_subscription(subscription, data)
+    db.add(subscription)
+    db.commit()
+    return {**_webhook_subscription_dict(subscription), "secret": subscription.secret}
+
+
+@app.post("/api/admin/webhooks/{subscription_id}")
+async def update_webhook_subscription(
+    subscription_id: int,
+    request: Request,
+    current_user: User = Depends(require_admin_session),
+    db: Session = Depends(get_db)
+):
+    """Update a webhook subscription (admin only)"""
+    from app.models import WebhookSubscription
+    
+    subscription = db.query(WebhookSubscription).filter(WebhookSubscription.id == subscription_id).first()
+    if not subscription:
+        raise HTTPException(status_code=404, detail="Webhook subscription not found")
+    _apply_webhook_subscription(subscription, await request.json())
+    db.commit()
+    return _webhook_subscription_dict(subscription)
+
+
+@app.post("/api/admin/webhooks/{subscription_id}/delete")
+async def delete_webhook_subscription(
+    subscription_id: int,
+    current_user: User = Depends(require_admin_session),
+    db: Session = Depends(get_db)
+):
+    """Delete a webhook subscription with its queued and dead-lettered events (admin only)"""
+    from app.models import WebhookSubscription, WebhookDelivery, WebhookDeadLetter
+    
+    subscription = db.query(WebhookSubscription).filter(WebhookSubscription.id == subscription_id).first()
+    if not subscription:
+        raise HTTPException(status_code=404, detail="Webhook subscription not found")
+    db.query(WebhookDelivery).filter(WebhookDelivery.subscription_id == subscription_id).delete()
+    db.query(WebhookDeadLetter).filter(WebhookDeadLetter.subscription_id == subscription_id).delete()
+    db.delete(subscription)
+    db.commit()
+    return {"message": f"Webhook subscription {subscription.name} deleted"}
+
+
+@app.get("/api/admin/webhooks/{subscription_id}/dead-letters")
+async def get_webhook_dead_letters(
+    subscription_id: int,
+    limit: int = Query(100, le=1000),
+    current_user: User = Depends(require_admin_session),
+    db: Session = Depends(get_read_db)
+):
+    """Events that exhausted their delivery attempts (admin only)"""
+    from app.models import WebhookDeadLetter
+    
+    rows = (
+        db.query(WebhookDeadLetter)
+        .filter(WebhookDeadLetter.subscription_id == subscription_id)
+        .order_by(WebhookDeadLetter.failed_at.desc())
+        .limit(limit)
+        .all()
+    )
+    return {
+        "dead_letters": [
+            {
+                "id": row.id,
+                "event_type": row.event_type,
+                "event": json.loads(row.payload),
+                "attempts": row.attempts,
+                "last_error": row.last_error,
+                "failed_at": row.failed_at.isoformat()
+            }
+            for row in rows
+        ]
+    }
+
+
+@app.post("/api/admin/webhooks/dead-letters/{dead_letter_id}/replay")
+async def replay_webhook_dead_letter(
+    dead_letter_id: int,
+    current_user: User = Depends(require_admin_session),
+    db: Session = Depends(get_db)
+):
+    """Put a dead-lettered event back on the delivery queue (admin only)"""
+    from app.models import WebhookDeadLetter
+    from app.services.webhooks import replay_dead_letter
+    
+    dead_letter = db.query(WebhookDeadLetter).filter(WebhookDeadLetter.id == dead_letter_id).first()
+    if not dead_letter:
+        raise HTTPException(status_code=404, detail="Dead letter not found")
+    delivery = replay_dead_letter(db, dead_letter)
+    return {"message": "Event queued for delivery", "delivery_id": delivery.id}
+
+
+def _check_policy_dict(policy) -> dict:
+    from app.services.check_policies import POLICY_FIELDS
+    return {
+        "scope": policy.scope,
+        "key": policy.key,
+        **{field: getattr(policy, field) for field in POLICY_FIELDS},
+        "note": policy.note,
+        "updated_at": policy.updated_at.isoformat() if policy.updated_at else None
+    }
+
+
+def _apply_check_policy(policy, data: dict):
+    """Validate and copy admin-supplied fields onto a check policy (null clears a field)"""
+    from app.services.check_policies import DAYS, TIERS, parse_hhmm
+    
+    if "timezone" in data:
+        if data["timezone"] is not None and data["timezone"] not in pytz.all_timezones_set:
+            raise HTTPException(status_code=400, detail="timezone must be an IANA time zone name or null")
+        policy.timezone = data["timezone"]
+    for field in ("active_start", "active_end"):
+        if field in data:
+            if data[field] is not None:
+                try:
+                    parse_hhmm(str(data[field]))
+                except ValueError:
+                    raise HTTPException(status_code=400, detail=f"{field} must be HH:MM or null")
+            setattr(policy, field, data[field])
+    if (policy.active_start is None) != (policy.active_end is None) or (policy.active_start and policy.active_start == policy.active_end):
+        raise HTTPException(status_code=400, detail="active_start and active_end must be set together and differ")
+    if "active_days" in data:
+        days = data["active_days"]
+        if isinstance(days, str):
+            days = [d.strip().lower() for d in days.split(",") if d.strip()]
+        if days is not None and (not isinstance(days, list) or not days or any(d not in DAYS for d in days)):
+            raise HTTPException(status_code=400, detail=f"active_days must be a non-empty list of {list(DAYS)} or null")
+        policy.active_days = ",".join(d for d in DAYS if d in days) if days else None
+    if "tier" in data:
+        if data["tier"] is not None and data["tier"] not in TIERS:
+            raise HTTPException(status_code=400, detail=f"tier must be one of {list(TIERS)} or null")
+        policy.tier = data["tier"]
+    if "paused" in data:
+        policy.paused = None if data["paused"] is None else bool(data["paused"])
+    if "note" in data:
+        policy.note = str(data["note"]).strip() if data["note"] else None
+
+
+@app.get("/api/admin/check-policies")
+async def get_check_policies(
+    current_user: User = Depends(require_admin_session),
+    db: Session = Depends(get_read_db)
+):
+    """Check policies and what a scheduled run right now would check (admin only)"""
+    from app.models import CheckPolicy
+    from app.services.check_policies import DAYS, SCOPES, TIERS, plan_run
+    
+    _, plan = plan_run(db, timezone=TIMEZONE, preview=True)
+    return {
+        "scopes": list(SCOPES),
+        "tiers": list(TIERS),
+        "days": list(DAYS),
+        "plan": plan,
+        "policies": [
+            _check_policy_dict(policy)
+            for policy in db.query(CheckPolicy).order_by(CheckPolicy.scope, CheckPolicy.key)
+        ]
+    }
+
+
+@app.post("/api/admin/check-policies/{scope}/{key}")
+async def set_check_policy(
+    scope: str,
+    key: str,
+    request: Request,
+    current_user: User = Depends(require_admin_session),
+    db: Session = Depends(get_db)
+):
+    """Create or update the policy for a merchant code or TPN (admin only)"""
+    from app.models import CheckPolicy
+    from app.services.check_policies import SCOPES
+    
+    if scope not in SCOPES:
+        raise HTTPException(status_code=400, detail=f"scope must be one of {list(SCOPES)}")
+    policy = db.get(CheckPolicy, (scope, key))
+    if policy is None:
+        policy = CheckPolicy(scope=scope, key=key)
+        db.add(policy)
+    _apply_check_policy(policy, await request.json())
+    policy.updated_by = current_user.id
+    db.commit()
+    return _check_policy_dict(policy)
+
+
+@app.post("/api/admin/check-policies/{scope}/{key}/delete")
+async def delete_check_policy(
+    scope: str,
+    key: str,
+    current_user: User = Depends(require_admin_session),
+    db: Session = Depends(get_db)
+):
+    """Delete a check policy; its terminals fall back to the merchant policy or every check time (admin only)"""
+    from app.models import CheckPolicy
+    
+    policy = db.get(CheckPolicy, (scope, key))
+    if not policy:
+        raise HTTPException(status_code=404, detail="Check policy not found")
+    db.delete(policy)
+    db.commit()
+    return {"message": f"Check policy for {scope} {key} deleted"}
+
+
 # UI Routes
 
 @app.get("/", response_class=HTMLResponse)
@@ -1881,7 +2692,7 @@ async def index(
     end_date: Optional[str] = Query(None),
     min_uptime: Optional[float] = Query(None),
     max_uptime: Optional[float] = Query(None),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Main page: list all terminals"""
     # Check authentication
@@ -1992,7 +2803,8 @@ async def index(
         has_single_merchant = True
         single_merchant_code = user_merchants[0]
     
-    return templates.TemplateResponse("index.html", {
+    # Rendering the full terminal table is the slowest part of the page
+    return await run_in_thread(templates.TemplateResponse, "index.html", {
         "request": request,
         "current_user": current_user,
         "terminals": terminals,
@@ -2024,7 +2836,7 @@ async def terminal_detail(
     min_uptime: Optional[float] = Query(None),
     max_uptime: Optional[float] = Query(None),
     from_merchant: Optional[str] = Query(None, description="Merchant code if coming from merchant view"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Terminal detail page"""
     # Check authentication
@@ -2096,24 +2908,22 @@ async def terminal_detail(
             "online_percentage": online_percentage
         })
     
-    # Fetch TerminalInfo from STEAM
-    steam_info = None
+    # TerminalInfo from the local STEAM cache; refresh in the background when
+    # stale, and only block on STEAM the first time a terminal is viewed
+    from app.services.terminal_info_cache import get_cached_terminal_info, schedule_refresh, refresh_terminal_info
+    steam_info, steam_info_stale = get_cached_terminal_info(db, tpn)
     steam_config = CONFIG.get("steam_api", {})
-    if steam_config:
+    if steam_info_stale and steam_config:
         username = steam_config.get("username")
         password = steam_config.get("password")
         soap_url = steam_config.get("soap_url", "https://dvmms.com/steam/api/ws/VDirectAccess.asmx")
         
         if username and password:
-            from app.services.steam_soap import get_terminal_info
             try:
-                steam_info = await get_terminal_info(soap_url, username, password, tpn)
-                # Update terminal profile_id if we got it
-                if steam_info and steam_info.get('ProfileID'):
-                    terminal = db.query(Terminal).filter(Terminal.tpn == tpn).first()
-                    if terminal and terminal.profile_id != steam_info['ProfileID']:
-                        terminal.profile_id = steam_info['ProfileID']
-                        db.commit()
+                if steam_info is None:
+                    steam_info = await refresh_terminal_info(soap_url, username, password, tpn)
+                else:
+                    schedule_refresh(soap_url, username, password, tpn)
             except Exception as e:
                 logger.warning(f"Failed to fetch TerminalInfo for {tpn}: {e}")
     
@@ -2157,7 +2967,7 @@ async def terminal_detail(
 
 
 @app.get("/api/terminal-counts")
-async def get_terminal_counts(db: Session = Depends(get_db)):
+async def get_terminal_counts(db: Session = Depends(get_read_db)):
     """Get terminal counts for display in header - only active Steam terminals"""
     from app.services.tpn_loader import count_tpns_in_file
     steam_terminals_count = count_tpns_in_file(TPN_FILE_PATH)
@@ -2172,7 +2982,7 @@ async def merchant_view(
     request: Request,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Merchant view page with statistics"""
     # Check authentication
@@ -2235,7 +3045,7 @@ async def analytics_always_offline(
     min_online: Optional[str] = Query(None, description="Minimum online count"),
     min_offline: Optional[str] = Query(None, description="Minimum offline count"),
     min_percentage: Optional[str] = Query(None, description="Minimum online percentage"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """View terminals that are always offline today"""
     # Convert empty strings to None and parse numeric values
@@ -2280,10 +3090,6 @@ async def analytics_always_offline(
     merchant_counts = {}  # Track counts by merchant for ALL terminals
     
     for tpn in terminals:
-        terminal = db.query(Terminal).filter(Terminal.tpn == tpn).first()
-        if not terminal:
-            continue
-        
         # Get merchant code (first 4 chars of TPN)
         tpn_merchant_code = tpn[:4] if len(tpn) >= 4 else None
         
@@ -2302,12 +3108,14 @@ async def analytics_always_offline(
                 }
             merchant_counts[tpn_merchant_code]["count"] += 1
     
-    # Now get terminal statistics (all history) and apply filters
+    # Now get terminal statistics (all history, from the merchant snapshots) and apply filters
+    from app.services.merchant_snapshots import stats_by_tpn
+    all_stats = stats_by_tpn(db, terminals)
     terminals_data = []
     
     for tpn in terminals:
-        terminal = db.query(Terminal).filter(Terminal.tpn == tpn).first()
-        if not terminal:
+        stats = all_stats.get(tpn)
+        if not stats:
             continue
         
         # Get merchant code (first 4 chars of TPN)
@@ -2316,20 +3124,11 @@ async def analytics_always_offline(
         # Apply merchant filter
         if merchant_code and tpn_merchant_code != merchant_code:
             continue
-            
-        all_checks = db.query(StatusCheck).filter(
-            StatusCheck.terminal_id == terminal.id
-        ).all()
         
-        total_all = len(all_checks)
-        online_all = sum(1 for c in all_checks if c.status == 'ONLINE')
-        offline_all = sum(1 for c in all_checks if c.status == 'OFFLINE')
-        online_pct_all = (online_all / total_all * 100) if total_all > 0 else 0
-        
-        # Get latest status
-        latest_check = db.query(StatusCheck).filter(
-            StatusCheck.terminal_id == terminal.id
-        ).order_by(desc(StatusCheck.checked_at)).first()
+        total_all = stats["total_checks"]
+        online_all = stats["online_count"]
+        offline_all = stats["offline_count"]
+        online_pct_all = stats["online_percentage"]
         
         # Apply filters
         if min_total and total_all < min_total:
@@ -2357,15 +3156,10 @@ async def analytics_always_offline(
             merchant_counts[tpn_merchant_code]["count"] += 1
         
         terminals_data.append({
-            "tpn": terminal.tpn,
+            **stats,
             "merchant_code": tpn_merchant_code,
             "merchant_name": merchant_name,
-            "merchant_display": merchant_display_name,
-            "latest_status": latest_check.status if latest_check else None,
-            "total_checks": total_all,
-            "online_count": online_all,
-            "offline_count": offline_all,
-            "online_percentage": round(online_pct_all, 2)
+            "merchant_display": merchant_display_name
         })
     
     # Get the base path for clear filters link
@@ -2397,40 +3191,15 @@ async def analytics_always_offline(
 
 
 @app.get("/analytics/always-online", response_class=HTMLResponse)
-async def analytics_always_online(request: Request, db: Session = Depends(get_db)):
+async def analytics_always_online(request: Request, db: Session = Depends(get_read_db)):
     """View terminals that are always online today"""
     analytics_data = await get_analytics(db=db)
     terminals = analytics_data.get("always_online_today", [])
     
-    # Get terminal statistics (all history)
-    terminals_data = []
-    for tpn in terminals:
-        terminal = db.query(Terminal).filter(Terminal.tpn == tpn).first()
-        if not terminal:
-            continue
-            
-        all_checks = db.query(StatusCheck).filter(
-            StatusCheck.terminal_id == terminal.id
-        ).all()
-        
-        total_all = len(all_checks)
-        online_all = sum(1 for c in all_checks if c.status == 'ONLINE')
-        offline_all = sum(1 for c in all_checks if c.status == 'OFFLINE')
-        online_pct_all = (online_all / total_all * 100) if total_all > 0 else 0
-        
-        # Get latest status
-        latest_check = db.query(StatusCheck).filter(
-            StatusCheck.terminal_id == terminal.id
-        ).order_by(desc(StatusCheck.checked_at)).first()
-        
-        terminals_data.append({
-            "tpn": terminal.tpn,
-            "latest_status": latest_check.status if latest_check else None,
-            "total_checks": total_all,
-            "online_count": online_all,
-            "offline_count": offline_all,
-            "online_percentage": round(online_pct_all, 2)
-        })
+    # Get terminal statistics (all history, from the merchant snapshots)
+    from app.services.merchant_snapshots import stats_by_tpn
+    all_stats = stats_by_tpn(db, terminals)
+    terminals_data = [all_stats[tpn] for tpn in terminals if tpn in all_stats]
     
     return templates.TemplateResponse("analytics_list.html", {
         "request": request,
@@ -2443,52 +3212,23 @@ async def analytics_always_online(request: Request, db: Session = Depends(get_db
 
 
 @app.get("/analytics/online-once", response_class=HTMLResponse)
-async def analytics_online_once(request: Request, db: Session = Depends(get_db)):
+async def analytics_online_once(request: Request, db: Session = Depends(get_read_db)):
     """View terminals that were online at least once today"""
     today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
     
     # Get all checks today
-    today_checks = db.query(StatusCheck).filter(
-        StatusCheck.checked_at >= today_start
-    ).all()
+    from app.services.history import checks_in_range
+    today_checks = checks_in_range(db, today_start, datetime.utcnow())
     
     # Find terminals that were online at least once today
-    online_today = set()
-    for check in today_checks:
-        if check.status == 'ONLINE':
-            terminal = db.query(Terminal).filter(Terminal.id == check.terminal_id).first()
-            if terminal:
-                online_today.add(terminal.tpn)
-    
-    # Get terminal statistics (all history)
-    terminals_data = []
-    for tpn in sorted(online_today):
-        terminal = db.query(Terminal).filter(Terminal.tpn == tpn).first()
-        if not terminal:
-            continue
-            
-        all_checks = db.query(StatusCheck).filter(
-            StatusCheck.terminal_id == terminal.id
-        ).all()
-        
-        total_all = len(all_checks)
-        online_all = sum(1 for c in all_checks if c.status == 'ONLINE')
-        offline_all = sum(1 for c in all_checks if c.status == 'OFFLINE')
-        online_pct_all = (online_all / total_all * 100) if total_all > 0 else 0
-        
-        # Get latest status
-        latest_check = db.query(StatusCheck).filter(
-            StatusCheck.terminal_id == terminal.id
-        ).order_by(desc(StatusCheck.checked_at)).first()
-        
-        terminals_data.append({
-            "tpn": terminal.tpn,
-            "latest_status": latest_check.status if latest_check else None,
-            "total_checks": total_all,
-            "online_count": online_all,
-            "offline_count": offline_all,
-            "online_percentage": round(online_pct_all, 2)
-        })
+    online_ids = {check.terminal_id for check in today_checks if check.status == 'ONLINE'}
+    online_today = {tpn for (tpn,) in db.query(Terminal.tpn).filter(Terminal.id.in_(online_ids))} if online_ids else set()
+    
+    # Get terminal statistics (all history, from the merchant snapshots)
+    from app.services.merchant_snapshots import stats_by_tpn
+    online_today = sorted(online_today)
+    all_stats = stats_by_tpn(db, online_today)
+    terminals_data = [all_stats[tpn] for tpn in online_today if tpn in all_stats]
     
     return templates.TemplateResponse("analytics_list.html", {
         "request": request,
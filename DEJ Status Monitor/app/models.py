@@ -1,9 +1,12 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Enum as SQLEnum, Boolean, Float
+import logging
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Enum as SQLEnum, Boolean, Float, Index, event, text
 from sqlalchemy.orm import relationship
 from app.db import Base
 import enum
 
+logger = logging.getLogger(__name__)
+
 
 class Status(enum.Enum):
     ONLINE = "ONLINE"
@@ -99,3 +102,337 @@ class PasswordResetToken(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", backref="password_reset_tokens")
+
+
+class TerminalInfo(Base):
+    """Cached STEAM TerminalInfo per TPN; refreshed when older than the TTL."""
+    __tablename__ = "terminal_info"
+
+    tpn = Column(String, primary_key=True)
+    profile_id = Column(Integer, nullable=True)
+    description = Column(String, nullable=True)
+    hardware_name = Column(String, nullable=True)
+    last_download = Column(String, nullable=True)
+    last_success_update = Column(String, nullable=True)
+    update_status = Column(String, nullable=True)
+    steam_status = Column(String, nullable=True)
+    fetched_at = Column(DateTime, nullable=False, index=True)
+
+
+class CheckRunTrace(Base):
+    """Per-TPN span timeline for one check run (compact JSON), for the admin run timeline page."""
+    __tablename__ = "check_run_traces"
+
+    run_id = Column(String, primary_key=True)
+    started_at = Column(DateTime, nullable=False, index=True)
+    duration_ms = Column(Integer, nullable=True)
+    terminal_count = Column(Integer, nullable=True)
+    concurrency = Column(Integer, nullable=True)
+    trace_json = Column(Text, nullable=False)
+
+
+class TerminalState(Base):
+    """Current status per terminal, maintained at ingest so "last online" and outage start are O(1)."""
+    __tablename__ = "terminal_states"
+
+    terminal_id = Column(Integer, ForeignKey("terminals.id"), primary_key=True)
+    status = Column(String, nullable=False, index=True)
+    checked_at = Column(DateTime, nullable=False)
+    status_since = Column(DateTime, nullable=False)  # First check of the current status run
+    last_online_at = Column(DateTime, nullable=True, index=True)
+    run_id = Column(String, nullable=True)
+
+
+class StatusTransition(Base):
+    """Append-only log of status changes (from_status is NULL for a terminal's first check)."""
+    __tablename__ = "status_transitions"
+    __table_args__ = (Index("ix_status_transitions_terminal_at", "terminal_id", "transitioned_at"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    terminal_id = Column(Integer, ForeignKey("terminals.id"), nullable=False)
+    from_status = Column(String, nullable=True)
+    to_status = Column(String, nullable=False)
+    transitioned_at = Column(DateTime, nullable=False, index=True)
+    run_id = Column(String, nullable=True)
+
+
+class AlertState(Base):
+    """Whether an EmailNotification is currently firing for a scope (whole subscription or one merchant)."""
+    __tablename__ = "alert_states"
+
+    notification_id = Column(Integer, ForeignKey("email_notifications.id"), primary_key=True)
+    scope = Column(String, primary_key=True)  # "all" or a merchant code
+    is_active = Column(Boolean, default=False, nullable=False)
+    value = Column(Float, nullable=True)
+    first_fired_at = Column(DateTime, nullable=True)
+    last_notified_at = Column(DateTime, nullable=True)
+    resolved_at = Column(DateTime, nullable=True)
+
+
+class AlertEvent(Base):
+    """A fired or resolved alert waiting for (or included in) a user's digest email."""
+    __tablename__ = "alert_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    notification_id = Column(Integer, ForeignKey("email_notifications.id"), nullable=False)
+    metric_type = Column(String, nullable=False)
+    scope = Column(String, nullable=False)
+    kind = Column(String, nullable=False)  # "fired" or "resolved"
+    value = Column(Float, nullable=True)
+    threshold_value = Column(Float, nullable=True)
+    run_id = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = Column(DateTime, nullable=True, index=True)  # When the digest containing it was queued
+
+
+class OutboundEmail(Base):
+    """Queued email; request handlers insert rows and the outbox worker delivers them."""
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    to_emails = Column(Text, nullable=False)  # JSON list
+    subject = Column(String, nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(String, default="pending", nullable=False, index=True)  # pending/sent/failed
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = Column(DateTime, nullable=True)
+
+
+class WebhookSubscription(Base):
+    """Admin-configured endpoint that receives status events."""
+    __tablename__ = "webhook_subscriptions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)
+    url = Column(String, nullable=False)
+    secret = Column(String, nullable=False)  # HMAC-SHA256 signing key
+    event_types = Column(Text, nullable=False)  # JSON list, e.g. ["terminal.offline", "run.completed"]
+    merchant_codes = Column(Text, nullable=True)  # JSON list; NULL = all merchants
+    is_enabled = Column(Boolean, default=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    created_by = Column(Integer, ForeignKey("users.id"), nullable=True)
+
+
+class WebhookDelivery(Base):
+    """One event queued for one subscription; the webhook worker batches these per endpoint."""
+    __tablename__ = "webhook_deliveries"
+    __table_args__ = (
+        Index("ix_webhook_deliveries_due", "next_attempt_at", "subscription_id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    subscription_id = Column(Integer, ForeignKey("webhook_subscriptions.id"), nullable=False)
+    event_type = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)  # JSON event object
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class WebhookDeadLetter(Base):
+    """Event that exhausted its delivery attempts; can be replayed from the admin API."""
+    __tablename__ = "webhook_dead_letters"
+
+    id = Column(Integer, primary_key=True, index=True)
+    subscription_id = Column(Integer, ForeignKey("webhook_subscriptions.id"), nullable=False, index=True)
+    event_type = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)
+    attempts = Column(Integer, nullable=False)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    failed_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+
+class LatencySketch(Base):
+    """
+    DDSketch of SpinPOS response latency (app/services/latency_sketch.py).
+    "all" and "merchant" rows are per run; "terminal" rows are per local day,
+    merged as each run lands. Sketches of any rows can be merged for ranges.
+    """
+    __tablename__ = "latency_sketches"
+    __table_args__ = (
+        Index("ix_latency_sketches_scope_period", "scope", "period_start", "scope_key"),
+        Index("ix_latency_sketches_scope_p95", "scope", "period_start", "p95_ms"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    scope = Column(String, nullable=False)  # "all", "merchant" or "terminal"
+    scope_key = Column(String, nullable=False)  # "" for all, merchant code or TPN
+    period_start = Column(DateTime, nullable=False)  # Run time, or local midnight (UTC) for terminal days
+    run_id = Column(String, nullable=True, index=True)
+    count = Column(Integer, nullable=False)
+    p95_ms = Column(Float, nullable=True)  # For ranking candidates without decoding sketches
+    sketch = Column(Text, nullable=False)  # Compact JSON (DDSketch.to_json)
+
+
+class TerminalAvailability(Base):
+    """
+    Per-terminal cursor and lifetime totals for time-weighted availability
+    (app/services/availability.py), advanced by each new check.
+    """
+    __tablename__ = "terminal_availability"
+
+    terminal_id = Column(Integer, ForeignKey("terminals.id"), primary_key=True)
+    status = Column(String, nullable=False)  # Status of the last applied check
+    state = Column(String, nullable=True)  # Last known "up"/"down" (ERROR/UNKNOWN checks do not change it)
+    observed_until = Column(DateTime, nullable=False)  # checked_at of the last applied check
+    down_since = Column(DateTime, nullable=True)  # First down check of an outage that followed an up check
+    last_check_id = Column(Integer, nullable=False, index=True)
+    checks = Column(Integer, default=0, nullable=False)
+    online_checks = Column(Integer, default=0, nullable=False)
+    up_seconds = Column(Float, default=0, nullable=False)
+    down_seconds = Column(Float, default=0, nullable=False)
+    failures = Column(Integer, default=0, nullable=False)  # up -> down
+    recoveries = Column(Integer, default=0, nullable=False)  # down -> up, after an observed failure
+    repair_seconds = Column(Float, default=0, nullable=False)  # Summed duration of recovered outages
+
+
+class AvailabilityDaily(Base):
+    """Time-weighted availability rollup per terminal or merchant per local day."""
+    __tablename__ = "availability_daily"
+    __table_args__ = (Index("ix_availability_daily_scope_day", "scope", "day_start"),)
+
+    scope = Column(String, primary_key=True)  # "terminal" or "merchant"
+    scope_key = Column(String, primary_key=True)  # TPN or merchant code
+    day_start = Column(DateTime, primary_key=True)  # Local midnight as naive UTC
+    up_seconds = Column(Float, default=0, nullable=False)
+    down_seconds = Column(Float, default=0, nullable=False)
+    failures = Column(Integer, default=0, nullable=False)
+    recoveries = Column(Integer, default=0, nullable=False)
+    repair_seconds = Column(Float, default=0, nullable=False)
+    up_checks = Column(Integer, default=0, nullable=False)  # Checks of an up terminal (chances to fail)
+
+
+class OutageIncident(Base):
+    """
+    Merchant-wide outage: more of a merchant's terminals (optionally one
+    HardwareName) went down together than its baseline failure rate explains.
+    """
+    __tablename__ = "outage_incidents"
+    __table_args__ = (Index("ix_outage_incidents_merchant_open", "merchant_code", "resolved_at"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    merchant_code = Column(String, nullable=False)
+    hardware_name = Column(String, nullable=True)  # Set when incidents are grouped by HardwareName
+    run_id = Column(String, nullable=True)  # Run that opened the incident
+    started_at = Column(DateTime, nullable=False, index=True)
+    resolved_at = Column(DateTime, nullable=True)
+    terminal_count = Column(Integer, nullable=False)  # Terminals in the group that were up before the drop
+    affected_count = Column(Integer, nullable=False)
+    affected_tpns = Column(Text, nullable=False)  # JSON list
+    expected_drops = Column(Float, nullable=False)  # Baseline expectation for the opening run
+    p_value = Column(Float, nullable=False)  # Poisson tail probability of the opening drop
+
+
+class RunSummary(Base):
+    """Status counts of one check run, fleet-wide ("all") and per merchant, for trend charts."""
+    __tablename__ = "run_summaries"
+    __table_args__ = (Index("ix_run_summaries_scope_run_at", "scope", "scope_key", "run_at"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(String, nullable=False, index=True)
+    run_at = Column(DateTime, nullable=False)  # First check of the run
+    scope = Column(String, nullable=False)  # "all" or "merchant"
+    scope_key = Column(String, nullable=False)  # "" for all, else merchant code
+    total = Column(Integer, nullable=False)
+    online = Column(Integer, nullable=False)
+    offline = Column(Integer, nullable=False)
+    disconnect = Column(Integer, nullable=False)
+    error = Column(Integer, nullable=False)
+    unknown = Column(Integer, nullable=False)
+
+
+class MerchantTerminalSnapshot(Base):
+    """
+    Per-terminal all-time check counts for the merchant page
+    (app/services/merchant_snapshots.py), advanced after each run.
+    """
+    __tablename__ = "merchant_terminal_snapshots"
+
+    terminal_id = Column(Integer, ForeignKey("terminals.id"), primary_key=True)
+    merchant_code = Column(String, nullable=False, index=True)
+    tpn = Column(String, nullable=False)
+    total_checks = Column(Integer, default=0, nullable=False)
+    online_count = Column(Integer, default=0, nullable=False)
+    offline_count = Column(Integer, default=0, nullable=False)
+    last_check_id = Column(Integer, default=0, nullable=False, index=True)
+
+
+class MerchantDailyCounts(Base):
+    """Check counts by status per merchant per local day (includes manual checks)."""
+    __tablename__ = "merchant_daily_counts"
+
+    merchant_code = Column(String, primary_key=True)
+    day_start = Column(DateTime, primary_key=True)  # Local midnight as naive UTC
+    total = Column(Integer, default=0, nullable=False)
+    online = Column(Integer, default=0, nullable=False)
+    offline = Column(Integer, default=0, nullable=False)
+    disconnect = Column(Integer, default=0, nullable=False)
+    error = Column(Integer, default=0, nullable=False)
+    unknown = Column(Integer, default=0, nullable=False)
+
+
+class HistoryPartition(Base):
+    """
+    A closed month of status_checks moved to its own frozen SQLite file
+    (app/services/history.py); ATTACHed only by queries that overlap it.
+    """
+    __tablename__ = "history_partitions"
+
+    month = Column(String, primary_key=True)  # "YYYY-MM" (UTC)
+    file_name = Column(String, nullable=False)  # In HISTORY_DIR; .db.gz when compressed
+    start = Column(DateTime, nullable=False)  # First instant of the month (naive UTC)
+    end = Column(DateTime, nullable=False)  # First instant of the next month
+    rows = Column(Integer, nullable=False)
+    first_check_id = Column(Integer, nullable=True)
+    last_check_id = Column(Integer, nullable=True)
+    archived_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    parquet_file = Column(String, nullable=True)  # Set when HISTORY_EXPORT_PARQUET is on
+
+
+class CheckPolicy(Base):
+    """
+    When scheduled runs check a merchant's terminals (scope "merchant", key =
+    merchant code) or one terminal (scope "terminal", key = TPN). Unset
+    (NULL) fields inherit: terminal -> merchant -> check every slot.
+    Planned by app/services/check_policies.py.
+    """
+    __tablename__ = "check_policies"
+
+    scope = Column(String, primary_key=True)  # "merchant" or "terminal"
+    key = Column(String, primary_key=True)
+    timezone = Column(String, nullable=True)  # IANA name for active hours; NULL = app timezone
+    active_start = Column(String, nullable=True)  # "HH:MM" local; with active_end
+    active_end = Column(String, nullable=True)  # "HH:MM" local, exclusive; may wrap past midnight
+    active_days = Column(String, nullable=True)  # e.g. "mon,tue,wed,thu,fri"; NULL = every day
+    tier = Column(String, nullable=True)  # standard | daily | weekly
+    paused = Column(Boolean, nullable=True)
+    note = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    updated_by = Column(Integer, ForeignKey("users.id"), nullable=True)
+
+
+# Typeahead search index (app/services/search_index.py). An FTS5 virtual table
+# with the trigram tokenizer, so it is created with raw DDL whenever
+# create_all runs rather than declared as a mapped table.
+SEARCH_INDEX_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+    "kind UNINDEXED, key UNINDEXED, tpn, merchant_code, company_name, description, hardware_name, "
+    "tokenize='trigram')"
+)
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _create_search_index(target, connection, **kw):
+    if connection.dialect.name != "sqlite":
+        return
+    try:
+        connection.execute(text(SEARCH_INDEX_DDL))
+    except Exception as e:
+        # SQLite older than 3.34 has no trigram tokenizer; search falls back to LIKE
+        logger.warning(f"Search index unavailable: {e}")
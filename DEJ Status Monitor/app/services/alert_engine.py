@@ -0,0 +1,285 @@
+"""
+Threshold alert engine for EmailNotification subscriptions
+Runs once after each check run: builds per-merchant aggregates from
+terminal_states in one pass, evaluates every enabled subscription against
+the merchants in its owner's scope, records fire/resolve events (deduplicated
+via alert_states) and queues one digest email per user in the outbox.
+"""
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import pytz
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models import AlertEvent, AlertState, EmailNotification, Terminal, TerminalState, User, UserMerchant
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+ALERT_RENOTIFY_HOURS = float(os.getenv("ALERT_RENOTIFY_HOURS", "24"))  # Re-send a still-firing alert after this long
+ALERT_DIGEST_MINUTES = int(os.getenv("ALERT_DIGEST_MINUTES", "0"))  # 0 = one digest per run
+MERCHANT_OUTAGE_MIN_TERMINALS = int(os.getenv("MERCHANT_OUTAGE_MIN_TERMINALS", "2"))
+
+# metric_type -> (description, default threshold)
+METRIC_TYPES = {
+    "always_offline_threshold": ("Terminals with no ONLINE check today", 1),
+    "always_offline_percentage": ("Percent of terminals with no ONLINE check today", 10),
+    "offline_count": ("Terminals not ONLINE in the latest check", 1),
+    "offline_percentage": ("Percent of terminals not ONLINE in the latest check", 10),
+    "merchant_outage": ("Merchants with at least this percent of terminals not ONLINE", 100),
+}
+ALL_SCOPE = "all"
+
+# Per-merchant counters: [total, offline_now, always_offline_today]
+MerchantAggregates = Dict[str, List[int]]
+
+
+def compute_merchant_aggregates(
+    db: Session,
+    day_start: datetime,
+    active_tpns: Optional[Set[str]] = None
+) -> MerchantAggregates:
+    """
+    One pass over terminal_states: per merchant code, terminal count, terminals
+    not ONLINE now, and terminals checked today with no ONLINE check today.
+    day_start is naive UTC. active_tpns limits to terminals in the TPN file.
+    """
+    aggregates: MerchantAggregates = defaultdict(lambda: [0, 0, 0])
+    rows = db.query(
+        Terminal.tpn, TerminalState.status, TerminalState.checked_at, TerminalState.last_online_at
+    ).join(TerminalState, TerminalState.terminal_id == Terminal.id)
+    for tpn, status, checked_at, last_online_at in rows:
+        if active_tpns is not None and tpn not in active_tpns:
+            continue
+        counters = aggregates[tpn[:4]]
+        counters[0] += 1
+        if status != "ONLINE":
+            counters[1] += 1
+            if checked_at >= day_start and (last_online_at is None or last_online_at < day_start):
+                counters[2] += 1
+    return dict(aggregates)
+
+
+def _scope_totals(aggregates: MerchantAggregates, merchant_codes: Optional[Tuple[str, ...]]) -> List[int]:
+    totals = [0, 0, 0]
+    codes = aggregates.keys() if merchant_codes is None else merchant_codes
+    for code in codes:
+        counters = aggregates.get(code)
+        if counters:
+            totals = [a + b for a, b in zip(totals, counters)]
+    return totals
+
+
+def evaluate_metric(
+    metric_type: str,
+    threshold: float,
+    aggregates: MerchantAggregates,
+    merchant_codes: Optional[Tuple[str, ...]]
+) -> Dict[str, float]:
+    """Scopes currently breaching the threshold, with their value ({} if none)"""
+    if metric_type == "merchant_outage":
+        codes = aggregates.keys() if merchant_codes is None else merchant_codes
+        breaching = {}
+        for code in codes:
+            total, offline, _ = aggregates.get(code, (0, 0, 0))
+            if total >= MERCHANT_OUTAGE_MIN_TERMINALS:
+                percentage = offline / total * 100
+                if percentage >= threshold:
+                    breaching[code] = round(percentage, 1)
+        return breaching
+
+    total, offline, always_offline = _scope_totals(aggregates, merchant_codes)
+    value = {
+        "always_offline_threshold": always_offline,
+        "always_offline_percentage": always_offline / total * 100 if total else 0,
+        "offline_count": offline,
+        "offline_percentage": offline / total * 100 if total else 0,
+    }[metric_type]
+    return {ALL_SCOPE: round(value, 1)} if total and value >= threshold else {}
+
+
+def evaluate_alerts(
+    db: Session,
+    run_id: Optional[str] = None,
+    active_tpns: Optional[Set[str]] = None,
+    timezone=pytz.UTC,
+    now: Optional[datetime] = None
+) -> List[AlertEvent]:
+    """
+    Evaluate every enabled subscription once against precomputed aggregates.
+    New breaches (or ones still firing after ALERT_RENOTIFY_HOURS) add a
+    "fired" event; cleared breaches add a "resolved" event. Commits.
+    """
+    now = now or datetime.utcnow()
+    local_now = pytz.UTC.localize(now).astimezone(timezone)
+    day_start = local_now.replace(hour=0, minute=0, second=0, microsecond=0).astimezone(pytz.UTC).replace(tzinfo=None)
+    aggregates = compute_merchant_aggregates(db, day_start, active_tpns)
+
+    subscriptions = db.query(EmailNotification, User).join(User, EmailNotification.user_id == User.id).filter(
+        EmailNotification.is_enabled == True, User.is_active == True
+    ).all()
+    if not subscriptions:
+        return []
+
+    access: Dict[int, List[str]] = defaultdict(list)
+    for user_id, merchant_code in db.query(UserMerchant.user_id, UserMerchant.merchant_code):
+        access[user_id].append(merchant_code)
+    states: Dict[int, Dict[str, AlertState]] = defaultdict(dict)
+    for state in db.query(AlertState).filter(
+        AlertState.notification_id.in_([notification.id for notification, _ in subscriptions])
+    ):
+        states[state.notification_id][state.scope] = state
+
+    renotify_after = timedelta(hours=ALERT_RENOTIFY_HOURS)
+    cache: Dict[tuple, Dict[str, float]] = {}
+    events = []
+    for notification, user in subscriptions:
+        if notification.metric_type not in METRIC_TYPES:
+            continue
+        merchant_codes = None if user.is_admin else tuple(sorted(access.get(user.id, [])))
+        if merchant_codes == ():
+            continue
+        threshold = notification.threshold_value
+        if threshold is None:
+            threshold = METRIC_TYPES[notification.metric_type][1]
+        key = (notification.metric_type, threshold, merchant_codes)
+        if key not in cache:
+            cache[key] = evaluate_metric(notification.metric_type, threshold, aggregates, merchant_codes)
+        breaching = cache[key]
+
+        def _event(scope, kind, value):
+            events.append(AlertEvent(
+                user_id=user.id, notification_id=notification.id, metric_type=notification.metric_type,
+                scope=scope, kind=kind, value=value, threshold_value=threshold, run_id=run_id, created_at=now
+            ))
+
+        scope_states = states[notification.id]
+        for scope, value in breaching.items():
+            state = scope_states.get(scope)
+            if state is None:
+                state = AlertState(notification_id=notification.id, scope=scope, is_active=False)
+                db.add(state)
+                scope_states[scope] = state
+            state.value = value
+            if not state.is_active:
+                state.is_active = True
+                state.first_fired_at = now
+                state.resolved_at = None
+                state.last_notified_at = now
+                _event(scope, "fired", value)
+            elif state.last_notified_at is None or now - state.last_notified_at >= renotify_after:
+                state.last_notified_at = now
+                _event(scope, "fired", value)
+
+        for scope, state in scope_states.items():
+            if state.is_active and scope not in breaching:
+                state.is_active = False
+                state.resolved_at = now
+                _event(scope, "resolved", state.value)
+
+    db.add_all(events)
+    db.commit()
+    if events:
+        logger.info(f"Alert evaluation for run {run_id}: {len(events)} events across {len(subscriptions)} subscriptions")
+    return events
+
+
+def _digest_body(events: Iterable[AlertEvent], mapping: Dict[str, str]) -> str:
+    rows = []
+    for event in events:
+        description = METRIC_TYPES.get(event.metric_type, (event.metric_type, None))[0]
+        scope = "All terminals" if event.scope == ALL_SCOPE else f"{event.scope} - {mapping.get(event.scope, event.scope)}"
+        color = "#e74c3c" if event.kind == "fired" else "#27ae60"
+        rows.append(
+            f"<tr><td style=\"color: {color};\"><strong>{event.kind.upper()}</strong></td>"
+            f"<td>{description}</td><td>{scope}</td>"
+            f"<td>{event.value:g}</td><td>{event.threshold_value:g}</td></tr>"
+        )
+    return f"""
+        <html>
+        <body>
+            <h2>Terminal Status Alerts</h2>
+            <table cellpadding="6" style="border-collapse: collapse;">
+                <tr><th align="left">Alert</th><th align="left">Metric</th><th align="left">Scope</th>
+                    <th align="left">Value</th><th align="left">Threshold</th></tr>
+                {''.join(rows)}
+            </table>
+        </body>
+        </html>
+        """
+
+
+def queue_alert_digests(db: Session, now: Optional[datetime] = None) -> int:
+    """
+    Queue one outbox email per user with their unsent alert events. With
+    ALERT_DIGEST_MINUTES > 0 a user gets at most one digest per interval.
+    Returns the number of digests queued.
+    """
+    from app.services.email_outbox import enqueue_email, wake_outbox
+    from app.services.merchant_loader import load_merchant_mapping
+
+    now = now or datetime.utcnow()
+    pending = db.query(AlertEvent).filter(AlertEvent.sent_at.is_(None)).order_by(AlertEvent.created_at).all()
+    if not pending:
+        return 0
+
+    by_user: Dict[int, List[AlertEvent]] = defaultdict(list)
+    for event in pending:
+        by_user[event.user_id].append(event)
+
+    last_sent = {}
+    if ALERT_DIGEST_MINUTES > 0:
+        last_sent = dict(
+            db.query(AlertEvent.user_id, func.max(AlertEvent.sent_at))
+            .filter(AlertEvent.user_id.in_(list(by_user)), AlertEvent.sent_at.isnot(None))
+            .group_by(AlertEvent.user_id)
+            .all()
+        )
+    emails = dict(db.query(User.id, User.email).filter(User.id.in_(list(by_user))))
+    orphaned = [user_id for user_id in by_user if user_id not in emails]
+    if orphaned:
+        # Users deleted while their events were waiting for a digest
+        logger.warning(f"Dropping unsent alert events of {len(orphaned)} deleted user(s)")
+        db.query(AlertEvent).filter(AlertEvent.user_id.in_(orphaned)).delete(synchronize_session=False)
+        for user_id in orphaned:
+            del by_user[user_id]
+    mapping = load_merchant_mapping()
+
+    queued = 0
+    for user_id, events in by_user.items():
+        previous = last_sent.get(user_id)
+        if previous and now - previous < timedelta(minutes=ALERT_DIGEST_MINUTES):
+            continue
+        fired = sum(1 for e in events if e.kind == "fired")
+        subject = f"Terminal Status Alerts: {fired} firing, {len(events) - fired} resolved"
+        enqueue_email(db, [emails[user_id]], subject, _digest_body(events, mapping), commit=False)
+        for event in events:
+            event.sent_at = now
+        queued += 1
+    db.commit()
+    if queued:
+        wake_outbox()
+    return queued
+
+
+def delete_user_alerts(db: Session, user_id: int):
+    """Remove a user's alert events and subscription states before the user is deleted (caller commits)"""
+    notification_ids = [n_id for n_id, in db.query(EmailNotification.id).filter(EmailNotification.user_id == user_id)]
+    if notification_ids:
+        db.query(AlertState).filter(AlertState.notification_id.in_(notification_ids)).delete(synchronize_session=False)
+    db.query(AlertEvent).filter(AlertEvent.user_id == user_id).delete(synchronize_session=False)
+
+
+def process_alerts(
+    db: Session,
+    run_id: Optional[str],
+    active_tpns: Optional[Set[str]] = None,
+    timezone=pytz.UTC
+) -> int:
+    """Post-run hook: evaluate subscriptions, then queue due digests. Returns digests queued."""
+    evaluate_alerts(db, run_id, active_tpns, timezone)
+    return queue_alert_digests(db)
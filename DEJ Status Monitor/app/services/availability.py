@@ -0,0 +1,321 @@
+"""
+Time-weighted availability, MTTR and MTBF
+After each run, every new check advances its terminal's cursor in
+terminal_availability: the time since the terminal's previous check is
+credited to the previous check's status (up = ONLINE, down = OFFLINE or
+DISCONNECT; ERROR/UNKNOWN and gaps longer than AVAILABILITY_MAX_GAP_HOURS
+are unobserved). Seconds, failures and recoveries are added to lifetime
+totals on the cursor and to per-day rows (terminal and merchant) in
+availability_daily, so any window is a sum over day rows. Day rows also count
+up_checks, the checks that found a terminal up before them: each was a chance
+to see a failure (the incident baseline is failures per up-check).
+"""
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import pytz
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models import AvailabilityDaily, StatusCheck, Terminal, TerminalAvailability
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+AVAILABILITY_MAX_GAP_HOURS = float(os.getenv("AVAILABILITY_MAX_GAP_HOURS", "24"))  # Longer gaps are not credited
+
+STATE_BY_STATUS = {"ONLINE": "up", "OFFLINE": "down", "DISCONNECT": "down"}
+ID_CHUNK_SIZE = 500  # Terminal ids per IN (...) lookup
+
+# (scope, scope_key, day_start) -> [up_seconds, down_seconds, failures, recoveries, repair_seconds, up_checks]
+Buckets = Dict[Tuple[str, str, datetime], List[float]]
+
+
+class _Days:
+    """Local day boundaries (naive UTC), cached because a run's checks share a day"""
+
+    def __init__(self, timezone):
+        self.timezone = timezone
+        self._start: Optional[datetime] = None
+        self._end: Optional[datetime] = None
+
+    def bounds(self, moment: datetime) -> Tuple[datetime, datetime]:
+        if self._start is None or not (self._start <= moment < self._end):
+            local = pytz.UTC.localize(moment).astimezone(self.timezone).replace(tzinfo=None)
+            midnight = local.replace(hour=0, minute=0, second=0, microsecond=0)
+            to_utc = lambda value: self.timezone.localize(value).astimezone(pytz.UTC).replace(tzinfo=None)
+            self._start, self._end = to_utc(midnight), to_utc(midnight + timedelta(days=1))
+        return self._start, self._end
+
+    def split(self, start: datetime, end: datetime) -> Iterator[Tuple[datetime, float]]:
+        """(day_start, seconds) pieces of [start, end)"""
+        while start < end:
+            day_start, day_end = self.bounds(start)
+            piece_end = min(end, day_end)
+            yield day_start, (piece_end - start).total_seconds()
+            start = piece_end
+
+
+CURSOR_COLUMNS = (
+    "terminal_id", "status", "state", "observed_until", "down_since", "last_check_id", "checks",
+    "online_checks", "up_seconds", "down_seconds", "failures", "recoveries", "repair_seconds",
+)
+_CURSOR_SQL = "INSERT OR REPLACE INTO terminal_availability ({}) VALUES ({})".format(
+    ", ".join(CURSOR_COLUMNS), ", ".join("?" for _ in CURSOR_COLUMNS)
+)
+_BUCKET_SQL = (
+    "INSERT INTO availability_daily "
+    "(scope, scope_key, day_start, up_seconds, down_seconds, failures, recoveries, repair_seconds, up_checks) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (scope, scope_key, day_start) DO UPDATE SET "
+    "up_seconds = up_seconds + excluded.up_seconds, down_seconds = down_seconds + excluded.down_seconds, "
+    "failures = failures + excluded.failures, recoveries = recoveries + excluded.recoveries, "
+    "repair_seconds = repair_seconds + excluded.repair_seconds, up_checks = up_checks + excluded.up_checks"
+)
+
+
+class _Cursor:
+    """Plain copy of a terminal_availability row (ORM change tracking is too slow per run)"""
+    __slots__ = CURSOR_COLUMNS
+
+    def __init__(self, *row, **values):
+        for column, value in zip(CURSOR_COLUMNS, row):
+            setattr(self, column, value)
+        for column in CURSOR_COLUMNS[len(row):]:
+            setattr(self, column, values.get(column))
+
+
+@lru_cache(maxsize=4096)
+def _db_time(value: Optional[datetime]) -> Optional[str]:
+    # SQLAlchemy's SQLite DateTime storage format, so ORM reads and comparisons match
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f") if value is not None else None
+
+
+@lru_cache(maxsize=4096)
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+def _load_cursors(db: Session, terminal_ids: List[int], cursors: Dict[int, _Cursor]):
+    missing = [terminal_id for terminal_id in terminal_ids if terminal_id not in cursors]
+    dbapi_cursor = db.connection().connection.cursor()
+    try:
+        for start in range(0, len(missing), ID_CHUNK_SIZE):
+            chunk = missing[start:start + ID_CHUNK_SIZE]
+            dbapi_cursor.execute(
+                "SELECT {} FROM terminal_availability WHERE terminal_id IN ({})".format(
+                    ", ".join(CURSOR_COLUMNS), ", ".join("?" for _ in chunk)
+                ),
+                chunk
+            )
+            for row in dbapi_cursor.fetchall():
+                cursor = _Cursor(*row)
+                cursor.observed_until = _parse_time(cursor.observed_until)
+                cursor.down_since = _parse_time(cursor.down_since)
+                cursors[cursor.terminal_id] = cursor
+    finally:
+        dbapi_cursor.close()
+
+
+def _apply_check(
+    cursors: Dict[int, _Cursor],
+    buckets: Buckets,
+    days: _Days,
+    check_id: int,
+    terminal_id: int,
+    tpn: str,
+    status: str,
+    checked_at: datetime
+):
+    scopes = (("terminal", tpn), ("merchant", tpn[:4]))
+    cursor = cursors.get(terminal_id)
+    if cursor is None:
+        cursor = _Cursor(
+            terminal_id=terminal_id, status=status, observed_until=checked_at, last_check_id=check_id,
+            checks=0, online_checks=0, up_seconds=0.0, down_seconds=0.0, failures=0, recoveries=0, repair_seconds=0.0
+        )
+        cursors[terminal_id] = cursor
+    elif checked_at < cursor.observed_until:
+        # Older than what the cursor has seen (e.g. a slow manual check)
+        cursor.last_check_id = max(cursor.last_check_id, check_id)
+        return
+    else:
+        previous = STATE_BY_STATUS.get(cursor.status)
+        if previous is not None and checked_at - cursor.observed_until <= timedelta(hours=AVAILABILITY_MAX_GAP_HOURS):
+            index = 0 if previous == "up" else 1
+            for day_start, seconds in days.split(cursor.observed_until, checked_at):
+                for scope, key in scopes:
+                    buckets[(scope, key, day_start)][index] += seconds
+                if index == 0:
+                    cursor.up_seconds += seconds
+                else:
+                    cursor.down_seconds += seconds
+
+    state = STATE_BY_STATUS.get(status)
+    if state is not None and cursor.state == "up":
+        for scope, key in scopes:
+            buckets[(scope, key, days.bounds(checked_at)[0])][5] += 1
+    if state is not None and state != cursor.state:
+        day_start = days.bounds(checked_at)[0]
+        if cursor.state == "up":
+            cursor.failures += 1
+            cursor.down_since = checked_at
+            for scope, key in scopes:
+                buckets[(scope, key, day_start)][2] += 1
+        elif cursor.state == "down" and cursor.down_since is not None:
+            repair = (checked_at - cursor.down_since).total_seconds()
+            cursor.recoveries += 1
+            cursor.repair_seconds += repair
+            for scope, key in scopes:
+                bucket = buckets[(scope, key, day_start)]
+                bucket[3] += 1
+                bucket[4] += repair
+        if state == "up":
+            cursor.down_since = None
+        cursor.state = state
+
+    cursor.status = status
+    cursor.observed_until = checked_at
+    cursor.last_check_id = max(cursor.last_check_id, check_id)
+    cursor.checks += 1
+    if status == "ONLINE":
+        cursor.online_checks += 1
+
+
+def _write(db: Session, cursors: Iterable[_Cursor], buckets: Buckets):
+    """Store cursors and add bucket deltas to availability_daily"""
+    # DBAPI executemany: SQLAlchemy's per-row parameter handling dominates at fleet size
+    cursor_rows = []
+    for cursor in cursors:
+        row = [getattr(cursor, column) for column in CURSOR_COLUMNS]
+        row[3], row[4] = _db_time(cursor.observed_until), _db_time(cursor.down_since)
+        cursor_rows.append(row)
+    bucket_rows = [
+        (scope, key, _db_time(day_start), up, down, failures, recoveries, repair, up_checks)
+        for (scope, key, day_start), (up, down, failures, recoveries, repair, up_checks) in buckets.items()
+    ]
+    dbapi_cursor = db.connection().connection.cursor()
+    try:
+        dbapi_cursor.executemany(_CURSOR_SQL, cursor_rows)
+        dbapi_cursor.executemany(_BUCKET_SQL, bucket_rows)
+    finally:
+        dbapi_cursor.close()
+    buckets.clear()
+
+
+def update_availability(db: Session, timezone=pytz.UTC, batch_size: int = 50000) -> int:
+    """
+    Apply every check stored since the last update (in time order) to the
+    cursors and daily rollups. On the first start after upgrading this
+    replays all of status_checks. Commits. Returns checks applied.
+    """
+    watermark = db.query(func.max(TerminalAvailability.last_check_id)).scalar() or 0
+    query = db.query(
+        StatusCheck.id, StatusCheck.terminal_id, Terminal.tpn, StatusCheck.status, StatusCheck.checked_at
+    ).join(Terminal, Terminal.id == StatusCheck.terminal_id).filter(
+        StatusCheck.id > watermark
+    ).order_by(StatusCheck.checked_at, StatusCheck.id)
+
+    cursors: Dict[int, _Cursor] = {}
+    buckets: Buckets = defaultdict(lambda: [0.0, 0.0, 0, 0, 0.0, 0])
+    days = _Days(timezone)
+    applied = 0
+    batch = []
+
+    def _apply_batch():
+        touched = {row[1] for row in batch}
+        _load_cursors(db, list(touched), cursors)
+        for row in batch:
+            _apply_check(cursors, buckets, days, *row)
+        _write(db, (cursors[terminal_id] for terminal_id in touched), buckets)
+
+    for row in query.yield_per(batch_size):
+        batch.append(tuple(row))
+        if len(batch) >= batch_size:
+            _apply_batch()
+            applied += len(batch)
+            batch = []
+    if batch:
+        _apply_batch()
+        applied += len(batch)
+    db.commit()
+    if applied >= batch_size:
+        logger.info(f"Availability: applied {applied} checks for {len(cursors)} terminals")
+    return applied
+
+
+def _summary(up: float, down: float, failures: int, recoveries: int, repair: float) -> Dict:
+    observed = up + down
+    return {
+        "observed_seconds": round(observed),
+        "up_seconds": round(up),
+        "down_seconds": round(down),
+        "availability_percentage": round(up / observed * 100, 3) if observed else None,
+        "outages": failures,
+        "recoveries": recoveries,
+        "mttr_seconds": round(repair / recoveries) if recoveries else None,
+        "mtbf_seconds": round(up / failures) if failures else None,
+    }
+
+
+_SUMS = (
+    func.coalesce(func.sum(AvailabilityDaily.up_seconds), 0),
+    func.coalesce(func.sum(AvailabilityDaily.down_seconds), 0),
+    func.coalesce(func.sum(AvailabilityDaily.failures), 0),
+    func.coalesce(func.sum(AvailabilityDaily.recoveries), 0),
+    func.coalesce(func.sum(AvailabilityDaily.repair_seconds), 0),
+)
+
+
+def availability_summary(
+    db: Session,
+    start: datetime,
+    end: datetime,
+    scope: str = "all",
+    key: Optional[str] = None,
+    keys: Optional[Sequence[str]] = None
+) -> Dict:
+    """
+    Availability, outages, MTTR and MTBF for days starting in [start, end)
+    (naive UTC). For the "all" scope, keys limits the total to those merchants.
+    """
+    query = db.query(*_SUMS).filter(AvailabilityDaily.day_start >= start, AvailabilityDaily.day_start < end)
+    if scope == "all":
+        query = query.filter(AvailabilityDaily.scope == "merchant")
+        if keys is not None:
+            query = query.filter(AvailabilityDaily.scope_key.in_(list(keys)))
+    else:
+        query = query.filter(AvailabilityDaily.scope == scope, AvailabilityDaily.scope_key == key)
+    return _summary(*query.one())
+
+
+def availability_by_key(
+    db: Session,
+    start: datetime,
+    end: datetime,
+    scope: str,
+    prefix: Optional[str] = None,
+    keys: Optional[Sequence[str]] = None
+) -> Dict[str, Dict]:
+    """Per-merchant or per-terminal summaries; prefix limits terminals to one merchant"""
+    query = db.query(AvailabilityDaily.scope_key, *_SUMS).filter(
+        AvailabilityDaily.scope == scope, AvailabilityDaily.day_start >= start, AvailabilityDaily.day_start < end
+    )
+    if prefix:
+        query = query.filter(AvailabilityDaily.scope_key >= prefix, AvailabilityDaily.scope_key < prefix + "\uffff")
+    if keys is not None:
+        query = query.filter(AvailabilityDaily.scope_key.in_(list(keys)))
+    return {key: _summary(*sums) for key, *sums in query.group_by(AvailabilityDaily.scope_key).order_by(AvailabilityDaily.scope_key)}
+
+
+def uptime_percentage(cursor: Optional[TerminalAvailability]) -> float:
+    """Lifetime time-weighted uptime; the check ratio until any time has been observed"""
+    if cursor is None:
+        return 0.0
+    observed = cursor.up_seconds + cursor.down_seconds
+    if observed:
+        return cursor.up_seconds / observed * 100
+    return cursor.online_checks / cursor.checks * 100 if cursor.checks else 0.0
@@ -1,9 +1,17 @@
 """
 Database backup service
-Creates daily backups and maintains 1 week of backups
+Creates daily backups and maintains 1 week of backups.
+Backups use the SQLite online backup API (consistent even while the app is
+writing), are integrity-checked, then compressed with gzip (or zstd if the
+optional zstandard package is installed and BACKUP_COMPRESSION=zstd).
 """
+import asyncio
+import gzip
 import os
+import re
 import shutil
+import sqlite3
+import time
 import logging
 from datetime import datetime, timedelta
 from pathlib import Path
@@ -11,6 +19,15 @@ from typing import Optional
 
 logger = logging.getLogger(__name__)
 
+# Configuration
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "1024"))  # Pages copied per backup step
+BACKUP_COMPRESSION = os.getenv("BACKUP_COMPRESSION", "gzip").lower()  # gzip or zstd
+
+BACKUP_NAME_RE = re.compile(r"^status_monitor_(\d{8}_\d{6})\.db(\.gz|\.zst)?$")
+
+# Last backup stats (path, duration, sizes) for status reporting
+last_backup_stats: Optional[dict] = None
+
 
 def get_backup_dir() -> Path:
     """Get the backup directory path"""
@@ -19,29 +36,112 @@ def get_backup_dir() -> Path:
     return backup_dir
 
 
+def _list_backups(backup_dir: Path) -> list:
+    """Backup files in backup_dir (plain, .gz or .zst)"""
+    return [p for p in backup_dir.glob("status_monitor_*") if BACKUP_NAME_RE.match(p.name)]
+
+
+def _compressor():
+    """Return (extension, open function) for the configured compression"""
+    if BACKUP_COMPRESSION == "zstd":
+        try:
+            import zstandard
+            return ".zst", lambda path, mode: zstandard.open(path, mode)
+        except ImportError:
+            logger.warning("BACKUP_COMPRESSION=zstd but zstandard is not installed, falling back to gzip")
+    return ".gz", lambda path, mode: gzip.open(path, mode, compresslevel=6)
+
+
+def _open_backup(path: str):
+    """Open a backup file for reading, decompressing by extension"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".zst"):
+        import zstandard
+        return zstandard.open(path, "rb")
+    return open(path, "rb")
+
+
+def _online_copy(src_path: str, dst_path: str) -> None:
+    """Copy a SQLite database with the online backup API in page-stepped increments"""
+    src = sqlite3.connect(src_path)
+    dst = sqlite3.connect(dst_path)
+    try:
+        with dst:
+            src.backup(dst, pages=BACKUP_PAGES_PER_STEP)
+    finally:
+        dst.close()
+        src.close()
+
+
+def _integrity_ok(db_path: str) -> bool:
+    """Run PRAGMA integrity_check on a database file"""
+    conn = sqlite3.connect(db_path)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()
+        return bool(result) and result[0] == "ok"
+    finally:
+        conn.close()
+
+
 def create_backup(db_path: str) -> Optional[str]:
     """
-    Create a backup of the database file.
+    Create a compressed, integrity-checked backup of the database.
+    The compressed file is written under a .tmp name and renamed into place,
+    so a failed backup never leaves a truncated file for get_latest_backup().
+    Blocking; call from a worker thread when on the event loop.
     Returns the backup file path if successful, None otherwise.
     """
+    global last_backup_stats
+    tmp_path = None
+    partial_path = None
     try:
         if not os.path.exists(db_path):
             logger.warning(f"Database file not found: {db_path}")
             return None
-        
+
+        start_time = time.perf_counter()
         backup_dir = get_backup_dir()
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_filename = f"status_monitor_{timestamp}.db"
-        backup_path = backup_dir / backup_filename
-        
+        extension, open_compressed = _compressor()
+        backup_path = backup_dir / f"status_monitor_{timestamp}.db{extension}"
+        tmp_path = str(backup_dir / f"status_monitor_{timestamp}.db.tmp")
+        partial_path = f"{backup_path}.tmp"
+
         logger.info(f"Creating backup: {backup_path}")
-        shutil.copy2(db_path, backup_path)
-        logger.info(f"Backup created successfully: {backup_path}")
-        
+        _online_copy(db_path, tmp_path)
+
+        if not _integrity_ok(tmp_path):
+            logger.error(f"Backup failed integrity check, discarding: {tmp_path}")
+            return None
+
+        raw_size = os.path.getsize(tmp_path)
+        with open(tmp_path, "rb") as src, open_compressed(partial_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, length=1024 * 1024)
+        os.replace(partial_path, backup_path)
+        compressed_size = os.path.getsize(backup_path)
+        duration_ms = int((time.perf_counter() - start_time) * 1000)
+
+        last_backup_stats = {
+            "path": str(backup_path),
+            "created_at": datetime.now().isoformat(),
+            "duration_ms": duration_ms,
+            "raw_bytes": raw_size,
+            "compressed_bytes": compressed_size
+        }
+        logger.info(
+            f"Backup created successfully: {backup_path} "
+            f"({raw_size / 1048576:.1f} MB -> {compressed_size / 1048576:.1f} MB in {duration_ms}ms)"
+        )
+
         return str(backup_path)
     except Exception as e:
         logger.error(f"Error creating backup: {e}", exc_info=True)
         return None
+    finally:
+        for path in (tmp_path, partial_path):
+            if path and os.path.exists(path):
+                os.remove(path)
 
 
 def cleanup_old_backups(keep_days: int = 7) -> int:
@@ -53,17 +153,16 @@ def cleanup_old_backups(keep_days: int = 7) -> int:
         backup_dir = get_backup_dir()
         if not backup_dir.exists():
             return 0
-        
+
         cutoff_date = datetime.now() - timedelta(days=keep_days)
         deleted_count = 0
-        
-        for backup_file in backup_dir.glob("status_monitor_*.db"):
+
+        for backup_file in _list_backups(backup_dir):
             try:
-                # Extract timestamp from filename: status_monitor_YYYYMMDD_HHMMSS.db
-                filename = backup_file.stem  # status_monitor_YYYYMMDD_HHMMSS
-                timestamp_str = filename.replace("status_monitor_", "")
+                # Extract timestamp from filename: status_monitor_YYYYMMDD_HHMMSS.db[.gz|.zst]
+                timestamp_str = BACKUP_NAME_RE.match(backup_file.name).group(1)
                 file_date = datetime.strptime(timestamp_str, "%Y%m%d_%H%M%S")
-                
+
                 if file_date < cutoff_date:
                     logger.info(f"Deleting old backup: {backup_file}")
                     backup_file.unlink()
@@ -72,27 +171,54 @@ def cleanup_old_backups(keep_days: int = 7) -> int:
                 logger.warning(f"Error processing backup file {backup_file}: {e}")
                 # If we can't parse the date, skip it (might be manually created)
                 continue
-        
+
         if deleted_count > 0:
             logger.info(f"Cleaned up {deleted_count} old backup(s)")
-        
+
         return deleted_count
     except Exception as e:
         logger.error(f"Error cleaning up old backups: {e}", exc_info=True)
         return 0
 
 
+def backup_history_partitions(history_dir: str) -> int:
+    """
+    Copy frozen history partitions (app/services/history.py) that are new or
+    changed since the last backup into BACKUP_DIR/history. Partitions never
+    change once closed, so a nightly backup only copies newly closed months;
+    they are kept, not rotated. Returns files copied.
+    """
+    if not os.path.isdir(history_dir):
+        return 0
+    target_dir = get_backup_dir() / "history"
+    target_dir.mkdir(parents=True, exist_ok=True)
+    copied = 0
+    for entry in os.scandir(history_dir):
+        if not entry.is_file() or not re.match(r"^status_checks_\d{4}_\d{2}\.(db|db\.gz|parquet)$", entry.name):
+            continue
+        target = target_dir / entry.name
+        if target.exists() and target.stat().st_mtime >= entry.stat().st_mtime:
+            continue
+        tmp_path = target_dir / f"{entry.name}.tmp"
+        shutil.copyfile(entry.path, tmp_path)
+        os.replace(tmp_path, target)
+        copied += 1
+    if copied:
+        logger.info(f"Backed up {copied} history partition file(s) to {target_dir}")
+    return copied
+
+
 def get_latest_backup() -> Optional[str]:
     """Get the path to the most recent backup file"""
     try:
         backup_dir = get_backup_dir()
         if not backup_dir.exists():
             return None
-        
-        backups = list(backup_dir.glob("status_monitor_*.db"))
+
+        backups = _list_backups(backup_dir)
         if not backups:
             return None
-        
+
         # Sort by modification time (most recent first)
         backups.sort(key=lambda p: p.stat().st_mtime, reverse=True)
         return str(backups[0])
@@ -103,33 +229,50 @@ def get_latest_backup() -> Optional[str]:
 
 def restore_backup(backup_path: str, db_path: str) -> bool:
     """
-    Restore database from a backup file.
+    Restore database from a backup file (plain, .gz or .zst).
+    The backup is decompressed to a temp file, integrity-checked, then copied
+    into db_path with the online backup API.
     Returns True if successful, False otherwise.
     """
+    tmp_path = f"{db_path}.restore.tmp"
     try:
         if not os.path.exists(backup_path):
             logger.error(f"Backup file not found: {backup_path}")
             return False
-        
+
         logger.info(f"Restoring database from backup: {backup_path}")
-        shutil.copy2(backup_path, db_path)
+        with _open_backup(backup_path) as src, open(tmp_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, length=1024 * 1024)
+
+        if not _integrity_ok(tmp_path):
+            logger.error(f"Backup failed integrity check, not restoring: {backup_path}")
+            return False
+
+        _online_copy(tmp_path, db_path)
         logger.info(f"Database restored successfully from: {backup_path}")
         return True
     except Exception as e:
         logger.error(f"Error restoring backup: {e}", exc_info=True)
         return False
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 
-async def daily_backup_task(db_path: str) -> bool:
+async def daily_backup_task(db_path: str, history_dir: Optional[str] = None) -> bool:
     """
-    Daily backup task: create backup and cleanup old ones.
+    Daily backup task: create backup, copy newly closed history partitions
+    and cleanup old ones.
+    Runs the blocking work in a worker thread so the event loop stays free.
     Returns True if backup was created successfully.
     """
     logger.info("Starting daily backup task...")
-    
-    backup_path = create_backup(db_path)
+
+    backup_path = await asyncio.to_thread(create_backup, db_path)
     if backup_path:
-        cleanup_old_backups(keep_days=7)
+        if history_dir:
+            await asyncio.to_thread(backup_history_partitions, history_dir)
+        await asyncio.to_thread(cleanup_old_backups, 7)
         logger.info("Daily backup task completed successfully")
         return True
     else:
@@ -0,0 +1,145 @@
+"""
+Per-merchant check policies
+Scheduled runs plan their work set from check_policies instead of checking
+every terminal at every check time:
+- paused: not checked by scheduled runs (test/demo units, closed merchants)
+- active hours: active_start/active_end/active_days in the policy's time
+  zone; check times outside them are skipped
+- tier: standard checks at every check time; daily and weekly only once the
+  terminal's last check is that old
+Terminal policies override their merchant's field by field. Terminals with
+no ONLINE check for CHECK_POLICY_DORMANT_DAYS drop to the weekly tier unless a
+policy sets one, so a dead terminal is still seen when it comes back.
+Manual runs ("Run Check Now") check every terminal.
+"""
+import logging
+import os
+from datetime import datetime, time, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+import pytz
+from sqlalchemy.orm import Session
+
+from app.models import CheckPolicy, Status, Terminal, TerminalState
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+CHECK_POLICY_DORMANT_DAYS = int(os.getenv("CHECK_POLICY_DORMANT_DAYS", "30"))  # 0 = off
+
+SCOPES = ("merchant", "terminal")
+POLICY_FIELDS = ("timezone", "active_start", "active_end", "active_days", "tier", "paused")
+# Minimum age of the last check before a tier checks the terminal again; a
+# little under a day/week so a run starting a few minutes early still counts
+TIERS = {
+    "standard": timedelta(0),
+    "daily": timedelta(hours=20),
+    "weekly": timedelta(days=6, hours=20),
+}
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+DECISIONS = ("due", "paused", "inactive", "tier", "dormant")
+
+
+def parse_hhmm(value: str) -> time:
+    """"HH:MM" -> time; raises ValueError"""
+    hour, minute = value.split(":")
+    return time(int(hour), int(minute))
+
+
+def effective_policy(merchant: Optional[CheckPolicy], terminal: Optional[CheckPolicy]) -> Dict:
+    """Policy fields for one terminal: its own where set, else its merchant's, else None"""
+    return {
+        field: next(
+            (getattr(p, field) for p in (terminal, merchant) if p is not None and getattr(p, field) is not None),
+            None
+        )
+        for field in POLICY_FIELDS
+    }
+
+
+def is_active(policy: Dict, now: datetime, timezone=pytz.UTC) -> bool:
+    """Whether now (naive UTC) falls in the policy's active hours and days"""
+    tz = pytz.timezone(policy["timezone"]) if policy["timezone"] else timezone
+    local = pytz.UTC.localize(now).astimezone(tz)
+    day = local.weekday()
+    if policy["active_start"] and policy["active_end"]:
+        start, end, current = parse_hhmm(policy["active_start"]), parse_hhmm(policy["active_end"]), local.time()
+        if start < end:
+            if not start <= current < end:
+                return False
+        else:
+            # Wraps past midnight: the early hours belong to the previous day's window
+            if end <= current < start:
+                return False
+            if current < end:
+                day = (day - 1) % 7
+    if policy["active_days"]:
+        return DAYS[day] in policy["active_days"].split(",")
+    return True
+
+
+def _decide(policy: Dict, state: Optional[TerminalState], now: datetime, timezone, dormant_before: Optional[datetime]) -> str:
+    if policy["paused"]:
+        return "paused"
+    if not is_active(policy, now, timezone):
+        return "inactive"
+    if state is None:
+        return "due"
+    tier, reason = policy["tier"], "tier"
+    if tier is None and dormant_before is not None and state.status != Status.ONLINE.value:
+        if (state.last_online_at or state.status_since) < dormant_before:
+            tier, reason = "weekly", "dormant"
+    if tier and now - state.checked_at < TIERS[tier]:
+        return reason
+    return "due"
+
+
+def _load_policies(db: Session) -> Dict[Tuple[str, str], CheckPolicy]:
+    return {(policy.scope, policy.key): policy for policy in db.query(CheckPolicy)}
+
+
+def _policy_for(policies: Dict[Tuple[str, str], CheckPolicy], tpn: str) -> Dict:
+    return effective_policy(policies.get(("merchant", tpn[:4])), policies.get(("terminal", tpn)))
+
+
+def plan_run(
+    db: Session,
+    now: Optional[datetime] = None,
+    timezone=pytz.UTC,
+    preview: bool = False
+) -> Tuple[List[Terminal], Dict[str, int]]:
+    """
+    Terminals a scheduled run at now (naive UTC) should check, and terminal
+    counts per decision (see DECISIONS). preview skips metrics and logging.
+    """
+    now = now or datetime.utcnow()
+    policies = _load_policies(db)
+    dormant_before = now - timedelta(days=CHECK_POLICY_DORMANT_DAYS) if CHECK_POLICY_DORMANT_DAYS > 0 else None
+    counts = dict.fromkeys(DECISIONS, 0)
+    due = []
+    rows = db.query(Terminal, TerminalState).outerjoin(
+        TerminalState, TerminalState.terminal_id == Terminal.id
+    ).order_by(Terminal.id)
+    for terminal, state in rows:
+        decision = _decide(_policy_for(policies, terminal.tpn), state, now, timezone, dormant_before)
+        counts[decision] += 1
+        if decision == "due":
+            due.append(terminal)
+    if preview:
+        return due, counts
+
+    for decision, count in counts.items():
+        if count:
+            metrics.CHECK_PLANNED.inc(count, decision=decision)
+    skipped = ", ".join(f"{count} {decision}" for decision, count in counts.items() if decision != "due" and count)
+    logger.info(f"Planned run: {counts['due']} of {sum(counts.values())} terminals due" + (f" (skipped {skipped})" if skipped else ""))
+    return due, counts
+
+
+def paused_tpns(db: Session) -> Set[str]:
+    """TPNs paused by their own or their merchant's policy"""
+    policies = _load_policies(db)
+    if not any(policy.paused for policy in policies.values()):
+        return set()
+    return {tpn for (tpn,) in db.query(Terminal.tpn) if _policy_for(policies, tpn)["paused"]}
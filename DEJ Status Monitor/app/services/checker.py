@@ -2,18 +2,24 @@
 Async checker service for terminal status checks
 """
 import asyncio
+import contextlib
 import httpx
 import time
 import uuid
 import random
 import logging
+from collections import OrderedDict
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from sqlalchemy.orm import Session
 from app.models import Terminal, StatusCheck, Status
 from app.services.parser import parse_status_response, truncate_response
+from app.services import metrics, run_trace
+from app.services.transitions import record_transitions
 
 logger = logging.getLogger(__name__)
+# Per-TPN retry outcomes; sampled by the logging pipeline (see app.logging_config)
+retry_logger = logging.getLogger(f"{__name__}.retries")
 
 # Configuration
 BASE_URL = "https://spinpos.net/spin/GetTerminalStatus"
@@ -21,6 +27,25 @@ TIMEOUT_SECONDS = 30
 MAX_RETRIES = 3
 CONCURRENT_REQUESTS = 30  # Safe concurrency level
 JITTER_MS = (0, 500)  # Random delay between 0-500ms
+RECENT_RESULT_MAX_AGE_SECONDS = 600  # Longest freshness window served; older results are dropped
+
+# Singleflight state: one in-flight check per TPN, shared by every caller
+# (scheduled run, retry pass, manual "check now"), plus the most recent
+# result per TPN so callers can opt in to a freshness window. Results are
+# kept oldest first, so expired ones are evicted from the front.
+_inflight_checks: Dict[str, asyncio.Task] = {}
+_recent_results: "OrderedDict[str, Tuple[float, datetime, Dict]]" = OrderedDict()
+
+
+def _remember_result(tpn: str, result: Dict):
+    now = time.monotonic()
+    _recent_results.pop(tpn, None)
+    _recent_results[tpn] = (now, datetime.utcnow(), result)
+    while _recent_results:
+        oldest = next(iter(_recent_results.values()))
+        if now - oldest[0] <= RECENT_RESULT_MAX_AGE_SECONDS:
+            break
+        _recent_results.popitem(last=False)
 
 
 async def check_single_terminal(
@@ -37,87 +62,177 @@ async def check_single_terminal(
     # Add jitter to avoid slamming server
     jitter = random.uniform(*JITTER_MS) / 1000
     await asyncio.sleep(jitter)
+    run_trace.mark("jitter_done")
     
     async with semaphore:
-        start_time = time.time()
-        last_error = None
-        last_response = None
-        last_http_status = None
-        
-        for attempt in range(MAX_RETRIES):
-            try:
-                response = await client.get(url, timeout=TIMEOUT_SECONDS)
-                elapsed_ms = int((time.time() - start_time) * 1000)
-                last_http_status = response.status_code
+        run_trace.mark("acquired")
+        metrics.CHECK_INFLIGHT.inc()
+        try:
+            result = await _request_with_retries(client, url)
+        finally:
+            metrics.CHECK_INFLIGHT.dec()
+            run_trace.mark("released")
+    
+    metrics.CHECK_LATENCY.observe(result["latency_ms"] / 1000, outcome=result["status"].value)
+    return result
+
+
+async def _request_with_retries(client: httpx.AsyncClient, url: str) -> Dict:
+    """Issue the GetTerminalStatus request, retrying network errors with backoff"""
+    start_time = time.time()
+    last_error = None
+    last_response = None
+    last_http_status = None
+    
+    for attempt in range(MAX_RETRIES):
+        try:
+            run_trace.mark("request_start")
+            response = await client.get(url, timeout=TIMEOUT_SECONDS)
+            run_trace.mark("request_end")
+            elapsed_ms = int((time.time() - start_time) * 1000)
+            last_http_status = response.status_code
+            
+            if response.status_code == 200:
+                response_text = response.text
+                last_response = response_text
+                status = parse_status_response(response_text)
                 
-                if response.status_code == 200:
-                    response_text = response.text
-                    last_response = response_text
-                    status = parse_status_response(response_text)
-                    
-                    return {
-                        "status": status,
-                        "raw_response": truncate_response(response_text),
-                        "error": None,
-                        "http_status": response.status_code,
-                        "latency_ms": elapsed_ms
-                    }
-                else:
-                    # Non-200 status, treat as error but store response
-                    response_text = response.text
-                    last_response = response_text
-                    status = parse_status_response(response_text)
-                    
-                    return {
-                        "status": status if status != Status.UNKNOWN else Status.ERROR,
-                        "raw_response": truncate_response(response_text),
-                        "error": f"HTTP {response.status_code}",
-                        "http_status": response.status_code,
-                        "latency_ms": elapsed_ms
-                    }
-                    
-            except httpx.TimeoutException as e:
-                last_error = f"Timeout: {str(e)}"
-                if attempt < MAX_RETRIES - 1:
-                    wait_time = (2 ** attempt) + random.uniform(0, 1)
-                    await asyncio.sleep(wait_time)
-                continue
+                return {
+                    "status": status,
+                    "raw_response": truncate_response(response_text),
+                    "error": None,
+                    "http_status": response.status_code,
+                    "latency_ms": elapsed_ms
+                }
+            else:
+                # Non-200 status, treat as error but store response
+                response_text = response.text
+                last_response = response_text
+                status = parse_status_response(response_text)
+                metrics.CHECK_ERRORS.inc(type="http")
                 
-            except httpx.RequestError as e:
-                last_error = f"Request error: {str(e)}"
-                if attempt < MAX_RETRIES - 1:
-                    wait_time = (2 ** attempt) + random.uniform(0, 1)
-                    await asyncio.sleep(wait_time)
-                continue
+                return {
+                    "status": status if status != Status.UNKNOWN else Status.ERROR,
+                    "raw_response": truncate_response(response_text),
+                    "error": f"HTTP {response.status_code}",
+                    "http_status": response.status_code,
+                    "latency_ms": elapsed_ms
+                }
                 
-            except Exception as e:
-                last_error = f"Unexpected error: {str(e)}"
-                if attempt < MAX_RETRIES - 1:
-                    wait_time = (2 ** attempt) + random.uniform(0, 1)
-                    await asyncio.sleep(wait_time)
-                continue
+        except httpx.TimeoutException as e:
+            last_error = f"Timeout: {str(e)}"
+            error_type = "timeout"
+        except httpx.RequestError as e:
+            last_error = f"Request error: {str(e)}"
+            error_type = "request_error"
+        except Exception as e:
+            last_error = f"Unexpected error: {str(e)}"
+            error_type = "unexpected"
         
-        # All retries failed
-        elapsed_ms = int((time.time() - start_time) * 1000)
-        return {
-            "status": Status.ERROR,
-            "raw_response": truncate_response(last_response) if last_response else None,
-            "error": last_error or "Unknown error",
-            "http_status": last_http_status,
-            "latency_ms": elapsed_ms
-        }
-
-
-async def run_check_all_terminals(db: Session) -> str:
+        run_trace.mark("request_end")
+        metrics.CHECK_ERRORS.inc(type=error_type)
+        if attempt < MAX_RETRIES - 1:
+            metrics.CHECK_RETRIES.inc(type=error_type)
+            run_trace.mark("backoff")
+            wait_time = (2 ** attempt) + random.uniform(0, 1)
+            await asyncio.sleep(wait_time)
+    
+    # All retries failed
+    elapsed_ms = int((time.time() - start_time) * 1000)
+    return {
+        "status": Status.ERROR,
+        "raw_response": truncate_response(last_response) if last_response else None,
+        "error": last_error or "Unknown error",
+        "http_status": last_http_status,
+        "latency_ms": elapsed_ms
+    }
+
+
+async def _check_with_own_client(tpn: str, semaphore: asyncio.Semaphore) -> Dict:
+    async with httpx.AsyncClient(timeout=TIMEOUT_SECONDS) as client:
+        return await check_single_terminal(client, tpn, semaphore)
+
+
+async def check_terminal_singleflight(
+    client: Optional[httpx.AsyncClient],
+    tpn: str,
+    semaphore: asyncio.Semaphore,
+    max_age_seconds: Optional[float] = None
+) -> Tuple[Dict, datetime, bool]:
     """
-    Run status check for all terminals in the database.
+    Check a terminal, coalescing concurrent callers onto one upstream request.
+    If max_age_seconds is given and a result for this TPN was recorded within
+    that window (at most RECENT_RESULT_MAX_AGE_SECONDS), it is returned
+    without touching the network.
+    Callers that may be cancelled mid-check (an HTTP request) pass client=None:
+    the shared check then opens its own client, so callers that joined it are
+    not left with a closed one.
+    Returns (result, checked_at, performed) where performed is True only for
+    the caller whose request actually went out (and should store the result).
+    """
+    if max_age_seconds is not None and max_age_seconds > 0:
+        recent = _recent_results.get(tpn)
+        if recent and time.monotonic() - recent[0] <= max_age_seconds:
+            logger.debug(f"Serving cached result for {tpn} (age {time.monotonic() - recent[0]:.1f}s)")
+            return recent[2], recent[1], False
+
+    task = _inflight_checks.get(tpn)
+    if task is not None:
+        logger.debug(f"Joining in-flight check for {tpn}")
+        run_trace.mark("joined")
+        result = await asyncio.shield(task)
+        return result, _recent_results[tpn][1], False
+
+    if client is None:
+        task = asyncio.ensure_future(_check_with_own_client(tpn, semaphore))
+    else:
+        task = asyncio.ensure_future(check_single_terminal(client, tpn, semaphore))
+    _inflight_checks[tpn] = task
+
+    def _on_done(t: asyncio.Task):
+        if _inflight_checks.get(tpn) is t:
+            del _inflight_checks[tpn]
+        if not t.cancelled() and t.exception() is None:
+            _remember_result(tpn, t.result())
+
+    task.add_done_callback(_on_done)
+    result = await asyncio.shield(task)
+    return result, _recent_results[tpn][1], True
+
+
+async def _check_for_run(
+    client: httpx.AsyncClient,
+    tpn: str,
+    semaphore: asyncio.Semaphore,
+    trace: Optional[run_trace.RunTrace] = None,
+    pass_name: str = "main"
+) -> Tuple[Dict, bool]:
+    """
+    Run-path wrapper: share in-flight checks with manual callers, recording a
+    span if traced. Returns (result, performed); results joined from another
+    caller's check are stored by that caller, not the run.
+    """
+    if trace is None:
+        result, _, performed = await check_terminal_singleflight(client, tpn, semaphore)
+        return result, performed
+    with trace.span(tpn, pass_name) as span:
+        result, _, performed = await check_terminal_singleflight(client, tpn, semaphore)
+        span.status = result["status"].value
+    return result, performed
+
+
+async def run_check_all_terminals(db: Session, terminals: Optional[List[Terminal]] = None) -> str:
+    """
+    Run status check for all terminals in the database, or only the given
+    terminals (a scheduled run's plan, see app.services.check_policies).
     Returns run_id (UUID string) for this check run.
     """
     run_id = str(uuid.uuid4())
     logger.info(f"Starting check run {run_id}")
     
     # Get all terminals
-    terminals = db.query(Terminal).all()
+    if terminals is None:
+        terminals = db.query(Terminal).all()
     if not terminals:
         logger.warning("No terminals found in database")
         return run_id
@@ -126,17 +241,23 @@ async def run_check_all_terminals(db: Session) -> str:
     
     # Create semaphore for concurrency control
     semaphore = asyncio.Semaphore(CONCURRENT_REQUESTS)
+    metrics.CHECK_CONCURRENCY_WINDOW.set(CONCURRENT_REQUESTS)
+    trace = run_trace.RunTrace(run_id, CONCURRENT_REQUESTS) if run_trace.TRACE_ENABLED else None
+    phase = trace.phase if trace else (lambda name: contextlib.nullcontext())
+    phase_start = time.perf_counter()
     
     # Create HTTP client with timeout
     async with httpx.AsyncClient(timeout=TIMEOUT_SECONDS) as client:
         # Create tasks for all terminals
         tasks = [
-            check_single_terminal(client, terminal.tpn, semaphore)
+            _check_for_run(client, terminal.tpn, semaphore, trace)
             for terminal in terminals
         ]
         
         # Execute all checks concurrently
-        results = await asyncio.gather(*tasks)
+        with phase("fetch"):
+            results, performed = map(list, zip(*await asyncio.gather(*tasks)))
+        metrics.CHECK_RUN_PHASE.observe(time.perf_counter() - phase_start, phase="fetch")
         
         # Identify terminals that need retry (not ONLINE or OFFLINE)
         retry_terminals = []
@@ -149,54 +270,88 @@ async def run_check_all_terminals(db: Session) -> str:
         # Retry non-Online/Offline responses at the end
         if retry_terminals:
             logger.info(f"Retrying {len(retry_terminals)} terminals with non-Online/Offline status")
-            await asyncio.sleep(2)  # Small delay before retry
+            phase_start = time.perf_counter()
+            with phase("retry_wait"):
+                await asyncio.sleep(2)  # Small delay before retry
             
             retry_tasks = [
-                check_single_terminal(client, terminal.tpn, semaphore)
+                _check_for_run(client, terminal.tpn, semaphore, trace, "retry")
                 for terminal in retry_terminals
             ]
-            retry_new_results = await asyncio.gather(*retry_tasks)
+            with phase("retry_pass"):
+                retry_new_results = await asyncio.gather(*retry_tasks)
             
             # Update results with retry attempts
-            for idx, (original_idx, terminal, old_result, new_result) in enumerate(zip(retry_indices, retry_terminals, [results[i] for i in retry_indices], retry_new_results)):
+            for idx, (original_idx, terminal, old_result, (new_result, new_performed)) in enumerate(zip(retry_indices, retry_terminals, [results[i] for i in retry_indices], retry_new_results)):
                 # Only update if we got a credible response (ONLINE or OFFLINE)
                 if new_result["status"] in [Status.ONLINE, Status.OFFLINE]:
-                    logger.info(f"Retry successful for {terminal.tpn}: {old_result['status'].value} -> {new_result['status'].value}")
+                    retry_logger.info(f"Retry successful for {terminal.tpn}: {old_result['status'].value} -> {new_result['status'].value}")
                     results[original_idx] = new_result
+                    performed[original_idx] = new_performed
+                    metrics.CHECK_RETRY_PASS.inc(result="recovered")
                 else:
-                    logger.info(f"Retry still non-credible for {terminal.tpn}: {new_result['status'].value}, keeping original")
+                    retry_logger.info(f"Retry still non-credible for {terminal.tpn}: {new_result['status'].value}, keeping original")
+                    if new_performed and not performed[original_idx]:
+                        # The original was joined (stored by its caller); store the run's own check
+                        results[original_idx], performed[original_idx] = new_result, True
+                    metrics.CHECK_RETRY_PASS.inc(result="still_failed")
+            metrics.CHECK_RUN_PHASE.observe(time.perf_counter() - phase_start, phase="retry_pass")
     
-    # Store results in database
+    # Store results in database; joined results were stored by the caller that performed them
+    # (terminals left out count with their current state in run summaries)
+    owned = [(terminal, result) for terminal, result, own in zip(terminals, results, performed) if own]
+    if len(owned) < len(results):
+        logger.info(f"Skipping {len(results) - len(owned)} results joined from checks stored by other callers")
     checked_at = datetime.utcnow()
-    logger.info(f"Storing {len(results)} check results in database...")
+    logger.info(f"Storing {len(owned)} check results in database...")
+    phase_start = time.perf_counter()
     
     try:
-        for terminal, result in zip(terminals, results):
-            status_check = StatusCheck(
-                terminal_id=terminal.id,
-                checked_at=checked_at,
-                status=result["status"].value,
-                raw_response=result["raw_response"],
-                error=result["error"],
-                http_status=result["http_status"],
-                latency_ms=result["latency_ms"],
-                run_id=run_id
-            )
-            db.add(status_check)
-        
-        db.commit()
-        logger.info(f"Successfully committed {len(results)} check results to database for run {run_id}")
+        with phase("persist"):
+            for terminal, result in owned:
+                status_check = StatusCheck(
+                    terminal_id=terminal.id,
+                    checked_at=checked_at,
+                    status=result["status"].value,
+                    raw_response=result["raw_response"],
+                    error=result["error"],
+                    http_status=result["http_status"],
+                    latency_ms=result["latency_ms"],
+                    run_id=run_id
+                )
+                db.add(status_check)
+            
+            # Compare against each terminal's previous status; changes go to status_transitions
+            transitions = record_transitions(db, (
+                (terminal.id, result["status"].value, checked_at, run_id)
+                for terminal, result in owned
+            ))
+            db.commit()
+        metrics.CHECK_RUN_PHASE.observe(time.perf_counter() - phase_start, phase="persist")
+        logger.info(
+            f"Successfully committed {len(owned)} check results to database for run {run_id} "
+            f"({len(transitions)} status transitions)"
+        )
         
         # Verify the data was actually saved
         saved_count = db.query(StatusCheck).filter(StatusCheck.run_id == run_id).count()
-        if saved_count != len(results):
-            logger.warning(f"Data verification failed: Expected {len(results)} checks, but found {saved_count} in database for run {run_id}")
+        if saved_count != len(owned):
+            logger.warning(f"Data verification failed: Expected {len(owned)} checks, but found {saved_count} in database for run {run_id}")
         else:
             logger.info(f"Data verification passed: {saved_count} checks confirmed in database for run {run_id}")
             
     except Exception as e:
         logger.error(f"Error storing check results in database: {e}", exc_info=True)
         db.rollback()
+        metrics.CHECK_RUNS.inc(result="failed")
         raise
     
+    if trace:
+        try:
+            run_trace.save_trace(db, trace)
+        except Exception as e:
+            logger.warning(f"Could not store trace for run {run_id}: {e}")
+            db.rollback()
+    
+    metrics.CHECK_RUNS.inc(result="completed")
     return run_id
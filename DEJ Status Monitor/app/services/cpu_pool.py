@@ -0,0 +1,116 @@
+"""
+Bounded worker pools for CPU-bound work
+The event loop also drives the checker and scheduler, so anything that can
+hold it for more than a few milliseconds runs here instead:
+- run_in_thread: work that releases the GIL (bcrypt) or runs Python
+  bytecode the interpreter can switch away from (Jinja rendering)
+- run_in_process: long C calls that hold the GIL (ET.fromstring on large
+  SOAP payloads); falls back to the thread pool with CPU_PROCESS_WORKERS=0
+- dumps_json: JSON bytes for large responses, encoded in slices on a worker
+  thread so the loop gets the GIL between slices
+Both pools are created on first use and sized by configuration, so a burst
+of logins queues behind a few workers instead of starving in-flight checks.
+"""
+import asyncio
+import functools
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+CPU_THREAD_WORKERS = int(os.getenv("CPU_THREAD_WORKERS", "4"))
+CPU_PROCESS_WORKERS = int(os.getenv("CPU_PROCESS_WORKERS", "2"))  # 0 = parse in the thread pool
+JSON_SLICE_ITEMS = 1000  # List items per json.dumps call
+
+T = TypeVar("T")
+
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _threads() -> ThreadPoolExecutor:
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=CPU_THREAD_WORKERS, thread_name_prefix="cpu")
+    return _thread_pool
+
+
+def _processes() -> Optional[ProcessPoolExecutor]:
+    global _process_pool
+    if _process_pool is None and CPU_PROCESS_WORKERS > 0:
+        # spawn, not fork: the parent has running threads and open SQLite connections
+        _process_pool = ProcessPoolExecutor(
+            max_workers=CPU_PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+
+async def _submit(executor: Executor, func: Callable[..., T], *args, **kwargs) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_in_thread(func: Callable[..., T], *args, **kwargs) -> T:
+    """Run func(*args, **kwargs) on the bounded thread pool"""
+    return await _submit(_threads(), func, *args, **kwargs)
+
+
+async def run_in_process(func: Callable[..., T], *args) -> T:
+    """
+    Run func(*args) on the process pool. func and its arguments must be
+    picklable (module-level functions). A crashed pool is replaced once and
+    the call retried on a thread.
+    """
+    global _process_pool
+    executor = _processes()
+    if executor is None:
+        return await run_in_thread(func, *args)
+    try:
+        return await _submit(executor, func, *args)
+    except BrokenProcessPool:
+        logger.error("CPU process pool broke; restarting it and running this call on a thread")
+        _process_pool = None
+        executor.shutdown(wait=False)
+        return await run_in_thread(func, *args)
+
+
+def _encode(value: Any) -> str:
+    # Same settings as Starlette's JSONResponse
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+
+
+def _encode_sliced(value: Any) -> bytes:
+    """JSON for value; top-level (and dict-valued) long lists are encoded JSON_SLICE_ITEMS at a time"""
+    def encode(item: Any) -> str:
+        if isinstance(item, list) and len(item) > JSON_SLICE_ITEMS:
+            return "[" + ",".join(
+                _encode(item[start:start + JSON_SLICE_ITEMS])[1:-1]
+                for start in range(0, len(item), JSON_SLICE_ITEMS)
+            ) + "]"
+        return _encode(item)
+
+    if isinstance(value, dict):
+        text = "{" + ",".join(f"{_encode(str(key))}:{encode(item)}" for key, item in value.items()) + "}"
+    else:
+        text = encode(value)
+    return text.encode("utf-8")
+
+
+async def dumps_json(value: Any) -> bytes:
+    """JSON bytes for a large response body, encoded off the event loop"""
+    return await run_in_thread(_encode_sliced, value)
+
+
+def shutdown_pools():
+    """Stop both pools (app shutdown); they are recreated on next use"""
+    global _thread_pool, _process_pool
+    for pool in (_thread_pool, _process_pool):
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+    _thread_pool = _process_pool = None
@@ -0,0 +1,155 @@
+"""
+Outbound email queue
+Request handlers and the alert engine call enqueue_email(), which only inserts
+an email_outbox row. A single background worker delivers due rows in batches
+through one EmailService (pooled HTTP client / SMTP connection), retries
+failures with exponential backoff and stays under the provider's per-minute
+quota.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "30"))  # Idle poll interval (enqueue wakes the worker)
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_MAX_PER_MINUTE = int(os.getenv("OUTBOX_MAX_PER_MINUTE", "100"))  # Provider quota (messages per minute)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "30"))
+OUTBOX_RETRY_MAX_SECONDS = float(os.getenv("OUTBOX_RETRY_MAX_SECONDS", "3600"))
+
+_wake_event: Optional[asyncio.Event] = None
+_wake_loop: Optional[asyncio.AbstractEventLoop] = None  # Loop the worker runs on
+_sent_times: deque = deque()  # monotonic send times within the last minute (rate limit)
+
+
+def enqueue_email(db: Session, to_emails: List[str], subject: str, body: str, commit: bool = True) -> OutboundEmail:
+    """
+    Queue an email for the outbox worker. With commit=False the row is only
+    added to the session, so it is committed with the caller's own changes.
+    """
+    message = OutboundEmail(to_emails=json.dumps(list(to_emails)), subject=subject, body=body)
+    db.add(message)
+    if commit:
+        db.commit()
+        wake_outbox()
+    return message
+
+
+def wake_outbox():
+    """
+    Ask the worker to deliver now instead of at its next poll. Safe to call
+    from worker threads (post-run stages run off the event loop).
+    """
+    event, loop = _wake_event, _wake_loop
+    if event is None or loop is None:
+        return
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        event.set()
+        return
+    try:
+        loop.call_soon_threadsafe(event.set)
+    except RuntimeError:
+        pass  # Loop already closed (shutdown)
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """Backoff after the given number of failed attempts"""
+    return timedelta(seconds=min(OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1), OUTBOX_RETRY_MAX_SECONDS))
+
+
+def _quota_remaining() -> int:
+    now = time.monotonic()
+    while _sent_times and now - _sent_times[0] >= 60:
+        _sent_times.popleft()
+    return max(0, OUTBOX_MAX_PER_MINUTE - len(_sent_times))
+
+
+async def deliver_pending(db: Session, email_service, now: Optional[datetime] = None) -> int:
+    """
+    Deliver due pending emails (oldest first, up to the batch size and the
+    remaining per-minute quota). Returns the number sent.
+    """
+    now = now or datetime.utcnow()
+    limit = min(OUTBOX_BATCH_SIZE, _quota_remaining())
+    if limit <= 0:
+        return 0
+    due = db.query(OutboundEmail).filter(
+        OutboundEmail.status == "pending", OutboundEmail.next_attempt_at <= now
+    ).order_by(OutboundEmail.next_attempt_at, OutboundEmail.id).limit(limit).all()
+    if not due:
+        return 0
+
+    results = await email_service.send_batch([
+        (json.loads(message.to_emails), message.subject, message.body) for message in due
+    ])
+    sent = 0
+    for message, error in zip(due, results):
+        message.attempts += 1
+        if error is None:
+            message.status = "sent"
+            message.sent_at = datetime.utcnow()
+            message.last_error = None
+            _sent_times.append(time.monotonic())
+            sent += 1
+        elif message.attempts >= OUTBOX_MAX_ATTEMPTS:
+            message.status = "failed"
+            message.last_error = error
+            logger.error(f"Giving up on email {message.id} ({message.subject}) after {message.attempts} attempts: {error}")
+        else:
+            message.last_error = error
+            message.next_attempt_at = now + retry_delay(message.attempts)
+    db.commit()
+    if sent or len(due) > sent:
+        logger.info(f"Outbox: sent {sent} of {len(due)} due email(s)")
+    return sent
+
+
+async def run_outbox_worker(session_factory: Callable[[], Session], email_service_factory: Optional[Callable] = None):
+    """Deliver queued email until cancelled; wakes on enqueue or every OUTBOX_POLL_SECONDS"""
+    global _wake_event, _wake_loop
+    if email_service_factory is None:
+        from app.services.email_service import EmailService
+        email_service_factory = EmailService
+    _wake_event = asyncio.Event()
+    _wake_loop = asyncio.get_running_loop()
+    email_service = email_service_factory()
+    logger.info("Email outbox worker started")
+    try:
+        while True:
+            db = session_factory()
+            try:
+                sent = await deliver_pending(db, email_service)
+            except Exception as e:
+                logger.error(f"Error delivering queued email: {e}", exc_info=True)
+                db.rollback()
+                sent = 0
+            finally:
+                db.close()
+            if sent and _quota_remaining():
+                continue  # Drain the backlog while quota allows
+            try:
+                await asyncio.wait_for(_wake_event.wait(), timeout=OUTBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            _wake_event.clear()
+    finally:
+        _wake_event = None
+        _wake_loop = None
+        await email_service.aclose()
+        logger.info("Email outbox worker stopped")
@@ -1,13 +1,23 @@
 """
 Email notification service
 Supports SendGrid API (recommended) or SMTP fallback
+send_batch() is used by the outbox worker: it keeps one HTTP client / SMTP
+connection open across messages and sends SendGrid personalizations in bulk.
 """
+import asyncio
 import os
-from typing import List
+from collections import OrderedDict
+from typing import List, Optional, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
 
+SENDGRID_URL = "https://api.sendgrid.com/v3/mail/send"
+SENDGRID_MAX_PERSONALIZATIONS = 1000  # SendGrid limit per /mail/send request
+
+# (to_emails, subject, html body)
+EmailMessage = Tuple[List[str], str, str]
+
 
 class EmailService:
     def __init__(self):
@@ -25,6 +35,8 @@ class EmailService:
             self.smtp_port = int(os.getenv("SMTP_PORT", "587"))
             self.sender_email = os.getenv("NOTIFICATION_EMAIL", "josh.thurman@curbstone.com")
             self.sender_password = os.getenv("NOTIFICATION_EMAIL_PASSWORD")
+        self._http_client = None
+        self._smtp = None
         
     async def send_notification(
         self,
@@ -52,7 +64,7 @@ class EmailService:
         try:
             import httpx
             
-            url = "https://api.sendgrid.com/v3/mail/send"
+            url = SENDGRID_URL
             headers = {
                 "Authorization": f"Bearer {self.sendgrid_api_key}",
                 "Content-Type": "application/json"
@@ -120,3 +132,113 @@ class EmailService:
         except Exception as e:
             logger.error(f"Failed to send notification email via SMTP: {e}", exc_info=True)
             return False
+
+    async def send_batch(self, messages: List[EmailMessage]) -> List[Optional[str]]:
+        """
+        Send several messages, reusing one connection. Returns one entry per
+        message: None when sent, otherwise the error text.
+        """
+        if not messages:
+            return []
+        if self.email_provider == "sendgrid":
+            return await self._send_batch_via_sendgrid(messages)
+        return await asyncio.to_thread(self._send_batch_via_smtp, messages)
+
+    async def _send_batch_via_sendgrid(self, messages: List[EmailMessage]) -> List[Optional[str]]:
+        """Messages with the same body share a request, one personalization each"""
+        if not self.sendgrid_api_key:
+            return ["SendGrid API key not configured"] * len(messages)
+
+        import httpx
+
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(
+                timeout=10.0,
+                headers={"Authorization": f"Bearer {self.sendgrid_api_key}"}
+            )
+        results: List[Optional[str]] = [None] * len(messages)
+        groups = OrderedDict()
+        for index, (_, _, body) in enumerate(messages):
+            groups.setdefault(body, []).append(index)
+
+        for body, indexes in groups.items():
+            for start in range(0, len(indexes), SENDGRID_MAX_PERSONALIZATIONS):
+                chunk = indexes[start:start + SENDGRID_MAX_PERSONALIZATIONS]
+                payload = {
+                    "personalizations": [{
+                        "to": [{"email": email} for email in messages[i][0]],
+                        "subject": messages[i][1]
+                    } for i in chunk],
+                    "from": {"email": self.sender_email, "name": self.sender_name},
+                    "content": [{"type": "text/html", "value": body}]
+                }
+                try:
+                    response = await self._http_client.post(SENDGRID_URL, json=payload)
+                    response.raise_for_status()
+                    logger.info(f"Sent {len(chunk)} email(s) via SendGrid in one request")
+                except Exception as e:
+                    logger.error(f"Failed to send {len(chunk)} email(s) via SendGrid: {e}")
+                    for i in chunk:
+                        results[i] = str(e) or type(e).__name__
+        return results
+
+    def _smtp_connection(self):
+        """Open (or reuse) an authenticated SMTP connection"""
+        import smtplib
+
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except smtplib.SMTPException:
+                pass
+            self._close_smtp()
+        server = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=30)
+        server.starttls()
+        server.login(self.sender_email, self.sender_password)
+        self._smtp = server
+        return server
+
+    def _close_smtp(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+    def _send_batch_via_smtp(self, messages: List[EmailMessage]) -> List[Optional[str]]:
+        """Blocking; run in a thread. One login for the whole batch."""
+        import smtplib
+        from email.mime.text import MIMEText
+        from email.mime.multipart import MIMEMultipart
+
+        if not self.sender_email or not self.sender_password:
+            return ["SMTP credentials not configured"] * len(messages)
+
+        results: List[Optional[str]] = []
+        for to_emails, subject, body in messages:
+            msg = MIMEMultipart()
+            msg['From'] = self.sender_email
+            msg['To'] = ", ".join(to_emails)
+            msg['Subject'] = subject
+            msg.attach(MIMEText(body, 'html'))
+            try:
+                try:
+                    self._smtp_connection().send_message(msg)
+                except smtplib.SMTPServerDisconnected:
+                    self._close_smtp()
+                    self._smtp_connection().send_message(msg)
+                results.append(None)
+            except Exception as e:
+                logger.error(f"Failed to send email via SMTP to {to_emails}: {e}")
+                self._close_smtp()
+                results.append(str(e) or type(e).__name__)
+        return results
+
+    async def aclose(self):
+        """Close the pooled HTTP client / SMTP connection"""
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+        await asyncio.to_thread(self._close_smtp)
@@ -0,0 +1,334 @@
+"""
+Time-partitioned status history
+status_checks keeps only the hot months (HISTORY_HOT_MONTHS, default the
+current UTC month). Each night, closed months are moved to their own SQLite
+file in HISTORY_DIR. The file is vacuumed, gzip-compressed, made read-only
+and recorded in history_partitions. With HISTORY_EXPORT_PARQUET the month is
+also written as Parquet (needs pyarrow).
+
+Readers go through terminal_checks / checks_in_range. These query the hot
+table, then ATTACH only the partitions overlapping the requested range.
+Partitions are decompressed on first use into HISTORY_DIR/cache, which keeps
+the HISTORY_CACHE_MONTHS most recently used months.
+"""
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import MetaData, Table, create_engine, desc, func, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from app.models import HistoryPartition, StatusCheck
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+HISTORY_DIR = os.getenv("HISTORY_DIR", "./history")
+HISTORY_HOT_MONTHS = max(1, int(os.getenv("HISTORY_HOT_MONTHS", "1")))  # Months kept in status_checks, incl. the current one
+HISTORY_COMPRESSION = os.getenv("HISTORY_COMPRESSION", "gzip").lower()  # gzip or none
+HISTORY_CACHE_MONTHS = int(os.getenv("HISTORY_CACHE_MONTHS", "3"))  # Decompressed partitions kept for queries
+HISTORY_EXPORT_PARQUET = os.getenv("HISTORY_EXPORT_PARQUET", "false").lower() == "true"
+HISTORY_VACUUM_FREE_FRACTION = float(os.getenv("HISTORY_VACUUM_FREE_FRACTION", "0.25"))
+
+CHECK_COLUMNS = [column.name for column in StatusCheck.__table__.columns]
+DB_TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"  # SQLAlchemy's SQLite DateTime storage format
+
+
+def month_start(moment: datetime) -> datetime:
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(start: datetime) -> datetime:
+    return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+
+
+def hot_start(now: Optional[datetime] = None) -> datetime:
+    """First instant (naive UTC) still kept in status_checks"""
+    start = month_start(now or datetime.utcnow())
+    for _ in range(HISTORY_HOT_MONTHS - 1):
+        start = month_start(start - timedelta(days=1))
+    return start
+
+
+def _month_key(start: datetime) -> str:
+    return f"{start.year:04d}-{start.month:02d}"
+
+
+def _base_name(month: str) -> str:
+    return f"status_checks_{month.replace('-', '_')}"
+
+
+# Archiving
+
+def _build_file(partition: Optional[HistoryPartition], month: str) -> str:
+    """Writable copy of the month's partition to add rows to (empty table for a new month)"""
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    build_path = os.path.join(HISTORY_DIR, f"{_base_name(month)}.build")
+    if os.path.exists(build_path):
+        os.remove(build_path)  # Left by an interrupted archive
+    if partition is not None:
+        # Checks for an already archived month (e.g. restored from a backup) join its file
+        with _open_partition_file(partition) as src, open(build_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, length=1024 * 1024)
+        os.chmod(build_path, 0o644)
+    else:
+        engine = create_engine(f"sqlite:///{build_path}")
+        try:
+            StatusCheck.__table__.create(bind=engine)
+        finally:
+            engine.dispose()
+    return build_path
+
+
+def _export_parquet(build_path: str, month: str) -> Optional[str]:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        logger.warning("HISTORY_EXPORT_PARQUET=true but pyarrow is not installed; skipping Parquet export")
+        return None
+    conn = sqlite3.connect(build_path)
+    try:
+        rows = conn.execute(f"SELECT {', '.join(CHECK_COLUMNS)} FROM status_checks ORDER BY id").fetchall()
+    finally:
+        conn.close()
+    columns = {}
+    for index, column in enumerate(StatusCheck.__table__.columns):
+        values = [row[index] for row in rows]
+        if column.type.python_type is datetime:
+            values = [datetime.fromisoformat(value) if value else None for value in values]
+        columns[column.name] = values
+    file_name = f"{_base_name(month)}.parquet"
+    pq.write_table(pa.table(columns), os.path.join(HISTORY_DIR, file_name), compression="zstd")
+    return file_name
+
+
+def _freeze(build_path: str, month: str) -> str:
+    """Vacuum, compress and write-protect a built partition. Returns its file name."""
+    conn = sqlite3.connect(build_path)
+    try:
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    file_name = f"{_base_name(month)}.db" + (".gz" if HISTORY_COMPRESSION == "gzip" else "")
+    final_path = os.path.join(HISTORY_DIR, file_name)
+    if HISTORY_COMPRESSION == "gzip":
+        tmp_path = f"{final_path}.tmp"
+        with open(build_path, "rb") as src, gzip.open(tmp_path, "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, length=1024 * 1024)
+        os.replace(tmp_path, final_path)
+        os.remove(build_path)
+    else:
+        os.replace(build_path, final_path)
+    os.chmod(final_path, 0o444)
+    # A re-archived month must not be served from an old decompressed copy
+    cached = os.path.join(HISTORY_DIR, "cache", f"{_base_name(month)}.db")
+    if os.path.exists(cached):
+        os.remove(cached)
+    return file_name
+
+
+def _archive_month(db: Session, start: datetime, end: datetime, keep_id: int) -> int:
+    """Move one closed month (except check keep_id) out of status_checks. Commits. Returns checks moved."""
+    in_month = (StatusCheck.checked_at >= start, StatusCheck.checked_at < end, StatusCheck.id != keep_id)
+    count, first_id, last_id = db.query(
+        func.count(StatusCheck.id), func.min(StatusCheck.id), func.max(StatusCheck.id)
+    ).filter(*in_month).one()
+    if not count:
+        return 0
+    month = _month_key(start)
+    partition = db.get(HistoryPartition, month)
+    build_path = _build_file(partition, month)
+
+    # Copy on a separate connection: only the partition file is written here
+    columns = ", ".join(CHECK_COLUMNS)
+    with db.get_bind().connect() as connection:
+        raw = connection.connection.dbapi_connection
+        raw.execute("ATTACH DATABASE ? AS archive", (build_path,))
+        try:
+            raw.execute(
+                f"INSERT INTO archive.status_checks ({columns}) SELECT {columns} FROM main.status_checks "
+                "WHERE checked_at >= ? AND checked_at < ? AND id != ?",
+                (start.strftime(DB_TIME_FORMAT), end.strftime(DB_TIME_FORMAT), keep_id)
+            )
+            raw.commit()
+        except Exception:
+            raw.rollback()
+            raise
+        finally:
+            raw.execute("DETACH DATABASE archive")
+
+    parquet_file = _export_parquet(build_path, month) if HISTORY_EXPORT_PARQUET else None
+    file_name = _freeze(build_path, month)
+
+    if partition is None:
+        partition = HistoryPartition(month=month, start=start, end=end, rows=0)
+        db.add(partition)
+    partition.file_name = file_name
+    partition.rows += count
+    partition.first_check_id = min(first_id, partition.first_check_id or first_id)
+    partition.last_check_id = max(last_id, partition.last_check_id or last_id)
+    partition.archived_at = datetime.utcnow()
+    partition.parquet_file = parquet_file or partition.parquet_file
+    db.query(StatusCheck).filter(*in_month).delete(synchronize_session=False)
+    db.commit()
+    logger.info(f"Archived {count} checks from {month} to {file_name}")
+    return count
+
+
+def _vacuum_if_sparse(db: Session):
+    """VACUUM the main file once archiving has left much of it free (backups copy every page)"""
+    with db.get_bind().connect() as connection:
+        raw = connection.connection.dbapi_connection
+        pages = raw.execute("PRAGMA page_count").fetchone()[0]
+        free = raw.execute("PRAGMA freelist_count").fetchone()[0]
+        if pages and free / pages >= HISTORY_VACUUM_FREE_FRACTION:
+            logger.info(f"Vacuuming database ({free} of {pages} pages free after archiving)")
+            raw.execute("VACUUM")
+
+
+def archive_closed_months(db: Session, now: Optional[datetime] = None) -> List[str]:
+    """
+    Move every month older than the hot window from status_checks to its
+    partition file, oldest first. Commits per month. Returns months archived.
+
+    The newest check always stays in status_checks: SQLite hands out
+    max(id) + 1, and snapshot watermarks (last_check_id) rely on ids never
+    being reused. It is archived on a later night as a late row.
+    """
+    cutoff = hot_start(now)
+    keep_id = db.query(func.max(StatusCheck.id)).scalar()
+    oldest = db.query(func.min(StatusCheck.checked_at)).filter(StatusCheck.checked_at < cutoff).scalar()
+    archived = []
+    if oldest is not None:
+        start = month_start(oldest)
+        while start < cutoff:
+            end = next_month(start)
+            if _archive_month(db, start, end, keep_id):
+                archived.append(_month_key(start))
+            start = end
+    db.commit()
+    if archived:
+        _vacuum_if_sparse(db)
+    return archived
+
+
+# Reading
+
+@contextmanager
+def _open_partition_file(partition: HistoryPartition):
+    path = os.path.join(HISTORY_DIR, partition.file_name)
+    with (gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")) as handle:
+        yield handle
+
+
+def _local_copy(partition: HistoryPartition) -> str:
+    """Path of a queryable (uncompressed) copy of the partition"""
+    if not partition.file_name.endswith(".gz"):
+        return os.path.join(HISTORY_DIR, partition.file_name)
+    cache_dir = os.path.join(HISTORY_DIR, "cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    cached = os.path.join(cache_dir, partition.file_name[:-len(".gz")])
+    if os.path.exists(cached):
+        os.utime(cached)
+        return cached
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    with os.fdopen(fd, "wb") as dst, _open_partition_file(partition) as src:
+        shutil.copyfileobj(src, dst, length=1024 * 1024)
+    os.replace(tmp_path, cached)
+
+    copies = sorted(
+        (entry for entry in os.scandir(cache_dir) if entry.name.endswith(".db")),
+        key=lambda entry: entry.stat().st_mtime, reverse=True
+    )
+    for entry in copies[max(HISTORY_CACHE_MONTHS, 1):]:
+        if entry.path != cached:
+            os.remove(entry.path)
+    return cached
+
+
+@contextmanager
+def _partition_table(db: Session, partition: HistoryPartition) -> Iterator[Tuple[Connection, Table]]:
+    """(connection, status_checks table) with the partition ATTACHed, one at a time (SQLite allows 10)"""
+    schema = "h_" + partition.month.replace("-", "_")
+    connection = db.get_bind().connect()
+    try:
+        connection.exec_driver_sql(f"ATTACH DATABASE ? AS {schema}", (_local_copy(partition),))
+        try:
+            yield connection, StatusCheck.__table__.to_metadata(MetaData(), schema=schema)
+        finally:
+            connection.exec_driver_sql(f"DETACH DATABASE {schema}")
+    finally:
+        connection.close()
+
+
+def _overlapping(db: Session, start: Optional[datetime], end: Optional[datetime]) -> List[HistoryPartition]:
+    """Partitions overlapping [start, end], newest first"""
+    query = db.query(HistoryPartition)
+    if start is not None:
+        query = query.filter(HistoryPartition.end > start)
+    if end is not None:
+        query = query.filter(HistoryPartition.start <= end)
+    return query.order_by(HistoryPartition.start.desc()).all()
+
+
+def terminal_checks(
+    db: Session,
+    terminal_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: Optional[int] = None
+) -> list:
+    """
+    A terminal's checks in [start, end], newest first: StatusCheck rows from
+    the hot table, then rows with the same attributes from older partitions
+    until limit is reached.
+    """
+    query = db.query(StatusCheck).filter(StatusCheck.terminal_id == terminal_id)
+    if start is not None:
+        query = query.filter(StatusCheck.checked_at >= start)
+    if end is not None:
+        query = query.filter(StatusCheck.checked_at <= end)
+    checks = query.order_by(desc(StatusCheck.checked_at)).limit(limit).all()
+
+    for partition in _overlapping(db, start, end):
+        if limit is not None and len(checks) >= limit:
+            break
+        with _partition_table(db, partition) as (connection, table):
+            statement = select(table).where(table.c.terminal_id == terminal_id)
+            if start is not None:
+                statement = statement.where(table.c.checked_at >= start)
+            if end is not None:
+                statement = statement.where(table.c.checked_at <= end)
+            statement = statement.order_by(table.c.checked_at.desc())
+            if limit is not None:
+                statement = statement.limit(limit - len(checks))
+            checks.extend(connection.execute(statement).all())
+    return checks
+
+
+def checks_in_range(
+    db: Session,
+    start: datetime,
+    end: datetime,
+    columns: Sequence[str] = ("terminal_id", "status")
+) -> list:
+    """Rows (with the named columns as attributes) of every check in [start, end], hot and archived"""
+    rows = db.query(*[getattr(StatusCheck, column) for column in columns]).filter(
+        StatusCheck.checked_at >= start, StatusCheck.checked_at <= end
+    ).all()
+    for partition in _overlapping(db, start, end):
+        with _partition_table(db, partition) as (connection, table):
+            rows.extend(connection.execute(
+                select(*[table.c[column] for column in columns]).where(
+                    table.c.checked_at >= start, table.c.checked_at <= end
+                )
+            ).all())
+    return rows
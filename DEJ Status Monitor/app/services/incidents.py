@@ -0,0 +1,250 @@
+"""
+Correlated merchant-wide outage detection
+After each run, the run's up -> down transitions are grouped by merchant code
+(and HardwareName with INCIDENT_GROUP_BY_HARDWARE). The drop count of each
+group is compared with what the merchant's baseline failure rate predicts
+for the group's terminals this run found up before: failures per up-check
+from the last INCIDENT_BASELINE_DAYS of availability_daily, with one
+pseudo-failure at the fleet rate so small or new merchants are not flagged by
+a single drop. Rates are per check, not per second, because a drop is only
+seen at a check and runs are not evenly spaced (retry passes, planned runs).
+Groups whose Poisson tail probability is below INCIDENT_P_VALUE become (or
+extend) an open outage_incidents row; an incident resolves once
+INCIDENT_RESOLVE_FRACTION of its terminals are ONLINE again.
+"""
+import json
+import logging
+import math
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import pytz
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models import AvailabilityDaily, OutageIncident, StatusCheck, StatusTransition, Terminal, TerminalInfo, TerminalState
+from app.services.availability import STATE_BY_STATUS, _Days
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+INCIDENT_MIN_TERMINALS = int(os.getenv("INCIDENT_MIN_TERMINALS", "3"))  # Fewer simultaneous drops never open an incident
+INCIDENT_P_VALUE = float(os.getenv("INCIDENT_P_VALUE", "0.001"))
+INCIDENT_BASELINE_DAYS = int(os.getenv("INCIDENT_BASELINE_DAYS", "14"))
+INCIDENT_RESOLVE_FRACTION = float(os.getenv("INCIDENT_RESOLVE_FRACTION", "0.8"))
+INCIDENT_GROUP_BY_HARDWARE = os.getenv("INCIDENT_GROUP_BY_HARDWARE", "false").lower() == "true"
+
+DOWN_STATUSES = [status for status, state in STATE_BY_STATUS.items() if state == "down"]
+PRIOR_CHECKS_FLOOR = 30 * 24  # Prior up-checks per failure when the fleet has no failure history
+
+# (merchant_code, hardware_name or None)
+GroupKey = Tuple[str, Optional[str]]
+
+
+def poisson_tail(k: int, mu: float) -> float:
+    """P(X >= k) for X ~ Poisson(mu)"""
+    if k <= 0:
+        return 1.0
+    if mu <= 0:
+        return 0.0
+    if k <= mu:
+        return 1.0  # Not unusual; no need for the exact value
+    term = math.exp(-mu + k * math.log(mu) - math.lgamma(k + 1))
+    total = 0.0
+    i = k
+    while term > total * 1e-12:
+        total += term
+        i += 1
+        term *= mu / i
+    return min(total, 1.0)
+
+
+def _failure_rates(db: Session, day_start: datetime) -> Tuple[Dict[str, float], float]:
+    """Per-merchant failures per up-check over the baseline window, and the fleet prior rate"""
+    since = day_start - timedelta(days=INCIDENT_BASELINE_DAYS)
+    rows = db.query(
+        AvailabilityDaily.scope_key, func.sum(AvailabilityDaily.failures), func.sum(AvailabilityDaily.up_checks)
+    ).filter(
+        AvailabilityDaily.scope == "merchant", AvailabilityDaily.day_start >= since, AvailabilityDaily.day_start < day_start
+    ).group_by(AvailabilityDaily.scope_key).all()
+    fleet_failures = sum(failures or 0 for _, failures, _ in rows)
+    fleet_checks = sum(checks or 0 for _, _, checks in rows)
+    # One pseudo-failure over the fleet's mean up-checks between failures
+    prior_checks = fleet_checks / fleet_failures if fleet_failures else PRIOR_CHECKS_FLOOR
+    rates = {code: ((failures or 0) + 1) / ((checks or 0) + prior_checks) for code, failures, checks in rows}
+    return rates, 1 / prior_checks
+
+
+def _run_started(db: Session, run_id: str) -> Optional[datetime]:
+    return db.query(func.min(StatusCheck.checked_at)).filter(StatusCheck.run_id == run_id).scalar()
+
+
+def _group_of(tpn: str, hardware: Dict[str, Optional[str]]) -> GroupKey:
+    return (tpn[:4], hardware.get(tpn) if INCIDENT_GROUP_BY_HARDWARE else None)
+
+
+def detect_incidents(
+    db: Session,
+    run_id: str,
+    active_tpns: Optional[Set[str]] = None,
+    timezone=pytz.UTC
+) -> List[OutageIncident]:
+    """
+    Open or extend incidents for this run's correlated drops. The baseline
+    ends at local midnight before the run. Commits. Returns incidents opened
+    or extended.
+    """
+    run_started = _run_started(db, run_id)
+    if run_started is None:
+        return []
+    day_start = _Days(timezone).bounds(run_started)[0]
+
+    dropped = [
+        tpn for tpn, in db.query(Terminal.tpn).join(StatusTransition, StatusTransition.terminal_id == Terminal.id).filter(
+            StatusTransition.transitioned_at >= run_started,
+            StatusTransition.run_id == run_id,
+            StatusTransition.from_status == "ONLINE",
+            StatusTransition.to_status.in_(DOWN_STATUSES)
+        )
+        if active_tpns is None or tpn in active_tpns
+    ]
+    if not dropped:
+        return []
+
+    hardware: Dict[str, Optional[str]] = {}
+    merchants = {tpn[:4] for tpn in dropped}
+    if INCIDENT_GROUP_BY_HARDWARE:
+        hardware = dict(db.query(TerminalInfo.tpn, TerminalInfo.hardware_name).filter(
+            func.substr(TerminalInfo.tpn, 1, 4).in_(list(merchants))
+        ))
+
+    drops: Dict[GroupKey, List[str]] = defaultdict(list)
+    for tpn in dropped:
+        drops[_group_of(tpn, hardware)].append(tpn)
+    open_incidents = {
+        (incident.merchant_code, incident.hardware_name): incident
+        for incident in db.query(OutageIncident).filter(
+            OutageIncident.resolved_at.is_(None), OutageIncident.merchant_code.in_(list(merchants))
+        )
+    }
+    # Drops join an open incident of their group; otherwise enough of them must be unusual
+    candidates = {
+        group for group, tpns in drops.items() if len(tpns) >= INCIDENT_MIN_TERMINALS or group in open_incidents
+    }
+    if not candidates:
+        return []
+
+    # Terminals up before this run: checked ONLINE by it (and not just recovered) plus those
+    # that dropped. Terminals the run's plan skipped were not exposed to it.
+    recovered = {
+        tpn for tpn, in db.query(Terminal.tpn).join(StatusTransition, StatusTransition.terminal_id == Terminal.id).filter(
+            StatusTransition.transitioned_at >= run_started,
+            StatusTransition.run_id == run_id,
+            StatusTransition.to_status == "ONLINE"
+        )
+    }
+    exposed: Dict[GroupKey, int] = defaultdict(int)
+    for tpn, in db.query(Terminal.tpn).join(StatusCheck, StatusCheck.terminal_id == Terminal.id).filter(
+        StatusCheck.run_id == run_id, StatusCheck.status == "ONLINE",
+        func.substr(Terminal.tpn, 1, 4).in_([code for code, _ in candidates])
+    ).distinct():
+        if tpn not in recovered and (active_tpns is None or tpn in active_tpns):
+            exposed[_group_of(tpn, hardware)] += 1
+
+    rates, fleet_rate = _failure_rates(db, day_start)
+    changed = []
+    for group in sorted(candidates, key=lambda g: (g[0], g[1] or "")):
+        tpns = sorted(drops[group])
+        incident = open_incidents.get(group)
+        if incident is None:
+            terminal_count = exposed[group] + len(tpns)
+            expected = terminal_count * rates.get(group[0], fleet_rate)
+            p_value = poisson_tail(len(tpns), expected)
+            if p_value >= INCIDENT_P_VALUE:
+                continue
+            incident = OutageIncident(
+                merchant_code=group[0], hardware_name=group[1], run_id=run_id, started_at=run_started,
+                terminal_count=terminal_count, affected_count=len(tpns), affected_tpns=json.dumps(tpns),
+                expected_drops=expected, p_value=p_value
+            )
+            db.add(incident)
+            logger.warning(
+                f"Outage incident for merchant {group[0]}{f' ({group[1]})' if group[1] else ''}: "
+                f"{len(tpns)} of {terminal_count} terminals down in run {run_id} (expected {expected:.2f}, p={p_value:.2g})"
+            )
+        else:
+            affected = sorted(set(json.loads(incident.affected_tpns)).union(tpns))
+            incident.affected_tpns = json.dumps(affected)
+            incident.affected_count = len(affected)
+        changed.append(incident)
+    db.commit()
+    return changed
+
+
+def resolve_incidents(db: Session, now: Optional[datetime] = None) -> int:
+    """Resolve open incidents whose terminals are mostly ONLINE again. Commits. Returns incidents resolved."""
+    now = now or datetime.utcnow()
+    open_incidents = db.query(OutageIncident).filter(OutageIncident.resolved_at.is_(None)).all()
+    if not open_incidents:
+        return 0
+    online = {
+        tpn for tpn, in db.query(Terminal.tpn).join(TerminalState, TerminalState.terminal_id == Terminal.id).filter(
+            TerminalState.status == "ONLINE",
+            func.substr(Terminal.tpn, 1, 4).in_(list({incident.merchant_code for incident in open_incidents}))
+        )
+    }
+    resolved = 0
+    for incident in open_incidents:
+        tpns = json.loads(incident.affected_tpns)
+        if sum(1 for tpn in tpns if tpn in online) >= INCIDENT_RESOLVE_FRACTION * len(tpns):
+            incident.resolved_at = now
+            resolved += 1
+    db.commit()
+    return resolved
+
+
+def process_incidents(
+    db: Session,
+    run_id: str,
+    active_tpns: Optional[Set[str]] = None,
+    timezone=pytz.UTC
+) -> List[OutageIncident]:
+    """Post-run hook: resolve recovered incidents, then open/extend incidents for this run"""
+    resolve_incidents(db, _run_started(db, run_id))
+    return detect_incidents(db, run_id, active_tpns, timezone)
+
+
+def incident_dict(incident: OutageIncident, mapping: Dict[str, str]) -> Dict:
+    return {
+        "id": incident.id,
+        "merchant_code": incident.merchant_code,
+        "company_name": mapping.get(incident.merchant_code),
+        "hardware_name": incident.hardware_name,
+        "run_id": incident.run_id,
+        "started_at": incident.started_at.isoformat() + "Z",
+        "resolved_at": incident.resolved_at.isoformat() + "Z" if incident.resolved_at else None,
+        "terminal_count": incident.terminal_count,
+        "affected_count": incident.affected_count,
+        "affected_tpns": json.loads(incident.affected_tpns),
+        "expected_drops": round(incident.expected_drops, 3),
+        "p_value": incident.p_value,
+    }
+
+
+def list_incidents(
+    db: Session,
+    since: datetime,
+    merchant_codes: Optional[Sequence[str]] = None,
+    open_only: bool = False
+) -> List[OutageIncident]:
+    """Open incidents plus those started since a time (newest first)"""
+    query = db.query(OutageIncident)
+    if open_only:
+        query = query.filter(OutageIncident.resolved_at.is_(None))
+    else:
+        query = query.filter((OutageIncident.resolved_at.is_(None)) | (OutageIncident.started_at >= since))
+    if merchant_codes is not None:
+        query = query.filter(OutageIncident.merchant_code.in_(list(merchant_codes)))
+    return query.order_by(OutageIncident.started_at.desc(), OutageIncident.id.desc()).all()
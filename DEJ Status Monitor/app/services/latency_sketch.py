@@ -0,0 +1,341 @@
+"""
+Latency sketches for SpinPOS responses
+After each run, latency_ms of the run's answered checks (HTTP 200) is folded
+into DDSketches: one for the whole run, one per merchant, and one per
+terminal per local day. Sketches have bounded relative error and merge
+exactly, so percentiles for any date range come from merging stored
+sketches instead of scanning status_checks.
+"""
+import json
+import logging
+import math
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import pytz
+from sqlalchemy.orm import Session
+
+from app.models import LatencySketch, StatusCheck, Terminal
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+SKETCH_RELATIVE_ACCURACY = float(os.getenv("LATENCY_SKETCH_ACCURACY", "0.01"))  # Quantiles within 1%
+SLOWEST_CANDIDATE_FACTOR = 5  # Terminal-days ranked by stored p95 before exact merging
+
+SCOPES = ("all", "merchant", "terminal")
+
+
+class DDSketch:
+    """
+    Minimal DDSketch (Masson et al., 2019): logarithmic buckets with
+    relative accuracy alpha for positive values, plus a zero bucket.
+    """
+
+    def __init__(self, relative_accuracy: float = SKETCH_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = defaultdict(int)
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def add(self, value: float, count: int = 1):
+        if value <= 0:
+            self.zero_count += count
+        else:
+            self.bins[math.ceil(math.log(value) / self._log_gamma)] += count
+        self.count += count
+        self.sum += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: "DDSketch"):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        for index, count in other.bins.items():
+            self.bins[index] += count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Value at quantile q (0..1), within relative_accuracy of the true value"""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if rank < seen:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_json(self) -> str:
+        """Compact form: sorted bins as a flat [index, count, ...] list"""
+        bins = []
+        for index in sorted(self.bins):
+            bins.extend((index, self.bins[index]))
+        return json.dumps({
+            "a": self.relative_accuracy, "n": self.count, "s": round(self.sum, 3),
+            "lo": self.min, "hi": self.max, "z": self.zero_count, "b": bins,
+        }, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, data: str) -> "DDSketch":
+        raw = json.loads(data)
+        sketch = cls(raw["a"])
+        flat = raw["b"]
+        for i in range(0, len(flat), 2):
+            sketch.bins[flat[i]] = flat[i + 1]
+        sketch.zero_count = raw["z"]
+        sketch.count = raw["n"]
+        sketch.sum = raw["s"]
+        sketch.min = raw["lo"]
+        sketch.max = raw["hi"]
+        return sketch
+
+
+def summarize(sketch: DDSketch) -> Dict:
+    """Count, mean and p50/p95/p99 (ms) of a sketch"""
+    if sketch.count == 0:
+        return {"count": 0, "mean_ms": None, "p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    return {
+        "count": sketch.count,
+        "mean_ms": round(sketch.sum / sketch.count, 1),
+        "p50_ms": round(sketch.quantile(0.5), 1),
+        "p95_ms": round(sketch.quantile(0.95), 1),
+        "p99_ms": round(sketch.quantile(0.99), 1),
+        "max_ms": sketch.max,
+    }
+
+
+def _local_day_start(moment: datetime, timezone) -> datetime:
+    """Naive UTC time of local midnight for a naive UTC moment"""
+    local = pytz.UTC.localize(moment).astimezone(timezone)
+    midnight = timezone.localize(local.replace(tzinfo=None).replace(hour=0, minute=0, second=0, microsecond=0))
+    return midnight.astimezone(pytz.UTC).replace(tzinfo=None)
+
+
+_INSERT_SQL = (
+    "INSERT INTO latency_sketches (scope, scope_key, period_start, run_id, count, p95_ms, sketch) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+_UPDATE_SQL = "UPDATE latency_sketches SET count = ?, p95_ms = ?, sketch = ? WHERE id = ?"
+
+
+def _db_time(value: datetime) -> str:
+    # SQLAlchemy's SQLite DateTime storage format, so ORM reads and comparisons match
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def _store_run(
+    db: Session,
+    run_id: str,
+    run_at: datetime,
+    samples: Sequence[Tuple[str, int]],
+    timezone
+):
+    """Add sketches for one run's (tpn, latency_ms) samples; caller commits"""
+    overall = DDSketch()
+    merchants: Dict[str, DDSketch] = defaultdict(DDSketch)
+    terminals: Dict[str, List[int]] = defaultdict(list)
+    for tpn, latency_ms in samples:
+        overall.add(latency_ms)
+        merchants[tpn[:4]].add(latency_ms)
+        terminals[tpn].append(latency_ms)
+
+    def _values(scope, key, period_start, sketch, row_run_id):
+        return (scope, key, period_start, row_run_id, sketch.count, sketch.quantile(0.95), sketch.to_json())
+
+    run_at_db = _db_time(run_at)
+    inserts = [_values("all", "", run_at_db, overall, run_id)]
+    inserts.extend(_values("merchant", code, run_at_db, sketch, run_id) for code, sketch in merchants.items())
+
+    # Terminal sketches are per day: merge into today's row where one exists.
+    # DBAPI reads/executemany: a fleet's worth of ORM rows dominated the post-run hook
+    day_start = _db_time(_local_day_start(run_at, timezone))
+    updates = []
+    dbapi_cursor = db.connection().connection.cursor()
+    try:
+        existing = {
+            key: (row_id, data) for row_id, key, data in dbapi_cursor.execute(
+                "SELECT id, scope_key, sketch FROM latency_sketches WHERE scope = 'terminal' AND period_start = ?",
+                (day_start,)
+            )
+        }
+        for tpn, values in terminals.items():
+            row = existing.get(tpn)
+            sketch = DDSketch.from_json(row[1]) if row else DDSketch()
+            for value in values:
+                sketch.add(value)
+            if row is None:
+                inserts.append(_values("terminal", tpn, day_start, sketch, None))
+            else:
+                updates.append((sketch.count, sketch.quantile(0.95), sketch.to_json(), row[0]))
+        dbapi_cursor.executemany(_INSERT_SQL, inserts)
+        dbapi_cursor.executemany(_UPDATE_SQL, updates)
+    finally:
+        dbapi_cursor.close()
+
+
+def record_run_latency(db: Session, run_id: str, timezone=pytz.UTC) -> int:
+    """Post-run hook: sketch this run's latencies (idempotent per run). Commits. Returns samples."""
+    if db.query(LatencySketch.id).filter(LatencySketch.run_id == run_id).first():
+        return 0
+    rows = db.query(Terminal.tpn, StatusCheck.latency_ms, StatusCheck.checked_at).join(
+        Terminal, Terminal.id == StatusCheck.terminal_id
+    ).filter(
+        StatusCheck.run_id == run_id, StatusCheck.http_status == 200, StatusCheck.latency_ms.isnot(None)
+    ).all()
+    if not rows:
+        return 0
+    _store_run(db, run_id, min(row.checked_at for row in rows), [(row.tpn, row.latency_ms) for row in rows], timezone)
+    db.commit()
+    return len(rows)
+
+
+def backfill_latency_sketches(db: Session, timezone=pytz.UTC, batch_size: int = 50000) -> int:
+    """
+    Sketch stored runs that have none yet (first start after upgrading), in
+    one pass over status_checks in time order. Returns runs backfilled.
+    """
+    done = {run_id for run_id, in db.query(LatencySketch.run_id).filter(LatencySketch.scope == "all")}
+    query = db.query(StatusCheck.run_id, StatusCheck.checked_at, Terminal.tpn, StatusCheck.latency_ms).join(
+        Terminal, Terminal.id == StatusCheck.terminal_id
+    ).filter(
+        StatusCheck.run_id.isnot(None), StatusCheck.http_status == 200, StatusCheck.latency_ms.isnot(None)
+    ).order_by(StatusCheck.checked_at, StatusCheck.id)
+
+    backfilled = 0
+    current_run, run_at, samples = None, None, []
+
+    def _flush():
+        nonlocal backfilled
+        if current_run is not None and current_run not in done and samples:
+            _store_run(db, current_run, run_at, samples, timezone)
+            db.flush()
+            done.add(current_run)
+            backfilled += 1
+
+    for run_id, checked_at, tpn, latency_ms in query.yield_per(batch_size):
+        if run_id != current_run:
+            _flush()
+            current_run, run_at, samples = run_id, checked_at, []
+        samples.append((tpn, latency_ms))
+    _flush()
+    db.commit()
+    if backfilled:
+        logger.info(f"Backfilled latency sketches for {backfilled} runs")
+    return backfilled
+
+
+def _merged(rows: Iterable[str]) -> DDSketch:
+    sketch = DDSketch()
+    for data in rows:
+        sketch.merge(DDSketch.from_json(data))
+    return sketch
+
+
+def latency_summary(
+    db: Session,
+    start: datetime,
+    end: datetime,
+    scope: str = "all",
+    key: Optional[str] = None
+) -> Dict:
+    """p50/p95/p99 for [start, end) (naive UTC) from stored sketches"""
+    query = db.query(LatencySketch.sketch).filter(
+        LatencySketch.scope == scope, LatencySketch.period_start >= start, LatencySketch.period_start < end
+    )
+    if scope != "all":
+        query = query.filter(LatencySketch.scope_key == key)
+    return summarize(_merged(data for data, in query))
+
+
+def merchant_latency(
+    db: Session,
+    start: datetime,
+    end: datetime,
+    merchant_codes: Optional[Sequence[str]] = None
+) -> Dict[str, Dict]:
+    """Per-merchant summaries for [start, end)"""
+    sketches: Dict[str, DDSketch] = defaultdict(DDSketch)
+    query = db.query(LatencySketch.scope_key, LatencySketch.sketch).filter(
+        LatencySketch.scope == "merchant", LatencySketch.period_start >= start, LatencySketch.period_start < end
+    )
+    if merchant_codes is not None:
+        query = query.filter(LatencySketch.scope_key.in_(list(merchant_codes)))
+    for code, data in query:
+        sketches[code].merge(DDSketch.from_json(data))
+    return {code: summarize(sketch) for code, sketch in sorted(sketches.items())}
+
+
+def slowest_terminals(
+    db: Session,
+    start: datetime,
+    end: datetime,
+    limit: int = 20,
+    min_count: int = 2,
+    merchant_codes: Optional[Sequence[str]] = None,
+    active_tpns: Optional[set] = None
+) -> List[Dict]:
+    """
+    Terminals with the highest p95 over [start, end). Candidates are the
+    terminal-days with the highest stored p95 (index order); only their
+    sketches are decoded and merged across the range.
+    """
+    candidates = db.query(LatencySketch.scope_key).filter(
+        LatencySketch.scope == "terminal", LatencySketch.period_start >= start, LatencySketch.period_start < end
+    )
+    if merchant_codes is not None:
+        if not merchant_codes:
+            return []
+        merchant_codes = set(merchant_codes)
+    keys = []
+    seen = set()
+    for key, in candidates.order_by(LatencySketch.p95_ms.desc()).yield_per(1000):
+        if key in seen:
+            continue
+        if merchant_codes is not None and key[:4] not in merchant_codes:
+            continue
+        if active_tpns is not None and key not in active_tpns:
+            continue
+        seen.add(key)
+        keys.append(key)
+        if len(keys) >= limit * SLOWEST_CANDIDATE_FACTOR:
+            break
+    if not keys:
+        return []
+
+    sketches: Dict[str, DDSketch] = defaultdict(DDSketch)
+    for key, data in db.query(LatencySketch.scope_key, LatencySketch.sketch).filter(
+        LatencySketch.scope == "terminal", LatencySketch.scope_key.in_(keys),
+        LatencySketch.period_start >= start, LatencySketch.period_start < end
+    ):
+        sketches[key].merge(DDSketch.from_json(data))
+
+    ranked = [
+        {"tpn": key, "merchant_code": key[:4], **summarize(sketch)}
+        for key, sketch in sketches.items() if sketch.count >= min_count
+    ]
+    ranked.sort(key=lambda item: item["p95_ms"], reverse=True)
+    return ranked[:limit]
+
+
+def day_range(days: int, timezone, now: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+    """[local midnight `days - 1` days ago, now) as naive UTC"""
+    now = now or datetime.utcnow()
+    start = _local_day_start(now, timezone) - timedelta(days=days - 1)
+    return start, now + timedelta(seconds=1)
@@ -70,9 +70,17 @@ def get_merchant_name(code: str) -> Optional[str]:
     return mapping.get(code)
 
 
+# Reverse (name -> code) index for the mapping dict it was built from
+_reverse_mapping_source: Optional[Dict[str, str]] = None
+_reverse_mapping: Dict[str, str] = {}
+
+
 def get_merchant_code_from_name(name: str, mapping: Dict[str, str]) -> Optional[str]:
-    """Get merchant code from company name (reverse lookup)"""
-    for code, company_name in mapping.items():
-        if company_name == name:
-            return code
-    return None
+    """Get merchant code from company name (reverse lookup, first code wins like the old scan)"""
+    global _reverse_mapping_source, _reverse_mapping
+    if mapping is not _reverse_mapping_source:
+        reverse = {}
+        for code, company_name in mapping.items():
+            reverse.setdefault(company_name, code)
+        _reverse_mapping, _reverse_mapping_source = reverse, mapping
+    return _reverse_mapping.get(name)
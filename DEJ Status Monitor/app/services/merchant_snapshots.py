@@ -0,0 +1,197 @@
+"""
+Precomputed merchant page statistics
+The merchant page shows per-terminal all-time check counts and the
+merchant's status counts for a date range. Both used to be computed by
+loading every stored check of the merchant on each view. Instead, each
+refresh (after a run, on TPN reload and at startup) folds the checks stored
+since the last refresh into merchant_terminal_snapshots (per-terminal
+counters) and merchant_daily_counts (per-merchant status counts per local
+day). A page view reads one row per terminal plus one row per day.
+"""
+import logging
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import pytz
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+
+from app.models import MerchantDailyCounts, MerchantTerminalSnapshot, Terminal, TerminalState
+
+logger = logging.getLogger(__name__)
+
+STATUS_COLUMNS = ("online", "offline", "disconnect", "error", "unknown")
+
+_ADD_TERMINALS_SQL = text(
+    "INSERT OR IGNORE INTO merchant_terminal_snapshots "
+    "(terminal_id, merchant_code, tpn, total_checks, online_count, offline_count, last_check_id) "
+    "SELECT id, substr(tpn, 1, 4), tpn, 0, 0, 0, 0 FROM terminals"
+)
+_ADVANCE_TERMINALS_SQL = text(
+    "UPDATE merchant_terminal_snapshots SET "
+    "total_checks = total_checks + d.checks, online_count = online_count + d.online, "
+    "offline_count = offline_count + d.offline, last_check_id = d.last_check_id "
+    "FROM (SELECT terminal_id, count(*) AS checks, sum(status = 'ONLINE') AS online, "
+    "sum(status = 'OFFLINE') AS offline, max(id) AS last_check_id "
+    "FROM status_checks WHERE id > :watermark AND id <= :until GROUP BY terminal_id) AS d "
+    "WHERE merchant_terminal_snapshots.terminal_id = d.terminal_id"
+)
+_NEW_COUNTS_SQL = text(
+    "SELECT substr(status_checks.checked_at, 1, 16), substr(terminals.tpn, 1, 4), status_checks.status, count(*) "
+    "FROM status_checks JOIN terminals ON terminals.id = status_checks.terminal_id "
+    "WHERE status_checks.id > :watermark AND status_checks.id <= :until GROUP BY 1, 2, 3"
+)
+_DAILY_SQL = (
+    "INSERT INTO merchant_daily_counts (merchant_code, day_start, total, online, offline, disconnect, error, unknown) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (merchant_code, day_start) DO UPDATE SET "
+    "total = total + excluded.total, online = online + excluded.online, offline = offline + excluded.offline, "
+    "disconnect = disconnect + excluded.disconnect, error = error + excluded.error, unknown = unknown + excluded.unknown"
+)
+
+
+@lru_cache(maxsize=4096)
+def _local_day_start(minute: str, timezone) -> datetime:
+    """Local midnight (naive UTC) of the day containing a stored "YYYY-MM-DD HH:MM" time"""
+    local = pytz.UTC.localize(datetime.fromisoformat(minute)).astimezone(timezone)
+    midnight = local.replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+    return timezone.localize(midnight).astimezone(pytz.UTC).replace(tzinfo=None)
+
+
+def refresh_merchant_snapshots(db: Session, timezone=pytz.UTC) -> int:
+    """
+    Add rows for new terminals, then fold every check stored since the last
+    refresh into the snapshots (all history on first start). Commits.
+    Returns checks applied.
+    """
+    # Bound first, so every check folded in has its terminal's row
+    until = db.execute(text("SELECT max(id) FROM status_checks")).scalar() or 0
+    db.execute(_ADD_TERMINALS_SQL)
+    watermark = db.query(func.max(MerchantTerminalSnapshot.last_check_id)).scalar() or 0
+    if until <= watermark:
+        db.commit()
+        return 0
+    bounds = {"watermark": watermark, "until": until}
+
+    daily: Dict[tuple, List[int]] = {}
+    applied = 0
+    for minute, code, status, count in db.execute(_NEW_COUNTS_SQL, bounds):
+        counts = daily.setdefault((code, _local_day_start(minute, timezone)), [0] * (len(STATUS_COLUMNS) + 1))
+        counts[0] += count
+        column = status.lower()
+        if column in STATUS_COLUMNS:
+            counts[1 + STATUS_COLUMNS.index(column)] += count
+        applied += count
+    db.execute(_ADVANCE_TERMINALS_SQL, bounds)
+
+    # DBAPI executemany, as in availability: one upsert per merchant-day
+    dbapi_cursor = db.connection().connection.cursor()
+    try:
+        dbapi_cursor.executemany(_DAILY_SQL, [
+            (code, day_start.strftime("%Y-%m-%d %H:%M:%S.%f"), *counts)
+            for (code, day_start), counts in daily.items()
+        ])
+    finally:
+        dbapi_cursor.close()
+    db.commit()
+    if applied:
+        logger.info(f"Merchant snapshots: applied {applied} checks for {len({code for code, _ in daily})} merchants")
+    return applied
+
+
+def terminal_stats(db: Session, merchant_code: str) -> List[Dict]:
+    """Per-terminal all-time counts and latest status, in terminal order"""
+    rows = db.query(MerchantTerminalSnapshot, TerminalState.status).outerjoin(
+        TerminalState, TerminalState.terminal_id == MerchantTerminalSnapshot.terminal_id
+    ).filter(
+        MerchantTerminalSnapshot.merchant_code == merchant_code
+    ).order_by(MerchantTerminalSnapshot.terminal_id).all()
+    return [
+        {
+            "tpn": snapshot.tpn,
+            "latest_status": latest_status,
+            "total_checks": snapshot.total_checks,
+            "online_count": snapshot.online_count,
+            "offline_count": snapshot.offline_count,
+            "online_percentage": round(snapshot.online_count / snapshot.total_checks * 100, 2) if snapshot.total_checks else 0,
+        }
+        for snapshot, latest_status in rows
+    ]
+
+
+def stats_by_tpn(db: Session, tpns) -> Dict[str, Dict]:
+    """
+    terminal_stats entries for the given TPNs, keyed by TPN. All-time counts
+    cover archived history too; terminals not yet refreshed count zero.
+    """
+    tpns = list(tpns)
+    stats = {}
+    for i in range(0, len(tpns), 500):
+        rows = db.query(Terminal.tpn, MerchantTerminalSnapshot, TerminalState.status).outerjoin(
+            MerchantTerminalSnapshot, MerchantTerminalSnapshot.terminal_id == Terminal.id
+        ).outerjoin(
+            TerminalState, TerminalState.terminal_id == Terminal.id
+        ).filter(Terminal.tpn.in_(tpns[i:i + 500])).all()
+        for tpn, snapshot, latest_status in rows:
+            total = snapshot.total_checks if snapshot else 0
+            online = snapshot.online_count if snapshot else 0
+            stats[tpn] = {
+                "tpn": tpn,
+                "latest_status": latest_status,
+                "total_checks": total,
+                "online_count": online,
+                "offline_count": snapshot.offline_count if snapshot else 0,
+                "online_percentage": round(online / total * 100, 2) if total else 0,
+            }
+    return stats
+
+
+def _unrefreshed_terminal_stats(db: Session, merchant_code: str) -> List[Dict]:
+    """Terminals of a merchant added since the last refresh, with no counts yet"""
+    rows = db.query(Terminal.tpn, TerminalState.status).outerjoin(
+        TerminalState, TerminalState.terminal_id == Terminal.id
+    ).filter(
+        func.substr(Terminal.tpn, 1, 4) == merchant_code
+    ).order_by(Terminal.id).all()
+    return [
+        {"tpn": tpn, "latest_status": latest_status, "total_checks": 0, "online_count": 0, "offline_count": 0, "online_percentage": 0}
+        for tpn, latest_status in rows
+    ]
+
+
+def range_counts(db: Session, merchant_code: str, start: datetime, end: datetime, timezone=pytz.UTC) -> Dict[str, int]:
+    """
+    Status counts of the local days overlapping [start, end] (naive UTC):
+    whole days, so a time-of-day in start/end widens to its day.
+    """
+    first_day = _local_day_start(start.strftime("%Y-%m-%d %H:%M"), timezone)
+    columns = [func.coalesce(func.sum(getattr(MerchantDailyCounts, column)), 0) for column in ("total",) + STATUS_COLUMNS]
+    row = db.query(*columns).filter(
+        MerchantDailyCounts.merchant_code == merchant_code,
+        MerchantDailyCounts.day_start >= first_day,
+        MerchantDailyCounts.day_start <= end
+    ).one()
+    return dict(zip(("total",) + STATUS_COLUMNS, row))
+
+
+def merchant_stats(db: Session, merchant_code: str, start: datetime, end: datetime, timezone=pytz.UTC) -> Optional[Dict]:
+    """
+    Merchant page statistics from the snapshots, or None for an unknown
+    merchant. Read-only, so it can run on the read engine.
+    """
+    stats = terminal_stats(db, merchant_code) or _unrefreshed_terminal_stats(db, merchant_code)
+    if not stats:
+        return None
+    counts = range_counts(db, merchant_code, start, end, timezone)
+    return {
+        "merchant": merchant_code,
+        "total_terminals": len(stats),
+        "range_stats": {
+            "total_checks": counts["total"],
+            **{column: counts[column] for column in STATUS_COLUMNS},
+            "online_percentage": round(counts["online"] / counts["total"] * 100, 2) if counts["total"] else 0,
+            "start_date": start.isoformat(),
+            "end_date": end.isoformat(),
+        },
+        "terminal_stats": stats,
+    }
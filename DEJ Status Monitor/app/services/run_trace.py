@@ -0,0 +1,196 @@
+"""
+Check-run trace timeline
+Records per-TPN spans (queued, jitter done, semaphore acquired, request
+start/end per attempt, backoff, released) and run phases, so a slow run shows
+whether time went to jitter, semaphore waits, network, backoff, the retry
+pass or the DB commit. Traces are stored as compact JSON in check_run_traces.
+"""
+import contextlib
+import json
+import logging
+import os
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.models import CheckRunTrace
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+TRACE_ENABLED = os.getenv("CHECK_TRACE_ENABLED", "true").lower() in ("1", "true", "yes")
+TRACE_KEEP_RUNS = int(os.getenv("CHECK_TRACE_KEEP_RUNS", "30"))  # Older traces are pruned
+QUEUE_DEPTH_POINTS = 300  # Samples in the queue-depth curve
+
+# Span being recorded by the current check task (copied into singleflight tasks)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("check_run_span", default=None)
+
+
+class Span:
+    """Events for one TPN check within a run pass"""
+    __slots__ = ("trace", "tpn", "pass_name", "events", "status")
+
+    def __init__(self, trace: "RunTrace", tpn: str, pass_name: str):
+        self.trace = trace
+        self.tpn = tpn
+        self.pass_name = pass_name
+        self.events: List[list] = []
+        self.status: Optional[str] = None
+
+    def mark(self, event: str):
+        self.events.append([event, self.trace.now_ms()])
+
+    def to_list(self) -> list:
+        return [self.tpn, self.pass_name, self.status, self.events]
+
+
+class RunTrace:
+    """Timeline for one check run; times are ms since the run started"""
+
+    def __init__(self, run_id: str, concurrency: int):
+        self.run_id = run_id
+        self.concurrency = concurrency
+        self.started_at = datetime.utcnow()
+        self._t0 = time.perf_counter()
+        self.phases: List[list] = []
+        self.spans: List[Span] = []
+
+    def now_ms(self) -> float:
+        return round((time.perf_counter() - self._t0) * 1000, 1)
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """Record a run phase (fetch, retry_wait, retry_pass, persist)"""
+        start = self.now_ms()
+        try:
+            yield
+        finally:
+            self.phases.append([name, start, self.now_ms()])
+
+    @contextlib.contextmanager
+    def span(self, tpn: str, pass_name: str):
+        """Make a new span current for the check of tpn; yields the Span"""
+        span = Span(self, tpn, pass_name)
+        self.spans.append(span)
+        span.mark("queued")
+        token = _current_span.set(span)
+        try:
+            yield span
+        finally:
+            span.mark("done")
+            _current_span.reset(token)
+
+    def to_dict(self) -> Dict:
+        return {
+            "run_id": self.run_id,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": self.now_ms(),
+            "concurrency": self.concurrency,
+            "phases": self.phases,
+            "spans": [s.to_list() for s in self.spans],
+        }
+
+
+def mark(event: str):
+    """Mark an event on the current span, if this check is being traced"""
+    span = _current_span.get()
+    if span is not None:
+        span.mark(event)
+
+
+def save_trace(db: Session, trace: RunTrace) -> None:
+    """Store a run trace and prune traces beyond TRACE_KEEP_RUNS"""
+    data = trace.to_dict()
+    db.add(CheckRunTrace(
+        run_id=trace.run_id,
+        started_at=trace.started_at,
+        duration_ms=int(data["duration_ms"]),
+        terminal_count=len({s.tpn for s in trace.spans}),
+        concurrency=trace.concurrency,
+        trace_json=json.dumps(data, separators=(",", ":"))
+    ))
+    keep_ids = [
+        row.run_id for row in
+        db.query(CheckRunTrace.run_id).order_by(CheckRunTrace.started_at.desc()).limit(TRACE_KEEP_RUNS - 1)
+    ]
+    db.query(CheckRunTrace).filter(
+        CheckRunTrace.run_id != trace.run_id,
+        CheckRunTrace.run_id.notin_(keep_ids)
+    ).delete(synchronize_session=False)
+    db.commit()
+
+
+def load_trace(db: Session, run_id: str) -> Optional[Dict]:
+    """Load a stored trace as a dict, or None"""
+    row = db.query(CheckRunTrace).filter(CheckRunTrace.run_id == run_id).first()
+    return json.loads(row.trace_json) if row else None
+
+
+def _event_times(events: list, name: str) -> List[float]:
+    return [t for e, t in events if e == name]
+
+
+def summarize_trace(data: Dict) -> Dict:
+    """
+    Where the time went: per-phase wall clock, and task time summed over spans
+    for jitter, semaphore wait, network and retry backoff.
+    """
+    totals = {"jitter_ms": 0.0, "semaphore_wait_ms": 0.0, "network_ms": 0.0, "backoff_ms": 0.0}
+    attempts = 0
+    for _tpn, _pass, _status, events in data["spans"]:
+        times = {e: t for e, t in reversed(events)}  # first occurrence of each event
+        if "jitter_done" in times:
+            totals["jitter_ms"] += times["jitter_done"] - times["queued"]
+            if "acquired" in times:
+                totals["semaphore_wait_ms"] += times["acquired"] - times["jitter_done"]
+        starts = _event_times(events, "request_start")
+        ends = _event_times(events, "request_end")
+        attempts += len(starts)
+        totals["network_ms"] += sum(end - start for start, end in zip(starts, ends))
+        backoffs = _event_times(events, "backoff")
+        totals["backoff_ms"] += sum(start - b for b, start in zip(backoffs, starts[1:]))
+    return {
+        "phases": {name: round(end - start, 1) for name, start, end in data["phases"]},
+        "task_time": {k: round(v, 1) for k, v in totals.items()},
+        "spans": len(data["spans"]),
+        "attempts": attempts,
+    }
+
+
+def queue_depth_series(data: Dict, points: int = QUEUE_DEPTH_POINTS) -> List[Dict]:
+    """
+    Tasks waiting on the semaphore and holding a slot over time, sampled to
+    `points` buckets (max per bucket so short spikes stay visible).
+    """
+    deltas = []
+    for _tpn, _pass, _status, events in data["spans"]:
+        times = {e: t for e, t in reversed(events)}
+        if "jitter_done" in times:
+            deltas.append((times["jitter_done"], 1, 0))
+            if "acquired" in times:
+                deltas.append((times["acquired"], -1, 1))
+                deltas.append((times.get("released", times.get("done", times["acquired"])), 0, -1))
+            else:
+                deltas.append((times.get("done", times["jitter_done"]), -1, 0))
+    duration = max(data.get("duration_ms") or 0, max((t for t, _, _ in deltas), default=0))
+    if not deltas or duration <= 0:
+        return []
+
+    deltas.sort(key=lambda d: d[0])
+    bucket_ms = duration / points
+    series = [{"t": round(i * bucket_ms, 1), "waiting": 0, "inflight": 0} for i in range(points)]
+    waiting = inflight = 0
+    index = 0
+    for bucket in series:
+        bucket_end = bucket["t"] + bucket_ms
+        bucket["waiting"], bucket["inflight"] = waiting, inflight
+        while index < len(deltas) and deltas[index][0] < bucket_end:
+            waiting += deltas[index][1]
+            inflight += deltas[index][2]
+            bucket["waiting"] = max(bucket["waiting"], waiting)
+            bucket["inflight"] = max(bucket["inflight"], inflight)
+            index += 1
+    return series
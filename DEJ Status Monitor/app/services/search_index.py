@@ -0,0 +1,273 @@
+"""
+Typeahead search over terminals and merchants
+The search_index FTS5 table (trigram tokenizer, created with the schema in
+app/models.py) holds one row per active terminal (TPN, merchant code, STEAM
+Description/HardwareName) and one per merchant (code, company name from
+merchant_mapping.json). Any substring of 3+ characters is an index lookup;
+shorter queries only match merchant code/name prefixes.
+"""
+import logging
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Select, literal_column, select, text
+from sqlalchemy.orm import Session
+
+from app.models import TerminalInfo
+
+logger = logging.getLogger(__name__)
+
+MIN_TRIGRAM_LENGTH = 3  # Shorter terms cannot use the trigram index
+INSERT_BATCH_SIZE = 5000
+
+_INSERT_SQL = (
+    "INSERT INTO search_index (kind, key, tpn, merchant_code, company_name, description, hardware_name) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+# Mapping dict the merchant rows were built from (load_merchant_mapping returns
+# a new dict whenever merchant_mapping.json changes), and those rows as
+# (code, company name) for short queries. kind/key are UNINDEXED, so filtering
+# on them alone would scan the whole table.
+_indexed_mapping: Optional[Dict[str, str]] = None
+_indexed_merchants: Optional[List[Tuple[str, Optional[str]]]] = None
+
+
+def is_available(db: Session) -> bool:
+    """True if the search_index table exists in this database"""
+    return db.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'"
+    )).first() is not None
+
+
+# (kind, key, tpn, merchant_code, company_name, description, hardware_name)
+IndexRow = Tuple[str, str, Optional[str], str, Optional[str], Optional[str], Optional[str]]
+
+
+def _insert(db: Session, rows: List[IndexRow]):
+    # DBAPI executemany: SQLAlchemy's per-row parameter handling dominates bulk loads here
+    cursor = db.connection().connection.cursor()
+    try:
+        for i in range(0, len(rows), INSERT_BATCH_SIZE):
+            cursor.executemany(_INSERT_SQL, rows[i:i + INSERT_BATCH_SIZE])
+    finally:
+        cursor.close()
+
+
+def _rebuild_merchants(db: Session, merchant_codes: Iterable[str], mapping: Dict[str, str]):
+    global _indexed_mapping, _indexed_merchants
+    db.execute(text("DELETE FROM search_index WHERE kind = 'merchant'"))
+    merchants = [(code, mapping.get(code)) for code in sorted(set(merchant_codes))]
+    _insert(db, [("merchant", code, None, code, name, None, None) for code, name in merchants])
+    _indexed_mapping = mapping
+    _indexed_merchants = merchants
+
+
+def _merchant_rows(db: Session) -> List[Tuple[str, Optional[str]]]:
+    """Indexed merchants, read from the table once per process"""
+    global _indexed_merchants
+    if _indexed_merchants is None:
+        _indexed_merchants = [
+            (key, name) for key, name in db.execute(
+                text("SELECT key, company_name FROM search_index WHERE kind = 'merchant' ORDER BY key")
+            )
+        ]
+    return _indexed_merchants
+
+
+def rebuild_search_index(db: Session, active_tpns: Sequence[str]) -> int:
+    """
+    Sync the index with the given active TPNs after a TPN load/reload: rows
+    for TPNs no longer active are deleted, new TPNs are added with their
+    cached TerminalInfo, and merchant rows are rebuilt. Commits. Returns the
+    number of terminals added.
+    """
+    from app.services.merchant_loader import load_merchant_mapping
+
+    if not is_available(db):
+        return 0
+    start = time.perf_counter()
+    active = set(active_tpns)
+    indexed = {
+        key: rowid for rowid, key in db.execute(text("SELECT rowid, key FROM search_index WHERE kind = 'terminal'"))
+    }
+    removed = [rowid for key, rowid in indexed.items() if key not in active]
+    added = sorted(active.difference(indexed))
+    for i in range(0, len(removed), INSERT_BATCH_SIZE):
+        db.execute(
+            text("DELETE FROM search_index WHERE rowid IN ({})".format(",".join(str(r) for r in removed[i:i + INSERT_BATCH_SIZE])))
+        )
+    if added:
+        info = {
+            tpn: (description, hardware_name)
+            for tpn, description, hardware_name in db.query(
+                TerminalInfo.tpn, TerminalInfo.description, TerminalInfo.hardware_name
+            )
+        }
+        _insert(db, [("terminal", tpn, tpn, tpn[:4], None, *info.get(tpn, (None, None))) for tpn in added])
+    _rebuild_merchants(db, (tpn[:4] for tpn in active if len(tpn) >= 4), load_merchant_mapping())
+    db.commit()
+    if added or removed:
+        logger.info(
+            f"Search index: added {len(added)}, removed {len(removed)} terminals "
+            f"in {int((time.perf_counter() - start) * 1000)}ms"
+        )
+    return len(added)
+
+
+def update_terminal(db: Session, tpn: str, description: Optional[str], hardware_name: Optional[str]):
+    """Refresh one terminal's STEAM fields if it is indexed (caller commits)"""
+    if not is_available(db):
+        return
+    db.execute(
+        text("UPDATE search_index SET description = :description, hardware_name = :hardware_name "
+             "WHERE rowid IN (SELECT rowid FROM search_index WHERE search_index MATCH :match AND tpn = :tpn)"),
+        {"match": _match_expression([tpn], "tpn"), "tpn": tpn, "description": description, "hardware_name": hardware_name}
+    )
+
+
+def sync_merchant_names(db: Session) -> bool:
+    """
+    Re-index merchant rows when merchant_mapping.json has changed. Writes, so
+    it runs on write sessions (post-run hook); search() itself only reads.
+    Commits. Returns True if the rows were rebuilt.
+    """
+    from app.services.merchant_loader import load_merchant_mapping
+
+    if not is_available(db):
+        return False
+    mapping = load_merchant_mapping()
+    if mapping is _indexed_mapping:
+        return False
+    _rebuild_merchants(db, [code for code, _ in _merchant_rows(db)], mapping)
+    db.commit()
+    return True
+
+
+def _unindexed_merchant_hits(db: Session, query: str, terms: List[str], mapping: Dict[str, str]) -> List[Dict]:
+    """Merchant hits matched in Python against the current mapping, while its rows are not yet re-indexed"""
+    lowered = query.lower()
+    hits = []
+    for code, _ in _merchant_rows(db):
+        name = mapping.get(code)
+        haystack = f"{code} {name or ''}".lower()
+        if all(term.lower() in haystack for term in terms):
+            order = 0 if code.lower() == lowered else 1 if code.lower().startswith(lowered) else 2
+            hits.append((order, code, name))
+    return [_merchant_hit(code, name) for _, code, name in sorted(hits)]
+
+
+def _merchant_hit(code: str, company_name: Optional[str]) -> Dict:
+    return {
+        "type": "merchant",
+        "key": code,
+        "label": f"{code} - {company_name}" if company_name else code,
+        "detail": None,
+        "url": f"/merchant/{code}",
+    }
+
+
+def _match_expression(terms: List[str], column: Optional[str] = None) -> str:
+    """FTS5 query: every term as a quoted substring phrase, ANDed"""
+    prefix = f"{column}:" if column else ""
+    return " AND ".join(prefix + '"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def matching_tpns_query(db: Session, query: str) -> Optional[Select]:
+    """
+    SELECT of the TPNs containing the query string, from the index, for use
+    as `Terminal.tpn.in_(...)`: a short query can match most of the fleet, so
+    the match stays inside SQLite instead of binding one parameter per TPN.
+    None when the index cannot answer (query too short or index missing);
+    callers fall back to LIKE.
+    """
+    query = query.strip()
+    if len(query) < MIN_TRIGRAM_LENGTH or not is_available(db):
+        return None
+    return select(literal_column("key")).select_from(text("search_index")).where(
+        text("search_index MATCH :match AND kind = 'terminal'").bindparams(match=_match_expression([query], "tpn"))
+    )
+
+
+def matching_tpns(db: Session, query: str) -> Optional[List[str]]:
+    """TPNs containing the query string, from the index (None as for matching_tpns_query)"""
+    tpns = matching_tpns_query(db, query)
+    if tpns is None:
+        return None
+    return [key for key, in db.execute(tpns)]
+
+
+def search(
+    db: Session,
+    query: str,
+    limit: int = 10,
+    merchant_codes: Optional[Sequence[str]] = None
+) -> List[Dict]:
+    """
+    Ranked typeahead hits for terminals and merchants. Exact and prefix key
+    matches come first, then FTS5 bm25 rank. merchant_codes limits results
+    to those merchants (None = all).
+    """
+    from app.services.merchant_loader import load_merchant_mapping
+
+    query = query.strip()
+    if not query or not is_available(db):
+        return []
+    # Merchant names come from the current mapping; until sync_merchant_names
+    # re-indexes a changed mapping, merchant rows are matched in Python
+    mapping = load_merchant_mapping()
+    stale = _indexed_mapping is not None and mapping is not _indexed_mapping
+
+    terms = query.split()
+    long_terms = [t for t in terms if len(t) >= MIN_TRIGRAM_LENGTH]
+    if not long_terms:
+        # 1-2 characters: merchant code / company name prefixes only
+        lowered = query.lower()
+        names = mapping if stale else dict(_merchant_rows(db))
+        return [
+            _merchant_hit(code, names.get(code)) for code, _ in _merchant_rows(db)
+            if (merchant_codes is None or code in merchant_codes)
+            and (code.lower().startswith(lowered) or (names.get(code) or "").lower().startswith(lowered))
+        ][:limit]
+
+    params: Dict = {"q": query, "prefix": f"{query}%", "limit": limit, "match": _match_expression(long_terms)}
+    filters = ""
+    for i, term in enumerate(t for t in terms if len(t) < MIN_TRIGRAM_LENGTH):
+        params[f"s{i}"] = f"%{term}%"
+        filters += f" AND (key LIKE :s{i} OR company_name LIKE :s{i} OR description LIKE :s{i} OR hardware_name LIKE :s{i})"
+    if merchant_codes is not None:
+        if not merchant_codes:
+            return []
+        placeholders = []
+        for i, code in enumerate(merchant_codes):
+            params[f"m{i}"] = code
+            placeholders.append(f":m{i}")
+        filters += f" AND merchant_code IN ({', '.join(placeholders)})"
+    if stale:
+        filters += " AND kind = 'terminal'"
+    sql = (
+        "SELECT kind, key, tpn, company_name, description, hardware_name FROM search_index "
+        f"WHERE search_index MATCH :match{filters} "
+        "ORDER BY CASE WHEN key = :q THEN 0 WHEN key LIKE :prefix THEN 1 ELSE 2 END, "
+        "CASE kind WHEN 'merchant' THEN 0 ELSE 1 END, rank LIMIT :limit"
+    )
+
+    results = []
+    if stale:
+        results = [
+            hit for hit in _unindexed_merchant_hits(db, query, terms, mapping)
+            if merchant_codes is None or hit["key"] in merchant_codes
+        ][:limit]
+        params["limit"] = limit - len(results)
+    for kind, key, tpn, company_name, description, hardware_name in db.execute(text(sql), params):
+        if kind == "merchant":
+            results.append(_merchant_hit(key, company_name))
+        else:
+            results.append({
+                "type": "terminal",
+                "key": key,
+                "label": tpn,
+                "detail": " · ".join(part for part in (description, hardware_name) if part) or None,
+                "url": f"/terminal/{tpn}",
+            })
+    return results
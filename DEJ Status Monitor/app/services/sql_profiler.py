@@ -0,0 +1,101 @@
+"""
+Per-request SQL profiler
+Hooks SQLAlchemy engine events to count queries and DB time for the
+current request (or any block wrapped in profile_queries()).
+"""
+import contextlib
+import logging
+import os
+import time
+from contextvars import ContextVar
+from typing import List, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+SLOW_REQUEST_QUERY_COUNT = int(os.getenv("SLOW_REQUEST_QUERY_COUNT", "100"))
+SLOWEST_STATEMENTS_KEPT = 5
+
+# Active profiles, innermost last; nested profile_queries() blocks all see each statement
+_active_profiles: ContextVar[Tuple["QueryProfile", ...]] = ContextVar("sql_query_profiles", default=())
+
+
+class QueryProfile:
+    """Query count, total DB time and the slowest statements for one unit of work"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.slowest: List[Tuple[float, str]] = []
+        self.statements: List[str] = []
+
+    def record(self, statement: str, elapsed_ms: float):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.statements.append(statement)
+        if len(self.slowest) < SLOWEST_STATEMENTS_KEPT or elapsed_ms > self.slowest[-1][0]:
+            self.slowest.append((elapsed_ms, statement))
+            self.slowest.sort(key=lambda item: item[0], reverse=True)
+            del self.slowest[SLOWEST_STATEMENTS_KEPT:]
+
+    def server_timing(self, total_ms: float) -> str:
+        """Server-Timing header value: db time/count and total handler time"""
+        return f'db;dur={self.total_ms:.1f};desc="{self.count} queries", app;dur={total_ms:.1f}'
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active_profiles.get():
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profiles = _active_profiles.get()
+    if not profiles:
+        return
+    starts = conn.info.get("query_start_time")
+    if not starts:
+        return
+    elapsed_ms = (time.perf_counter() - starts.pop()) * 1000
+    for profile in profiles:
+        profile.record(statement, elapsed_ms)
+
+
+@contextlib.contextmanager
+def profile_queries():
+    """Profile every SQL statement executed in this context; yields the QueryProfile"""
+    profile = QueryProfile()
+    token = _active_profiles.set(_active_profiles.get() + (profile,))
+    try:
+        yield profile
+    finally:
+        _active_profiles.reset(token)
+
+
+@contextlib.contextmanager
+def assert_max_queries(max_queries: int):
+    """
+    Fail if the wrapped block runs more than max_queries SQL statements.
+    Intended for tests, e.g. `with assert_max_queries(5): client.get("/api/terminals")`.
+    """
+    with profile_queries() as profile:
+        yield profile
+    if profile.count > max_queries:
+        statements = "\n".join(f"  {s}" for s in profile.statements)
+        raise AssertionError(f"Expected at most {max_queries} queries, got {profile.count}:\n{statements}")
+
+
+def log_if_slow(method: str, path: str, profile: QueryProfile, total_ms: float):
+    """Log requests over SLOW_REQUEST_MS or SLOW_REQUEST_QUERY_COUNT with their slowest statements"""
+    if total_ms < SLOW_REQUEST_MS and profile.count < SLOW_REQUEST_QUERY_COUNT:
+        return
+    slowest = "; ".join(f"{ms:.1f}ms {' '.join(sql.split())[:200]}" for ms, sql in profile.slowest[:3])
+    logger.warning(
+        f"Slow request {method} {path}: {total_ms:.0f}ms total, "
+        f"{profile.count} queries, {profile.total_ms:.0f}ms in DB. Slowest: {slowest}"
+    )
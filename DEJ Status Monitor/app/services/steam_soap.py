@@ -1,6 +1,8 @@
 """
 SOAP service for STEAM API integration
 """
+import io
+import time
 import httpx
 import xml.etree.ElementTree as ET
 import xml.sax.saxutils as saxutils
@@ -8,8 +10,12 @@ import logging
 from typing import List, Dict, Optional
 from xml.etree.ElementTree import Element
 from fastapi import HTTPException
+from app.services import metrics
+from app.services.cpu_pool import run_in_process
 
 logger = logging.getLogger(__name__)
+# SOAP request/response bodies; sampled by the logging pipeline (see app.logging_config)
+body_logger = logging.getLogger(f"{__name__}.bodies")
 
 # SOAP namespaces
 SOAP_NS = "http://schemas.xmlsoap.org/soap/envelope/"
@@ -19,6 +25,10 @@ XSI_NS = "http://www.w3.org/2001/XMLSchema-instance"
 MSDATA_NS = "urn:schemas-microsoft-com:xml-msdata"
 DIFFGR_NS = "urn:schemas-microsoft-com:xml-diffgram-v1"
 
+# TerminalInfo bodies at least this large are parsed in the CPU process pool
+# (ET.fromstring holds the GIL); smaller ones parse faster than the hand-off
+PARSE_OFFLOAD_CHARS = 64 * 1024
+
 
 def create_soap_envelope(body_content: str) -> str:
     """Create a SOAP envelope with the given body content"""
@@ -60,47 +70,39 @@ def create_terminal_info_request(username: str, password: str, tpn: str) -> str:
     return create_soap_envelope(body)
 
 
+def _local_name(tag: str) -> str:
+    """Strip any {namespace} prefix from an element tag"""
+    return tag.rsplit('}', 1)[-1]
+
+
+def _collect_tpn_events(events, tpns: List[str]) -> None:
+    """
+    Collect TPNs from iterparse/XMLPullParser "end" events.
+    Matches <tpn> in any namespace (covers diffgr:Table/tpn, Table/tpn and bare tpn)
+    and clears finished Table rows so memory stays flat on large companies.
+    """
+    for _, elem in events:
+        name = _local_name(elem.tag)
+        if name == 'tpn':
+            if elem.text and elem.text.strip():
+                tpns.append(elem.text.strip())
+        elif name == 'Table':
+            elem.clear()
+
+
 def parse_get_terminals_response(xml_response: str) -> List[str]:
-    """Parse Get_Terminals SOAP response and extract TPN list"""
+    """Parse Get_Terminals SOAP response incrementally and extract TPN list"""
     try:
-        logger.info(f"Parsing SOAP response (length: {len(xml_response)} chars)")
-        root = ET.fromstring(xml_response)
-        
-        # Register namespaces
-        namespaces = {
-            'soap': SOAP_NS,
-            'tempuri': TEMPURI_NS,
-            'diffgr': DIFFGR_NS
-        }
-        
-        # Try different XPath patterns to find TPNs
-        tpns = []
-        
-        # Pattern 1: diffgr:Table/tpn (original)
-        for tpn_elem in root.findall('.//diffgr:Table/tpn', namespaces):
-            if tpn_elem.text:
-                tpns.append(tpn_elem.text.strip())
-        
-        # Pattern 2: Try without namespace prefix
-        if not tpns:
-            logger.info("Trying alternative XPath patterns...")
-            for tpn_elem in root.findall('.//Table/tpn'):
-                if tpn_elem.text:
-                    tpns.append(tpn_elem.text.strip())
-        
-        # Pattern 3: Try finding all tpn elements anywhere
-        if not tpns:
-            logger.info("Trying to find all tpn elements...")
-            for tpn_elem in root.findall('.//tpn'):
-                if tpn_elem.text:
-                    tpns.append(tpn_elem.text.strip())
+        logger.debug(f"Parsing SOAP response (length: {len(xml_response)} chars)")
+        tpns: List[str] = []
+        _collect_tpn_events(
+            ET.iterparse(io.BytesIO(xml_response.encode('utf-8')), events=('end',)),
+            tpns
+        )
         
         logger.info(f"Parsed {len(tpns)} TPNs from SOAP response")
         if len(tpns) == 0:
-            logger.warning("No TPNs found in response. Full response structure:")
-            # Log the structure of the XML
-            for elem in root.iter():
-                logger.warning(f"Element: {elem.tag}, Text: {elem.text[:50] if elem.text else 'None'}")
+            logger.warning(f"No TPNs found in response (first 2000 chars): {xml_response[:2000]}")
         
         return tpns
     except ET.ParseError as e:
@@ -180,6 +182,8 @@ async def get_terminals_from_steam(
     Get list of TPNs from STEAM via SOAP
     Returns list of TPN strings
     """
+    start_time = time.perf_counter()
+    outcome = "error"
     try:
         request_body = create_get_terminals_request(username, password, company_id)
         
@@ -188,37 +192,51 @@ async def get_terminals_from_steam(
             "SOAPAction": f"{TEMPURI_NS}Get_Terminals"
         }
         
-        logger.info(f"Calling STEAM SOAP endpoint: {soap_url}")
-        logger.info(f"Headers: {headers}")
-        logger.info(f"Full SOAP Request Body:\n{request_body}")
+        logger.info(f"Calling STEAM SOAP endpoint: {soap_url} (CompanyId: {company_id})")
         
         async with httpx.AsyncClient(timeout=timeout) as client:
-            response = await client.post(soap_url, content=request_body, headers=headers)
-            
-            logger.info(f"SOAP Response status: {response.status_code}")
-            logger.info(f"SOAP Response headers: {dict(response.headers)}")
-            logger.info(f"Full SOAP Response Body:\n{response.text}")
-            
-            if response.status_code == 404:
-                error_msg = (
-                    f"SOAP endpoint not found (404): {soap_url}\n"
-                    f"Please verify the 'soap_url' in config.json is correct.\n"
-                    f"Common endpoints might be:\n"
-                    f"  - https://dvmms.com/steam/WebService.asmx\n"
-                    f"  - https://dvmms.com/steam/Service.asmx\n"
-                    f"  - https://dvmms.com/steam/api/webservice.asmx"
-                )
-                logger.error(error_msg)
-                raise HTTPException(status_code=404, detail=error_msg)
+            async with client.stream("POST", soap_url, content=request_body, headers=headers) as response:
+                logger.info(f"SOAP Response status: {response.status_code}")
+                body_logger.debug(f"SOAP Response headers: {dict(response.headers)}")
+                
+                if response.status_code == 404:
+                    error_msg = (
+                        f"SOAP endpoint not found (404): {soap_url}\n"
+                        f"Please verify the 'soap_url' in config.json is correct.\n"
+                        f"Common endpoints might be:\n"
+                        f"  - https://dvmms.com/steam/WebService.asmx\n"
+                        f"  - https://dvmms.com/steam/Service.asmx\n"
+                        f"  - https://dvmms.com/steam/api/webservice.asmx"
+                    )
+                    logger.error(error_msg)
+                    raise HTTPException(status_code=404, detail=error_msg)
+                
+                if response.is_error:
+                    await response.aread()
+                response.raise_for_status()
+                
+                # Parse the body as it arrives instead of buffering the whole document
+                tpns: List[str] = []
+                parser = ET.XMLPullParser(events=('end',))
+                received = 0
+                async for chunk in response.aiter_bytes():
+                    received += len(chunk)
+                    parser.feed(chunk)
+                    _collect_tpn_events(parser.read_events(), tpns)
+                parser.close()
+                _collect_tpn_events(parser.read_events(), tpns)
             
-            response.raise_for_status()
-            
-            tpns = parse_get_terminals_response(response.text)
-            logger.info(f"Parsed {len(tpns)} TPNs from response")
+            logger.info(f"Parsed {len(tpns)} TPNs from response ({received} bytes)")
+            if not tpns:
+                logger.warning(f"No TPNs found in Get_Terminals response for CompanyId {company_id}")
+            outcome = "success"
             return tpns
             
     except HTTPException:
         raise
+    except ET.ParseError as e:
+        logger.error(f"XML Parse error in Get_Terminals response: {e}")
+        raise HTTPException(status_code=502, detail=f"Invalid SOAP response: {str(e)}")
     except httpx.HTTPStatusError as e:
         error_msg = f"HTTP {e.response.status_code} error getting terminals from STEAM: {e.response.text[:200]}"
         logger.error(error_msg)
@@ -229,6 +247,8 @@ async def get_terminals_from_steam(
     except Exception as e:
         logger.error(f"Error getting terminals from STEAM: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+    finally:
+        metrics.SOAP_LATENCY.observe(time.perf_counter() - start_time, action="Get_Terminals", outcome=outcome)
 
 
 async def get_terminal_info(
@@ -236,13 +256,17 @@ async def get_terminal_info(
     username: str,
     password: str,
     tpn: str,
-    timeout: int = 30
+    timeout: int = 30,
+    client: Optional[httpx.AsyncClient] = None
 ) -> Optional[Dict]:
     """
     Get full TerminalInfo for a specific TPN from STEAM via SOAP
     Returns dict with ProfileID, Description, HardwareName, LastDownload, LastSuccessUpdate, UpdateStatus
-    or None if not found
+    or None if not found.
+    Pass client to reuse one connection pool across many lookups.
     """
+    start_time = time.perf_counter()
+    outcome = "error"
     try:
         request_body = create_terminal_info_request(username, password, tpn)
         
@@ -251,18 +275,26 @@ async def get_terminal_info(
             "SOAPAction": f"{TEMPURI_NS}TerminalInfo"
         }
         
-        logger.info(f"Fetching TerminalInfo for TPN: {tpn}")
-        logger.debug(f"SOAP Request: {request_body}")
+        logger.debug(f"Fetching TerminalInfo for TPN: {tpn}")
+        body_logger.debug(f"TerminalInfo SOAP request for TPN: {tpn}")
         
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            response = await client.post(soap_url, content=request_body, headers=headers)
-            response.raise_for_status()
-            
-            logger.debug(f"SOAP Response status: {response.status_code}")
-            logger.debug(f"SOAP Response: {response.text[:1000]}...")
-            
-            terminal_info = parse_terminal_info_response(response.text)
-            return terminal_info
+        if client is not None:
+            response = await client.post(soap_url, content=request_body, headers=headers, timeout=timeout)
+        else:
+            async with httpx.AsyncClient(timeout=timeout) as own_client:
+                response = await own_client.post(soap_url, content=request_body, headers=headers)
+        response.raise_for_status()
+        
+        body_logger.debug(f"SOAP Response status: {response.status_code}")
+        body_logger.debug(f"SOAP Response: {response.text[:1000]}...")
+        
+        xml_response = response.text
+        if len(xml_response) >= PARSE_OFFLOAD_CHARS:
+            terminal_info = await run_in_process(parse_terminal_info_response, xml_response)
+        else:
+            terminal_info = parse_terminal_info_response(xml_response)
+        outcome = "success" if terminal_info else "not_found"
+        return terminal_info
             
     except httpx.HTTPError as e:
         logger.warning(f"HTTP error getting TerminalInfo for TPN {tpn}: {e}")
@@ -270,3 +302,5 @@ async def get_terminal_info(
     except Exception as e:
         logger.warning(f"Error getting TerminalInfo for TPN {tpn}: {e}", exc_info=True)
         return None
+    finally:
+        metrics.SOAP_LATENCY.observe(time.perf_counter() - start_time, action="TerminalInfo", outcome=outcome)
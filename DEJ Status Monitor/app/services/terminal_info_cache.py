@@ -0,0 +1,207 @@
+"""
+Local cache for STEAM TerminalInfo
+Detail pages read from the terminal_info table; stale rows are refreshed
+in the background and by a scheduled enrichment job. TPNs STEAM has no
+TerminalInfo for are remembered for TERMINAL_INFO_NOT_FOUND_TTL_SECONDS, so
+viewing an unknown terminal does not call STEAM every time.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+import httpx
+from sqlalchemy.orm import Session
+
+from app.models import Terminal, TerminalInfo
+from app.services.search_index import update_terminal
+from app.services.steam_soap import get_terminal_info
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+TERMINAL_INFO_TTL_SECONDS = int(os.getenv("TERMINAL_INFO_TTL_SECONDS", str(6 * 3600)))
+ENRICH_CONCURRENCY = int(os.getenv("TERMINAL_INFO_ENRICH_CONCURRENCY", "5"))
+TERMINAL_INFO_NOT_FOUND_TTL_SECONDS = int(os.getenv("TERMINAL_INFO_NOT_FOUND_TTL_SECONDS", "600"))
+
+# TPNs with a background refresh already scheduled, and the refresh tasks
+# themselves (the event loop only keeps weak references to tasks)
+_refreshing: Set[str] = set()
+_refresh_tasks: Set[asyncio.Task] = set()
+# TPN -> monotonic time STEAM last returned no TerminalInfo for it
+_not_found: Dict[str, float] = {}
+
+
+def info_to_dict(row: TerminalInfo) -> Dict:
+    """Convert a cached row to the dict shape returned by steam_soap.get_terminal_info"""
+    return {
+        "ProfileID": row.profile_id,
+        "Description": row.description,
+        "HardwareName": row.hardware_name,
+        "LastDownload": row.last_download,
+        "LastSuccessUpdate": row.last_success_update,
+        "UpdateStatus": row.update_status,
+        "Status": row.steam_status,
+        "TPN": row.tpn,
+    }
+
+
+def is_stale(row: TerminalInfo, now: Optional[datetime] = None) -> bool:
+    """True if the cached row is older than the TTL"""
+    now = now or datetime.utcnow()
+    return row.fetched_at is None or now - row.fetched_at > timedelta(seconds=TERMINAL_INFO_TTL_SECONDS)
+
+
+def _recently_not_found(tpn: str) -> bool:
+    missed_at = _not_found.get(tpn)
+    if missed_at is None:
+        return False
+    if time.monotonic() - missed_at <= TERMINAL_INFO_NOT_FOUND_TTL_SECONDS:
+        return True
+    del _not_found[tpn]
+    return False
+
+
+def _remember_not_found(tpn: str) -> None:
+    now = time.monotonic()
+    for key in [key for key, missed_at in _not_found.items() if now - missed_at > TERMINAL_INFO_NOT_FOUND_TTL_SECONDS]:
+        del _not_found[key]
+    _not_found[tpn] = now
+
+
+def get_cached_terminal_info(db: Session, tpn: str) -> Tuple[Optional[Dict], bool]:
+    """
+    Look up cached TerminalInfo.
+    Returns (info dict or None, stale) where stale is True for missing or expired rows.
+    """
+    row = db.query(TerminalInfo).filter(TerminalInfo.tpn == tpn).first()
+    if not row:
+        return None, True
+    return info_to_dict(row), is_stale(row)
+
+
+def save_terminal_info(db: Session, tpn: str, info: Dict) -> None:
+    """Upsert cached TerminalInfo and keep Terminal.profile_id in sync (caller commits)"""
+    row = db.query(TerminalInfo).filter(TerminalInfo.tpn == tpn).first()
+    if not row:
+        row = TerminalInfo(tpn=tpn)
+        db.add(row)
+    row.profile_id = info.get("ProfileID")
+    row.description = info.get("Description")
+    row.hardware_name = info.get("HardwareName")
+    row.last_download = info.get("LastDownload")
+    row.last_success_update = info.get("LastSuccessUpdate")
+    row.update_status = info.get("UpdateStatus")
+    row.steam_status = info.get("Status")
+    row.fetched_at = datetime.utcnow()
+    update_terminal(db, tpn, row.description, row.hardware_name)
+
+    if info.get("ProfileID"):
+        terminal = db.query(Terminal).filter(Terminal.tpn == tpn).first()
+        if terminal and terminal.profile_id != info["ProfileID"]:
+            terminal.profile_id = info["ProfileID"]
+
+
+async def refresh_terminal_info(
+    soap_url: str,
+    username: str,
+    password: str,
+    tpn: str,
+    client: Optional[httpx.AsyncClient] = None
+) -> Optional[Dict]:
+    """
+    Fetch TerminalInfo from STEAM and store it. Returns the info dict or None
+    (also without asking STEAM while a recent lookup found nothing).
+    """
+    if _recently_not_found(tpn):
+        return None
+    info = await get_terminal_info(soap_url, username, password, tpn, client=client)
+    if not info:
+        _remember_not_found(tpn)
+        return None
+    _not_found.pop(tpn, None)
+
+    from app.db import SessionLocal
+    db = SessionLocal()
+    try:
+        save_terminal_info(db, tpn, info)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Failed to store TerminalInfo for {tpn}: {e}")
+    finally:
+        db.close()
+    return info
+
+
+def schedule_refresh(soap_url: str, username: str, password: str, tpn: str) -> bool:
+    """
+    Refresh TerminalInfo for a TPN in the background (at most one pending refresh per TPN).
+    Returns True if a refresh was scheduled.
+    """
+    if tpn in _refreshing or _recently_not_found(tpn):
+        return False
+    _refreshing.add(tpn)
+
+    async def _run():
+        try:
+            await refresh_terminal_info(soap_url, username, password, tpn)
+        except Exception as e:
+            logger.warning(f"Background TerminalInfo refresh failed for {tpn}: {e}")
+        finally:
+            _refreshing.discard(tpn)
+
+    task = asyncio.create_task(_run())
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+    return True
+
+
+def find_stale_tpns(db: Session, tpns: Iterable[str]) -> list:
+    """Return TPNs with no cached TerminalInfo or an expired row"""
+    cutoff = datetime.utcnow() - timedelta(seconds=TERMINAL_INFO_TTL_SECONDS)
+    fresh = {
+        tpn for (tpn,) in db.query(TerminalInfo.tpn).filter(TerminalInfo.fetched_at >= cutoff).all()
+    }
+    return [tpn for tpn in tpns if tpn not in fresh]
+
+
+async def enrich_stale_terminal_info(
+    db: Session,
+    soap_url: str,
+    username: str,
+    password: str,
+    tpns: Iterable[str],
+    concurrency: int = ENRICH_CONCURRENCY
+) -> Dict[str, int]:
+    """
+    Fetch TerminalInfo for every stale or missing TPN with bounded concurrency,
+    sharing one HTTP client. Returns counts: stale, fetched, failed.
+    """
+    stale = find_stale_tpns(db, tpns)
+    if not stale:
+        logger.info("TerminalInfo enrichment: all entries fresh")
+        return {"stale": 0, "fetched": 0, "failed": 0}
+
+    logger.info(f"TerminalInfo enrichment: refreshing {len(stale)} stale entries (concurrency {concurrency})")
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        async def _fetch(tpn: str):
+            async with semaphore:
+                return tpn, await get_terminal_info(soap_url, username, password, tpn, client=client)
+
+        results = await asyncio.gather(*[_fetch(tpn) for tpn in stale])
+
+    fetched = 0
+    for tpn, info in results:
+        if info:
+            save_terminal_info(db, tpn, info)
+            fetched += 1
+    db.commit()
+
+    failed = len(stale) - fetched
+    logger.info(f"TerminalInfo enrichment complete: {fetched} fetched, {failed} failed")
+    return {"stale": len(stale), "fetched": fetched, "failed": failed}
@@ -3,11 +3,23 @@ TPN file loader service
 """
 import os
 import logging
+import tempfile
+import time
+from datetime import datetime
+from typing import Iterable, List
+from sqlalchemy import func, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
 from app.models import Terminal
 
 logger = logging.getLogger(__name__)
 
+# Rows per INSERT OR IGNORE batch when bulk loading TPNs
+INSERT_BATCH_SIZE = 5000
+
+# Characters stripped when normalizing stored TPNs (matches str.strip() for TPN data)
+_TPN_WHITESPACE = " \t\r\n"
+
 
 def count_tpns_in_file(file_path: str) -> int:
     """
@@ -31,61 +43,97 @@ def count_tpns_in_file(file_path: str) -> int:
     return count
 
 
-def load_tpns_from_file(db: Session, file_path: str) -> int:
+def read_tpns_from_file(file_path: str) -> List[str]:
     """
-    Load TPNs from a plaintext file (one per line).
+    Read TPNs from a file (one per line).
     Ignores blank lines and lines starting with #.
-    Note: Terminals not in the file are preserved (not deleted) to maintain historical data.
-    Returns count of TPNs loaded.
+    Returns list of TPNs in file order (empty if file is missing).
     """
     if not os.path.exists(file_path):
-        logger.warning(f"TPN file not found: {file_path}")
-        return 0
+        return []
     
     tpns = []
     with open(file_path, 'r', encoding='utf-8') as f:
         for line in f:
-            # Strip whitespace
             line = line.strip()
-            # Skip blank lines and comments
             if not line or line.startswith('#'):
                 continue
             tpns.append(line)
+    return tpns
+
+
+def write_tpns_file_atomic(file_path: str, tpns: Iterable[str]) -> None:
+    """
+    Write TPNs (one per line) to a temp file next to file_path, then rename it
+    over the original so readers never see a partially written file.
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tpns_", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.writelines(f"{tpn}\n" for tpn in tpns)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates 0600 files; keep the original file's permissions
+        mode = os.stat(file_path).st_mode & 0o777 if os.path.exists(file_path) else 0o644
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, file_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def normalize_terminal_tpns(db: Session) -> int:
+    """
+    Strip stray whitespace from stored TPNs with a single UPDATE.
+    Returns number of rows normalized (caller commits).
+    """
+    result = db.execute(
+        update(Terminal)
+        .where(Terminal.tpn != func.trim(Terminal.tpn, _TPN_WHITESPACE))
+        .values(tpn=func.trim(Terminal.tpn, _TPN_WHITESPACE))
+    )
+    if result.rowcount:
+        logger.info(f"Normalized whitespace on {result.rowcount} stored TPNs")
+    return result.rowcount or 0
+
+
+def load_tpns_from_file(db: Session, file_path: str) -> int:
+    """
+    Load TPNs from a plaintext file (one per line).
+    Ignores blank lines and lines starting with #.
+    Note: Terminals not in the file are preserved (not deleted) to maintain historical data.
+    Returns count of TPNs loaded.
+    """
+    if not os.path.exists(file_path):
+        logger.warning(f"TPN file not found: {file_path}")
+        return 0
     
-    logger.info(f"Loaded {len(tpns)} TPNs from {file_path}")
+    start_time = time.perf_counter()
+    tpns = read_tpns_from_file(file_path)
     
-    # Convert to set for faster lookup (TPNs are already normalized from file)
-    tpn_set = set(tpns)
+    logger.info(f"Loaded {len(tpns)} TPNs from {file_path}")
     
     # First, normalize existing terminals in database (fix any with whitespace)
-    all_terminals = db.query(Terminal).all()
-    updated_count = 0
-    for terminal in all_terminals:
-        normalized_tpn = terminal.tpn.strip()
-        if terminal.tpn != normalized_tpn:
-            logger.info(f"Normalizing TPN: '{terminal.tpn}' -> '{normalized_tpn}'")
-            terminal.tpn = normalized_tpn
-            updated_count += 1
-    
-    # Commit normalization changes before proceeding
-    if updated_count > 0:
-        db.commit()
-        # Re-query to get updated terminals
-        all_terminals = db.query(Terminal).all()
+    updated_count = normalize_terminal_tpns(db)
     
-    # Upsert terminals
-    count = 0
-    for tpn in tpns:
-        terminal = db.query(Terminal).filter(Terminal.tpn == tpn).first()
-        if not terminal:
-            terminal = Terminal(tpn=tpn)
-            db.add(terminal)
-            count += 1
+    # Bulk insert in batches; rows whose TPN already exists are skipped by SQLite
+    count_before = db.query(func.count(Terminal.id)).scalar()
+    now = datetime.utcnow()
+    # Core insert against the table (not the ORM entity) keeps per-row overhead minimal
+    insert_stmt = sqlite_insert(Terminal.__table__).on_conflict_do_nothing(index_elements=["tpn"])
+    conn = db.connection()
+    for i in range(0, len(tpns), INSERT_BATCH_SIZE):
+        batch = tpns[i:i + INSERT_BATCH_SIZE]
+        conn.execute(insert_stmt, [{"tpn": tpn, "created_at": now} for tpn in batch])
+    count = db.query(func.count(Terminal.id)).scalar() - count_before
     
     # Note: We do NOT delete terminals that are no longer in the file.
     # All historical data is preserved. User will manage database size if needed.
     
     db.commit()
-    logger.info(f"Upserted {count} new terminals, {len(tpns) - count} already existed, {updated_count} normalized. All terminals preserved (none deleted).")
+    elapsed_ms = int((time.perf_counter() - start_time) * 1000)
+    logger.info(f"Upserted {count} new terminals, {len(tpns) - count} already existed, {updated_count} normalized in {elapsed_ms}ms. All terminals preserved (none deleted).")
     
     return len(tpns)
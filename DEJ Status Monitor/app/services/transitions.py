@@ -0,0 +1,124 @@
+"""
+Status transition detection at ingest
+Each stored check is compared with the terminal's current state
+(terminal_states); changes are appended to status_transitions. Readers get
+"last online", outage start and flapping from these tables instead of
+scanning status_checks.
+"""
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models import StatusCheck, StatusTransition, TerminalState
+
+logger = logging.getLogger(__name__)
+
+ID_CHUNK_SIZE = 500  # Terminal ids per IN (...) lookup
+
+# (terminal_id, status, checked_at, run_id)
+CheckRow = Tuple[int, str, datetime, Optional[str]]
+
+
+def _load_states(db: Session, terminal_ids: List[int]) -> Dict[int, TerminalState]:
+    states = {}
+    for start in range(0, len(terminal_ids), ID_CHUNK_SIZE):
+        chunk = terminal_ids[start:start + ID_CHUNK_SIZE]
+        for state in db.query(TerminalState).filter(TerminalState.terminal_id.in_(chunk)):
+            states[state.terminal_id] = state
+    return states
+
+
+def _apply_rows(db: Session, states: Dict[int, TerminalState], rows: Iterable[CheckRow]) -> List[StatusTransition]:
+    """Update states in place for rows in time order; return (and add) the transitions found"""
+    transitions = []
+    for terminal_id, status, checked_at, run_id in rows:
+        state = states.get(terminal_id)
+        if state is not None and checked_at < state.checked_at:
+            continue  # Out-of-order result (e.g. a slow manual check); state is already newer
+        if state is None:
+            state = TerminalState(terminal_id=terminal_id, status=status, checked_at=checked_at, status_since=checked_at)
+            db.add(state)
+            states[terminal_id] = state
+            transitions.append(StatusTransition(
+                terminal_id=terminal_id, from_status=None, to_status=status, transitioned_at=checked_at, run_id=run_id
+            ))
+        elif state.status != status:
+            transitions.append(StatusTransition(
+                terminal_id=terminal_id, from_status=state.status, to_status=status, transitioned_at=checked_at, run_id=run_id
+            ))
+            state.status = status
+            state.status_since = checked_at
+        state.checked_at = checked_at
+        state.run_id = run_id
+        if status == "ONLINE":
+            state.last_online_at = checked_at
+    db.add_all(transitions)
+    return transitions
+
+
+def record_transitions(db: Session, rows: Iterable[CheckRow]) -> List[StatusTransition]:
+    """
+    Apply new check results to terminal_states and append a StatusTransition
+    for every status change. Adds to the session; the caller commits
+    (together with the StatusCheck rows). Returns the new transitions.
+    """
+    rows = list(rows)
+    states = _load_states(db, list({row[0] for row in rows}))
+    return _apply_rows(db, states, rows)
+
+
+def backfill_terminal_states(db: Session, batch_size: int = 50000) -> int:
+    """
+    Replay status_checks for terminals that have checks but no state row yet
+    (first start after upgrading), building terminal_states and the
+    historical transition log. Returns the number of terminals backfilled.
+    """
+    have_state = {terminal_id for terminal_id, in db.query(TerminalState.terminal_id)}
+    missing = {
+        terminal_id for terminal_id, in db.query(StatusCheck.terminal_id).distinct()
+        if terminal_id not in have_state
+    }
+    if not missing:
+        return 0
+
+    logger.info(f"Backfilling terminal state and transitions for {len(missing)} terminals...")
+    states: Dict[int, TerminalState] = {}
+    transition_count = 0
+    batch: List[CheckRow] = []
+    query = db.query(
+        StatusCheck.terminal_id, StatusCheck.status, StatusCheck.checked_at, StatusCheck.run_id
+    ).order_by(StatusCheck.checked_at, StatusCheck.id)
+    for row in query.yield_per(batch_size):
+        if row.terminal_id in missing:
+            batch.append(tuple(row))
+        if len(batch) >= batch_size:
+            transition_count += len(_apply_rows(db, states, batch))
+            db.flush()
+            batch = []
+    transition_count += len(_apply_rows(db, states, batch))
+    db.commit()
+    logger.info(f"Backfilled terminal state for {len(states)} terminals ({transition_count} transitions)")
+    return len(states)
+
+
+def count_transitions(db: Session, terminal_id: int, since: datetime) -> int:
+    """Status changes for one terminal since a time (index lookup)"""
+    return db.query(func.count(StatusTransition.id)).filter(
+        StatusTransition.terminal_id == terminal_id,
+        StatusTransition.transitioned_at >= since,
+        StatusTransition.from_status.isnot(None)
+    ).scalar()
+
+
+def flapping_terminals(db: Session, since: datetime, min_transitions: int = 4) -> Dict[int, int]:
+    """Terminals with at least min_transitions status changes since a time: {terminal_id: count}"""
+    return dict(
+        db.query(StatusTransition.terminal_id, func.count(StatusTransition.id))
+        .filter(StatusTransition.transitioned_at >= since, StatusTransition.from_status.isnot(None))
+        .group_by(StatusTransition.terminal_id)
+        .having(func.count(StatusTransition.id) >= min_transitions)
+        .all()
+    )
@@ -0,0 +1,206 @@
+"""
+Fleet and merchant trends
+At the end of each run, its status counts are written to run_summaries once
+fleet-wide and once per merchant. Scheduled runs only check the terminals
+their check policies plan, so terminals a run skipped count with their last
+status (terminal_states): the fleet rows follow fleet health, not the plan.
+Trend series for any range read those rows
+(one per run) and are downsampled server-side, either with
+Largest-Triangle-Three-Buckets (keeps the visual shape) or min/max per
+bucket (keeps every spike), so a chart gets a bounded number of points
+however long the history is.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import exists, func
+from sqlalchemy.orm import Session
+
+from app.models import RunSummary, StatusCheck, Terminal, TerminalState
+
+logger = logging.getLogger(__name__)
+
+STATUS_COLUMNS = ("online", "offline", "disconnect", "error", "unknown")
+METRICS = ("online_percentage",) + STATUS_COLUMNS + ("total",)
+MANUAL_RUN_PREFIX = "manual-"  # Single-terminal checks from /api/check-tpn/{tpn}; not runs
+EPOCH = datetime(1970, 1, 1)
+
+
+def _summary_rows(run_id: str, run_at: datetime, counts: Dict[str, Dict[str, int]]) -> List[RunSummary]:
+    """RunSummary rows from {merchant_code: {status: count}}"""
+    fleet: Dict[str, int] = defaultdict(int)
+    rows = []
+    for code in sorted(counts):
+        by_status = counts[code]
+        for status, count in by_status.items():
+            fleet[status] += count
+        rows.append(_row(run_id, run_at, "merchant", code, by_status))
+    rows.insert(0, _row(run_id, run_at, "all", "", fleet))
+    return rows
+
+
+def _row(run_id: str, run_at: datetime, scope: str, key: str, by_status: Dict[str, int]) -> RunSummary:
+    values = {column: by_status.get(column.upper(), 0) for column in STATUS_COLUMNS}
+    return RunSummary(
+        run_id=run_id, run_at=run_at, scope=scope, scope_key=key, total=sum(by_status.values()), **values
+    )
+
+
+def record_run_summary(db: Session, run_id: str, active_tpns: Optional[Set[str]] = None) -> int:
+    """
+    Post-run hook: store this run's status counts (idempotent). Terminals the
+    run did not check add their current status; with active_tpns, only those
+    terminals (the TPN file minus paused ones). Commits. Returns rows written.
+    """
+    if run_id.startswith(MANUAL_RUN_PREFIX) or db.query(RunSummary.id).filter(RunSummary.run_id == run_id).first():
+        return 0
+    run_at = None
+    counts: Dict[str, Dict[str, int]] = defaultdict(dict)
+    for code, status, count, first_checked_at in db.query(
+        func.substr(Terminal.tpn, 1, 4), StatusCheck.status, func.count(StatusCheck.id), func.min(StatusCheck.checked_at)
+    ).join(Terminal, Terminal.id == StatusCheck.terminal_id).filter(
+        StatusCheck.run_id == run_id
+    ).group_by(func.substr(Terminal.tpn, 1, 4), StatusCheck.status):
+        counts[code][status] = count
+        run_at = first_checked_at if run_at is None else min(run_at, first_checked_at)
+    if not counts:
+        return 0
+    checked = exists().where(StatusCheck.run_id == run_id, StatusCheck.terminal_id == Terminal.id)
+    for tpn, status in db.query(Terminal.tpn, TerminalState.status).join(
+        TerminalState, TerminalState.terminal_id == Terminal.id
+    ).filter(~checked):
+        if active_tpns is None or tpn in active_tpns:
+            counts[tpn[:4]][status] = counts[tpn[:4]].get(status, 0) + 1
+    rows = _summary_rows(run_id, run_at, counts)
+    db.add_all(rows)
+    db.commit()
+    return len(rows)
+
+
+def backfill_run_summaries(db: Session) -> int:
+    """
+    Summarize stored runs when run_summaries is empty (first start after
+    upgrading) with one grouped pass over status_checks. Returns runs summarized.
+    """
+    if db.query(RunSummary.id).first():
+        return 0
+    runs: Dict[str, Dict[str, Dict[str, int]]] = defaultdict(lambda: defaultdict(dict))
+    run_times: Dict[str, datetime] = {}
+    for run_id, code, status, count, first_checked_at in db.query(
+        StatusCheck.run_id, func.substr(Terminal.tpn, 1, 4), StatusCheck.status,
+        func.count(StatusCheck.id), func.min(StatusCheck.checked_at)
+    ).join(Terminal, Terminal.id == StatusCheck.terminal_id).filter(
+        StatusCheck.run_id.isnot(None), ~StatusCheck.run_id.like(f"{MANUAL_RUN_PREFIX}%")
+    ).group_by(StatusCheck.run_id, func.substr(Terminal.tpn, 1, 4), StatusCheck.status):
+        runs[run_id][code][status] = count
+        run_times[run_id] = min(run_times.get(run_id, first_checked_at), first_checked_at)
+    for run_id, counts in runs.items():
+        db.add_all(_summary_rows(run_id, run_times[run_id], counts))
+    db.commit()
+    if runs:
+        logger.info(f"Backfilled run summaries for {len(runs)} runs")
+    return len(runs)
+
+
+def lttb(points: Sequence[Tuple[float, float]], threshold: int) -> List[int]:
+    """
+    Largest-Triangle-Three-Buckets (Steinarsson, 2013): indexes of
+    `threshold` points (first and last always kept) that best preserve the
+    shape of the (x, y) series.
+    """
+    n = len(points)
+    if threshold >= n or n <= 2:
+        return list(range(n))
+    threshold = max(threshold, 3)
+    selected = [0]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        count = next_end - next_start
+        avg_x = sum(points[j][0] for j in range(next_start, next_end)) / count
+        avg_y = sum(points[j][1] for j in range(next_start, next_end)) / count
+
+        ax, ay = points[a]
+        best, best_area = None, -1.0
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        a = best
+    selected.append(n - 1)
+    return selected
+
+
+def min_max(points: Sequence[Tuple[float, float]], threshold: int) -> List[int]:
+    """Indexes of the min and max point of each of threshold // 2 equal-count buckets, in order"""
+    n = len(points)
+    if threshold >= n:
+        return list(range(n))
+    buckets = max(threshold // 2, 1)
+    selected = []
+    for b in range(buckets):
+        start, end = b * n // buckets, (b + 1) * n // buckets
+        if start >= end:
+            continue
+        low = min(range(start, end), key=lambda j: points[j][1])
+        high = max(range(start, end), key=lambda j: points[j][1])
+        selected.extend(sorted({low, high}))
+    return selected
+
+
+DOWNSAMPLERS = {"lttb": lttb, "minmax": min_max}
+
+
+def _metric(row: Dict, metric: str) -> float:
+    if metric == "online_percentage":
+        return round(row["online"] / row["total"] * 100, 2) if row["total"] else 0.0
+    return row[metric]
+
+
+def trend_series(
+    db: Session,
+    start: datetime,
+    end: datetime,
+    scope: str = "all",
+    key: Optional[str] = None,
+    merchant_codes: Optional[Sequence[str]] = None,
+    metric: str = "online_percentage",
+    points: int = 500,
+    method: str = "lttb"
+) -> Dict:
+    """
+    Per-run series for runs in [start, end) (naive UTC), downsampled to at
+    most `points` points. For the "all" scope, merchant_codes sums only those
+    merchants (a restricted user's fleet).
+    """
+    columns = [func.sum(getattr(RunSummary, column)) for column in ("total",) + STATUS_COLUMNS]
+    query = db.query(RunSummary.run_at, *columns).filter(RunSummary.run_at >= start, RunSummary.run_at < end)
+    if scope == "all" and merchant_codes is None:
+        query = query.filter(RunSummary.scope == "all", RunSummary.scope_key == "")
+    elif scope == "all":
+        query = query.filter(RunSummary.scope == "merchant", RunSummary.scope_key.in_(list(merchant_codes)))
+    else:
+        query = query.filter(RunSummary.scope == "merchant", RunSummary.scope_key == key)
+    rows = [
+        dict(zip(("run_at", "total") + STATUS_COLUMNS, row))
+        for row in query.group_by(RunSummary.run_id, RunSummary.run_at).order_by(RunSummary.run_at)
+    ]
+
+    values = [((row["run_at"] - EPOCH).total_seconds(), _metric(row, metric)) for row in rows]
+    selected = DOWNSAMPLERS[method](values, points)
+    return {
+        "metric": metric,
+        "method": method,
+        "runs": len(rows),
+        "series": [
+            {"t": rows[i]["run_at"].isoformat() + "Z", "v": values[i][1], **{c: rows[i][c] for c in ("total",) + STATUS_COLUMNS}}
+            for i in selected
+        ],
+    }
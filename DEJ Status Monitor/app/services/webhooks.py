@@ -0,0 +1,282 @@
+"""
+Outbound webhooks for status events
+After a check run, terminal transitions (to OFFLINE, back to ONLINE) and a
+run summary are fanned out to matching subscriptions as webhook_deliveries
+rows. A background worker POSTs each endpoint's due events as one signed
+batch, endpoints in parallel, retrying with backoff; events that exhaust
+their attempts move to webhook_dead_letters. Nothing here runs inside
+run_check_all_terminals.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import httpx
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models import StatusCheck, StatusTransition, Terminal, WebhookDeadLetter, WebhookDelivery, WebhookSubscription
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+WEBHOOK_TIMEOUT_SECONDS = float(os.getenv("WEBHOOK_TIMEOUT_SECONDS", "10"))
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "100"))  # Events per POST
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_RETRY_BASE_SECONDS = float(os.getenv("WEBHOOK_RETRY_BASE_SECONDS", "30"))
+WEBHOOK_RETRY_MAX_SECONDS = float(os.getenv("WEBHOOK_RETRY_MAX_SECONDS", "3600"))
+WEBHOOK_POLL_SECONDS = float(os.getenv("WEBHOOK_POLL_SECONDS", "30"))
+
+EVENT_TYPES = {
+    "terminal.offline": "Terminal changed to OFFLINE",
+    "terminal.recovered": "Terminal back ONLINE after another status",
+    "run.completed": "Check run finished (status counts)",
+}
+SIGNATURE_HEADER = "X-Webhook-Signature"
+TIMESTAMP_HEADER = "X-Webhook-Timestamp"
+
+_wake_event: Optional[asyncio.Event] = None
+_wake_loop: Optional[asyncio.AbstractEventLoop] = None  # Loop the worker runs on
+
+
+def sign_payload(secret: str, timestamp: str, body: bytes) -> str:
+    """HMAC-SHA256 over "<timestamp>.<body>"; receivers recompute it to verify"""
+    digest = hmac.new(secret.encode(), timestamp.encode() + b"." + body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """Backoff after the given number of failed attempts"""
+    return timedelta(seconds=min(WEBHOOK_RETRY_BASE_SECONDS * 2 ** (attempts - 1), WEBHOOK_RETRY_MAX_SECONDS))
+
+
+def wake_webhooks():
+    """
+    Ask the worker to deliver now instead of at its next poll. Safe to call
+    from worker threads (post-run stages run off the event loop).
+    """
+    event, loop = _wake_event, _wake_loop
+    if event is None or loop is None:
+        return
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        event.set()
+        return
+    try:
+        loop.call_soon_threadsafe(event.set)
+    except RuntimeError:
+        pass  # Loop already closed (shutdown)
+
+
+def _event(event_type: str, occurred_at: datetime, run_id: Optional[str], data: Dict) -> Dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "type": event_type,
+        "occurred_at": occurred_at.isoformat() + "Z",
+        "run_id": run_id,
+        "data": data,
+    }
+
+
+def build_run_events(db: Session, run_id: str) -> List[Dict]:
+    """Transition and run.completed events for one stored run"""
+    run_started = db.query(func.min(StatusCheck.checked_at)).filter(StatusCheck.run_id == run_id).scalar()
+    if run_started is None:
+        return []
+
+    events = []
+    rows = db.query(
+        Terminal.tpn, StatusTransition.from_status, StatusTransition.to_status, StatusTransition.transitioned_at
+    ).join(Terminal, Terminal.id == StatusTransition.terminal_id).filter(
+        StatusTransition.transitioned_at >= run_started,
+        StatusTransition.run_id == run_id,
+        StatusTransition.from_status.isnot(None)
+    )
+    for tpn, from_status, to_status, transitioned_at in rows:
+        if to_status == "OFFLINE":
+            event_type = "terminal.offline"
+        elif to_status == "ONLINE":
+            event_type = "terminal.recovered"
+        else:
+            continue
+        events.append(_event(event_type, transitioned_at, run_id, {
+            "tpn": tpn, "merchant_code": tpn[:4], "from_status": from_status, "to_status": to_status
+        }))
+
+    statuses = dict(
+        db.query(StatusCheck.status, func.count(StatusCheck.id))
+        .filter(StatusCheck.run_id == run_id)
+        .group_by(StatusCheck.status)
+        .all()
+    )
+    events.append(_event("run.completed", run_started, run_id, {
+        "terminals": sum(statuses.values()),
+        "statuses": statuses,
+        "transitions": len(events),
+    }))
+    return events
+
+
+def enqueue_events(db: Session, events: List[Dict]) -> int:
+    """Fan events out to enabled subscriptions (event type + merchant filter). Commits."""
+    subscriptions = db.query(WebhookSubscription).filter(WebhookSubscription.is_enabled == True).all()
+    queued = 0
+    for subscription in subscriptions:
+        event_types = set(json.loads(subscription.event_types))
+        merchants = set(json.loads(subscription.merchant_codes)) if subscription.merchant_codes else None
+        for event in events:
+            if event["type"] not in event_types:
+                continue
+            merchant_code = event["data"].get("merchant_code")
+            if merchants is not None and merchant_code is not None and merchant_code not in merchants:
+                continue
+            db.add(WebhookDelivery(subscription_id=subscription.id, event_type=event["type"], payload=json.dumps(event)))
+            queued += 1
+    db.commit()
+    if queued:
+        wake_webhooks()
+    return queued
+
+
+def queue_run_webhooks(db: Session, run_id: str) -> int:
+    """Post-run hook: queue this run's events for every matching subscription"""
+    if not db.query(WebhookSubscription.id).filter(WebhookSubscription.is_enabled == True).first():
+        return 0
+    return enqueue_events(db, build_run_events(db, run_id))
+
+
+async def _post_batch(client: httpx.AsyncClient, subscription: WebhookSubscription, rows: List[WebhookDelivery]) -> Optional[str]:
+    """POST one batch; returns None on 2xx, otherwise the error text"""
+    body = json.dumps({"events": [json.loads(row.payload) for row in rows]}).encode()
+    timestamp = str(int(time.time()))
+    headers = {
+        "Content-Type": "application/json",
+        TIMESTAMP_HEADER: timestamp,
+        SIGNATURE_HEADER: sign_payload(subscription.secret, timestamp, body),
+    }
+    try:
+        response = await client.post(subscription.url, content=body, headers=headers)
+    except httpx.HTTPError as e:
+        return f"{type(e).__name__}: {e}"
+    if 200 <= response.status_code < 300:
+        return None
+    return f"HTTP {response.status_code}"
+
+
+async def _deliver_endpoint(client: httpx.AsyncClient, subscription: WebhookSubscription, rows: List[WebhookDelivery]):
+    """
+    Batches for one endpoint in order; stop at the first failure so later
+    batches keep their order. Returns ([(batch, error)], untried rows).
+    """
+    outcomes = []
+    for start in range(0, len(rows), WEBHOOK_BATCH_SIZE):
+        batch = rows[start:start + WEBHOOK_BATCH_SIZE]
+        error = await _post_batch(client, subscription, batch)
+        outcomes.append((batch, error))
+        if error is not None:
+            return outcomes, rows[start + WEBHOOK_BATCH_SIZE:]
+    return outcomes, []
+
+
+async def deliver_due(db: Session, client: httpx.AsyncClient, now: Optional[datetime] = None) -> int:
+    """
+    Deliver every due event, batched per endpoint. Endpoints are posted to in
+    parallel, each bounded by WEBHOOK_TIMEOUT_SECONDS. Returns events delivered.
+    """
+    now = now or datetime.utcnow()
+    due = db.query(WebhookDelivery).join(
+        WebhookSubscription, WebhookSubscription.id == WebhookDelivery.subscription_id
+    ).filter(
+        WebhookDelivery.next_attempt_at <= now, WebhookSubscription.is_enabled == True
+    ).order_by(WebhookDelivery.id).all()
+    if not due:
+        return 0
+
+    by_subscription: Dict[int, List[WebhookDelivery]] = defaultdict(list)
+    for row in due:
+        by_subscription[row.subscription_id].append(row)
+    subscriptions = {
+        s.id: s for s in db.query(WebhookSubscription).filter(WebhookSubscription.id.in_(list(by_subscription)))
+    }
+    results = await asyncio.gather(*(
+        _deliver_endpoint(client, subscriptions[subscription_id], rows)
+        for subscription_id, rows in by_subscription.items()
+    ))
+
+    delivered = 0
+    for outcomes, untried in results:
+        for batch, error in outcomes:
+            for row in batch:
+                if error is None:
+                    db.delete(row)
+                    delivered += 1
+                    continue
+                row.attempts += 1
+                row.last_error = error
+                if row.attempts >= WEBHOOK_MAX_ATTEMPTS:
+                    db.add(WebhookDeadLetter(
+                        subscription_id=row.subscription_id, event_type=row.event_type, payload=row.payload,
+                        attempts=row.attempts, last_error=error, created_at=row.created_at, failed_at=now
+                    ))
+                    db.delete(row)
+                else:
+                    row.next_attempt_at = now + retry_delay(row.attempts)
+            if error is not None:
+                logger.warning(f"Webhook delivery to subscription {batch[0].subscription_id} failed: {error}")
+                for row in untried:
+                    row.next_attempt_at = now + retry_delay(max(row.attempts, 1))
+    db.commit()
+    logger.info(f"Webhooks: delivered {delivered} of {len(due)} due event(s) to {len(by_subscription)} endpoint(s)")
+    return delivered
+
+
+def replay_dead_letter(db: Session, dead_letter: WebhookDeadLetter) -> WebhookDelivery:
+    """Move a dead-lettered event back onto the queue with a fresh attempt count. Commits."""
+    delivery = WebhookDelivery(
+        subscription_id=dead_letter.subscription_id, event_type=dead_letter.event_type,
+        payload=dead_letter.payload, created_at=dead_letter.created_at
+    )
+    db.add(delivery)
+    db.delete(dead_letter)
+    db.commit()
+    wake_webhooks()
+    return delivery
+
+
+async def run_webhook_worker(session_factory: Callable[[], Session]):
+    """Deliver queued webhook events until cancelled; wakes on enqueue or every WEBHOOK_POLL_SECONDS"""
+    global _wake_event, _wake_loop
+    _wake_event = asyncio.Event()
+    _wake_loop = asyncio.get_running_loop()
+    logger.info("Webhook worker started")
+    async with httpx.AsyncClient(timeout=WEBHOOK_TIMEOUT_SECONDS) as client:
+        try:
+            while True:
+                db = session_factory()
+                try:
+                    await deliver_due(db, client)
+                except Exception as e:
+                    logger.error(f"Error delivering webhooks: {e}", exc_info=True)
+                    db.rollback()
+                finally:
+                    db.close()
+                try:
+                    await asyncio.wait_for(_wake_event.wait(), timeout=WEBHOOK_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                _wake_event.clear()
+        finally:
+            _wake_event = None
+            _wake_loop = None
+            logger.info("Webhook worker stopped")
@@ -0,0 +1,3 @@
+"""
+Benchmarking tools: synthetic datasets and endpoint/check-run benchmarks
+"""
@@ -0,0 +1,238 @@
+"""
+Synthetic dataset generator
+Fills a SQLite database with N terminals across M merchants and a history of
+checks at the configured check times, plus the matching TPN file, merchant
+mapping and cached TerminalInfo rows.
+
+Usage:
+    python -m bench.dataset --out bench_data --terminals 5000 --merchants 200 --days 365
+"""
+import argparse
+import json
+import logging
+import random
+import sqlite3
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List
+
+import pytz
+from sqlalchemy import create_engine
+
+from app.db import Base
+import app.models  # noqa: F401  (registers tables on Base)
+from app.services.config_loader import load_config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATUS_MIX = "ONLINE=0.85,OFFLINE=0.1,DISCONNECT=0.03,ERROR=0.02"
+RAW_RESPONSES = {
+    "ONLINE": "Online",
+    "OFFLINE": "Offline",
+    "DISCONNECT": "Disconnected",
+    "ERROR": None,
+    "UNKNOWN": "Unexpected response",
+}
+INSERT_BATCH_SIZE = 50000
+INSERT_TRANSITION_SQL = (
+    "INSERT INTO status_transitions (terminal_id, from_status, to_status, transitioned_at, run_id) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+INSERT_CHECK_SQL = (
+    "INSERT INTO status_checks (terminal_id, checked_at, status, raw_response, error, http_status, latency_ms, run_id) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+DB_FILE = "status_monitor.db"
+TPN_FILE = "tpns.txt"
+MAPPING_FILE = "merchant_mapping.json"
+META_FILE = "dataset.json"
+
+
+def parse_status_mix(value: str) -> Dict[str, float]:
+    """Parse "ONLINE=0.85,OFFLINE=0.1,..." into normalized weights"""
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip().upper()
+        if name not in RAW_RESPONSES:
+            raise ValueError(f"Unknown status in mix: {name}")
+        mix[name] = float(weight)
+    total = sum(mix.values())
+    if total <= 0:
+        raise ValueError("Status mix weights must sum to more than 0")
+    return {name: weight / total for name, weight in mix.items()}
+
+
+def _sql_datetime(dt: datetime) -> str:
+    """Naive UTC datetime in the text format SQLAlchemy uses for SQLite DateTime columns"""
+    return dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def check_slots(days: int, check_times: List[str], timezone, end: datetime) -> List[datetime]:
+    """UTC timestamps (naive, like the app stores) of every scheduled check in the last `days` days"""
+    slots = []
+    end_local = end.astimezone(timezone)
+    for day_offset in range(days, -1, -1):
+        day = (end_local - timedelta(days=day_offset)).date()
+        for check_time in check_times:
+            hour, minute = map(int, check_time.split(":"))
+            local = timezone.localize(datetime(day.year, day.month, day.day, hour, minute))
+            utc = local.astimezone(pytz.UTC).replace(tzinfo=None)
+            if utc <= end.replace(tzinfo=None):
+                slots.append(utc)
+    return slots
+
+
+def generate_dataset(
+    out_dir: str,
+    terminals: int = 2000,
+    merchants: int = 100,
+    days: int = 365,
+    status_mix: Dict[str, float] = None,
+    dead_fraction: float = 0.05,
+    seed: int = 42,
+) -> Dict:
+    """
+    Write a synthetic dataset to out_dir and return its metadata.
+    Healthy terminals draw each check from status_mix; a dead_fraction of
+    terminals are OFFLINE for every check (the "always offline" population).
+    """
+    rng = random.Random(seed)
+    status_mix = status_mix or parse_status_mix(DEFAULT_STATUS_MIX)
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    db_path = out / DB_FILE
+    if db_path.exists():
+        db_path.unlink()
+
+    start_time = time.perf_counter()
+    engine = create_engine(f"sqlite:///{db_path}")
+    Base.metadata.create_all(bind=engine)
+    engine.dispose()
+
+    config = load_config()
+    timezone = pytz.timezone(config["timezone"])
+    now = datetime.now(pytz.UTC)
+    slots = check_slots(days, config["check_times"], timezone, now)
+
+    merchant_codes = [f"{9000 - i:04d}" for i in range(merchants)]
+    mapping = {code: f"Synthetic Merchant {code}" for code in merchant_codes}
+    tpns = [f"{merchant_codes[i % merchants]}{i:08d}" for i in range(terminals)]
+    dead = set(rng.sample(range(terminals), int(terminals * dead_fraction)))
+
+    statuses = list(status_mix)
+    weights = [status_mix[s] for s in statuses]
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    created_at = _sql_datetime(slots[0] if slots else now.replace(tzinfo=None))
+    fetched_at = _sql_datetime(now.replace(tzinfo=None))
+    conn.executemany(
+        "INSERT INTO terminals (id, tpn, profile_id, created_at) VALUES (?, ?, ?, ?)",
+        [(i + 1, tpn, 100000 + i, created_at) for i, tpn in enumerate(tpns)]
+    )
+    conn.executemany(
+        "INSERT INTO terminal_info (tpn, profile_id, description, hardware_name, steam_status, fetched_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        [(tpn, 100000 + i, f"Lane {i % 8 + 1}", "Z8", "Active", fetched_at) for i, tpn in enumerate(tpns)]
+    )
+
+    check_count = 0
+    batch = []
+    transitions = []
+    # Current state per terminal (status, since, last online), as the checker maintains it
+    last_status = [None] * terminals
+    status_since = [None] * terminals
+    last_online = [None] * terminals
+    last_run = [None] * terminals
+    for slot in slots:
+        run_id = str(uuid.uuid4())
+        checked_at = _sql_datetime(slot)
+        slot_statuses = rng.choices(statuses, weights, k=terminals)
+        for i in range(terminals):
+            status = "OFFLINE" if i in dead else slot_statuses[i]
+            if status != last_status[i]:
+                transitions.append((i + 1, last_status[i], status, checked_at, run_id))
+                last_status[i] = status
+                status_since[i] = checked_at
+            if status == "ONLINE":
+                last_online[i] = checked_at
+            last_run[i] = run_id
+            batch.append((
+                i + 1, checked_at, status, RAW_RESPONSES[status],
+                "Timeout: synthetic" if status == "ERROR" else None,
+                None if status == "ERROR" else 200,
+                rng.randint(80, 1500), run_id
+            ))
+        if len(batch) >= INSERT_BATCH_SIZE:
+            conn.executemany(INSERT_CHECK_SQL, batch)
+            check_count += len(batch)
+            batch = []
+    if batch:
+        conn.executemany(INSERT_CHECK_SQL, batch)
+        check_count += len(batch)
+    conn.executemany(INSERT_TRANSITION_SQL, transitions)
+    if slots:
+        last_checked_at = _sql_datetime(slots[-1])
+        conn.executemany(
+            "INSERT INTO terminal_states (terminal_id, status, checked_at, status_since, last_online_at, run_id) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (i + 1, last_status[i], last_checked_at, status_since[i], last_online[i], last_run[i])
+                for i in range(terminals)
+            ]
+        )
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+    (out / TPN_FILE).write_text("\n".join(tpns) + "\n", encoding="utf-8")
+    (out / MAPPING_FILE).write_text(json.dumps(mapping, indent=2), encoding="utf-8")
+
+    meta = {
+        "terminals": terminals,
+        "merchants": merchants,
+        "days": days,
+        "check_slots": len(slots),
+        "status_checks": check_count,
+        "status_transitions": len(transitions),
+        "status_mix": status_mix,
+        "dead_fraction": dead_fraction,
+        "seed": seed,
+        "generated_at": now.isoformat(),
+        "sample_tpn": tpns[0],
+        "sample_merchant": merchant_codes[0],
+    }
+    (out / META_FILE).write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    logger.info(
+        f"Generated {terminals} terminals, {check_count} checks in {out} "
+        f"({time.perf_counter() - start_time:.1f}s)"
+    )
+    return meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic status monitor dataset")
+    parser.add_argument("--out", default="bench_data", help="Output directory")
+    parser.add_argument("--terminals", type=int, default=2000)
+    parser.add_argument("--merchants", type=int, default=100)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--status-mix", default=DEFAULT_STATUS_MIX, help="e.g. ONLINE=0.85,OFFLINE=0.1,ERROR=0.05")
+    parser.add_argument("--dead-fraction", type=float, default=0.05, help="Share of terminals that are always offline")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    meta = generate_dataset(
+        args.out, args.terminals, args.merchants, args.days,
+        parse_status_mix(args.status_mix), args.dead_fraction, args.seed
+    )
+    print(json.dumps(meta, indent=2))
+
+
+if __name__ == "__main__":
+    main()
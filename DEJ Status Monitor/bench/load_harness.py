@@ -0,0 +1,216 @@
+"""
+Load harness for the checker and STEAM TPN reload
+Drives reload_tpns_from_steam and run_check_all_terminals against the mock
+vendors (bench.mock_vendor) and reports throughput, tail latency and memory.
+
+By default the mock runs in-process on a background thread (it then shares
+CPU and memory numbers with the app); pass --url to target a mock started
+separately with `python -m bench.mock_vendor`.
+
+Usage:
+    python -m bench.load_harness --terminals 20000 --latency-ms 200 --error-rate 0.02 --flapping-fraction 0.05
+"""
+import argparse
+import asyncio
+import json
+import logging
+import resource
+import socket
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db import Base
+from app.models import StatusCheck
+from bench.mock_vendor import SPIN_PATH, SOAP_PATH, VendorProfile, add_profile_arguments, create_app, profile_from_args
+
+logger = logging.getLogger(__name__)
+
+MAIN_COMPANY_ID = "MAIN"
+
+
+class MockServer:
+    """Run the mock vendor app with uvicorn on a background thread"""
+
+    def __init__(self, profile: VendorProfile, host: str = "127.0.0.1"):
+        import uvicorn
+
+        self.app = create_app(profile)
+        with socket.socket() as sock:
+            sock.bind((host, 0))
+            self.port = sock.getsockname()[1]
+        self.url = f"http://{host}:{self.port}"
+        self.server = uvicorn.Server(uvicorn.Config(
+            self.app, host=host, port=self.port, log_level="warning", limit_concurrency=None, backlog=4096
+        ))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+    @property
+    def requests(self) -> Dict[str, int]:
+        return dict(self.app.state.vendor.requests)
+
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(values)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+    return {"p50": statistics.median(ordered), "p95": pct(95), "p99": pct(99), "max": ordered[-1]}
+
+
+def _measure(coro_factory, trace_memory: bool):
+    """
+    Run a coroutine, returning (result, wall seconds, peak traced MB or None).
+    tracemalloc slows Python code several-fold, so it is opt-in.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = asyncio.run(coro_factory())
+    finally:
+        wall = time.perf_counter() - start
+        peak_mb = None
+        if trace_memory:
+            peak_mb = round(tracemalloc.get_traced_memory()[1] / 1048576, 1)
+            tracemalloc.stop()
+    return result, wall, peak_mb
+
+
+def _max_rss_mb() -> float:
+    # ru_maxrss is KB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run_harness(
+    base_url: str,
+    work_dir: str,
+    concurrency: Optional[int] = None,
+    timeout: Optional[float] = None,
+    jitter: bool = True,
+    ur_company_id: Optional[str] = None,
+    mock: Optional[MockServer] = None,
+    trace_memory: bool = False,
+) -> Dict:
+    """Reload TPNs from the mock STEAM, then run a full check against the mock SpinPOS"""
+    from app.services import checker
+    from app.services.steam_tpn_loader import reload_tpns_from_steam
+
+    work = Path(work_dir)
+    engine = create_engine(f"sqlite:///{work / 'load.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    report: Dict = {"config": {"base_url": base_url}}
+
+    ur_account = None
+    if ur_company_id:
+        ur_account = {"username": "bench-ur", "password": "bench", "company_id": ur_company_id}
+    reload_result, wall, peak_mb = _measure(lambda: reload_tpns_from_steam(
+        db, f"{base_url}{SOAP_PATH}", "bench", "bench", MAIN_COMPANY_ID,
+        str(work / "tpns.txt"), ur_account=ur_account
+    ), trace_memory)
+    report["reload"] = {
+        **reload_result,
+        "wall_s": round(wall, 2),
+        "tpns_per_s": round(reload_result["total_tpns"] / wall, 1) if wall else None,
+        "peak_traced_mb": peak_mb,
+    }
+
+    saved = (checker.BASE_URL, checker.CONCURRENT_REQUESTS, checker.TIMEOUT_SECONDS, checker.JITTER_MS)
+    checker.BASE_URL = f"{base_url}{SPIN_PATH}"
+    if concurrency:
+        checker.CONCURRENT_REQUESTS = concurrency
+    if timeout:
+        checker.TIMEOUT_SECONDS = timeout
+    if not jitter:
+        checker.JITTER_MS = (0, 0)
+    checker._inflight_checks.clear()
+    checker._recent_results.clear()
+    report["config"].update(
+        concurrency=checker.CONCURRENT_REQUESTS, timeout_s=checker.TIMEOUT_SECONDS, jitter_ms=list(checker.JITTER_MS)
+    )
+    requests_before = mock.requests if mock else {}
+    try:
+        run_id, wall, peak_mb = _measure(lambda: checker.run_check_all_terminals(db), trace_memory)
+    finally:
+        checker.BASE_URL, checker.CONCURRENT_REQUESTS, checker.TIMEOUT_SECONDS, checker.JITTER_MS = saved
+
+    rows = db.query(StatusCheck.status, StatusCheck.latency_ms).filter(StatusCheck.run_id == run_id).all()
+    checks = len(rows)
+    vendor_requests = None
+    if mock:
+        after = mock.requests
+        vendor_requests = {k: after.get(k, 0) - requests_before.get(k, 0) for k in after}
+    report["check_run"] = {
+        "run_id": run_id,
+        "terminals": checks,
+        "wall_s": round(wall, 2),
+        "checks_per_s": round(checks / wall, 1) if wall else None,
+        "vendor_requests_per_s": round(sum(vendor_requests.values()) / wall, 1) if vendor_requests and wall else None,
+        "latency_ms": _percentiles([r.latency_ms for r in rows if r.latency_ms is not None]),
+        "statuses": dict(Counter(r.status for r in rows)),
+        "vendor_requests": vendor_requests,
+        "peak_traced_mb": peak_mb,
+    }
+    report["max_rss_mb"] = _max_rss_mb()
+    db.close()
+    engine.dispose()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test TPN reload and check runs against mock vendors")
+    parser.add_argument("--url", help="Base URL of an already running bench.mock_vendor (default: start one in-process)")
+    parser.add_argument("--concurrency", type=int, help="Override checker.CONCURRENT_REQUESTS")
+    parser.add_argument("--timeout", type=float, help="Override checker.TIMEOUT_SECONDS")
+    parser.add_argument("--no-jitter", action="store_true", help="Disable the per-request jitter sleep")
+    parser.add_argument("--trace-memory", action="store_true", help="Report peak Python allocations (slow)")
+    parser.add_argument("--output", help="Write the report JSON here")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    profile = profile_from_args(args)
+    ur_company_id = args.ur_company_id if args.ur_terminals else None
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        if args.url:
+            report = run_harness(
+                args.url, work_dir, args.concurrency, args.timeout, not args.no_jitter, ur_company_id,
+                trace_memory=args.trace_memory
+            )
+        else:
+            with MockServer(profile) as mock:
+                report = run_harness(
+                    mock.url, work_dir, args.concurrency, args.timeout, not args.no_jitter, ur_company_id, mock,
+                    args.trace_memory
+                )
+
+    document = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(document, encoding="utf-8")
+    print(document)
+
+
+if __name__ == "__main__":
+    main()
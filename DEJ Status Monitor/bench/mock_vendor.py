@@ -0,0 +1,273 @@
+"""
+Local stand-ins for SpinPOS and STEAM
+An ASGI app implementing GetTerminalStatus and the Get_Terminals/TerminalInfo
+SOAP actions, with configurable latency, error, timeout and 429 rates and
+flapping terminals, so the checker and TPN reload can be load-tested locally.
+
+Usage:
+    python -m bench.mock_vendor --port 8900 --terminals 20000 --latency-ms 150 --error-rate 0.01
+Then point checker.BASE_URL at http://127.0.0.1:8900/spin/GetTerminalStatus
+and the STEAM soap_url at http://127.0.0.1:8900/steam/api/ws/VDirectAccess.asmx.
+"""
+import argparse
+import asyncio
+import random
+import time
+import xml.etree.ElementTree as ET
+import xml.sax.saxutils as saxutils
+import zlib
+from typing import Dict, List, Optional
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from app.services.steam_soap import TEMPURI_NS, DIFFGR_NS, MSDATA_NS, create_soap_envelope
+
+SPIN_PATH = "/spin/GetTerminalStatus"
+SOAP_PATH = "/steam/api/ws/VDirectAccess.asmx"
+GET_TERMINALS_CHUNK_ROWS = 500  # Table rows per streamed chunk
+
+
+class VendorProfile:
+    """
+    Behaviour of the mock vendors.
+    Rates are probabilities per request; offline/disconnect/flapping fractions
+    pick a fixed subset of TPNs (by hash) so a terminal behaves consistently.
+    """
+
+    def __init__(
+        self,
+        terminals: int = 5000,
+        ur_terminals: int = 0,
+        ur_company_id: str = "UR",
+        merchants: int = 100,
+        latency_ms: float = 150,
+        latency_sigma: float = 0.5,
+        error_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        hang_seconds: float = 35,
+        rate_limit_rate: float = 0.0,
+        max_rps: Optional[float] = None,
+        offline_fraction: float = 0.1,
+        disconnect_fraction: float = 0.02,
+        flapping_fraction: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.terminals = terminals
+        self.ur_terminals = ur_terminals
+        self.ur_company_id = ur_company_id
+        self.merchants = merchants
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self.rate_limit_rate = rate_limit_rate
+        self.max_rps = max_rps
+        self.offline_fraction = offline_fraction
+        self.disconnect_fraction = disconnect_fraction
+        self.flapping_fraction = flapping_fraction
+        self.rng = random.Random(seed)
+
+    def tpns_for_company(self, company_id: str) -> List[str]:
+        """Deterministic TPN list for a company; the UR company gets its own range"""
+        ur = company_id == self.ur_company_id
+        count = self.ur_terminals if ur else self.terminals
+        offset = self.terminals if ur else 0
+        return [f"{9000 - (i % self.merchants):04d}{i:08d}" for i in range(offset, offset + count)]
+
+    def sample_latency(self) -> float:
+        """Lognormal latency in seconds around latency_ms (median)"""
+        if self.latency_ms <= 0:
+            return 0.0
+        return self.rng.lognormvariate(0, self.latency_sigma) * self.latency_ms / 1000
+
+
+def _bucket(tpn: str) -> float:
+    """Stable [0, 1) value per TPN"""
+    return (zlib.crc32(tpn.encode()) % 10000) / 10000
+
+
+class MockVendor:
+    """Mock SpinPOS + STEAM state: request counters, rate limiter and flapping state"""
+
+    def __init__(self, profile: VendorProfile):
+        self.profile = profile
+        self.requests: Dict[str, int] = {}
+        self._flap_state: Dict[str, bool] = {}
+        self._window_start = time.monotonic()
+        self._window_count = 0
+
+    def _count(self, outcome: str):
+        self.requests[outcome] = self.requests.get(outcome, 0) + 1
+
+    def _rate_limited(self) -> bool:
+        profile = self.profile
+        if profile.rate_limit_rate and profile.rng.random() < profile.rate_limit_rate:
+            return True
+        if profile.max_rps:
+            now = time.monotonic()
+            if now - self._window_start >= 1:
+                self._window_start, self._window_count = now, 0
+            self._window_count += 1
+            return self._window_count > profile.max_rps
+        return False
+
+    async def _disruption(self) -> Optional[Response]:
+        """Shared latency/429/timeout/error handling; returns a response to short-circuit with"""
+        profile = self.profile
+        if self._rate_limited():
+            self._count("429")
+            return PlainTextResponse("Too Many Requests", status_code=429, headers={"Retry-After": "1"})
+        if profile.timeout_rate and profile.rng.random() < profile.timeout_rate:
+            self._count("timeout")
+            await asyncio.sleep(profile.hang_seconds)
+        await asyncio.sleep(profile.sample_latency())
+        if profile.error_rate and profile.rng.random() < profile.error_rate:
+            self._count("500")
+            return PlainTextResponse("Internal Server Error", status_code=500)
+        return None
+
+    def terminal_status(self, tpn: str) -> str:
+        """Status text for a TPN: flapping terminals alternate, others are fixed by hash"""
+        profile = self.profile
+        bucket = _bucket(tpn)
+        if bucket < profile.flapping_fraction:
+            online = not self._flap_state.get(tpn, False)
+            self._flap_state[tpn] = online
+            return "Online" if online else "Offline"
+        bucket -= profile.flapping_fraction
+        if bucket < profile.offline_fraction:
+            return "Offline"
+        bucket -= profile.offline_fraction
+        if bucket < profile.disconnect_fraction:
+            return "Disconnected"
+        return "Online"
+
+    async def get_terminal_status(self, request: Request) -> Response:
+        disrupted = await self._disruption()
+        if disrupted is not None:
+            return disrupted
+        self._count("200")
+        return PlainTextResponse(self.terminal_status(request.query_params.get("tpn", "")))
+
+    async def soap(self, request: Request) -> Response:
+        action = request.headers.get("SOAPAction", "").strip('"').rsplit("/", 1)[-1]
+        body = await request.body()
+        disrupted = await self._disruption()
+        if disrupted is not None:
+            return disrupted
+        fields = _soap_fields(body)
+        if action == "Get_Terminals":
+            self._count("200")
+            return self._get_terminals_response(fields.get("CompanyId", ""))
+        if action == "TerminalInfo":
+            self._count("200")
+            return Response(_terminal_info_xml(fields.get("tpn", "")), media_type="text/xml")
+        self._count("400")
+        return PlainTextResponse(f"Unknown SOAPAction {action}", status_code=400)
+
+    def _get_terminals_response(self, company_id: str) -> Response:
+        tpns = self.profile.tpns_for_company(company_id)
+        head, tail = create_soap_envelope(
+            f'<Get_TerminalsResponse xmlns="{TEMPURI_NS}"><Get_TerminalsResult>'
+            f'<diffgr:diffgram xmlns:msdata="{MSDATA_NS}" xmlns:diffgr="{DIFFGR_NS}"><NewDataSet xmlns="">'
+            '{rows}'
+            '</NewDataSet></diffgr:diffgram></Get_TerminalsResult></Get_TerminalsResponse>'
+        ).split("{rows}")
+
+        async def _stream():
+            yield head.encode()
+            for start in range(0, len(tpns), GET_TERMINALS_CHUNK_ROWS):
+                yield "".join(
+                    f'<Table diffgr:id="Table{i + 1}" msdata:rowOrder="{i}"><tpn>{tpn}</tpn></Table>'
+                    for i, tpn in enumerate(tpns[start:start + GET_TERMINALS_CHUNK_ROWS], start)
+                ).encode()
+            yield tail.encode()
+
+        return StreamingResponse(_stream(), media_type="text/xml")
+
+
+def _soap_fields(body: bytes) -> Dict[str, str]:
+    """Leaf element text of a SOAP request body by local name"""
+    fields = {}
+    try:
+        for elem in ET.fromstring(body).iter():
+            if len(elem) == 0 and elem.text:
+                fields[elem.tag.rsplit("}", 1)[-1]] = elem.text.strip()
+    except ET.ParseError:
+        pass
+    return fields
+
+
+def _terminal_info_xml(tpn: str) -> str:
+    profile_id = zlib.crc32(tpn.encode()) % 900000 + 100000
+    return create_soap_envelope(
+        f'<TerminalInfoResponse xmlns="{TEMPURI_NS}"><TerminalInfoResult>'
+        f'<diffgr:diffgram xmlns:msdata="{MSDATA_NS}" xmlns:diffgr="{DIFFGR_NS}"><NewDataSet xmlns="">'
+        f'<Table diffgr:id="Table1" msdata:rowOrder="0">'
+        f'<ProfileID>{profile_id}</ProfileID><Description>Mock terminal</Description>'
+        f'<HardwareName>Z8</HardwareName><LastDownload>2025-01-01</LastDownload>'
+        f'<LastSuccessUpdate>2025-01-01</LastSuccessUpdate><UpdateStatus>OK</UpdateStatus>'
+        f'<Status>Active</Status><TPN>{saxutils.escape(tpn)}</TPN>'
+        f'</Table></NewDataSet></diffgr:diffgram></TerminalInfoResult></TerminalInfoResponse>'
+    )
+
+
+def create_app(profile: VendorProfile) -> Starlette:
+    """ASGI app serving both mock vendors; the MockVendor is on app.state.vendor"""
+    vendor = MockVendor(profile)
+    app = Starlette(routes=[
+        Route(SPIN_PATH, vendor.get_terminal_status, methods=["GET"]),
+        Route(SOAP_PATH, vendor.soap, methods=["POST"]),
+    ])
+    app.state.vendor = vendor
+    return app
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    """CLI flags for VendorProfile (shared with bench.load_harness)"""
+    parser.add_argument("--terminals", type=int, default=5000, help="TPNs returned by Get_Terminals")
+    parser.add_argument("--ur-terminals", type=int, default=0, help="TPNs for the UR account")
+    parser.add_argument("--ur-company-id", default="UR", help="CompanyId that gets the UR TPNs")
+    parser.add_argument("--merchants", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=150, help="Median response latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Lognormal spread (tail heaviness)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of HTTP 500 responses")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="Share of requests that hang")
+    parser.add_argument("--hang-seconds", type=float, default=35)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of random 429 responses")
+    parser.add_argument("--max-rps", type=float, default=None, help="429 above this many requests per second")
+    parser.add_argument("--offline-fraction", type=float, default=0.1)
+    parser.add_argument("--disconnect-fraction", type=float, default=0.02)
+    parser.add_argument("--flapping-fraction", type=float, default=0.0, help="Terminals alternating Online/Offline")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def profile_from_args(args) -> VendorProfile:
+    return VendorProfile(
+        terminals=args.terminals, ur_terminals=args.ur_terminals,
+        ur_company_id=args.ur_company_id, merchants=args.merchants,
+        latency_ms=args.latency_ms, latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate, timeout_rate=args.timeout_rate, hang_seconds=args.hang_seconds,
+        rate_limit_rate=args.rate_limit_rate, max_rps=args.max_rps,
+        offline_fraction=args.offline_fraction, disconnect_fraction=args.disconnect_fraction,
+        flapping_fraction=args.flapping_fraction, seed=args.seed,
+    )
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve mock SpinPOS and STEAM endpoints")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(profile_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Endpoint and check-run benchmark suite
+Times the main API endpoints and pages against a dataset from bench.dataset,
+plus a full check run against a mocked SpinPOS, and compares the results with
+a JSON baseline.
+
+Usage:
+    python -m bench.dataset --out bench_data
+    python -m bench.run --data bench_data --save-baseline bench/baseline.json
+    python -m bench.run --data bench_data --baseline bench/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import shutil
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import httpx
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from bench.dataset import DB_FILE, TPN_FILE, MAPPING_FILE, META_FILE
+
+logger = logging.getLogger(__name__)
+
+BENCH_EMAIL = "bench@example.com"
+BENCH_PASSWORD = "bench-password"
+DEFAULT_TOLERANCE = 0.2  # Median slower than baseline by more than this fraction is a regression
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def time_call(fn: Callable[[], object], repeat: int, warmup: int = 1) -> Dict:
+    """Run fn warmup + repeat times; timings in ms plus the query count of the last run"""
+    from app.services.sql_profiler import profile_queries
+
+    for _ in range(warmup):
+        fn()
+    timings = []
+    queries = 0
+    for _ in range(repeat):
+        with profile_queries() as profile:
+            start = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - start) * 1000)
+        queries = profile.count
+    return {
+        "runs": repeat,
+        "min_ms": round(min(timings), 2),
+        "median_ms": round(statistics.median(timings), 2),
+        "p95_ms": round(_percentile(timings, 95), 2),
+        "max_ms": round(max(timings), 2),
+        "queries": queries,
+    }
+
+
+def _setup_app(data_dir: Path):
+    """Point the app at the dataset and return a logged-in TestClient"""
+    from fastapi.testclient import TestClient
+    import app.main as main
+    from app.auth import get_password_hash
+    from app.db import get_db, get_read_db, _set_read_pragmas
+    from app.models import User, UserRole
+    from app.services import merchant_loader, terminal_info_cache
+
+    engine = create_engine(f"sqlite:///{data_dir / DB_FILE}", connect_args={"check_same_thread": False})
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    # GET routes read through a query_only engine, as in the app
+    read_engine = create_engine(f"sqlite:///{data_dir / DB_FILE}", connect_args={"check_same_thread": False})
+    event.listen(read_engine, "connect", _set_read_pragmas)
+    ReadSession = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+    def override_get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def override_get_read_db():
+        db = ReadSession()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    main.app.dependency_overrides[get_db] = override_get_db
+    main.app.dependency_overrides[get_read_db] = override_get_read_db
+    main.TPN_FILE_PATH = str(data_dir / TPN_FILE)
+    merchant_loader.MERCHANT_MAPPING_FILE = str(data_dir / MAPPING_FILE)
+    merchant_loader.load_merchant_mapping(force_reload=True)
+
+    async def _no_steam(*args, **kwargs):
+        return None
+    # Never call STEAM from a benchmark; cached rows come from the dataset
+    terminal_info_cache.get_terminal_info = _no_steam
+
+    db = Session()
+    from app.services.search_index import rebuild_search_index
+    from app.services.tpn_loader import read_tpns_from_file
+    rebuild_search_index(db, read_tpns_from_file(str(data_dir / TPN_FILE)))
+    # Startup work the TestClient skips: merchant pages read these snapshots
+    from app.services.merchant_snapshots import refresh_merchant_snapshots
+    refresh_merchant_snapshots(db, main.TIMEZONE)
+    if not db.query(User).filter(User.email == BENCH_EMAIL).first():
+        db.add(User(
+            email=BENCH_EMAIL, hashed_password=get_password_hash(BENCH_PASSWORD),
+            is_active=True, is_admin=True, role=UserRole.ADMIN
+        ))
+        db.commit()
+    db.close()
+
+    client = TestClient(main.app)
+    response = client.post("/login", data={"email": BENCH_EMAIL, "password": BENCH_PASSWORD}, follow_redirects=False)
+    if response.status_code != 303:
+        raise RuntimeError(f"Benchmark login failed with status {response.status_code}")
+    return client
+
+
+def _get(client, url: str) -> Callable[[], object]:
+    def _call():
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} returned {response.status_code}")
+    return _call
+
+
+def benchmark_endpoints(client, meta: Dict, repeat: int) -> Dict[str, Dict]:
+    """Time each endpoint/page against the dataset"""
+    tpn = meta["sample_tpn"]
+    merchant = meta["sample_merchant"]
+    end = datetime.utcnow().date()
+    start = end - timedelta(days=30)
+    cases = {
+        "api_terminals": "/api/terminals",
+        "api_analytics_today": "/api/analytics?date_range=today",
+        "api_analytics_week": "/api/analytics?date_range=week",
+        "api_analytics_month": "/api/analytics?date_range=month",
+        "api_analytics_custom_30d": f"/api/analytics?date_range=custom&start_date={start}&end_date={end}",
+        "api_merchant": f"/api/merchants/{merchant}",
+        "api_search": f"/api/search?q={tpn[4:9]}",
+        "page_terminal": f"/terminal/{tpn}",
+        "page_analytics_always_offline": "/analytics/always-offline",
+        "page_analytics_always_online": "/analytics/always-online",
+        "page_analytics_online_once": "/analytics/online-once",
+    }
+    results = {}
+    for name, url in cases.items():
+        logger.info(f"Benchmarking {name} ({url})")
+        results[name] = time_call(_get(client, url), repeat)
+    return results
+
+
+def benchmark_check_run(data_dir: Path, work_dir: Path) -> Dict:
+    """Full run_check_all_terminals against a mocked SpinPOS, on a copy of the dataset"""
+    from app.services import checker
+
+    db_copy = work_dir / "check_run.db"
+    shutil.copyfile(data_dir / DB_FILE, db_copy)
+    engine = create_engine(f"sqlite:///{db_copy}")
+    db = sessionmaker(bind=engine)()
+
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, text="Online"))
+    real_client = httpx.AsyncClient
+    original_jitter = checker.JITTER_MS
+    httpx.AsyncClient = lambda **kwargs: real_client(transport=transport, **kwargs)
+    checker.JITTER_MS = (0, 0)
+    try:
+        result = time_call(lambda: asyncio.run(checker.run_check_all_terminals(db)), repeat=1, warmup=0)
+    finally:
+        httpx.AsyncClient = real_client
+        checker.JITTER_MS = original_jitter
+        db.close()
+        engine.dispose()
+        db_copy.unlink()
+    return result
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    """Print a comparison table; return names whose median regressed beyond tolerance"""
+    regressions = []
+    print(f"{'benchmark':34} {'baseline':>10} {'current':>10} {'change':>8} {'queries':>9}")
+    for name, current in results.items():
+        base = baseline.get(name)
+        if not base:
+            print(f"{name:34} {'-':>10} {current['median_ms']:>9.1f}ms {'new':>8} {current['queries']:>9}")
+            continue
+        change = (current["median_ms"] - base["median_ms"]) / base["median_ms"] if base["median_ms"] else 0
+        flag = ""
+        if change > tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        queries = f"{base['queries']}->{current['queries']}"
+        print(f"{name:34} {base['median_ms']:>9.1f}ms {current['median_ms']:>9.1f}ms {change:>+7.0%} {queries:>9}{flag}")
+    return regressions
+
+
+def run_suite(data_dir: str, repeat: int = 5, skip_check_run: bool = False) -> Dict:
+    """Run every benchmark against data_dir and return the results document"""
+    data_dir = Path(data_dir)
+    meta = json.loads((data_dir / META_FILE).read_text(encoding="utf-8"))
+    client = _setup_app(data_dir)
+    results = benchmark_endpoints(client, meta, repeat)
+    if not skip_check_run:
+        logger.info("Benchmarking check_run (mocked SpinPOS)")
+        results["check_run"] = benchmark_check_run(data_dir, data_dir)
+    return {
+        "created_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "dataset": meta,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark endpoints and a mocked check run")
+    parser.add_argument("--data", default="bench_data", help="Dataset directory from bench.dataset")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", help="Compare against this baseline JSON")
+    parser.add_argument("--save-baseline", help="Write results to this baseline JSON")
+    parser.add_argument("--output", help="Write results JSON here")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--skip-check-run", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    document = run_suite(args.data, args.repeat, args.skip_check_run)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            Path(path).write_text(json.dumps(document, indent=2), encoding="utf-8")
+
+    regressions: Optional[List[str]] = None
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        if baseline.get("dataset", {}).get("status_checks") != document["dataset"]["status_checks"]:
+            print("Warning: baseline was recorded on a different dataset")
+        regressions = compare(document["results"], baseline["results"], args.tolerance)
+    else:
+        print(json.dumps(document["results"], indent=2))
+
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) regressed more than {args.tolerance:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Shared fixtures for endpoint tests
+"""
+from types import SimpleNamespace
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    """
+    TestClient for the app backed by a temporary SQLite file and TPN file.
+    GET routes read through a query_only engine, as in the app.
+    Yields a namespace with client, Session (sessionmaker) and tpn_file.
+    """
+    from fastapi.testclient import TestClient
+    import app.main as main
+    from app.db import Base, get_db, get_read_db, _set_read_pragmas
+
+    test_engine = create_engine(
+        f"sqlite:///{tmp_path / 'test.db'}",
+        connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(bind=test_engine)
+    TestSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=test_engine)
+
+    test_read_engine = create_engine(
+        f"sqlite:///{tmp_path / 'test.db'}",
+        connect_args={"check_same_thread": False}
+    )
+    event.listen(test_read_engine, "connect", _set_read_pragmas)
+    TestReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=test_read_engine)
+
+    def override_get_db():
+        db = TestSessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def override_get_read_db():
+        db = TestReadSessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    tpn_file = tmp_path / "tpns.txt"
+    tpn_file.write_text("", encoding="utf-8")
+    monkeypatch.setattr(main, "TPN_FILE_PATH", str(tpn_file))
+    main.app.dependency_overrides[get_db] = override_get_db
+    main.app.dependency_overrides[get_read_db] = override_get_read_db
+    try:
+        yield SimpleNamespace(client=TestClient(main.app), Session=TestSessionLocal, tpn_file=tpn_file)
+    finally:
+        main.app.dependency_overrides.clear()
+        test_engine.dispose()
+        test_read_engine.dispose()
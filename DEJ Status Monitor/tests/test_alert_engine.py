@@ -0,0 +1,117 @@
+"""
+Tests for the threshold alert engine
+"""
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db import Base
+from app.models import AlertEvent, AlertState, EmailNotification, OutboundEmail, Terminal, TerminalState, User, UserMerchant
+from app.services import alert_engine
+from app.services.alert_engine import evaluate_alerts, queue_alert_digests
+
+NOW = datetime(2025, 1, 1, 15, 0)
+
+
+@pytest.fixture
+def db():
+    """Two merchants with two terminals each, one admin and one merchant-scoped user"""
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    for i, tpn in enumerate(["1000AAA1", "1000AAA2", "2000BBB1", "2000BBB2"], start=1):
+        session.add(Terminal(id=i, tpn=tpn))
+        session.add(TerminalState(
+            terminal_id=i, status="ONLINE", checked_at=NOW, status_since=NOW, last_online_at=NOW
+        ))
+    session.add(User(id=1, email="admin@example.com", hashed_password="x", is_active=True, is_admin=True))
+    session.add(User(id=2, email="merchant@example.com", hashed_password="x", is_active=True))
+    session.add(UserMerchant(user_id=2, merchant_code="2000"))
+    session.add(EmailNotification(id=1, user_id=1, metric_type="merchant_outage", threshold_value=100))
+    session.add(EmailNotification(id=2, user_id=2, metric_type="offline_count", threshold_value=1))
+    session.commit()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def _set_status(db, terminal_ids, status):
+    for state in db.query(TerminalState).filter(TerminalState.terminal_id.in_(terminal_ids)):
+        state.status = status
+    db.commit()
+
+
+def test_fire_dedupe_and_resolve(db):
+    """A breach fires once, stays quiet while active, and resolves when cleared"""
+    assert evaluate_alerts(db, "run1", now=NOW) == []
+
+    _set_status(db, [1, 2], "OFFLINE")
+    events = evaluate_alerts(db, "run2", now=NOW + timedelta(minutes=10))
+    assert [(e.user_id, e.scope, e.kind) for e in events] == [(1, "1000", "fired")]
+
+    assert evaluate_alerts(db, "run3", now=NOW + timedelta(minutes=20)) == []
+
+    _set_status(db, [2], "ONLINE")
+    events = evaluate_alerts(db, "run4", now=NOW + timedelta(minutes=30))
+    assert [(e.scope, e.kind) for e in events] == [("1000", "resolved")]
+    assert db.query(AlertState).filter(AlertState.is_active == True).count() == 0
+
+
+def test_merchant_scope_limits_user_alerts(db):
+    """Non-admin subscriptions only see their own merchants"""
+    _set_status(db, [1], "OFFLINE")
+    assert evaluate_alerts(db, now=NOW) == []
+
+    _set_status(db, [3], "OFFLINE")
+    events = evaluate_alerts(db, now=NOW + timedelta(minutes=10))
+    assert [(e.user_id, e.scope, e.value) for e in events] == [(2, "all", 1)]
+
+
+def test_still_firing_renotifies_after_interval(db, monkeypatch):
+    """An alert still active after ALERT_RENOTIFY_HOURS is sent again"""
+    monkeypatch.setattr(alert_engine, "ALERT_RENOTIFY_HOURS", 1)
+    _set_status(db, [3], "OFFLINE")
+    assert len(evaluate_alerts(db, now=NOW)) == 1
+    assert evaluate_alerts(db, now=NOW + timedelta(minutes=30)) == []
+    assert len(evaluate_alerts(db, now=NOW + timedelta(hours=2))) == 1
+
+
+def test_active_tpns_exclude_removed_terminals(db):
+    """Terminals no longer in the TPN file do not count"""
+    _set_status(db, [3], "OFFLINE")
+    assert evaluate_alerts(db, active_tpns={"2000BBB2"}, now=NOW) == []
+
+
+def test_digest_is_one_email_per_user(db, monkeypatch):
+    """All unsent events for a user go into one queued email and are marked sent"""
+    monkeypatch.setattr("app.services.merchant_loader.load_merchant_mapping", lambda: {})
+    _set_status(db, [1, 2, 3, 4], "OFFLINE")
+    events = evaluate_alerts(db, now=NOW)
+    assert len(events) == 3  # Two merchant outages for the admin, one offline_count for the user
+
+    assert queue_alert_digests(db, now=NOW) == 2
+    queued = db.query(OutboundEmail).order_by(OutboundEmail.to_emails).all()
+    assert [m.to_emails for m in queued] == ['["admin@example.com"]', '["merchant@example.com"]']
+    assert queued[0].subject == "Terminal Status Alerts: 2 firing, 0 resolved"
+    assert db.query(AlertEvent).filter(AlertEvent.sent_at.is_(None)).count() == 0
+
+    assert queue_alert_digests(db, now=NOW) == 0
+
+
+def test_deleted_user_does_not_break_digests(db, monkeypatch):
+    """Events left by a deleted user are dropped; delete_user_alerts clears a user's rows"""
+    monkeypatch.setattr("app.services.merchant_loader.load_merchant_mapping", lambda: {})
+    _set_status(db, [1, 2, 3, 4], "OFFLINE")
+    evaluate_alerts(db, now=NOW)
+    db.query(User).filter(User.id == 2).delete()  # Deleted without cleaning up its alert rows
+    db.commit()
+
+    assert queue_alert_digests(db, now=NOW) == 1
+    assert db.query(AlertEvent).filter(AlertEvent.user_id == 2).count() == 0
+
+    alert_engine.delete_user_alerts(db, 1)
+    db.commit()
+    assert db.query(AlertEvent).count() == 0
+    assert db.query(AlertState).filter(AlertState.notification_id == 1).count() == 0
+    assert db.query(AlertState).filter(AlertState.notification_id == 2).count() > 0
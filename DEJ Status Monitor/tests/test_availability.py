@@ -0,0 +1,96 @@
+"""
+Tests for time-weighted availability, MTTR and MTBF
+"""
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db import Base
+from app.models import AvailabilityDaily, StatusCheck, Terminal, TerminalAvailability
+from app.services.availability import availability_by_key, availability_summary, update_availability, uptime_percentage
+
+T0 = datetime(2024, 3, 5, 0, 0)
+DAY = (T0, T0 + timedelta(days=1))
+
+
+@pytest.fixture
+def db():
+    """In-memory database with two terminals at one merchant"""
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([Terminal(tpn="1000AAA111"), Terminal(tpn="1000AAA222")])
+    session.commit()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def _checks(db, tpn, statuses):
+    """Add (hours after T0, status) checks for one terminal"""
+    terminal = db.query(Terminal).filter(Terminal.tpn == tpn).one()
+    for hours, status in statuses:
+        db.add(StatusCheck(terminal_id=terminal.id, status=status, checked_at=T0 + timedelta(hours=hours)))
+    db.commit()
+
+
+def test_time_weighted_not_check_weighted(db):
+    """A long online stretch outweighs several quick offline checks"""
+    _checks(db, "1000AAA111", [(0, "ONLINE"), (10, "OFFLINE"), (11, "OFFLINE"), (12, "ONLINE")])
+    assert update_availability(db) == 4
+
+    summary = availability_summary(db, *DAY, "terminal", "1000AAA111")
+    assert summary["up_seconds"] == 10 * 3600
+    assert summary["down_seconds"] == 2 * 3600
+    assert summary["outages"] == 1
+    assert summary["mttr_seconds"] == 2 * 3600
+    assert summary["mtbf_seconds"] == 10 * 3600
+    cursor = db.query(TerminalAvailability).one()
+    assert round(uptime_percentage(cursor), 2) == 83.33
+    assert (cursor.checks, cursor.online_checks) == (4, 2)
+    # Only the check after the first ONLINE found the terminal up
+    assert db.query(AvailabilityDaily).filter(AvailabilityDaily.scope == "terminal").one().up_checks == 1
+
+
+def test_incremental_updates_match_single_pass(db):
+    """Applying checks run by run gives the same totals; re-running is a no-op"""
+    _checks(db, "1000AAA111", [(0, "ONLINE"), (6, "OFFLINE")])
+    update_availability(db)
+    _checks(db, "1000AAA111", [(9, "ONLINE"), (15, "ONLINE")])
+    assert update_availability(db) == 2
+    assert update_availability(db) == 0
+
+    summary = availability_summary(db, *DAY, "terminal", "1000AAA111")
+    assert (summary["up_seconds"], summary["down_seconds"]) == (12 * 3600, 3 * 3600)
+    assert summary["recoveries"] == 1
+
+
+def test_errors_and_long_gaps_are_unobserved(db):
+    """ERROR checks neither count as downtime nor break an outage; gaps over the limit are skipped"""
+    _checks(db, "1000AAA111", [(0, "ONLINE"), (1, "ERROR"), (2, "ONLINE"), (40, "ONLINE")])
+    update_availability(db)
+    summary = availability_summary(db, T0, T0 + timedelta(days=3), "terminal", "1000AAA111")
+    assert summary["up_seconds"] == 3600
+    assert summary["down_seconds"] == 0
+    assert summary["outages"] == 0
+    assert sum(row.up_checks for row in db.query(AvailabilityDaily).filter(AvailabilityDaily.scope == "terminal")) == 2
+
+
+def test_days_split_and_merchant_rollup(db):
+    """Intervals crossing midnight are split; merchant rows sum their terminals"""
+    _checks(db, "1000AAA111", [(20, "ONLINE"), (28, "ONLINE")])
+    _checks(db, "1000AAA222", [(20, "OFFLINE"), (22, "OFFLINE")])
+    update_availability(db)
+
+    assert availability_summary(db, *DAY, "terminal", "1000AAA111")["up_seconds"] == 4 * 3600
+    merchant = availability_summary(db, T0, T0 + timedelta(days=2), "merchant", "1000")
+    assert (merchant["up_seconds"], merchant["down_seconds"]) == (8 * 3600, 2 * 3600)
+    assert merchant["availability_percentage"] == 80
+    assert availability_summary(db, T0, T0 + timedelta(days=2))["observed_seconds"] == 10 * 3600
+    assert set(availability_by_key(db, T0, T0 + timedelta(days=2), "terminal", prefix="1000")) == {"1000AAA111", "1000AAA222"}
+
+
+def test_availability_api_requires_login(api):
+    """The availability endpoint is not public"""
+    assert api.client.get("/api/availability").status_code == 401
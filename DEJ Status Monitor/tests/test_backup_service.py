@@ -0,0 +1,61 @@
+"""
+Tests for database backup and restore
+"""
+import sqlite3
+from app.services import backup_service
+
+
+def _make_db(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS terminals (tpn TEXT)")
+    conn.execute("DELETE FROM terminals")
+    conn.executemany("INSERT INTO terminals VALUES (?)", [(r,) for r in rows])
+    conn.commit()
+    conn.close()
+
+
+def test_backup_is_compressed_and_restorable(tmp_path, monkeypatch):
+    """Backups are gzip-compressed and restore back to the original contents"""
+    monkeypatch.setenv("BACKUP_DIR", str(tmp_path / "backups"))
+    db_path = str(tmp_path / "status_monitor.db")
+    _make_db(db_path, ["TPN001", "TPN002"])
+
+    backup_path = backup_service.create_backup(db_path)
+
+    assert backup_path.endswith(".db.gz")
+    assert backup_service.get_latest_backup() == backup_path
+    assert backup_service.last_backup_stats["raw_bytes"] > 0
+    assert list((tmp_path / "backups").iterdir()) == [tmp_path / "backups" / backup_path.split("/")[-1]]
+
+    _make_db(db_path, ["CHANGED"])
+    assert backup_service.restore_backup(backup_path, db_path)
+
+    conn = sqlite3.connect(db_path)
+    assert [r[0] for r in conn.execute("SELECT tpn FROM terminals ORDER BY tpn")] == ["TPN001", "TPN002"]
+    conn.close()
+
+
+def test_failed_compression_leaves_no_backup(tmp_path, monkeypatch):
+    """A backup that fails while compressing leaves neither a truncated backup nor temp files"""
+    monkeypatch.setenv("BACKUP_DIR", str(tmp_path / "backups"))
+    db_path = str(tmp_path / "status_monitor.db")
+    _make_db(db_path, ["TPN001"])
+
+    def _fail_midway(src, dst, length=0):
+        dst.write(src.read(100))
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(backup_service.shutil, "copyfileobj", _fail_midway)
+    assert backup_service.create_backup(db_path) is None
+    assert list((tmp_path / "backups").iterdir()) == []
+    assert backup_service.get_latest_backup() is None
+
+
+def test_restore_rejects_corrupt_backup(tmp_path):
+    """A backup that fails integrity checks is not restored"""
+    db_path = str(tmp_path / "status_monitor.db")
+    _make_db(db_path, ["TPN001"])
+    bad_backup = tmp_path / "status_monitor_20250101_000000.db"
+    bad_backup.write_bytes(b"not a database")
+
+    assert backup_service.restore_backup(str(bad_backup), db_path) is False
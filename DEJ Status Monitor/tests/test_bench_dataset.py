@@ -0,0 +1,29 @@
+"""
+Tests for the synthetic benchmark dataset generator
+"""
+import json
+import sqlite3
+from bench.dataset import generate_dataset, parse_status_mix
+
+
+def test_status_mix_is_normalized():
+    """Weights are normalized and unknown statuses rejected"""
+    assert parse_status_mix("ONLINE=3,OFFLINE=1") == {"ONLINE": 0.75, "OFFLINE": 0.25}
+
+
+def test_generate_dataset_writes_matching_files(tmp_path):
+    """Terminals, checks, TPN file and merchant mapping line up"""
+    meta = generate_dataset(str(tmp_path), terminals=40, merchants=4, days=3, dead_fraction=0.25)
+
+    conn = sqlite3.connect(tmp_path / "status_monitor.db")
+    assert conn.execute("SELECT COUNT(*) FROM terminals").fetchone()[0] == 40
+    assert conn.execute("SELECT COUNT(*) FROM status_checks").fetchone()[0] == meta["status_checks"] == 40 * meta["check_slots"]
+    always_offline = conn.execute(
+        "SELECT COUNT(*) FROM (SELECT terminal_id FROM status_checks GROUP BY terminal_id "
+        "HAVING SUM(status != 'OFFLINE') = 0)"
+    ).fetchone()[0]
+    conn.close()
+
+    assert always_offline >= 10
+    assert len((tmp_path / "tpns.txt").read_text().split()) == 40
+    assert len(json.loads((tmp_path / "merchant_mapping.json").read_text())) == 4
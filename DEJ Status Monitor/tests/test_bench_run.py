@@ -0,0 +1,24 @@
+"""
+Smoke test for the endpoint benchmark runner
+"""
+import app.main as main
+from app.services import merchant_loader, terminal_info_cache
+from bench.dataset import generate_dataset
+from bench.run import run_suite
+
+
+def test_run_suite_serves_every_endpoint_from_dataset(tmp_path, monkeypatch):
+    """Every benchmarked GET (read engine included) answers 200 against the dataset DB"""
+    # run_suite points the app at the dataset; put everything back afterwards
+    monkeypatch.setattr(main, "TPN_FILE_PATH", main.TPN_FILE_PATH)
+    monkeypatch.setattr(merchant_loader, "MERCHANT_MAPPING_FILE", merchant_loader.MERCHANT_MAPPING_FILE)
+    monkeypatch.setattr(terminal_info_cache, "get_terminal_info", terminal_info_cache.get_terminal_info)
+    monkeypatch.chdir(tmp_path)  # An empty status_monitor.db here would shadow a missing override
+    generate_dataset(str(tmp_path / "data"), terminals=20, merchants=2, days=2)
+    try:
+        document = run_suite(str(tmp_path / "data"), repeat=1, skip_check_run=True)
+    finally:
+        main.app.dependency_overrides.clear()
+        merchant_loader.load_merchant_mapping(force_reload=True)
+
+    assert {"api_terminals", "api_merchant", "api_search", "page_terminal"} <= set(document["results"])
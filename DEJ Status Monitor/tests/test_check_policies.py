@@ -0,0 +1,108 @@
+"""
+Tests for per-merchant check policies
+"""
+import pytest
+import pytz
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db import Base
+from app.models import CheckPolicy, Terminal, TerminalState
+from app.services import check_policies
+from app.services.check_policies import effective_policy, is_active, paused_tpns, plan_run
+
+EASTERN = pytz.timezone("America/New_York")
+# Tuesday 2024-03-05 10:00 in New York
+NOW = datetime(2024, 3, 5, 15, 0)
+
+
+@pytest.fixture
+def db():
+    """In-memory database"""
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def _terminal(db, tpn, status=None, checked_ago=None, online_ago=None):
+    terminal = Terminal(tpn=tpn)
+    db.add(terminal)
+    db.flush()
+    if status:
+        db.add(TerminalState(
+            terminal_id=terminal.id, status=status, checked_at=NOW - checked_ago,
+            status_since=NOW - (online_ago or checked_ago),
+            last_online_at=NOW - online_ago if online_ago else None
+        ))
+    db.commit()
+
+
+def _policy(**fields):
+    return {field: fields.get(field) for field in check_policies.POLICY_FIELDS}
+
+
+def test_terminal_policy_overrides_merchant_field_by_field():
+    """Unset terminal fields inherit the merchant's"""
+    merchant = CheckPolicy(scope="merchant", key="1000", tier="daily", paused=True, timezone="America/Chicago")
+    terminal = CheckPolicy(scope="terminal", key="1000AAA111", paused=False)
+    policy = effective_policy(merchant, terminal)
+    assert (policy["tier"], policy["paused"], policy["timezone"]) == ("daily", False, "America/Chicago")
+    assert effective_policy(None, None) == _policy()
+
+
+def test_active_hours_and_days():
+    """Hours are local to the policy time zone; windows past midnight belong to the day they start"""
+    office = _policy(active_start="09:00", active_end="17:00", active_days="mon,tue,wed,thu,fri")
+    assert is_active(office, NOW, EASTERN)
+    assert not is_active({**office, "timezone": "America/Los_Angeles"}, NOW, EASTERN)  # 07:00 there
+    assert not is_active(office, datetime(2024, 3, 9, 15, 0), EASTERN)  # Saturday
+
+    late = _policy(active_start="18:00", active_end="02:00", active_days="fri")
+    assert is_active(late, datetime(2024, 3, 9, 6, 0), EASTERN)  # Saturday 01:00 = Friday night
+    assert not is_active(late, datetime(2024, 3, 9, 8, 0), EASTERN)  # Saturday 03:00
+    assert not is_active(late, datetime(2024, 3, 5, 6, 0), EASTERN)  # Tuesday 01:00 = Monday night
+
+
+def test_plan_run_skips_by_policy(db):
+    """Paused, out-of-hours, recently checked lower tiers and dormant terminals are skipped"""
+    db.add_all([
+        CheckPolicy(scope="merchant", key="1000", timezone="America/New_York", active_start="09:00", active_end="17:00"),
+        CheckPolicy(scope="terminal", key="1000AAA222", paused=True),
+        CheckPolicy(scope="merchant", key="2000", active_start="18:00", active_end="02:00"),
+        CheckPolicy(scope="merchant", key="3000", tier="daily"),
+    ])
+    _terminal(db, "1000AAA111", "ONLINE", timedelta(hours=3))
+    _terminal(db, "1000AAA222", "ONLINE", timedelta(hours=3))
+    _terminal(db, "2000BBB333", "ONLINE", timedelta(hours=3))
+    _terminal(db, "3000CCC444", "ONLINE", timedelta(hours=4))
+    _terminal(db, "3000CCC555", "ONLINE", timedelta(days=1))
+    _terminal(db, "4000DDD666", "OFFLINE", timedelta(hours=3), online_ago=timedelta(days=60))
+    _terminal(db, "4000DDD777", "OFFLINE", timedelta(days=8), online_ago=timedelta(days=60))
+    _terminal(db, "4000DDD888")
+
+    due, counts = plan_run(db, NOW, EASTERN)
+    assert [t.tpn for t in due] == ["1000AAA111", "3000CCC555", "4000DDD777", "4000DDD888"]
+    assert counts == {"due": 4, "paused": 1, "inactive": 1, "tier": 1, "dormant": 1}
+
+
+def test_dormant_fallback_can_be_disabled(db, monkeypatch):
+    """CHECK_POLICY_DORMANT_DAYS=0 keeps long-offline terminals on every run"""
+    _terminal(db, "4000DDD666", "OFFLINE", timedelta(hours=3), online_ago=timedelta(days=60))
+    monkeypatch.setattr(check_policies, "CHECK_POLICY_DORMANT_DAYS", 0)
+    assert plan_run(db, NOW, EASTERN)[1]["due"] == 1
+
+
+def test_paused_tpns_respects_terminal_override(db):
+    """A paused merchant pauses its terminals unless a terminal policy unpauses one"""
+    assert paused_tpns(db) == set()
+    db.add_all([
+        CheckPolicy(scope="merchant", key="1000", paused=True),
+        CheckPolicy(scope="terminal", key="1000AAA222", paused=False),
+    ])
+    for tpn in ("1000AAA111", "1000AAA222", "2000BBB333"):
+        _terminal(db, tpn)
+    assert paused_tpns(db) == {"1000AAA111"}
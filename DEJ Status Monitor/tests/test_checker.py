@@ -0,0 +1,139 @@
+"""
+Tests for checker singleflight coalescing
+"""
+import asyncio
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db import Base
+from app.models import Status, StatusCheck, Terminal
+from app.services import checker
+
+
+@pytest.fixture(autouse=True)
+def clear_singleflight_state():
+    """Reset module-level singleflight state between tests"""
+    checker._inflight_checks.clear()
+    checker._recent_results.clear()
+    yield
+    checker._inflight_checks.clear()
+    checker._recent_results.clear()
+
+
+@pytest.fixture
+def fake_check(monkeypatch):
+    """Replace the upstream check with a slow fake that counts calls"""
+    calls = []
+
+    async def _fake(client, tpn, semaphore):
+        calls.append(tpn)
+        await asyncio.sleep(0.05)
+        return {
+            "status": Status.ONLINE,
+            "raw_response": "Online",
+            "error": None,
+            "http_status": 200,
+            "latency_ms": 50
+        }
+
+    monkeypatch.setattr(checker, "check_single_terminal", _fake)
+    return calls
+
+
+def test_concurrent_callers_share_one_request(fake_check):
+    """Concurrent checks for the same TPN make a single upstream call"""
+    async def _run():
+        semaphore = asyncio.Semaphore(5)
+        return await asyncio.gather(*[
+            checker.check_terminal_singleflight(None, "TPN001", semaphore)
+            for _ in range(5)
+        ])
+
+    results = asyncio.run(_run())
+
+    assert fake_check == ["TPN001"]
+    assert sum(1 for _, _, performed in results if performed) == 1
+    assert all(result["status"] == Status.ONLINE for result, _, _ in results)
+    assert not checker._inflight_checks
+
+
+def test_freshness_window_skips_network(fake_check):
+    """A recent result is reused only when the caller opts in"""
+    async def _run():
+        semaphore = asyncio.Semaphore(1)
+        await checker.check_terminal_singleflight(None, "TPN001", semaphore)
+        cached = await checker.check_terminal_singleflight(None, "TPN001", semaphore, max_age_seconds=60)
+        fresh = await checker.check_terminal_singleflight(None, "TPN001", semaphore)
+        return cached, fresh
+
+    cached, fresh = asyncio.run(_run())
+
+    assert cached[2] is False
+    assert fresh[2] is True
+    assert fake_check == ["TPN001", "TPN001"]
+
+
+def test_cancelled_starter_does_not_close_joined_check(monkeypatch):
+    """A run joining a manual check still gets its result when the manual request goes away"""
+    clients = []
+
+    async def _fake(client, tpn, semaphore):
+        await asyncio.sleep(0.05)
+        clients.append(client.is_closed)
+        return {"status": Status.ONLINE, "raw_response": "Online", "error": None, "http_status": 200, "latency_ms": 50}
+
+    monkeypatch.setattr(checker, "check_single_terminal", _fake)
+
+    async def _run():
+        semaphore = asyncio.Semaphore(1)
+        manual = asyncio.create_task(checker.check_terminal_singleflight(None, "TPN001", semaphore))
+        await asyncio.sleep(0.01)
+        joined = asyncio.create_task(checker.check_terminal_singleflight(object(), "TPN001", semaphore))
+        await asyncio.sleep(0.01)
+        manual.cancel()
+        return await joined
+
+    result, _, performed = asyncio.run(_run())
+
+    assert result["status"] == Status.ONLINE and performed is False
+    assert clients == [False]
+
+
+def test_run_does_not_store_joined_results(fake_check):
+    """A run that joins a manual check leaves that result to the manual caller"""
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add_all([Terminal(tpn="TPN001"), Terminal(tpn="TPN002")])
+    db.commit()
+
+    async def _run():
+        manual = asyncio.ensure_future(checker.check_terminal_singleflight(None, "TPN001", asyncio.Semaphore(1)))
+        await asyncio.sleep(0.01)
+        run_id = await checker.run_check_all_terminals(db)
+        return run_id, await manual
+
+    run_id, (_, _, manual_performed) = asyncio.run(_run())
+
+    assert manual_performed is True
+    assert sorted(fake_check) == ["TPN001", "TPN002"]
+    stored = db.query(Terminal.tpn).join(StatusCheck, StatusCheck.terminal_id == Terminal.id).filter(StatusCheck.run_id == run_id)
+    assert [tpn for tpn, in stored] == ["TPN002"]
+    db.close()
+
+
+def test_recent_results_are_evicted(monkeypatch):
+    """Results older than the longest freshness window are dropped"""
+    now = [1000.0]
+    monkeypatch.setattr(checker.time, "monotonic", lambda: now[0])
+    result = {"status": Status.ONLINE}
+    checker._remember_result("TPN001", result)
+    now[0] += 60
+    checker._remember_result("TPN002", result)
+    checker._remember_result("TPN001", result)  # Refreshed: moves behind TPN002
+    now[0] += checker.RECENT_RESULT_MAX_AGE_SECONDS - 30
+    checker._remember_result("TPN003", result)
+    assert list(checker._recent_results) == ["TPN002", "TPN001", "TPN003"]
+    now[0] += 60
+    checker._remember_result("TPN004", result)
+    assert list(checker._recent_results) == ["TPN003", "TPN004"]
@@ -0,0 +1,91 @@
+"""
+Tests for the CPU worker pools
+"""
+import asyncio
+import json
+import threading
+import time
+import pytest
+from app.services import cpu_pool
+from app.services.steam_soap import DIFFGR_NS, SOAP_NS, parse_terminal_info_response
+
+TERMINAL_INFO_RESPONSE = f"""<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="{SOAP_NS}"><soap:Body><TerminalInfoResponse><TerminalInfoResult>
+<diffgr:diffgram xmlns:diffgr="{DIFFGR_NS}"><NewDataSet><Table>
+<ProfileID>42</ProfileID><TPN>1000AAA111</TPN><HardwareName>PAX A920</HardwareName>
+</Table></NewDataSet></diffgr:diffgram>
+</TerminalInfoResult></TerminalInfoResponse></soap:Body></soap:Envelope>"""
+
+
+@pytest.fixture(autouse=True)
+def fresh_pools():
+    """Each test gets its own pools"""
+    cpu_pool.shutdown_pools()
+    yield
+    cpu_pool.shutdown_pools()
+
+
+def test_thread_pool_is_bounded(monkeypatch):
+    """No more than CPU_THREAD_WORKERS calls run at once; results and errors come back"""
+    monkeypatch.setattr(cpu_pool, "CPU_THREAD_WORKERS", 2)
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def work(value):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        if value < 0:
+            raise ValueError("negative")
+        return value * 2
+
+    async def main():
+        results = await asyncio.gather(*(cpu_pool.run_in_thread(work, i) for i in range(6)))
+        with pytest.raises(ValueError):
+            await cpu_pool.run_in_thread(work, -1)
+        return results
+
+    assert asyncio.run(main()) == [0, 2, 4, 6, 8, 10]
+    assert peak[0] == 2
+
+
+def test_event_loop_keeps_running_during_offloaded_work():
+    """The loop ticks while a worker thread is busy"""
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.005)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        await cpu_pool.run_in_thread(time.sleep, 0.1)
+        task.cancel()
+        return ticks
+
+    assert asyncio.run(main()) >= 5
+
+
+def test_process_pool_parses_and_falls_back(monkeypatch):
+    """SOAP parsing runs in a worker process, or on a thread when processes are disabled"""
+    expected = parse_terminal_info_response(TERMINAL_INFO_RESPONSE)
+    assert expected["ProfileID"] == 42
+    assert asyncio.run(cpu_pool.run_in_process(parse_terminal_info_response, TERMINAL_INFO_RESPONSE)) == expected
+
+    cpu_pool.shutdown_pools()
+    monkeypatch.setattr(cpu_pool, "CPU_PROCESS_WORKERS", 0)
+    assert asyncio.run(cpu_pool.run_in_process(parse_terminal_info_response, TERMINAL_INFO_RESPONSE)) == expected
+    assert cpu_pool._process_pool is None
+
+
+def test_dumps_json_matches_single_pass_encoding():
+    """Sliced encoding of long lists produces the same document"""
+    payload = {"terminals": [{"tpn": f"T{i}", "name": "Café", "uptime": i / 3, "last": None} for i in range(2500)], "n": 1}
+    encoded = asyncio.run(cpu_pool.dumps_json(payload))
+    assert encoded == json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    assert asyncio.run(cpu_pool.dumps_json({"terminals": []})) == b'{"terminals":[]}'
@@ -0,0 +1,161 @@
+"""
+Tests for the outbound email queue
+"""
+import asyncio
+import json
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db import Base
+from app.models import OutboundEmail
+from app.services import email_outbox
+from app.services.email_outbox import enqueue_email, deliver_pending
+from app.services.email_service import EmailService
+
+NOW = datetime(2025, 1, 1, 12, 0)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """In-memory database and a fresh rate-limit window"""
+    monkeypatch.setattr(email_outbox, "_sent_times", email_outbox.deque())
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+class FakeEmailService:
+    """Records batches; fails messages whose subject is in fail_subjects"""
+
+    def __init__(self, fail_subjects=()):
+        self.batches = []
+        self.fail_subjects = set(fail_subjects)
+
+    async def send_batch(self, messages):
+        self.batches.append(messages)
+        return ["boom" if subject in self.fail_subjects else None for _, subject, _ in messages]
+
+    async def aclose(self):
+        pass
+
+
+def _enqueue(db, count, subject="Hello"):
+    for i in range(count):
+        enqueue_email(db, [f"user{i}@example.com"], subject, "<p>hi</p>")
+        db.query(OutboundEmail).filter(OutboundEmail.next_attempt_at > NOW).update({"next_attempt_at": NOW})
+    db.commit()
+
+
+def test_due_messages_are_sent_in_one_batch(db):
+    """Pending rows go out in a single send_batch call and are marked sent"""
+    _enqueue(db, 3)
+    service = FakeEmailService()
+
+    assert asyncio.run(deliver_pending(db, service, now=NOW)) == 3
+    assert len(service.batches) == 1
+    assert [to for to, _, _ in service.batches[0]] == [["user0@example.com"], ["user1@example.com"], ["user2@example.com"]]
+    assert db.query(OutboundEmail).filter(OutboundEmail.status == "sent").count() == 3
+    assert asyncio.run(deliver_pending(db, service, now=NOW)) == 0
+
+
+def test_failures_back_off_then_give_up(db, monkeypatch):
+    """A failing message is retried after a growing delay and marked failed after max attempts"""
+    monkeypatch.setattr(email_outbox, "OUTBOX_MAX_ATTEMPTS", 3)
+    _enqueue(db, 1, subject="Broken")
+    service = FakeEmailService(fail_subjects={"Broken"})
+
+    now = NOW
+    asyncio.run(deliver_pending(db, service, now=now))
+    message = db.query(OutboundEmail).one()
+    assert message.status == "pending"
+    assert message.next_attempt_at == now + email_outbox.retry_delay(1)
+
+    # Not due yet
+    asyncio.run(deliver_pending(db, service, now=now + timedelta(seconds=1)))
+    assert message.attempts == 1
+
+    for _ in range(2):
+        now = message.next_attempt_at
+        asyncio.run(deliver_pending(db, service, now=now))
+    assert message.status == "failed"
+    assert message.attempts == 3
+    assert message.last_error == "boom"
+
+
+def test_rate_limit_caps_messages_per_minute(db, monkeypatch):
+    """No more than OUTBOX_MAX_PER_MINUTE messages are sent in a minute"""
+    monkeypatch.setattr(email_outbox, "OUTBOX_MAX_PER_MINUTE", 2)
+    _enqueue(db, 5)
+    service = FakeEmailService()
+
+    assert asyncio.run(deliver_pending(db, service, now=NOW)) == 2
+    assert asyncio.run(deliver_pending(db, service, now=NOW)) == 0
+    assert db.query(OutboundEmail).filter(OutboundEmail.status == "pending").count() == 3
+
+
+def test_sendgrid_batch_uses_personalizations(monkeypatch):
+    """Messages sharing a body become one SendGrid request with a personalization each"""
+    import httpx
+
+    monkeypatch.setenv("EMAIL_PROVIDER", "sendgrid")
+    monkeypatch.setenv("SENDGRID_API_KEY", "test-key")
+    requests = []
+
+    def handler(request):
+        requests.append(json.loads(request.content))
+        return httpx.Response(202)
+
+    service = EmailService()
+    service._http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    async def _run():
+        try:
+            return await service.send_batch([
+                (["a@example.com"], "Approved", "<p>same</p>"),
+                (["b@example.com"], "Approved", "<p>same</p>"),
+                (["c@example.com"], "Reset", "<p>other</p>"),
+            ])
+        finally:
+            await service.aclose()
+
+    assert asyncio.run(_run()) == [None, None, None]
+    assert len(requests) == 2
+    assert [p["to"] for p in requests[0]["personalizations"]] == [[{"email": "a@example.com"}], [{"email": "b@example.com"}]]
+
+
+def test_enqueue_from_worker_thread_wakes_outbox(tmp_path, monkeypatch):
+    """Post-run stages queue digests off the event loop; the worker still wakes at once"""
+    monkeypatch.setattr(email_outbox, "_sent_times", email_outbox.deque())
+    engine = create_engine(f"sqlite:///{tmp_path / 'outbox.db'}")
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    service = FakeEmailService()
+
+    def _enqueue_in_thread():
+        session = Session()
+        try:
+            enqueue_email(session, ["a@example.com"], "Digest", "<p>hi</p>")
+        finally:
+            session.close()
+
+    async def _run():
+        worker = asyncio.create_task(email_outbox.run_outbox_worker(Session, lambda: service))
+        try:
+            await asyncio.sleep(0.05)  # Idle: waiting out OUTBOX_POLL_SECONDS
+            await asyncio.to_thread(_enqueue_in_thread)
+            for _ in range(100):
+                if service.batches:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            worker.cancel()
+            await asyncio.gather(worker, return_exceptions=True)
+
+    asyncio.run(_run())
+    engine.dispose()
+    assert [[to for to, _, _ in batch] for batch in service.batches] == [[["a@example.com"]]]
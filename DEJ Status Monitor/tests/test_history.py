@@ -0,0 +1,106 @@
+"""
+Tests for time-partitioned status history
+"""
+import os
+import pytest
+from datetime import datetime
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db import Base
+from app.models import HistoryPartition, StatusCheck, Terminal
+from app.services import backup_service, history
+
+NOW = datetime(2024, 4, 10, 12, 0)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """File database (partitions are ATTACHed to it) with HISTORY_DIR in tmp_path"""
+    monkeypatch.setattr(history, "HISTORY_DIR", str(tmp_path / "history"))
+    engine = create_engine(f"sqlite:///{tmp_path / 'status_monitor.db'}")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.add(Terminal(tpn="1000AAA111"))
+    session.commit()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
+
+
+def _add(db, *times, status="ONLINE"):
+    for checked_at in times:
+        db.add(StatusCheck(terminal_id=1, status=status, checked_at=checked_at, run_id="r"))
+    db.commit()
+
+
+def test_archive_moves_closed_months_only(db):
+    """Closed months go to frozen, compressed files; the current month stays hot"""
+    _add(db, datetime(2024, 2, 3), datetime(2024, 2, 20), datetime(2024, 3, 31, 23, 59), datetime(2024, 4, 1))
+    assert history.archive_closed_months(db, NOW) == ["2024-02", "2024-03"]
+    assert history.archive_closed_months(db, NOW) == []
+
+    assert [c.checked_at for c in db.query(StatusCheck)] == [datetime(2024, 4, 1)]
+    february = db.get(HistoryPartition, "2024-02")
+    assert (february.rows, february.file_name) == (2, "status_checks_2024_02.db.gz")
+    path = os.path.join(history.HISTORY_DIR, february.file_name)
+    assert not os.access(path, os.W_OK) or os.geteuid() == 0
+    assert oct(os.stat(path).st_mode & 0o777) == "0o444"
+
+
+def test_reads_merge_hot_and_archived(db):
+    """Newest first across partitions, limit respected, only overlapping months read"""
+    _add(db, datetime(2024, 2, 3), datetime(2024, 3, 5), datetime(2024, 4, 2))
+    _add(db, datetime(2024, 3, 6), status="OFFLINE")
+    history.archive_closed_months(db, NOW)
+
+    march = history.terminal_checks(db, 1, start=datetime(2024, 3, 1), end=datetime(2024, 3, 31))
+    assert [c.checked_at for c in march] == [datetime(2024, 3, 6), datetime(2024, 3, 5)]
+    rows = history.checks_in_range(db, datetime(2024, 3, 6), datetime(2024, 4, 30))
+    assert sorted(row.status for row in rows) == ["OFFLINE", "ONLINE"]
+    # February was never decompressed for these reads
+    assert os.listdir(os.path.join(history.HISTORY_DIR, "cache")) == ["status_checks_2024_03.db"]
+
+    checks = history.terminal_checks(db, 1)
+    assert [c.checked_at for c in checks] == [
+        datetime(2024, 4, 2), datetime(2024, 3, 6), datetime(2024, 3, 5), datetime(2024, 2, 3)
+    ]
+    assert checks[1].status == "OFFLINE" and checks[1].run_id == "r"
+    assert len(history.terminal_checks(db, 1, limit=2)) == 2
+
+
+def test_late_rows_join_existing_partition(db):
+    """Checks written for an already archived month are added to its file"""
+    _add(db, datetime(2024, 2, 3), datetime(2024, 4, 1))
+    history.archive_closed_months(db, NOW)
+    assert len(history.terminal_checks(db, 1)) == 2
+    _add(db, datetime(2024, 2, 4), datetime(2024, 4, 2))
+    assert history.archive_closed_months(db, NOW) == ["2024-02"]
+
+    assert db.get(HistoryPartition, "2024-02").rows == 2
+    assert db.query(StatusCheck).count() == 2
+    assert [c.checked_at for c in history.terminal_checks(db, 1)] == [
+        datetime(2024, 4, 2), datetime(2024, 4, 1), datetime(2024, 2, 4), datetime(2024, 2, 3)
+    ]
+
+
+def test_newest_check_stays_hot(db):
+    """Ids are never reused: the newest check is not archived even from a closed month"""
+    _add(db, datetime(2024, 2, 3), datetime(2024, 3, 30))
+    assert history.archive_closed_months(db, NOW) == ["2024-02"]
+    assert [c.id for c in db.query(StatusCheck)] == [2]
+    _add(db, datetime(2024, 4, 1))
+    assert db.query(StatusCheck.id).order_by(StatusCheck.id.desc()).first()[0] == 3
+
+
+def test_backup_copies_new_partitions_once(db, tmp_path, monkeypatch):
+    """Nightly backups copy each frozen month once and skip the query cache"""
+    monkeypatch.setenv("BACKUP_DIR", str(tmp_path / "backups"))
+    _add(db, datetime(2024, 2, 3), datetime(2024, 4, 1))
+    history.archive_closed_months(db, NOW)
+    history.terminal_checks(db, 1)  # Fills the cache
+
+    assert backup_service.backup_history_partitions(history.HISTORY_DIR) == 1
+    assert backup_service.backup_history_partitions(history.HISTORY_DIR) == 0
+    assert os.listdir(tmp_path / "backups" / "history") == ["status_checks_2024_02.db.gz"]
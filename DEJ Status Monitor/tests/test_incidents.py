@@ -0,0 +1,146 @@
+"""
+Tests for correlated merchant-wide outage detection
+"""
+import json
+import pytest
+import pytz
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db import Base
+from app.models import AvailabilityDaily, OutageIncident, StatusCheck, Terminal
+from app.services.availability import update_availability
+from app.services.incidents import list_incidents, poisson_tail, process_incidents
+from app.services.transitions import record_transitions
+
+MERCHANT_A = [f"1000AA{i:04d}" for i in range(20)]
+MERCHANT_B = [f"2000BB{i:04d}" for i in range(20)]
+MERCHANT_C = [f"3000CC{i:04d}" for i in range(10)]
+T0 = datetime(2024, 3, 1, 12, 0)
+EASTERN = pytz.timezone("America/New_York")
+
+
+@pytest.fixture
+def db():
+    """Two merchants with three days of hourly all-ONLINE runs (one stray drop per day)"""
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([Terminal(tpn=tpn) for tpn in MERCHANT_A + MERCHANT_B])
+    session.commit()
+    for hour in range(3 * 24):
+        statuses = {tpn: "ONLINE" for tpn in MERCHANT_A + MERCHANT_B}
+        if hour % 24 == 5:
+            statuses[MERCHANT_B[hour % 20]] = "OFFLINE"
+        _run(session, f"h{hour}", T0 + timedelta(hours=hour), statuses)
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def _run(db, run_id, checked_at, statuses):
+    """Store one run's checks and transitions, then update availability"""
+    ids = {t.tpn: t.id for t in db.query(Terminal)}
+    for tpn, status in statuses.items():
+        db.add(StatusCheck(terminal_id=ids[tpn], status=status, checked_at=checked_at, run_id=run_id))
+    record_transitions(db, [(ids[tpn], status, checked_at, run_id) for tpn, status in statuses.items()])
+    db.commit()
+    update_availability(db)
+
+
+def _baseline_then_drops(db, baseline_day, failures, up_checks, run_at, drops, timezone=pytz.UTC):
+    """Merchant C: one baseline day row, a run a minute before run_at, then `drops` of its terminals down"""
+    db.add_all([Terminal(tpn=tpn) for tpn in MERCHANT_C])
+    db.add(AvailabilityDaily(
+        scope="merchant", scope_key="3000", day_start=baseline_day,
+        up_seconds=up_checks * 3600, failures=failures, up_checks=up_checks
+    ))
+    db.commit()
+    ids = {t.tpn: t.id for t in db.query(Terminal)}
+    for run_id, checked_at, down in (("prev", run_at - timedelta(minutes=1), 0), ("now", run_at, drops)):
+        statuses = {tpn: "OFFLINE" if i < down else "ONLINE" for i, tpn in enumerate(MERCHANT_C)}
+        for tpn, status in statuses.items():
+            db.add(StatusCheck(terminal_id=ids[tpn], status=status, checked_at=checked_at, run_id=run_id))
+        record_transitions(db, [(ids[tpn], status, checked_at, run_id) for tpn, status in statuses.items()])
+        db.commit()
+    return process_incidents(db, "now", timezone=timezone)
+
+
+def test_poisson_tail():
+    """Upper tail matches a hand-computed value and is 1 when k is not above the mean"""
+    assert poisson_tail(0, 0.5) == 1.0
+    assert abs(poisson_tail(2, 0.5) - (1 - 1.5 * 2.718281828459045 ** -0.5)) < 1e-12
+    assert poisson_tail(3, 5) == 1.0
+
+
+def test_simultaneous_drop_opens_one_incident(db):
+    """Many terminals of one merchant dropping together is an incident; a single drop is not"""
+    run_at = T0 + timedelta(days=3)
+    statuses = {tpn: "ONLINE" for tpn in MERCHANT_A + MERCHANT_B}
+    statuses.update({tpn: "OFFLINE" for tpn in MERCHANT_A[:8]})
+    statuses[MERCHANT_B[0]] = "DISCONNECT"
+    _run(db, "outage", run_at, statuses)
+
+    incidents = process_incidents(db, "outage")
+    assert len(incidents) == 1
+    incident = incidents[0]
+    assert incident.merchant_code == "1000"
+    assert incident.terminal_count == 20
+    assert json.loads(incident.affected_tpns) == MERCHANT_A[:8]
+    assert incident.expected_drops < 1
+    assert incident.resolved_at is None
+
+
+def test_exposure_counts_only_terminals_the_run_checked(db):
+    """Terminals a planned run skipped are not counted as exposed to it"""
+    run_at = T0 + timedelta(days=3)
+    statuses = {tpn: "ONLINE" for tpn in MERCHANT_A[:10]}
+    statuses.update({tpn: "OFFLINE" for tpn in MERCHANT_A[:6]})
+    _run(db, "planned", run_at, statuses)
+
+    incident = process_incidents(db, "planned")[0]
+    assert (incident.terminal_count, incident.affected_count) == (10, 6)
+
+
+def test_baseline_is_per_check_not_per_second(db):
+    """Drops at a flaky merchant's usual rate are not an incident, however soon after the last run"""
+    run_at = datetime(2024, 11, 10, 17, 0)
+    # One drop per 20 up-checks: 10 checks expect 0.5 drops, so 3 is not unusual
+    assert _baseline_then_drops(db, datetime(2024, 11, 9), 50, 1000, run_at, drops=3) == []
+
+
+def test_baseline_ends_at_local_midnight_across_dst(db):
+    """On a DST change day the baseline still ends at local midnight, so today's rows stay out"""
+    run_at = datetime(2024, 11, 3, 17, 0)  # 12:00 EST; midnight was still EDT (04:00 UTC)
+    incidents = _baseline_then_drops(db, datetime(2024, 11, 3, 4, 0), 1000, 1000, run_at, drops=3, timezone=EASTERN)
+    assert [incident.merchant_code for incident in incidents] == ["3000"]
+
+
+def test_incident_extends_then_resolves(db):
+    """Later drops join the open incident; it resolves once most terminals are back"""
+    run_at = T0 + timedelta(days=3)
+    statuses = {tpn: "ONLINE" for tpn in MERCHANT_A + MERCHANT_B}
+    statuses.update({tpn: "OFFLINE" for tpn in MERCHANT_A[:5]})
+    _run(db, "outage", run_at, statuses)
+    process_incidents(db, "outage")
+
+    statuses.update({tpn: "OFFLINE" for tpn in MERCHANT_A[5:7]})
+    _run(db, "spread", run_at + timedelta(hours=1), statuses)
+    process_incidents(db, "spread")
+    incident = db.query(OutageIncident).one()
+    assert incident.affected_count == 7
+
+    statuses.update({tpn: "ONLINE" for tpn in MERCHANT_A[:6]})
+    _run(db, "recovered", run_at + timedelta(hours=2), statuses)
+    process_incidents(db, "recovered")
+    db.refresh(incident)
+    assert incident.resolved_at == run_at + timedelta(hours=2)
+    assert list_incidents(db, run_at, open_only=True) == []
+    assert [i.id for i in list_incidents(db, run_at, ["1000"])] == [incident.id]
+    assert list_incidents(db, run_at, ["2000"]) == []
+
+
+def test_incidents_api_requires_login(api):
+    """The incidents endpoint is not public"""
+    assert api.client.get("/api/incidents").status_code == 401
@@ -0,0 +1,112 @@
+"""
+Tests for latency sketches
+"""
+import random
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db import Base
+from app.models import LatencySketch, StatusCheck, Terminal
+from app.services.latency_sketch import (
+    DDSketch, backfill_latency_sketches, latency_summary, merchant_latency,
+    record_run_latency, slowest_terminals
+)
+
+RUN_AT = datetime(2024, 3, 5, 15, 0)
+
+
+@pytest.fixture
+def db():
+    """In-memory database with terminals at two merchants"""
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([Terminal(tpn=tpn) for tpn in ("1000AAA111", "1000AAA222", "2000BBB333")])
+    session.commit()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def _add_run(db, run_id, checked_at, latencies):
+    ids = {t.tpn: t.id for t in db.query(Terminal)}
+    for tpn, latency_ms in latencies.items():
+        db.add(StatusCheck(
+            terminal_id=ids[tpn], status="ONLINE", http_status=200 if latency_ms is not None else None,
+            latency_ms=latency_ms, checked_at=checked_at, run_id=run_id
+        ))
+    db.commit()
+
+
+def test_sketch_quantiles_within_relative_accuracy():
+    """Quantiles stay within 1% of the exact value, also after merging"""
+    rng = random.Random(7)
+    values = [rng.lognormvariate(5, 1) for _ in range(20000)]
+    left, right = DDSketch(), DDSketch()
+    for i, value in enumerate(values):
+        (left if i % 2 else right).add(value)
+    left.merge(DDSketch.from_json(right.to_json()))
+
+    values.sort()
+    assert left.count == len(values)
+    for q in (0.5, 0.95, 0.99):
+        exact = values[int(q * (len(values) - 1))]
+        assert abs(left.quantile(q) - exact) <= exact * 0.011
+
+
+def test_record_run_is_idempotent_and_merges_terminal_days(db):
+    """Per-run rows for all/merchant; one row per terminal per day; unanswered checks are skipped"""
+    _add_run(db, "r1", RUN_AT, {"1000AAA111": 100, "1000AAA222": 300, "2000BBB333": None})
+    assert record_run_latency(db, "r1") == 2
+    assert record_run_latency(db, "r1") == 0
+    _add_run(db, "r2", RUN_AT + timedelta(hours=2), {"1000AAA111": 200})
+    record_run_latency(db, "r2")
+
+    scopes = [(row.scope, row.scope_key) for row in db.query(LatencySketch).order_by(LatencySketch.id)]
+    assert scopes.count(("all", "")) == 2
+    assert scopes.count(("merchant", "1000")) == 2
+    assert scopes.count(("terminal", "1000AAA111")) == 1
+    assert ("merchant", "2000") not in scopes
+
+    day = (RUN_AT.replace(hour=0), RUN_AT.replace(hour=0) + timedelta(days=1))
+    terminal = latency_summary(db, *day, scope="terminal", key="1000AAA111")
+    assert terminal["count"] == 2
+    assert terminal["mean_ms"] == 150
+    overall = latency_summary(db, *day)
+    assert overall["count"] == 3
+    assert abs(overall["p50_ms"] - 200) <= 2
+    assert merchant_latency(db, *day)["1000"]["count"] == 3
+
+
+def test_slowest_terminals_scoped_and_ranked(db):
+    """Highest p95 first; merchant scope, active TPNs and min_count are honoured"""
+    for i in range(3):
+        _add_run(db, f"r{i}", RUN_AT + timedelta(hours=i), {"1000AAA111": 100 + i, "1000AAA222": 900 + i, "2000BBB333": 500})
+        record_run_latency(db, f"r{i}")
+    start, end = RUN_AT - timedelta(days=1), RUN_AT + timedelta(days=1)
+
+    assert [t["tpn"] for t in slowest_terminals(db, start, end)] == ["1000AAA222", "2000BBB333", "1000AAA111"]
+    assert [t["tpn"] for t in slowest_terminals(db, start, end, merchant_codes=["2000"])] == ["2000BBB333"]
+    assert slowest_terminals(db, start, end, merchant_codes=[]) == []
+    assert [t["tpn"] for t in slowest_terminals(db, start, end, limit=1, active_tpns={"1000AAA111"})] == ["1000AAA111"]
+    assert slowest_terminals(db, start, end, min_count=4) == []
+
+
+def test_backfill_sketches_stored_runs(db):
+    """Runs stored before sketches existed are backfilled once"""
+    _add_run(db, "old1", RUN_AT, {"1000AAA111": 120})
+    _add_run(db, "old2", RUN_AT + timedelta(hours=1), {"1000AAA111": 80, "2000BBB333": 40})
+    assert backfill_latency_sketches(db) == 2
+    assert backfill_latency_sketches(db) == 0
+    assert record_run_latency(db, "old2") == 0
+    summary = latency_summary(db, RUN_AT.replace(hour=0), RUN_AT.replace(hour=0) + timedelta(days=1), "terminal", "1000AAA111")
+    assert summary["count"] == 2
+    assert summary["max_ms"] == 120
+
+
+def test_latency_api_requires_login(api):
+    """Latency endpoints are not public"""
+    assert api.client.get("/api/latency").status_code == 401
+    assert api.client.get("/api/latency/slowest").status_code == 401
@@ -0,0 +1,46 @@
+"""
+Tests for the logging pipeline
+"""
+import json
+import logging
+from app.logging_config import SamplingFilter, JsonFormatter, parse_sample_rates
+
+
+def _record(name, level=logging.INFO, msg="hello"):
+    return logging.LogRecord(name, level, __file__, 1, msg, None, None)
+
+
+def test_sampling_keeps_fraction_of_chatty_logger():
+    """Sampled loggers (and children) keep ~rate of INFO records; others pass"""
+    sampler = SamplingFilter({"app.chatty": 0.25})
+
+    kept = sum(sampler.filter(_record("app.chatty.child")) for _ in range(100))
+
+    assert kept == 25
+    assert all(sampler.filter(_record("app.other")) for _ in range(10))
+
+
+def test_sampling_never_drops_warnings():
+    """Warnings and errors bypass sampling"""
+    sampler = SamplingFilter({"app.chatty": 0})
+
+    assert sampler.filter(_record("app.chatty", logging.INFO)) is False
+    assert sampler.filter(_record("app.chatty", logging.WARNING)) is True
+
+
+def test_parse_sample_rates_overrides_defaults():
+    """Env overrides are merged over the defaults; bad entries are ignored"""
+    rates = parse_sample_rates("app.services.checker.retries=1,bad,x=y")
+
+    assert rates["app.services.checker.retries"] == 1.0
+    assert "app.services.steam_soap.bodies" in rates
+    assert "bad" not in rates and "x" not in rates
+
+
+def test_json_formatter_outputs_one_object():
+    """JSON output has time, level, logger and message"""
+    entry = json.loads(JsonFormatter().format(_record("app.test", msg="ready")))
+
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "app.test"
+    assert entry["message"] == "ready"
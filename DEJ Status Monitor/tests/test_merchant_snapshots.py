@@ -0,0 +1,107 @@
+"""
+Tests for merchant page snapshots
+"""
+import pytest
+import pytz
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db import Base
+from app.models import MerchantDailyCounts, StatusCheck, Terminal, TerminalState
+from app.services.merchant_snapshots import merchant_stats, refresh_merchant_snapshots, terminal_stats
+
+EASTERN = pytz.timezone("America/New_York")
+# 2024-03-05 local midnight is 05:00 UTC
+DAY_START = datetime(2024, 3, 5, 5, 0)
+
+
+@pytest.fixture
+def db():
+    """In-memory database with two terminals at one merchant and one at another"""
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([Terminal(tpn=tpn) for tpn in ("1000AAA111", "1000AAA222", "2000BBB333")])
+    session.commit()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def _check(db, tpn, status, checked_at):
+    terminal = db.query(Terminal).filter(Terminal.tpn == tpn).one()
+    db.add(StatusCheck(terminal_id=terminal.id, status=status, checked_at=checked_at, run_id="r"))
+    db.merge(TerminalState(terminal_id=terminal.id, status=status, checked_at=checked_at, status_since=checked_at))
+    db.commit()
+
+
+def test_refresh_counts_terminals_and_local_days(db):
+    """All-time per-terminal counts; daily counts split at local (not UTC) midnight"""
+    _check(db, "1000AAA111", "ONLINE", DAY_START - timedelta(hours=1))  # 23:00 local, previous day
+    _check(db, "1000AAA111", "OFFLINE", DAY_START + timedelta(hours=1))
+    _check(db, "1000AAA222", "DISCONNECT", DAY_START + timedelta(hours=1))
+    _check(db, "2000BBB333", "ONLINE", DAY_START + timedelta(hours=1))
+    assert refresh_merchant_snapshots(db, EASTERN) == 4
+    assert refresh_merchant_snapshots(db, EASTERN) == 0
+
+    days = {
+        (row.merchant_code, row.day_start): (row.total, row.online, row.offline, row.disconnect)
+        for row in db.query(MerchantDailyCounts)
+    }
+    assert days == {
+        ("1000", DAY_START - timedelta(days=1)): (1, 1, 0, 0),
+        ("1000", DAY_START): (2, 0, 1, 1),
+        ("2000", DAY_START): (1, 1, 0, 0),
+    }
+    assert terminal_stats(db, "1000") == [
+        {"tpn": "1000AAA111", "latest_status": "OFFLINE", "total_checks": 2, "online_count": 1, "offline_count": 1, "online_percentage": 50.0},
+        {"tpn": "1000AAA222", "latest_status": "DISCONNECT", "total_checks": 1, "online_count": 0, "offline_count": 0, "online_percentage": 0},
+    ]
+
+    # Later checks are added on top
+    _check(db, "1000AAA222", "ONLINE", DAY_START + timedelta(hours=5))
+    assert refresh_merchant_snapshots(db, EASTERN) == 1
+    assert terminal_stats(db, "1000")[1]["total_checks"] == 2
+    assert db.get(MerchantDailyCounts, ("1000", DAY_START)).online == 1
+
+
+def test_merchant_stats_ranges_and_new_terminals(db):
+    """Range stats sum whole local days; unknown merchants are None; unrefreshed terminals appear unchecked"""
+    _check(db, "1000AAA111", "ONLINE", DAY_START + timedelta(hours=1))
+    _check(db, "1000AAA111", "OFFLINE", DAY_START + timedelta(days=1, hours=1))
+    refresh_merchant_snapshots(db, EASTERN)
+
+    first_day = merchant_stats(db, "1000", DAY_START, DAY_START + timedelta(hours=23), EASTERN)
+    assert first_day["range_stats"]["total_checks"] == 1
+    assert first_day["range_stats"]["online_percentage"] == 100.0
+    both_days = merchant_stats(db, "1000", DAY_START + timedelta(hours=12), DAY_START + timedelta(days=1, hours=2), EASTERN)
+    assert both_days["range_stats"]["total_checks"] == 2
+    assert both_days["total_terminals"] == 2
+
+    assert merchant_stats(db, "9999", DAY_START, DAY_START, EASTERN) is None
+    db.add(Terminal(tpn="3000CCC444"))
+    db.commit()
+    added = merchant_stats(db, "3000", DAY_START, DAY_START, EASTERN)
+    assert added["terminal_stats"][0]["latest_status"] is None
+    assert added["range_stats"]["total_checks"] == 0
+
+
+def test_merchant_api_serves_snapshot(api):
+    """/api/merchants/{merchant} keeps its response shape and 404s unknown merchants"""
+    from app.main import TIMEZONE
+    db = api.Session()
+    try:
+        db.add(Terminal(tpn="1000AAA111"))
+        db.commit()
+        _check(db, "1000AAA111", "ONLINE", datetime.utcnow())
+        refresh_merchant_snapshots(db, TIMEZONE)  # As after_check_run does
+    finally:
+        db.close()
+
+    today = api.client.get("/api/merchants/1000").json()
+    assert today["total_terminals"] == 1
+    assert today["range_stats"]["online"] == 1
+    assert today["terminal_stats"][0]["latest_status"] == "ONLINE"
+    assert api.client.get("/api/merchants/9999").status_code == 404
+    assert api.client.get("/api/merchants/1000?start_date=2024-13-01").status_code == 400
@@ -0,0 +1,32 @@
+"""
+Tests for the metrics exposition
+"""
+from app.services.metrics import Counter, Histogram, render_metrics
+
+
+def test_counter_renders_labels():
+    """Counters render one sample per label set"""
+    counter = Counter("test_events_total", "Test events", ["type"])
+    counter.inc(type="timeout")
+    counter.inc(2, type="timeout")
+
+    output = render_metrics()
+
+    assert "# TYPE test_events_total counter" in output
+    assert 'test_events_total{type="timeout"} 3' in output
+
+
+def test_histogram_buckets_are_cumulative():
+    """Histogram buckets are cumulative with +Inf, _sum and _count"""
+    histogram = Histogram("test_latency_seconds", "Test latency", ["outcome"], buckets=(0.1, 1.0))
+    histogram.observe(0.05, outcome="ONLINE")
+    histogram.observe(0.5, outcome="ONLINE")
+    histogram.observe(5, outcome="ONLINE")
+
+    output = render_metrics()
+
+    assert 'test_latency_seconds_bucket{outcome="ONLINE",le="0.1"} 1' in output
+    assert 'test_latency_seconds_bucket{outcome="ONLINE",le="1"} 2' in output
+    assert 'test_latency_seconds_bucket{outcome="ONLINE",le="+Inf"} 3' in output
+    assert 'test_latency_seconds_sum{outcome="ONLINE"} 5.55' in output
+    assert 'test_latency_seconds_count{outcome="ONLINE"} 3' in output
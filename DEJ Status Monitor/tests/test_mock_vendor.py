@@ -0,0 +1,52 @@
+"""
+Tests for the mock SpinPOS/STEAM servers used by the load harness
+"""
+import asyncio
+import httpx
+from app.services.steam_soap import (
+    create_get_terminals_request, create_terminal_info_request,
+    parse_get_terminals_response, parse_terminal_info_response, TEMPURI_NS
+)
+from bench.mock_vendor import SPIN_PATH, SOAP_PATH, VendorProfile, create_app
+
+
+def _post_soap(client, action, body):
+    return client.post(SOAP_PATH, content=body, headers={"SOAPAction": f"{TEMPURI_NS}{action}"})
+
+
+def test_soap_actions_round_trip_through_app_parsers():
+    """Get_Terminals and TerminalInfo responses parse with the app's SOAP parsers"""
+    app = create_app(VendorProfile(terminals=1200, ur_terminals=10, latency_ms=0))
+
+    async def _run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://mock") as client:
+            main = await _post_soap(client, "Get_Terminals", create_get_terminals_request("u", "p", "MAIN"))
+            ur = await _post_soap(client, "Get_Terminals", create_get_terminals_request("u", "p", "UR"))
+            info = await _post_soap(client, "TerminalInfo", create_terminal_info_request("u", "p", "900000000001"))
+            return main.text, ur.text, info.text
+
+    main_xml, ur_xml, info_xml = asyncio.run(_run())
+    main_tpns = parse_get_terminals_response(main_xml)
+
+    assert len(main_tpns) == 1200
+    assert set(parse_get_terminals_response(ur_xml)).isdisjoint(main_tpns)
+    assert parse_terminal_info_response(info_xml)["TPN"] == "900000000001"
+
+
+def test_flapping_terminals_alternate_and_errors_are_injected():
+    """Flapping TPNs alternate Online/Offline; error_rate=1 returns 500s"""
+    healthy = create_app(VendorProfile(latency_ms=0, flapping_fraction=1.0))
+    failing = create_app(VendorProfile(latency_ms=0, error_rate=1.0))
+
+    async def _run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=healthy), base_url="http://mock") as client:
+            statuses = [(await client.get(SPIN_PATH, params={"tpn": "T1"})).text for _ in range(3)]
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=failing), base_url="http://mock") as client:
+            failed = await client.get(SPIN_PATH, params={"tpn": "T1"})
+        return statuses, failed.status_code
+
+    statuses, failed_status = asyncio.run(_run())
+
+    assert statuses == ["Online", "Offline", "Online"]
+    assert failed_status == 500
+    assert failing.state.vendor.requests == {"500": 1}
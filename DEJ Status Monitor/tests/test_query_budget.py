@@ -0,0 +1,119 @@
+"""
+Query budgets for API endpoints
+Each endpoint must run a bounded number of queries regardless of fleet size.
+"""
+import pytest
+from datetime import datetime, timedelta
+from app.auth import get_password_hash
+from app.models import Terminal, StatusCheck, User, UserMerchant, UserRole
+from app.services.availability import update_availability
+from app.services.merchant_snapshots import refresh_merchant_snapshots
+from app.services.sql_profiler import assert_max_queries
+from app.services.transitions import backfill_terminal_states
+
+
+def _seed(api, terminal_count, checks_per_terminal=3):
+    """Create terminals with a few checks each and list them in the TPN file"""
+    db = api.Session()
+    now = datetime.utcnow()
+    tpns = []
+    for i in range(terminal_count):
+        terminal = Terminal(tpn=f"0147{i:08d}")
+        db.add(terminal)
+        db.flush()
+        tpns.append(terminal.tpn)
+        for j in range(checks_per_terminal):
+            db.add(StatusCheck(
+                terminal_id=terminal.id,
+                status="ONLINE" if j % 2 == 0 else "OFFLINE",
+                checked_at=now - timedelta(hours=j)
+            ))
+    db.commit()
+    backfill_terminal_states(db)
+    update_availability(db)
+    refresh_merchant_snapshots(db)
+    db.close()
+    api.tpn_file.write_text("\n".join(tpns) + "\n", encoding="utf-8")
+
+
+def test_terminals_query_count_is_constant(api):
+    """/api/terminals does not issue per-terminal queries"""
+    _seed(api, 25)
+
+    with assert_max_queries(3):
+        response = api.client.get("/api/terminals")
+
+    assert response.status_code == 200
+    assert len(response.json()["terminals"]) == 25
+    assert response.json()["terminals"][0]["total_checks"] == 3
+
+
+def test_terminal_detail_api_budget(api):
+    """/api/terminals/{tpn} stays within its budget and reports Server-Timing"""
+    _seed(api, 3)
+
+    with assert_max_queries(3):
+        response = api.client.get("/api/terminals/014700000001")
+
+    assert response.status_code == 200
+    assert "db;dur=" in response.headers["Server-Timing"]
+
+
+def _login_admin(api):
+    db = api.Session()
+    db.add(User(email="admin@example.com", hashed_password=get_password_hash("pw"), is_active=True, is_admin=True, role=UserRole.ADMIN))
+    db.commit()
+    db.close()
+    assert api.client.post("/login", data={"email": "admin@example.com", "password": "pw"}, follow_redirects=False).status_code == 303
+
+
+def test_merchant_stats_budget(api):
+    """/api/merchants/{merchant} reads the precomputed snapshots"""
+    _seed(api, 25)
+
+    with assert_max_queries(2):
+        response = api.client.get("/api/merchants/0147")
+
+    assert response.status_code == 200
+
+
+def test_admin_users_budget(api):
+    """/admin/users loads every user's merchant access in one query"""
+    _login_admin(api)
+    db = api.Session()
+    users = [User(email=f"user{i}@example.com", hashed_password="x", is_active=i % 2 == 0, role=UserRole.USER) for i in range(25)]
+    db.add_all(users)
+    db.flush()
+    db.add_all([UserMerchant(user_id=user.id, merchant_code=f"{1000 + i % 3}") for i, user in enumerate(users)])
+    db.commit()
+    db.close()
+
+    with assert_max_queries(3):
+        response = api.client.get("/admin/users")
+
+    assert response.status_code == 200
+    assert "user24@example.com" in response.text
+
+
+@pytest.mark.parametrize("path", [
+    "/api/analytics",
+    "/api/analytics?date_range=week",
+    "/api/analytics?date_range=month",
+    f"/api/analytics?date_range=custom&start_date={(datetime.utcnow() - timedelta(days=2)):%Y-%m-%d}&end_date={(datetime.utcnow() + timedelta(days=1)):%Y-%m-%d}",
+    "/analytics/always-offline",
+    "/analytics/always-online",
+    "/analytics/online-once",
+])
+def test_analytics_budget(api, path):
+    """Analytics endpoints and pages do not look terminals up one by one"""
+    _seed(api, 25)
+    db = api.Session()
+    offline_ids = [terminal.id for terminal in db.query(Terminal).filter(Terminal.id <= 10)]
+    db.query(StatusCheck).filter(StatusCheck.terminal_id.in_(offline_ids)).update({"status": "OFFLINE"}, synchronize_session=False)
+    db.commit()
+    db.close()
+
+    with assert_max_queries(5):
+        response = api.client.get(path)
+
+    assert response.status_code == 200
@@ -0,0 +1,65 @@
+"""
+Tests for check-run trace recording
+"""
+import asyncio
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db import Base
+from app.models import Terminal, CheckRunTrace
+from app.services import checker, run_trace
+
+
+def test_run_records_spans_and_phases(tmp_path, monkeypatch):
+    """Each checked TPN gets a span; the trace is stored with its run"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add_all([Terminal(tpn=f"TPN{i:03d}") for i in range(5)])
+    db.commit()
+
+    real_client = httpx.AsyncClient
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, text="Online"))
+    monkeypatch.setattr(httpx, "AsyncClient", lambda **kwargs: real_client(transport=transport, **kwargs))
+    monkeypatch.setattr(checker, "JITTER_MS", (0, 0))
+    checker._inflight_checks.clear()
+    checker._recent_results.clear()
+
+    run_id = asyncio.run(checker.run_check_all_terminals(db))
+
+    trace = run_trace.load_trace(db, run_id)
+    assert db.query(CheckRunTrace).count() == 1
+    assert [name for name, _, _ in trace["phases"]] == ["fetch", "persist"]
+    assert len(trace["spans"]) == 5
+    tpn, pass_name, status, events = trace["spans"][0]
+    assert pass_name == "main" and status == "ONLINE"
+    assert [e for e, _ in events] == [
+        "queued", "jitter_done", "acquired", "request_start", "request_end", "released", "done"
+    ]
+    summary = run_trace.summarize_trace(trace)
+    assert summary["attempts"] == 5
+    db.close()
+
+
+def test_queue_depth_and_summary():
+    """Queue depth counts waiters and slot holders; backoff is measured to the next attempt"""
+    data = {
+        "duration_ms": 120,
+        "concurrency": 1,
+        "phases": [["fetch", 0, 100]],
+        "spans": [
+            ["A", "main", "ONLINE", [["queued", 0], ["jitter_done", 0], ["acquired", 0],
+                                     ["request_start", 0], ["request_end", 10], ["backoff", 10],
+                                     ["request_start", 40], ["request_end", 50], ["released", 50], ["done", 50]]],
+            ["B", "main", "ONLINE", [["queued", 0], ["jitter_done", 5], ["acquired", 50],
+                                     ["request_start", 50], ["request_end", 90], ["released", 90], ["done", 90]]],
+        ],
+    }
+
+    summary = run_trace.summarize_trace(data)
+    series = run_trace.queue_depth_series(data, points=10)
+
+    assert summary["task_time"] == {"jitter_ms": 5, "semaphore_wait_ms": 45, "network_ms": 60, "backoff_ms": 30}
+    assert summary["attempts"] == 3
+    assert series[2] == {"t": 24.0, "waiting": 1, "inflight": 1}
+    assert series[9]["inflight"] == 0
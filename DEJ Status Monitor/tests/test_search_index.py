@@ -0,0 +1,154 @@
+"""
+Tests for the terminal/merchant search index
+"""
+import json
+import pytest
+from datetime import datetime
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db import Base
+from app.models import Terminal
+from app.services import merchant_loader, search_index
+from app.services.search_index import matching_tpns, rebuild_search_index, search, sync_merchant_names
+from app.services.terminal_info_cache import save_terminal_info
+
+TPNS = ["1000AAA111", "1000AAA222", "2000BBB333", "3000CCC444"]
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Indexed database with a merchant mapping file"""
+    mapping_file = tmp_path / "merchant_mapping.json"
+    mapping_file.write_text(json.dumps({"1000": "Acme Coffee", "2000": "Blue Bakery"}), encoding="utf-8")
+    monkeypatch.setattr(merchant_loader, "MERCHANT_MAPPING_FILE", str(mapping_file))
+    merchant_loader.load_merchant_mapping(force_reload=True)
+
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([Terminal(tpn=tpn) for tpn in TPNS])
+    session.commit()
+    save_terminal_info(session, "2000BBB333", {"Description": "Front counter", "HardwareName": "Z8"})
+    session.commit()
+    rebuild_search_index(session, TPNS[:3])  # 3000CCC444 is no longer active
+    try:
+        yield session
+    finally:
+        session.close()
+        monkeypatch.setattr(search_index, "_indexed_mapping", None)
+        monkeypatch.setattr(search_index, "_indexed_merchants", None)
+
+
+def test_substring_match_on_tpn(db):
+    """Any 3+ character substring of a TPN finds it; inactive terminals are not indexed"""
+    assert sorted(matching_tpns(db, "AAA")) == ["1000AAA111", "1000AAA222"]
+    assert matching_tpns(db, "aa2") == ["1000AAA222"]
+    assert matching_tpns(db, "CCC") == []
+    assert matching_tpns(db, "AA") is None  # Too short for the trigram index
+
+
+def test_resync_adds_and_removes_terminals(db):
+    """A reload only touches changed TPNs"""
+    assert rebuild_search_index(db, ["1000AAA111", "3000CCC444"]) == 1
+    assert matching_tpns(db, "CCC4") == ["3000CCC444"]
+    assert matching_tpns(db, "BBB") == []
+    assert [h["key"] for h in search(db, "bakery")] == []
+
+
+def test_search_ranks_exact_and_prefix_first(db):
+    """An exact key match is the first hit; merchants are found by company name"""
+    hits = search(db, "1000")
+    assert hits[0] == {"type": "merchant", "key": "1000", "label": "1000 - Acme Coffee", "detail": None, "url": "/merchant/1000"}
+    assert {h["key"] for h in hits[1:]} == {"1000AAA111", "1000AAA222"}
+
+    assert [h["key"] for h in search(db, "coffee")] == ["1000"]
+
+
+def test_search_uses_steam_fields_and_follows_updates(db):
+    """Description/HardwareName are searchable and refreshed when TerminalInfo is saved"""
+    hit = search(db, "front counter")[0]
+    assert hit["key"] == "2000BBB333"
+    assert hit["detail"] == "Front counter · Z8"
+
+    save_terminal_info(db, "1000AAA111", {"Description": "Drive thru", "HardwareName": "P3"})
+    db.commit()
+    assert [h["key"] for h in search(db, "drive")] == ["1000AAA111"]
+
+
+def test_search_respects_merchant_scope(db):
+    """Restricted users only see their merchants"""
+    assert {h["key"] for h in search(db, "AAA", merchant_codes=["2000"])} == set()
+    assert [h["key"] for h in search(db, "bak", merchant_codes=["2000"])] == ["2000"]
+    assert search(db, "AAA", merchant_codes=[]) == []
+
+
+def test_short_queries_and_mapping_changes(db, tmp_path):
+    """1-2 character queries match merchant prefixes; renamed merchants are re-indexed"""
+    assert [h["key"] for h in search(db, "bl")] == ["2000"]
+
+    mapping_file = tmp_path / "merchant_mapping.json"
+    mapping_file.write_text(json.dumps({"1000": "Acme Coffee", "2000": "Crimson Bakery"}), encoding="utf-8")
+    merchant_loader.load_merchant_mapping(force_reload=True)
+    assert [h["label"] for h in search(db, "crimson")] == ["2000 - Crimson Bakery"]
+    assert search(db, "blue") == []
+    assert [h["label"] for h in search(db, "cr")] == ["2000 - Crimson Bakery"]
+
+    # Re-indexed on the write path; results are the same from the index
+    assert sync_merchant_names(db)
+    assert not sync_merchant_names(db)
+    assert [h["label"] for h in search(db, "crimson")] == ["2000 - Crimson Bakery"]
+    assert search(db, "blue") == []
+
+
+def test_search_api_reads_after_mapping_change(api, tmp_path, monkeypatch):
+    """/api/search runs on the query_only engine and still answers after merchant_mapping.json changes"""
+    from app.auth import get_password_hash
+    from app.models import User, UserRole
+
+    mapping_file = tmp_path / "merchant_mapping.json"
+    mapping_file.write_text(json.dumps({"1000": "Acme Coffee"}), encoding="utf-8")
+    monkeypatch.setattr(merchant_loader, "MERCHANT_MAPPING_FILE", str(mapping_file))
+    merchant_loader.load_merchant_mapping(force_reload=True)
+    db = api.Session()
+    db.add_all([Terminal(tpn=tpn) for tpn in TPNS])
+    db.add(User(email="admin@example.com", hashed_password=get_password_hash("pw"), is_active=True, is_admin=True, role=UserRole.ADMIN))
+    db.commit()
+    rebuild_search_index(db, TPNS)
+    db.close()
+    assert api.client.post("/login", data={"email": "admin@example.com", "password": "pw"}, follow_redirects=False).status_code == 303
+
+    mapping_file.write_text(json.dumps({"1000": "Amber Coffee"}), encoding="utf-8")
+    merchant_loader.load_merchant_mapping(force_reload=True)
+    try:
+        response = api.client.get("/api/search", params={"q": "amber"})
+        assert response.status_code == 200
+        assert [h["label"] for h in response.json()["results"]] == ["1000 - Amber Coffee"]
+    finally:
+        monkeypatch.setattr(search_index, "_indexed_mapping", None)
+        monkeypatch.setattr(search_index, "_indexed_merchants", None)
+
+
+def test_terminals_api_search_uses_index(api):
+    """/api/terminals?search= returns the same substring matches through the index"""
+    from app.services.transitions import record_transitions
+
+    api.tpn_file.write_text("\n".join(TPNS), encoding="utf-8")
+    db = api.Session()
+    from app.services.tpn_loader import load_tpns_from_file
+    load_tpns_from_file(db, str(api.tpn_file))
+    rebuild_search_index(db, TPNS)
+    now = datetime.utcnow()
+    record_transitions(db, [(t.id, "ONLINE", now, "run1") for t in db.query(Terminal)])
+    db.commit()
+    db.close()
+
+    response = api.client.get("/api/terminals", params={"search": "BBB3"})
+    assert [t["tpn"] for t in response.json()["terminals"]] == ["2000BBB333"]
+
+    # The match is a subquery of the terminals query, not one bound parameter per matching TPN
+    from app.services.sql_profiler import profile_queries
+    with profile_queries() as profile:
+        response = api.client.get("/api/terminals", params={"search": "000"})
+    assert len(response.json()["terminals"]) == len(TPNS)
+    assert not any(statement.lstrip().startswith("SELECT key") for statement in profile.statements)
+    assert any("FROM terminals" in statement and "search_index MATCH" in statement for statement in profile.statements)
@@ -0,0 +1,72 @@
+"""
+Tests for STEAM TPN parsing and reload
+"""
+import asyncio
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+from app.db import Base
+from app.models import Terminal
+from app.services import steam_tpn_loader
+from app.services.steam_soap import parse_get_terminals_response
+
+
+GET_TERMINALS_RESPONSE = """<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">
+  <soap:Body>
+    <Get_TerminalsResponse xmlns="http://tempuri.org/">
+      <Get_TerminalsResult>
+        <diffgr:diffgram xmlns:diffgr="urn:schemas-microsoft-com:xml-diffgram-v1">
+          <NewDataSet xmlns="">
+            <Table diffgr:id="Table1"><tpn> TPN001 </tpn></Table>
+            <Table diffgr:id="Table2"><tpn>TPN002</tpn></Table>
+            <Table diffgr:id="Table3"><tpn></tpn></Table>
+          </NewDataSet>
+        </diffgr:diffgram>
+      </Get_TerminalsResult>
+    </Get_TerminalsResponse>
+  </soap:Body>
+</soap:Envelope>"""
+
+
+@pytest.fixture
+def db():
+    """Create a test database session"""
+    test_engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=test_engine)
+    TestSessionLocal = sessionmaker(bind=test_engine)
+    db = TestSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def test_parse_get_terminals_response():
+    """TPNs are extracted from diffgram rows, stripped, blanks skipped"""
+    assert parse_get_terminals_response(GET_TERMINALS_RESPONSE) == ["TPN001", "TPN002"]
+
+
+def test_reload_diffs_and_writes_file(db: Session, tmp_path, monkeypatch):
+    """Reload merges both accounts, inserts only new TPNs and rewrites the file"""
+    async def _fake_fetch(soap_url, username, password, company_id):
+        return {"1": ["TPN001", "TPN002 "], "2": ["TPN002", "TPN003"]}[company_id]
+
+    monkeypatch.setattr(steam_tpn_loader, "get_terminals_from_steam", _fake_fetch)
+    db.add_all([Terminal(tpn="TPN001"), Terminal(tpn="OLD001")])
+    db.commit()
+    tpn_file = tmp_path / "tpns.txt"
+    tpn_file.write_text("OLD001\n", encoding="utf-8")
+
+    results = asyncio.run(steam_tpn_loader.reload_tpns_from_steam(
+        db=db, soap_url="http://steam", username="u", password="p", company_id="1",
+        tpn_file_path=str(tpn_file),
+        ur_account={"username": "u", "password": "p", "company_id": "2"}
+    ))
+
+    assert results["total_tpns"] == 3
+    assert results["new_tpns"] == 2
+    assert results["updated_tpns"] == 1
+    assert tpn_file.read_text(encoding="utf-8") == "TPN001\nTPN002\nTPN003\n"
+    assert {t.tpn for t in db.query(Terminal).all()} == {"TPN001", "TPN002", "TPN003", "OLD001"}
+    assert list(tmp_path.iterdir()) == [tpn_file]
@@ -0,0 +1,83 @@
+"""
+Tests for the STEAM TerminalInfo cache
+"""
+import asyncio
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+from app.db import Base
+from app.models import Terminal, TerminalInfo
+from app.services import terminal_info_cache
+from app.services.terminal_info_cache import (
+    TERMINAL_INFO_TTL_SECONDS, get_cached_terminal_info, save_terminal_info, find_stale_tpns,
+    refresh_terminal_info, schedule_refresh
+)
+
+
+@pytest.fixture
+def db():
+    """Create a test database session"""
+    test_engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=test_engine)
+    TestSessionLocal = sessionmaker(bind=test_engine)
+    db = TestSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def test_save_and_read_back(db: Session):
+    """Saved info is served from the table and syncs profile_id"""
+    db.add(Terminal(tpn="TEST001"))
+    db.commit()
+
+    save_terminal_info(db, "TEST001", {"ProfileID": 42, "Description": "Front desk", "HardwareName": "P8"})
+    db.commit()
+
+    info, stale = get_cached_terminal_info(db, "TEST001")
+    assert stale is False
+    assert info["ProfileID"] == 42
+    assert info["Description"] == "Front desk"
+    assert db.query(Terminal).filter(Terminal.tpn == "TEST001").first().profile_id == 42
+
+
+def test_missing_and_expired_are_stale(db: Session):
+    """Missing rows and rows older than the TTL need a refresh"""
+    db.add(TerminalInfo(tpn="OLD", fetched_at=datetime.utcnow() - timedelta(seconds=TERMINAL_INFO_TTL_SECONDS + 60)))
+    db.add(TerminalInfo(tpn="NEW", fetched_at=datetime.utcnow()))
+    db.commit()
+
+    assert get_cached_terminal_info(db, "MISSING") == (None, True)
+    assert get_cached_terminal_info(db, "OLD")[1] is True
+    assert find_stale_tpns(db, ["OLD", "NEW", "MISSING"]) == ["OLD", "MISSING"]
+
+
+def test_unknown_tpn_is_not_looked_up_again(monkeypatch):
+    """A TPN STEAM does not know is remembered; background refreshes are kept referenced until done"""
+    calls = []
+
+    async def _not_found(soap_url, username, password, tpn, client=None):
+        calls.append(tpn)
+        await asyncio.sleep(0)
+        return None
+
+    monkeypatch.setattr(terminal_info_cache, "get_terminal_info", _not_found)
+    monkeypatch.setattr(terminal_info_cache, "_not_found", {})
+
+    async def _run():
+        assert schedule_refresh("url", "user", "pass", "UNKNOWN1")
+        assert len(terminal_info_cache._refresh_tasks) == 1
+        await asyncio.gather(*terminal_info_cache._refresh_tasks)
+        await asyncio.sleep(0)
+        assert not terminal_info_cache._refresh_tasks
+        assert schedule_refresh("url", "user", "pass", "UNKNOWN1") is False
+        return await refresh_terminal_info("url", "user", "pass", "UNKNOWN1")
+
+    assert asyncio.run(_run()) is None
+    assert calls == ["UNKNOWN1"]
+
+    monkeypatch.setattr(terminal_info_cache, "TERMINAL_INFO_NOT_FOUND_TTL_SECONDS", -1)
+    assert asyncio.run(refresh_terminal_info("url", "user", "pass", "UNKNOWN1")) is None
+    assert calls == ["UNKNOWN1", "UNKNOWN1"]
@@ -0,0 +1,52 @@
+"""
+Tests for TPN file loading
+"""
+import time
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+from app.db import Base
+from app.models import Terminal
+from app.services.tpn_loader import load_tpns_from_file
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Create a file-backed test database session"""
+    test_engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(bind=test_engine)
+    TestSessionLocal = sessionmaker(bind=test_engine)
+    db = TestSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def test_load_skips_existing_and_normalizes(db: Session, tmp_path):
+    """Existing TPNs are kept, whitespace is normalized, comments/blanks ignored"""
+    db.add_all([Terminal(tpn=" TPN001\t"), Terminal(tpn="TPN002")])
+    db.commit()
+    tpn_file = tmp_path / "tpns.txt"
+    tpn_file.write_text("# comment\nTPN001\n\nTPN002\nTPN003\nTPN003\n", encoding="utf-8")
+
+    assert load_tpns_from_file(db, str(tpn_file)) == 4
+    assert sorted(t.tpn for t in db.query(Terminal).all()) == ["TPN001", "TPN002", "TPN003"]
+
+
+def test_load_100k_tpns_is_fast(db: Session, tmp_path):
+    """A 100k-line file loads (and reloads) in a couple of seconds"""
+    tpn_file = tmp_path / "tpns.txt"
+    tpn_file.write_text("".join(f"{i:012d}\n" for i in range(100_000)), encoding="utf-8")
+
+    start = time.perf_counter()
+    load_tpns_from_file(db, str(tpn_file))
+    first_load = time.perf_counter() - start
+
+    start = time.perf_counter()
+    load_tpns_from_file(db, str(tpn_file))
+    second_load = time.perf_counter() - start
+
+    assert db.query(Terminal).count() == 100_000
+    assert first_load < 2
+    assert second_load < 2
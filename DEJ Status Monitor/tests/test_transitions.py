@@ -0,0 +1,75 @@
+"""
+Tests for status transition detection
+"""
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db import Base
+from app.models import Terminal, StatusCheck, StatusTransition, TerminalState
+from app.services.transitions import (
+    record_transitions, backfill_terminal_states, count_transitions, flapping_terminals
+)
+
+
+@pytest.fixture
+def db():
+    """In-memory database with one terminal"""
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.add(Terminal(id=1, tpn="TPN001"))
+    session.commit()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def test_only_changes_are_recorded(db):
+    """Repeated statuses update state without adding transitions"""
+    t0 = datetime(2025, 1, 1, 12, 0)
+    for i, status in enumerate(["ONLINE", "ONLINE", "OFFLINE", "OFFLINE", "ONLINE"]):
+        record_transitions(db, [(1, status, t0 + timedelta(hours=i), f"run{i}")])
+        db.commit()
+
+    transitions = db.query(StatusTransition).order_by(StatusTransition.transitioned_at).all()
+    state = db.query(TerminalState).one()
+
+    assert [(t.from_status, t.to_status) for t in transitions] == [
+        (None, "ONLINE"), ("ONLINE", "OFFLINE"), ("OFFLINE", "ONLINE")
+    ]
+    assert state.status == "ONLINE"
+    assert state.status_since == t0 + timedelta(hours=4)
+    assert state.last_online_at == t0 + timedelta(hours=4)
+    assert count_transitions(db, 1, t0) == 2
+    assert flapping_terminals(db, t0, min_transitions=2) == {1: 2}
+
+
+def test_out_of_order_result_is_ignored(db):
+    """An older result arriving late does not roll state back"""
+    t0 = datetime(2025, 1, 1, 12, 0)
+    record_transitions(db, [(1, "OFFLINE", t0, "run1")])
+    db.commit()
+    record_transitions(db, [(1, "ONLINE", t0 - timedelta(minutes=5), "manual")])
+    db.commit()
+
+    assert db.query(TerminalState).one().status == "OFFLINE"
+    assert db.query(StatusTransition).count() == 1
+
+
+def test_backfill_replays_history(db):
+    """Backfill derives current status, outage start and last online from existing checks"""
+    t0 = datetime(2025, 1, 1, 12, 0)
+    for i, status in enumerate(["ONLINE", "OFFLINE", "OFFLINE"]):
+        db.add(StatusCheck(terminal_id=1, status=status, checked_at=t0 + timedelta(hours=i), run_id=f"run{i}"))
+    db.commit()
+
+    assert backfill_terminal_states(db) == 1
+    assert backfill_terminal_states(db) == 0
+
+    state = db.query(TerminalState).one()
+    assert (state.status, state.status_since, state.last_online_at) == (
+        "OFFLINE", t0 + timedelta(hours=1), t0
+    )
+    assert db.query(StatusTransition).count() == 2
@@ -0,0 +1,111 @@
+"""
+Tests for run summaries and trend downsampling
+"""
+import math
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db import Base
+from app.models import RunSummary, StatusCheck, Terminal
+from app.services.transitions import record_transitions
+from app.services.trends import backfill_run_summaries, lttb, min_max, record_run_summary, trend_series
+
+T0 = datetime(2024, 3, 1, 12, 0)
+
+
+@pytest.fixture
+def db():
+    """In-memory database with two merchants (two terminals each)"""
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([Terminal(tpn=tpn) for tpn in ("1000A1", "1000A2", "2000B1", "2000B2")])
+    session.commit()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def _add_run(db, run_id, checked_at, statuses):
+    ids = {t.tpn: t.id for t in db.query(Terminal)}
+    for tpn, status in statuses.items():
+        db.add(StatusCheck(terminal_id=ids[tpn], status=status, checked_at=checked_at, run_id=run_id))
+    db.commit()
+
+
+def test_record_run_summary(db):
+    """One fleet row and one row per merchant; recording twice is a no-op; manual checks are skipped"""
+    _add_run(db, "r1", T0, {"1000A1": "ONLINE", "1000A2": "OFFLINE", "2000B1": "ONLINE", "2000B2": "ERROR"})
+    assert record_run_summary(db, "r1") == 3
+    assert record_run_summary(db, "r1") == 0
+    assert record_run_summary(db, "manual-2024-03-01T12:00:00") == 0
+
+    rows = {(r.scope, r.scope_key): r for r in db.query(RunSummary)}
+    assert (rows[("all", "")].total, rows[("all", "")].online, rows[("all", "")].error) == (4, 2, 1)
+    assert (rows[("merchant", "1000")].online, rows[("merchant", "1000")].offline) == (1, 1)
+    assert rows[("merchant", "2000")].run_at == T0
+
+
+def test_planned_run_counts_skipped_terminals_at_last_status(db):
+    """A run that checked part of the fleet still summarizes the whole (active) fleet"""
+    ids = {t.tpn: t.id for t in db.query(Terminal)}
+    full = {"1000A1": "ONLINE", "1000A2": "ONLINE", "2000B1": "OFFLINE", "2000B2": "ONLINE"}
+    _add_run(db, "r1", T0, full)
+    record_transitions(db, [(ids[tpn], status, T0, "r1") for tpn, status in full.items()])
+    db.commit()
+    _add_run(db, "r2", T0 + timedelta(hours=1), {"1000A1": "ERROR"})
+    record_transitions(db, [(ids["1000A1"], "ERROR", T0 + timedelta(hours=1), "r2")])
+    db.commit()
+
+    assert record_run_summary(db, "r2", active_tpns={"1000A1", "1000A2", "2000B1"}) == 3
+    rows = {(r.scope, r.scope_key): r for r in db.query(RunSummary).filter(RunSummary.run_id == "r2")}
+    fleet = rows[("all", "")]
+    assert (fleet.total, fleet.online, fleet.offline, fleet.error) == (3, 1, 1, 1)
+    assert (rows[("merchant", "1000")].online, rows[("merchant", "1000")].error) == (1, 1)
+    assert fleet.run_at == T0 + timedelta(hours=1)
+
+
+def test_backfill_and_series_scopes(db):
+    """Backfill summarizes stored runs once; series respect scope and restricted merchants"""
+    _add_run(db, "r1", T0, {"1000A1": "ONLINE", "1000A2": "ONLINE", "2000B1": "OFFLINE", "2000B2": "OFFLINE"})
+    _add_run(db, "r2", T0 + timedelta(hours=1), {"1000A1": "ONLINE", "1000A2": "OFFLINE", "2000B1": "ONLINE", "2000B2": "ONLINE"})
+    _add_run(db, "manual-x", T0 + timedelta(hours=2), {"1000A1": "OFFLINE"})
+    assert backfill_run_summaries(db) == 2
+    assert backfill_run_summaries(db) == 0
+
+    window = (T0 - timedelta(days=1), T0 + timedelta(days=1))
+    fleet = trend_series(db, *window)
+    assert [p["v"] for p in fleet["series"]] == [50.0, 75.0]
+    assert fleet["series"][0]["t"] == T0.isoformat() + "Z"
+    assert [p["v"] for p in trend_series(db, *window, scope="merchant", key="2000")["series"]] == [0.0, 100.0]
+    assert [p["v"] for p in trend_series(db, *window, merchant_codes=["1000"])["series"]] == [100.0, 50.0]
+    assert [p["offline"] for p in trend_series(db, *window, metric="offline")["series"]] == [2, 1]
+
+
+def test_lttb_keeps_shape_and_bounds():
+    """LTTB returns exactly the requested count, keeps the ends and catches a lone spike"""
+    points = [(i, math.sin(i / 50)) for i in range(5000)]
+    points[2500] = (2500, 10.0)
+    selected = lttb(points, 100)
+    assert len(selected) == 100
+    assert selected[0] == 0 and selected[-1] == 4999
+    assert selected == sorted(selected)
+    assert 2500 in selected
+    assert lttb(points[:50], 100) == list(range(50))
+
+
+def test_min_max_keeps_extremes():
+    """Every bucket's min and max survive, in time order"""
+    points = [(i, (i * 37) % 101) for i in range(1000)]
+    selected = min_max(points, 20)
+    assert len(selected) <= 20
+    assert selected == sorted(selected)
+    values = [points[i][1] for i in selected]
+    assert max(values) == 100 and min(values) == 0
+
+
+def test_trends_api_requires_login(api):
+    """The trends endpoint is not public"""
+    assert api.client.get("/api/trends").status_code == 401
@@ -0,0 +1,144 @@
+"""
+Tests for outbound webhook delivery
+"""
+import asyncio
+import json
+import pytest
+import httpx
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db import Base
+from app.models import StatusCheck, Terminal, WebhookDeadLetter, WebhookDelivery, WebhookSubscription
+from app.services import webhooks
+from app.services.transitions import record_transitions
+from app.services.webhooks import (
+    build_run_events, deliver_due, enqueue_events, queue_run_webhooks, replay_dead_letter, sign_payload
+)
+
+T0 = datetime(2025, 1, 1, 12, 0)
+
+
+@pytest.fixture
+def db():
+    """Two terminals at different merchants with one stored run each at T0 and T0+1h"""
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([Terminal(id=1, tpn="1000AAA1"), Terminal(id=2, tpn="2000BBB1")])
+    session.commit()
+    for run_id, checked_at, statuses in (
+        ("run1", T0, {1: "ONLINE", 2: "OFFLINE"}),
+        ("run2", T0 + timedelta(hours=1), {1: "OFFLINE", 2: "ONLINE"}),
+    ):
+        for terminal_id, status in statuses.items():
+            session.add(StatusCheck(terminal_id=terminal_id, status=status, checked_at=checked_at, run_id=run_id))
+        record_transitions(session, [(tid, status, checked_at, run_id) for tid, status in statuses.items()])
+        session.commit()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def _subscribe(db, event_types, merchant_codes=None, url="https://hooks.example.com/a"):
+    subscription = WebhookSubscription(
+        name="test", url=url, secret="s3cret", event_types=json.dumps(event_types),
+        merchant_codes=json.dumps(merchant_codes) if merchant_codes else None
+    )
+    db.add(subscription)
+    db.commit()
+    return subscription
+
+
+def _client(handler):
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def test_run_events_cover_transitions_and_summary(db):
+    """A run yields offline/recovered events for changed terminals plus run.completed"""
+    events = build_run_events(db, "run2")
+    by_type = {e["type"]: e for e in events}
+
+    assert by_type["terminal.offline"]["data"]["tpn"] == "1000AAA1"
+    assert by_type["terminal.recovered"]["data"]["tpn"] == "2000BBB1"
+    assert by_type["run.completed"]["data"] == {"terminals": 2, "statuses": {"ONLINE": 1, "OFFLINE": 1}, "transitions": 2}
+    # First-ever statuses are not transitions
+    assert [e["type"] for e in build_run_events(db, "run1")] == ["run.completed"]
+
+
+def test_subscription_filters_event_type_and_merchant(db):
+    """Only matching event types and merchants are queued"""
+    _subscribe(db, ["terminal.offline", "terminal.recovered"], merchant_codes=["2000"])
+    assert queue_run_webhooks(db, "run2") == 1
+    assert db.query(WebhookDelivery).one().event_type == "terminal.recovered"
+
+
+def test_batch_is_signed_and_removed_on_success(db):
+    """All due events for an endpoint go in one signed POST"""
+    _subscribe(db, list(webhooks.EVENT_TYPES))
+    queue_run_webhooks(db, "run2")
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(204)
+
+    async def _run():
+        async with _client(handler) as client:
+            return await deliver_due(db, client, now=datetime.utcnow())
+
+    assert asyncio.run(_run()) == 3
+    assert len(requests) == 1
+    request = requests[0]
+    assert len(json.loads(request.content)["events"]) == 3
+    expected = sign_payload("s3cret", request.headers[webhooks.TIMESTAMP_HEADER], request.content)
+    assert request.headers[webhooks.SIGNATURE_HEADER] == expected
+    assert db.query(WebhookDelivery).count() == 0
+
+
+def test_failures_retry_then_dead_letter(db, monkeypatch):
+    """Failed batches back off, dead-letter after max attempts, and can be replayed"""
+    monkeypatch.setattr(webhooks, "WEBHOOK_MAX_ATTEMPTS", 2)
+    _subscribe(db, ["run.completed"])
+    queue_run_webhooks(db, "run2")
+
+    async def _deliver(now, status_code):
+        async with _client(lambda request: httpx.Response(status_code)) as client:
+            return await deliver_due(db, client, now=now)
+
+    now = datetime.utcnow()
+    assert asyncio.run(_deliver(now, 500)) == 0
+    delivery = db.query(WebhookDelivery).one()
+    assert delivery.attempts == 1
+    assert delivery.next_attempt_at == now + webhooks.retry_delay(1)
+    assert delivery.last_error == "HTTP 500"
+
+    asyncio.run(_deliver(delivery.next_attempt_at, 500))
+    assert db.query(WebhookDelivery).count() == 0
+    dead_letter = db.query(WebhookDeadLetter).one()
+    assert dead_letter.attempts == 2
+
+    replay_dead_letter(db, dead_letter)
+    assert asyncio.run(_deliver(datetime.utcnow() + timedelta(seconds=1), 200)) == 1
+    assert db.query(WebhookDeadLetter).count() == 0
+
+
+def test_slow_endpoint_does_not_hold_back_others(db):
+    """Endpoints are delivered concurrently; a timing-out receiver only fails its own batch"""
+    _subscribe(db, ["run.completed"], url="https://slow.example.com/hook")
+    _subscribe(db, ["run.completed"], url="https://fast.example.com/hook")
+    enqueue_events(db, build_run_events(db, "run2"))
+
+    def handler(request):
+        if request.url.host == "slow.example.com":
+            raise httpx.ReadTimeout("timed out", request=request)
+        return httpx.Response(200)
+
+    async def _run():
+        async with _client(handler) as client:
+            return await deliver_due(db, client, now=datetime.utcnow())
+
+    assert asyncio.run(_run()) == 1
+    remaining = db.query(WebhookDelivery).one()
+    assert remaining.last_error.startswith("ReadTimeout")